@@ -0,0 +1,191 @@
+"""
+Benchmark the cold import of the src packages: every import runs in a fresh
+interpreter, timed, with the heavy dependencies it loaded. The packages load
+their backends lazily, so importing the types of a package must load none of
+them, and importing a factory must not load the backend of any model or
+database before it is selected; the imports that do are flagged.
+
+The results are written as JSON; with a baseline, the imports slower than
+the baseline by more than the tolerance are flagged as regressions, and the
+exit code is 1 on any regression.
+
+Run from the repository root:
+    python -m benchmark.bench_imports --output bench_imports.json
+    python -m benchmark.bench_imports --baseline bench_imports.json
+"""
+import argparse, json, os, platform, subprocess, sys, time
+import numpy as np
+
+from typing import Dict, List
+
+# the dependencies the types of a package must not load
+HEAVY_MODULES = ["pandas", "pyarrow", "langchain", "langchain_core",
+                 "langchain_community", "langchain_openai", "openai",
+                 "chromadb", "faiss", "sentence_transformers",
+                 "transformers", "torch", "serpapi"]
+# the backends a factory must not load before they are selected
+BACKEND_MODULES = ["langchain_community", "langchain_openai", "openai",
+                   "chromadb", "faiss", "sentence_transformers",
+                   "transformers", "torch", "serpapi"]
+# import statement -> the modules it must not load
+TARGETS = {
+    "from src.models import ModelType": HEAVY_MODULES,
+    "from src.embeddings import EmbeddingType": HEAVY_MODULES,
+    "from src.tools import ToolType": HEAVY_MODULES,
+    "from src.vector_database import FaissIndexType": HEAVY_MODULES,
+    "from src.agent import HistoryPolicy, RoutePath": HEAVY_MODULES,
+    "import src.data_preparation": HEAVY_MODULES,
+    "from src.models import Models": BACKEND_MODULES,
+    "from src.embeddings import Embeddings": BACKEND_MODULES,
+    "from src.tools import RetrieverTool": BACKEND_MODULES,
+    "from src.vector_database import ChromaDB, FaissDB": BACKEND_MODULES,
+    "from src.agent import Agents, AgentRunner": BACKEND_MODULES,
+}
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': sorted(
+    {{name.split('.')[0] for name in sys.modules}})}}))
+"""
+MIN_DIFFERENCE_MS = 20.0
+
+
+def measure(statement: str, forbidden: List[str], repeat: int) -> dict:
+    """
+    Time an import statement in fresh interpreters.
+
+    Parameters
+    ----------
+    statement: str
+        The import statement.
+    forbidden: List[str]
+        The modules the import must not load.
+    repeat: int
+        The number of interpreters.
+
+    Returns
+    -------
+    dict
+        The median and the minimum milliseconds of the import, and the
+        forbidden modules it loaded.
+    """
+    seconds, loaded = [], set()
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(statement=statement)],
+            check=True, capture_output=True, text=True).stdout
+        probe = json.loads(output.strip().splitlines()[-1])
+        seconds.append(probe['seconds'])
+        loaded.update(set(probe['modules']) & set(forbidden))
+    return {'median_ms': float(np.median(seconds)) * 1000,
+            'min_ms': float(np.min(seconds)) * 1000,
+            'forbidden_loaded': sorted(loaded)}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[dict]:
+    """
+    Compare the import times of the results with the ones of a baseline.
+
+    Parameters
+    ----------
+    results: dict
+        The results, as written by this benchmark.
+    baseline: dict
+        The baseline, as written by this benchmark.
+    tolerance: float
+        The relative change allowed, e.g. 0.2 for 20%.
+
+    Returns
+    -------
+    List[dict]
+        Every import of both, with its baseline and new median milliseconds,
+        relative change and whether it regressed.
+    """
+    rows = []
+    for statement, result in results['results'].items():
+        base = baseline['results'].get(statement)
+        if base is None:
+            continue
+        value, base = result['median_ms'], base['median_ms']
+        change = (value - base) / base if base else 0.0
+        rows.append({'statement': statement, 'baseline': base,
+                     'value': value, 'change': change,
+                     'regression': change > tolerance
+                     and value - base > MIN_DIFFERENCE_MS})
+    return rows
+
+
+def print_results(results: dict) -> int:
+    """
+    Print the import times and the forbidden modules loaded.
+
+    Returns
+    -------
+    int
+        The number of imports loading forbidden modules.
+    """
+    n_failed = 0
+    for statement, result in results['results'].items():
+        loaded = result['forbidden_loaded']
+        n_failed += bool(loaded)
+        print(f"{statement:<52} {result['median_ms']:>9.1f} ms"
+              + (f"  LOADS {', '.join(loaded)}" if loaded else ""))
+    return n_failed
+
+
+def print_comparison(rows: List[dict], tolerance: float) -> int:
+    """
+    Print the comparison with the baseline.
+
+    Returns
+    -------
+    int
+        The number of regressions.
+    """
+    regressions = [row for row in rows if row['regression']]
+    for row in rows:
+        print(f"{row['statement']:<52} {row['baseline']:>9.1f} -> "
+              f"{row['value']:>9.1f} ms ({row['change']:+.0%})"
+              + ("  REGRESSION" if row['regression'] else ""))
+    print(f"[INFO] {len(regressions)} regressions beyond "
+          f"{tolerance:.0%}")
+    return len(regressions)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="the number of fresh interpreters per import")
+    parser.add_argument("--output", default="bench_imports.json")
+    parser.add_argument("--baseline", default=None,
+                        help="flag the regressions against these results")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results: Dict[str, dict] = {
+        'meta': {'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 'python': sys.version.split()[0],
+                 'platform': platform.platform(),
+                 'cpus': os.cpu_count(),
+                 'args': vars(args)},
+        'results': {statement: measure(statement, forbidden, args.repeat)
+                    for statement, forbidden in TARGETS.items()}}
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[INFO] Results written to {args.output}")
+    n_failed = print_results(results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        n_failed += print_comparison(
+            compare(results, baseline, args.tolerance), args.tolerance)
+    if n_failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""
+Benchmark the whole pipeline on synthetic raw reviews at several scales:
+the processed data creation, the index build and load, the retriever query
+latency and the agent turns. Every stage runs in a fresh process, timed and
+with the growth of its peak RSS. The LLM and the embedding model are the
+offline stand-ins, so no network is needed and only the pipeline is measured.
+
+The results are written as JSON; with a baseline, the metrics worse than the
+baseline by more than the tolerance are flagged as regressions and the exit
+code is 1.
+
+Run from the repository root:
+    python -m benchmark.bench_pipeline --scales 10000 100000 515000 \
+        --output bench_pipeline.json
+    python -m benchmark.bench_pipeline --scales 10000 \
+        --baseline bench_pipeline.json
+    python -m benchmark.bench_pipeline --compare new.json \
+        --baseline bench_pipeline.json
+"""
+import argparse, asyncio, json, os, platform, shutil, sys, tempfile, time
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+from typing import Callable, Dict, List, Tuple
+
+COUNTRY = "United Kingdom"
+DATABASES = ["chroma", "faiss", "numpy"]
+WORDS = ["staff", "friendly", "room", "spotless", "breakfast", "noisy",
+         "location", "tube", "bed", "small", "great", "view", "pool", "bar",
+         "quiet", "central", "clean", "rude", "cosy", "modern", "park",
+         "station", "museum", "river", "shower", "spa", "gym", "parking"]
+UK_POSTAL_CODES = ["W1U 8ED", "W8 5SP", "SW1A 2JR", "EC1V 9LT", "WC2N 5DU",
+                   "SE1 7PB", "E1 6AN", "N1 9AG", "NW1 2BU", "W2 1HU"]
+OTHER_ADDRESSES = ["Rue de Rivoli 8th arr 75008 Paris France",
+                   "Damrak 1 Centrum 1012 LG Amsterdam Netherlands",
+                   "Gran Via 10 Eixample 08010 Barcelona Spain"]
+# the metrics where higher is better, the others are costs
+HIGHER_IS_BETTER = {'throughput_per_s'}
+# the differences below these are noise, whatever the tolerance
+MIN_DIFFERENCE = {'seconds': 0.05, 'peak_mb': 16.0}
+MIN_DIFFERENCE_MS = 0.5
+
+
+def make_raw_reviews(n_row: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Create a synthetic raw dataset with the columns of 'Hotel_Reviews.csv'
+    and about its proportions: some 350 reviews per hotel, a quarter of the
+    hotels in the United Kingdom and half of the reviewers British.
+    """
+    rng = np.random.default_rng(seed)
+    n_hotel = max(n_row // 350, 20)
+    n_uk_hotel = max(n_hotel // 4, 10)
+    addresses = np.array(
+        [f"{i} Street London {UK_POSTAL_CODES[i % len(UK_POSTAL_CODES)]} "
+         f"United Kingdom" for i in range(n_uk_hotel)]
+        + [f"{i} {OTHER_ADDRESSES[i % len(OTHER_ADDRESSES)]}"
+           for i in range(n_hotel - n_uk_hotel)])
+    hotel_ids = rng.integers(0, n_hotel, n_row)
+    texts = np.array([" ".join(rng.choice(WORDS, rng.integers(3, 30)))
+                      for _ in range(2000)] + ["No Negative", "No Positive"])
+    return pd.DataFrame({
+        'Hotel_Address': addresses[hotel_ids],
+        'Additional_Number_of_Scoring': 100,
+        'Review_Date': [f"{month}/{day}/2017" for month, day in zip(
+            rng.integers(1, 13, n_row), rng.integers(1, 29, n_row))],
+        'Average_Score': (7.0 + (hotel_ids % 30) / 10).round(1),
+        'Hotel_Name': [f"Hotel {i}" for i in hotel_ids],
+        'Reviewer_Nationality': rng.choice(
+            [" United Kingdom ", " United States of America ", " Ireland ",
+             " Australia "], n_row, p=[0.5, 0.2, 0.15, 0.15]),
+        'Negative_Review': rng.choice(texts, n_row),
+        'Review_Total_Negative_Word_Counts': 10,
+        'Total_Number_of_Reviews': 1000,
+        'Positive_Review': rng.choice(texts, n_row),
+        'Review_Total_Positive_Word_Counts': 10,
+        'Total_Number_of_Reviews_Reviewer_Has_Given': 1,
+        'Reviewer_Score': rng.choice([5.0, 7.5, 8.3, 9.2, 10.0], n_row),
+        'Tags': "[' Leisure trip ', ' Couple ', ' Double Room ', "
+                "' Stayed 2 nights ']",
+        'days_since_review': "0 days",
+        'lat': 51.5 + (hotel_ids % 100) / 1000,
+        'lng': -0.1 - (hotel_ids % 100) / 1000,
+    })
+
+
+def make_questions(n_question: int, seed: int = 1) -> List[str]:
+    """
+    Create questions naming a few review words, some with a score bound.
+    """
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(WORDS, 3))
+            + (f" hotel above {rng.integers(7, 10)}" if i % 4 == 0 else
+               " hotel in London")
+            for i in range(n_question)]
+
+
+def _peak_rss_mb() -> float:
+    """
+    Read the peak resident set size of the current process (Linux).
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 2 ** 10
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def _measure(fn: Callable) -> Tuple[object, dict]:
+    """
+    Run a function, measuring its wall time and the growth of the peak RSS.
+    """
+    start_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    result = fn()
+    return result, {'seconds': time.perf_counter() - start,
+                    'peak_mb': _peak_rss_mb() - start_rss}
+
+
+def _percentiles(latencies: List[float]) -> dict:
+    """
+    Summarize latencies in milliseconds.
+    """
+    latencies = np.array(latencies) * 1000
+    return {'mean_ms': float(latencies.mean()),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99))}
+
+
+def _configure(data_dir: str, database: str):
+    """
+    Point every data path of the pipeline at the benchmark directory and get
+    the vector database class.
+    """
+    from src.data_preparation import prepare_docs
+    from src.vector_database import vector_database
+    from src.vector_database import ChromaDB, FaissDB, NumpyDB
+    prepare_docs.RAW_DATA_DIR = os.path.join(data_dir, "raw")
+    prepare_docs.PROCESSED_DATA_DIR = os.path.join(data_dir, "processed")
+    vector_database.DATA_DIR = data_dir
+    ChromaDB.CHROMA_DB_PATH = os.path.join(data_dir, "chroma_db")
+    FaissDB.FAISS_DB_PATH = os.path.join(data_dir, "faiss_db")
+    NumpyDB.NUMPY_DB_PATH = os.path.join(data_dir, "numpy_db")
+    return {'chroma': ChromaDB, 'faiss': FaissDB, 'numpy': NumpyDB}[database]
+
+
+def _embedding_model(args):
+    from src.embeddings import Embeddings, EmbeddingType
+    return Embeddings.get(EmbeddingType.HASHING,
+                          latency=args['embedding_latency'])
+
+
+def stage_generate(data_dir: str, args: dict) -> Dict[str, dict]:
+    """
+    Write the synthetic raw CSV.
+    """
+    raw_dir = os.path.join(data_dir, "raw")
+    os.makedirs(raw_dir, exist_ok=True)
+    _, generate = _measure(lambda: make_raw_reviews(args['n_row']).to_csv(
+        os.path.join(raw_dir, "Hotel_Reviews.csv"), index=False))
+    return {'generate': generate}
+
+
+def stage_prep(data_dir: str, args: dict) -> Dict[str, dict]:
+    """
+    Create the processed data from the raw CSV.
+    """
+    from src.data_preparation import CSVData
+    _configure(data_dir, args['database'])
+    data = CSVData("Hotel_Reviews")
+    _, prep = _measure(lambda: data.create_processed_data(
+        COUNTRY, chunksize=args['chunksize'], csv_export=False))
+    prep['n_hotel'] = len(data.load_processed_data(columns=['Hotel_Name']))
+    return {'prep': prep}
+
+
+def stage_build(data_dir: str, args: dict) -> Dict[str, dict]:
+    """
+    Build the vector index, then the indexes of the filtered retriever.
+    """
+    db_cls = _configure(data_dir, args['database'])
+    embedding_model = _embedding_model(args)
+    _, index_build = _measure(lambda: db_cls.get(embedding_model, COUNTRY))
+    _, retriever_build = _measure(lambda: db_cls.get_filtered_retriever(
+        embedding_model, COUNTRY, k=3))
+    return {'index_build': index_build, 'retriever_build': retriever_build}
+
+
+def stage_query(data_dir: str, args: dict) -> Dict[str, dict]:
+    """
+    Load the built indexes, then time the retriever queries and the agent
+    turns, one at a time and concurrently.
+    """
+    from src.agent import Agents, AgentRunner
+    from src.models import Models, ModelType
+    from src.prompts import ReactPrompt
+    from src.tools import RetrieverTool
+    db_cls = _configure(data_dir, args['database'])
+    embedding_model = _embedding_model(args)
+    _, index_load = _measure(lambda: db_cls.get(embedding_model, COUNTRY))
+    retriever, retriever_load = _measure(lambda: db_cls.get_filtered_retriever(
+        embedding_model, COUNTRY, k=3))
+
+    questions = make_questions(args['n_query'])
+    for question in questions[:5]:  # warm up
+        retriever.invoke(question)
+    latencies = []
+
+    def query_all():
+        for question in questions:
+            start = time.perf_counter()
+            retriever.invoke(question)
+            latencies.append(time.perf_counter() - start)
+
+    _, retrieval = _measure(query_all)
+    retrieval.update(_percentiles(latencies))
+
+    llm = Models.get(ModelType.SCRIPTED_REACT,
+                     token_delay=args['llm_token_delay'],
+                     first_token_delay=args['llm_first_token_delay'])
+    agent = Agents.get(llm, [RetrieverTool.get(retriever)],
+                       ReactPrompt(conversation_history=False).get(),
+                       react=True)
+    runner = AgentRunner(agent, max_concurrency=args['concurrency'])
+    questions = make_questions(args['n_turn'], seed=2)
+    latencies = []
+
+    async def turn(question):
+        start = time.perf_counter()
+        await runner.ainvoke(question)
+        latencies.append(time.perf_counter() - start)
+
+    async def run_sequential():
+        for question in questions:
+            await turn(question)
+
+    async def run_concurrent():
+        await asyncio.gather(*[runner.ainvoke(question)
+                               for question in questions])
+
+    _, agent_turn = _measure(lambda: asyncio.run(run_sequential()))
+    agent_turn.update(_percentiles(latencies))
+    _, concurrent = _measure(lambda: asyncio.run(run_concurrent()))
+    agent_turn['throughput_per_s'] = len(questions) / concurrent['seconds']
+    return {'index_load': index_load, 'retriever_load': retriever_load,
+            'retrieval': retrieval, 'agent_turn': agent_turn}
+
+
+def _run_stage(stage: str, data_dir: str, args: dict, queue: mp.Queue):
+    """
+    Run a stage in the current, fresh, process and report its metrics.
+    """
+    try:
+        queue.put(globals()[f"stage_{stage}"](data_dir, args))
+    except Exception as e:  # reported by the parent
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+
+
+def bench_scale(n_row: int, args: argparse.Namespace) -> Dict[str, dict]:
+    """
+    Run every stage on a synthetic dataset of a number of rows.
+    """
+    stage_args = {'n_row': n_row, 'database': args.database,
+                  'chunksize': args.chunksize, 'n_query': args.n_query,
+                  'n_turn': args.n_turn, 'concurrency': args.concurrency,
+                  'embedding_latency': args.embedding_latency,
+                  'llm_token_delay': args.llm_token_delay,
+                  'llm_first_token_delay': args.llm_first_token_delay}
+    data_dir = tempfile.mkdtemp()
+    results = {}
+    ctx = mp.get_context('spawn')
+    try:
+        for stage in ["generate", "prep", "build", "query"]:
+            queue = ctx.Queue()
+            process = ctx.Process(target=_run_stage,
+                                  args=(stage, data_dir, stage_args, queue))
+            process.start()
+            metrics = queue.get()
+            process.join()
+            if 'error' in metrics:
+                raise RuntimeError(f"The {stage} stage of {n_row} rows "
+                                   f"failed: {metrics['error']}")
+            results.update(metrics)
+            print(f"[INFO] {n_row} rows: {stage} done")
+    finally:
+        shutil.rmtree(data_dir)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[dict]:
+    """
+    Compare the metrics of the results with the ones of a baseline.
+
+    Parameters
+    ----------
+    results: dict
+        The results, as written by this benchmark.
+    baseline: dict
+        The baseline, as written by this benchmark.
+    tolerance: float
+        The relative change allowed, e.g. 0.2 for 20%.
+
+    Returns
+    -------
+    List[dict]
+        Every metric of both, with its scale, stage, name, baseline and new
+        values, relative change and whether it regressed.
+    """
+    rows = []
+    for scale, stages in results['results'].items():
+        for stage, metrics in stages.items():
+            base_metrics = baseline['results'].get(scale, {}).get(stage, {})
+            for name, value in metrics.items():
+                base = base_metrics.get(name)
+                if not isinstance(base, (int, float)) or name == 'n_hotel':
+                    continue
+                change = (value - base) / base if base else 0.0
+                worse = -change if name in HIGHER_IS_BETTER else change
+                min_difference = MIN_DIFFERENCE_MS if name.endswith('_ms') \
+                    else MIN_DIFFERENCE.get(name, 0.0)
+                rows.append({'scale': scale, 'stage': stage, 'metric': name,
+                             'baseline': base, 'value': value,
+                             'change': change,
+                             'regression': worse > tolerance
+                             and abs(value - base) > min_difference})
+    return rows
+
+
+def print_results(results: dict):
+    print(f"{'rows':>8} {'stage':<16}{'seconds':>10}{'peak (MB)':>11}"
+          f"{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+    for scale, stages in results['results'].items():
+        for stage, metrics in stages.items():
+            line = f"{scale:>8} {stage:<16}{metrics['seconds']:>10.3f}" \
+                   f"{metrics['peak_mb']:>11.1f}"
+            if 'p50_ms' in metrics:
+                line += f"{metrics['p50_ms']:>10.2f}" \
+                        f"{metrics['p95_ms']:>10.2f}{metrics['p99_ms']:>10.2f}"
+            if 'throughput_per_s' in metrics:
+                line += f"  {metrics['throughput_per_s']:.1f} turns/s"
+            print(line)
+
+
+def print_comparison(rows: List[dict], tolerance: float) -> int:
+    regressions = [row for row in rows if row['regression']]
+    print(f"{len(rows)} metrics compared, {len(regressions)} worse than the "
+          f"baseline by more than {tolerance:.0%}")
+    for row in regressions:
+        print(f"REGRESSION {row['scale']:>8} {row['stage']:<16}"
+              f"{row['metric']:<18}{row['baseline']:>12.3f} -> "
+              f"{row['value']:>12.3f} ({row['change']:+.0%})")
+    return len(regressions)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+",
+                        default=[10000, 100000, 515000],
+                        help="the numbers of raw reviews")
+    parser.add_argument("--database", choices=DATABASES, default="chroma")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="read the raw data in chunks of this many rows")
+    parser.add_argument("--n-query", type=int, default=200)
+    parser.add_argument("--n-turn", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--embedding-latency", type=float, default=0.0,
+                        help="the simulated seconds of an embedding call")
+    parser.add_argument("--llm-token-delay", type=float, default=0.0,
+                        help="the simulated seconds between two tokens")
+    parser.add_argument("--llm-first-token-delay", type=float, default=0.0,
+                        help="the simulated seconds before the first token")
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--baseline", default=None,
+                        help="flag the regressions against these results")
+    parser.add_argument("--compare", default=None,
+                        help="compare these results with the baseline "
+                             "instead of running the benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare) as f:
+            results = json.load(f)
+    else:
+        results = {
+            'meta': {'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     'python': sys.version.split()[0],
+                     'platform': platform.platform(),
+                     'cpus': os.cpu_count(),
+                     'args': vars(args)},
+            'results': {str(n_row): bench_scale(n_row, args)
+                        for n_row in args.scales}}
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Results written to {args.output}")
+    print_results(results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.tolerance)
+        if print_comparison(rows, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
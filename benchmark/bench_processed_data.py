@@ -0,0 +1,124 @@
+"""
+Benchmark the loading of the processed data: the CSV export versus the typed
+Parquet file, fully and with only the columns needed at startup.
+
+Run from the repository root:
+    python -m benchmark.bench_processed_data --n-hotel 20000
+"""
+import argparse, os, resource, tempfile, time
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+from typing import List, Optional
+
+from src.data_preparation.storage import save_processed_df, load_processed_df
+
+
+def make_processed_df(n_hotel: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Create a synthetic processed dataset with the columns of the real one.
+    """
+    rng = np.random.default_rng(seed)
+    cities = np.array(["London", "Manchester", "Edinburgh", "Bristol"])
+    words = np.array(["staff", "friendly", "room", "spotless", "breakfast",
+                      "noisy", "location", "tube", "bed", "small", "great"])
+    reviews = [" ".join(rng.choice(words, 40)) for _ in range(2 * n_hotel)]
+    return pd.DataFrame({
+        'Hotel_Name': [f"Hotel {i}" for i in range(n_hotel)],
+        'Average_Score': rng.uniform(5, 10, n_hotel).round(1),
+        'Hotel_Address': [f"{i} Road London SW{i % 20} 1AA United Kingdom"
+                          for i in range(n_hotel)],
+        'Review_Date': "8/3/2017",
+        'Postal_Code': [f"SW{i % 20} 1AA" for i in range(n_hotel)],
+        'City': rng.choice(cities, n_hotel),
+        'lat': rng.uniform(50, 56, n_hotel),
+        'lng': rng.uniform(-4, 1, n_hotel),
+        'Clean_Tags': "Leisure trip, Couple, Double Room, Stayed 2 nights",
+        'Positive_Review': reviews[:n_hotel],
+        'Negative_Review': reviews[n_hotel:],
+    })
+
+
+def _peak_rss_mb() -> float:
+    """
+    Read the peak resident set size of the current process (Linux).
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 2 ** 10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def _load(loader: str, path: str, columns: Optional[List[str]],
+          queue: mp.Queue):
+    """
+    Load the data in a fresh process and report the growth of its peak RSS.
+    """
+    start_rss = _peak_rss_mb()
+    if loader == 'csv':
+        df = pd.read_csv(path, usecols=columns)
+    else:
+        df = load_processed_df(path, columns=columns)
+    queue.put((_peak_rss_mb() - start_rss,
+               df.memory_usage(deep=True).sum() / 2 ** 20))
+
+
+def measure(loader: str, path: str, columns: Optional[List[str]],
+            repeat: int) -> dict:
+    """
+    Measure the best wall time of a loader, the growth of the peak RSS while
+    loading in a fresh process and the memory of the loaded data.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if loader == 'csv':
+            pd.read_csv(path, usecols=columns)
+        else:
+            load_processed_df(path, columns=columns)
+        times.append(time.perf_counter() - start)
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_load, args=(loader, path, columns, queue))
+    process.start()
+    peak_mb, data_mb = queue.get()
+    process.join()
+    return {'time_ms': min(times) * 1000, 'peak_mb': peak_mb,
+            'data_mb': data_mb}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-hotel", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = os.path.join(tmp_dir, "bench_processed_df.parquet")
+        csv_path = os.path.join(tmp_dir, "bench_processed_df.csv")
+        save_processed_df(make_processed_df(args.n_hotel), data_path)
+        startup_cols = ['Hotel_Name', 'City', 'Postal_Code', 'lat', 'lng']
+        results = {
+            'csv': measure('csv', csv_path, None, args.repeat),
+            'csv (startup columns)': measure('csv', csv_path, startup_cols,
+                                             args.repeat),
+            'parquet': measure('parquet', data_path, None, args.repeat),
+            'parquet (startup columns)': measure('parquet', data_path,
+                                                 startup_cols, args.repeat),
+        }
+        sizes = {'csv': os.path.getsize(csv_path),
+                 'parquet': os.path.getsize(data_path)}
+
+    print(f"{args.n_hotel} hotels, CSV {sizes['csv'] / 2 ** 20:.1f} MB, "
+          f"Parquet {sizes['parquet'] / 2 ** 20:.1f} MB")
+    print(f"{'format':<28}{'time (ms)':>12}{'peak (MB)':>12}"
+          f"{'data (MB)':>12}")
+    for name, result in results.items():
+        print(f"{name:<28}{result['time_ms']:>12.1f}"
+              f"{result['peak_mb']:>12.1f}{result['data_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
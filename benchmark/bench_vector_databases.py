@@ -0,0 +1,150 @@
+"""
+Compare the vector databases on synthetic hotels: build time, load time,
+query latency and recall@k against an exact cosine search.
+
+Run from the repository root:
+    python -m benchmark.bench_vector_databases --n-hotel 5000
+"""
+import argparse, hashlib, os, shutil, tempfile, time
+import numpy as np
+import pandas as pd
+
+from langchain_core.embeddings import Embeddings
+
+from src.vector_database import vector_database
+from src.vector_database import (ChromaDB, FaissDB, FaissIndexType, NumpyDB,
+                                 QuantizationType)
+
+COUNTRY = "United Kingdom"
+WORDS = ["staff", "friendly", "room", "spotless", "breakfast", "noisy",
+         "location", "tube", "bed", "small", "great", "view", "pool", "bar",
+         "quiet", "central", "clean", "rude", "cosy", "modern", "park",
+         "station", "museum", "river", "shower", "spa", "gym", "parking"]
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    A deterministic bag-of-words embedding, so that no model is needed.
+    """
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def _embed(self, text: str):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in text.lower().split():
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[index] += 1 if digest[4] % 2 else -1
+        return (vector / max(np.linalg.norm(vector), 1e-12)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def make_processed_data(data_dir: str, n_hotel: int, seed: int = 0):
+    """
+    Write a synthetic processed dataset in the data directory.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Hotel_Name': [f"Hotel {i}" for i in range(n_hotel)],
+        'City': rng.choice(["London", "Manchester", "Bristol"], n_hotel),
+        'Positive_Review': [" ".join(rng.choice(WORDS, 12))
+                            for _ in range(n_hotel)],
+        'Negative_Review': [" ".join(rng.choice(WORDS, 6))
+                            for _ in range(n_hotel)],
+    })
+    os.makedirs(os.path.join(data_dir, "processed"))
+    df.to_parquet(os.path.join(data_dir, "processed",
+                               f"{COUNTRY}_processed_df.parquet"))
+
+
+def exact_top_k(embedding_model, queries, k):
+    """
+    The exact cosine similarity of every hotel and the k-th best similarity
+    of every query. Ties with the k-th hotel count as correct results.
+    """
+    documents = vector_database.load_documents(COUNTRY)
+    vectors = np.array(embedding_model.embed_documents(
+        [document.page_content for document in documents]))
+    query_vectors = np.array(embedding_model.embed_documents(queries))
+    truth = []
+    for scores in query_vectors @ vectors.T:
+        kth_score = np.sort(scores)[-k]
+        truth.append(({document.metadata['hotel_id']: score
+                       for document, score in zip(documents, scores)},
+                      kth_score))
+    return truth
+
+
+def bench(name, db_cls, get_db, queries, truth, k):
+    """
+    Build, load and query a vector database.
+    """
+    start = time.perf_counter()
+    get_db()  # build and load
+    build_s = time.perf_counter() - start
+    start = time.perf_counter()
+    db_cls.unload()  # measure a cold load, not the warm index
+    vector_db = get_db()  # load only
+    load_s = time.perf_counter() - start
+    latencies, recalls = [], []
+    for query, (scores, kth_score) in zip(queries, truth):
+        start = time.perf_counter()
+        documents = vector_db.similarity_search(query, k=k)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(np.mean([
+            scores[document.metadata['hotel_id']] >= kth_score - 1e-5
+            for document in documents]))
+    latencies = np.array(latencies) * 1000
+    print(f"{name:<14}{build_s:>10.2f}{load_s * 1000:>12.1f}"
+          f"{np.percentile(latencies, 50):>10.2f}"
+          f"{np.percentile(latencies, 95):>10.2f}{np.mean(recalls):>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-hotel", type=int, default=5000)
+    parser.add_argument("--n-query", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    vector_database.DATA_DIR = tmp_dir
+    FaissDB.FAISS_DB_PATH = os.path.join(tmp_dir, "faiss_db")
+    ChromaDB.CHROMA_DB_PATH = os.path.join(tmp_dir, "chroma_db")
+    NumpyDB.NUMPY_DB_PATH = os.path.join(tmp_dir, "numpy_db")
+    try:
+        make_processed_data(tmp_dir, args.n_hotel)
+        embedding_model = HashingEmbeddings()
+        rng = np.random.default_rng(1)
+        queries = [" ".join(rng.choice(WORDS, 4))
+                   for _ in range(args.n_query)]
+        truth = exact_top_k(embedding_model, queries, args.k)
+
+        print(f"{args.n_hotel} hotels, {args.n_query} queries, k={args.k}")
+        print(f"{'database':<14}{'build (s)':>10}{'load (ms)':>12}"
+              f"{'p50 (ms)':>10}{'p95 (ms)':>10}{'recall':>10}")
+        for index_type in FaissIndexType:
+            bench(f"faiss-{index_type.value}", FaissDB,
+                  lambda: FaissDB.get(embedding_model, COUNTRY, index_type),
+                  queries, truth, args.k)
+        for quantization in QuantizationType:
+            bench(f"numpy-{quantization.value}", NumpyDB,
+                  lambda: NumpyDB.get(embedding_model, COUNTRY, quantization),
+                  queries, truth, args.k)
+        try:
+            bench("chroma", ChromaDB,
+                  lambda: ChromaDB.get(embedding_model, COUNTRY),
+                  queries, truth, args.k)
+        except ImportError as e:
+            print(f"chroma        skipped ({e})")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
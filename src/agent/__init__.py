@@ -1 +1,18 @@
-from .agents import Agents
+from ..shared import lazy_exports
+from .history_type import HistoryPolicy
+from .route_type import RoutePath
+
+# the agent and its runners are imported on first use, with langchain, so
+# that importing the package for the policies stays cheap
+_LAZY_IMPORTS = {
+    'Agents': '.agents',
+    'AgentRunner': '.runner',
+    'SessionHistory': '.history',
+    'SessionStore': '.history',
+    'SESSION_STORE_PATH': '.history',
+    'QuestionRouter': '.router',
+    'MetricsCallbackHandler': '.metrics',
+    'METRICS_DIR': '.metrics'
+}
+__getattr__, __dir__, __all__ = lazy_exports(
+    __name__, _LAZY_IMPORTS, ['HistoryPolicy', 'RoutePath'])
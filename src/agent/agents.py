@@ -1,8 +1,12 @@
-from langchain.agents import create_react_agent, AgentExecutor, Tool
-from langchain_openai import ChatOpenAI
-from langchain_community.llms import HuggingFaceEndpoint
+from __future__ import annotations
 from langchain_core.prompts import PromptTemplate
-from typing import Union, List
+from langchain_core.tools import Tool
+from typing import Union, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from langchain.agents import AgentExecutor
+    from langchain_openai import ChatOpenAI
+    from langchain_community.llms import HuggingFaceEndpoint
 
 
 class Agents:
@@ -45,6 +49,7 @@ class Agents:
         """
         if react:
             print("[INFO] Creating React Agent.")
+            from langchain.agents import create_react_agent, AgentExecutor
             agent = create_react_agent(llm, tools, prompt)
             return AgentExecutor(
                 agent=agent,
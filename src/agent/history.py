@@ -0,0 +1,278 @@
+import os, json, time, sqlite3, threading
+from collections import OrderedDict
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import (BaseMessage, SystemMessage,
+                                     get_buffer_string, messages_from_dict,
+                                     messages_to_dict)
+from .history_type import HistoryPolicy
+from typing import Callable, List, Optional, Sequence
+
+DATA_DIR = os.path.join(os.path.dirname(os.getcwd()), 'data')
+SESSION_STORE_PATH = os.path.join(DATA_DIR, "chat_history", "sessions.sqlite")
+SUMMARY_TEMPLATE = """Progressively summarize the conversation between a user
+and a hotel recommendation assistant, adding onto the previous summary. Keep
+the hotels, places and preferences mentioned.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:"""
+
+
+class SessionHistory(BaseChatMessageHistory):
+    """
+    The chat history of a session, bounded by its policy: only the last k
+    turns are kept, and with the summary policy the older turns are folded
+    into a rolling summary given as a first system message.
+    """
+    def __init__(self,
+                 session_id: str,
+                 policy: HistoryPolicy = HistoryPolicy.WINDOW,
+                 k: int = 5,
+                 summarize: Optional[Callable[[str, List[BaseMessage]],
+                                              str]] = None,
+                 messages: Optional[List[BaseMessage]] = None,
+                 summary: str = "",
+                 on_change: Optional[Callable[["SessionHistory"], None]]
+                 = None):
+        """
+        Initialize a new SessionHistory.
+
+        Parameters
+        ----------
+        session_id: str
+            The session ID.
+        policy: HistoryPolicy, optional
+            The history policy. Defaults to the window of the last k turns.
+        k: int, optional
+            The number of turns kept as messages. Defaults to 5.
+        summarize: Optional[Callable[[str, List[BaseMessage]], str]], optional
+            Folds messages into a summary, required by the summary policy.
+        messages: Optional[List[BaseMessage]], optional
+            The messages kept.
+        summary: str, optional
+            The summary of the older turns.
+        on_change: Optional[Callable[[SessionHistory], None]], optional
+            Called after every change, e.g. to save the history.
+        """
+        if policy == HistoryPolicy.SUMMARY and summarize is None:
+            raise ValueError("The summary policy needs a summarizer.")
+        self.session_id = session_id
+        self.policy = policy
+        self.k = k
+        self.summarize = summarize
+        self.kept_messages = list(messages or [])
+        self.summary = summary
+        self.on_change = on_change
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """
+        Get the messages given to the prompt.
+        """
+        if self.summary:
+            return [SystemMessage(
+                content=f"Summary of the earlier conversation: "
+                        f"{self.summary}")] + self.kept_messages
+        return list(self.kept_messages)
+
+    def add_messages(self, messages: Sequence[BaseMessage]):
+        self.kept_messages.extend(messages)
+        n_kept = 2 * self.k  # a turn is a question and an answer
+        if len(self.kept_messages) > n_kept:
+            dropped = self.kept_messages[:len(self.kept_messages) - n_kept]
+            self.kept_messages = self.kept_messages[len(dropped):]
+            if self.policy == HistoryPolicy.SUMMARY:
+                self.summary = self.summarize(self.summary, dropped)
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def clear(self):
+        self.kept_messages = []
+        self.summary = ""
+        if self.on_change is not None:
+            self.on_change(self)
+
+
+class SessionStore:
+    """
+    The store of the chat histories of the sessions. The least recently used
+    sessions are evicted beyond a number of sessions and the idle ones expire
+    after a time to live. With a path, the histories are saved in a SQLite
+    file, so the sessions survive a restart and the evicted ones are reloaded.
+    """
+    def __init__(self,
+                 policy: HistoryPolicy = HistoryPolicy.WINDOW,
+                 k: int = 5,
+                 llm: Optional[BaseLanguageModel] = None,
+                 max_sessions: int = 1024,
+                 ttl_seconds: Optional[float] = 24 * 3600,
+                 path: Optional[str] = None):
+        """
+        Initialize a new SessionStore.
+
+        Parameters
+        ----------
+        policy: HistoryPolicy, optional
+            The history policy. Defaults to the window of the last k turns.
+        k: int, optional
+            The number of turns kept as messages. Defaults to 5.
+        llm: Optional[BaseLanguageModel], optional
+            The LLM writing the rolling summary, required by the summary
+            policy.
+        max_sessions: int, optional
+            The maximum number of sessions in memory. Defaults to 1024.
+        ttl_seconds: Optional[float], optional
+            The time to live of an idle session, None to never expire.
+            Defaults to a day.
+        path: Optional[str], optional
+            The path of the SQLite file, e.g. SESSION_STORE_PATH. Defaults to
+            None to keep the sessions in memory only.
+        """
+        if policy == HistoryPolicy.SUMMARY and llm is None:
+            raise ValueError("The summary policy needs an LLM.")
+        self.policy = policy
+        self.k = k
+        self.llm = llm
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._lock = threading.RLock()
+        # session ID -> (history, last access), least recently used first
+        self._sessions = OrderedDict()
+        self._conn = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, "
+                "summary TEXT NOT NULL, last_access REAL NOT NULL)")
+            self._conn.commit()
+
+    def get_session_history(self, session_id: str) -> SessionHistory:
+        """
+        Retrieve the history of a session, creating it the first time. It is
+        the `get_session_history` of a RunnableWithMessageHistory.
+
+        Parameters
+        ----------
+        session_id: str
+            The session ID.
+
+        Returns
+        -------
+        SessionHistory
+            The history.
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if session_id in self._sessions:
+                history = self._sessions.pop(session_id)[0]
+            else:
+                history = self._load(session_id)
+            self._sessions[session_id] = (history, now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+            return history
+
+    def sessions(self) -> List[str]:
+        """
+        List the IDs of the sessions in memory, least recently used first.
+        """
+        with self._lock:
+            return list(self._sessions)
+
+    def delete(self, session_id: str):
+        """
+        Delete the history of a session.
+
+        Parameters
+        ----------
+        session_id: str
+            The session ID.
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?",
+                                   (session_id,))
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        """
+        Report the usage of the store.
+
+        Returns
+        -------
+        dict
+            The number of sessions and messages in memory, and of evictions.
+        """
+        with self._lock:
+            return {'sessions': len(self._sessions),
+                    'messages': sum(len(history.kept_messages)
+                                    for history, _ in self._sessions.values()),
+                    'evictions': self.evictions}
+
+    def _load(self, session_id: str) -> SessionHistory:
+        """
+        Load the history of a session from the SQLite file, or create it.
+        """
+        messages, summary = [], ""
+        if self._conn is not None:
+            row = self._conn.execute(
+                "SELECT messages, summary FROM sessions WHERE session_id = ?",
+                (session_id,)).fetchone()
+            if row is not None:
+                messages, summary = messages_from_dict(json.loads(row[0])), \
+                    row[1]
+        return SessionHistory(
+            session_id, self.policy, self.k,
+            self._summarize if self.policy == HistoryPolicy.SUMMARY else None,
+            messages, summary,
+            self._save if self._conn is not None else None)
+
+    def _save(self, history: SessionHistory):
+        """
+        Save the history of a session in the SQLite file.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                (history.session_id,
+                 json.dumps(messages_to_dict(history.kept_messages)),
+                 history.summary, time.time()))
+            self._conn.commit()
+
+    def _expire(self, now: float):
+        """
+        Remove the sessions idle for longer than the time to live.
+        """
+        if self.ttl_seconds is None:
+            return
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+            self.evictions += 1
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM sessions WHERE last_access < ?",
+                               (now - self.ttl_seconds,))
+            self._conn.commit()
+
+    def _summarize(self, summary: str, messages: List[BaseMessage]) -> str:
+        """
+        Fold messages into the rolling summary with the LLM.
+        """
+        response = self.llm.invoke(SUMMARY_TEMPLATE.format(
+            summary=summary or "(none)",
+            new_lines=get_buffer_string(messages)))
+        return getattr(response, 'content', response).strip()
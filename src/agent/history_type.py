@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class HistoryPolicy(str, Enum):
+    WINDOW = "window"
+    SUMMARY = "summary"
@@ -0,0 +1,511 @@
+import os, json, time, uuid, threading
+from collections import deque
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+DATA_DIR = os.path.join(os.path.dirname(os.getcwd()), 'data')
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+METRIC_PREFIX = "staychat"
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+# the tool run by the agent executor when the output of the LLM cannot be
+# parsed, before asking the LLM again
+PARSING_ERROR_TOOL = "_Exception"
+
+
+class Histogram:
+    """
+    A cumulative histogram, as in Prometheus: the number of observations at
+    most every bucket bound, their sum and their count.
+    """
+    def __init__(self, buckets: Sequence[float]):
+        """
+        Initialize a new Histogram.
+
+        Parameters
+        ----------
+        buckets: Sequence[float]
+            The upper bounds of the buckets, increasing.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """
+        Add an observation.
+        """
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    A callback handler recording a span for every agent run, LLM call, tool
+    call and retrieval, with latency and token histograms, so a slow answer
+    can be traced to the LLM, the retriever, the online search or the
+    retries after parsing errors.
+
+    The spans of a request share its trace ID, given in the metadata of the
+    run config, e.g. `agent_executor.invoke(inputs, config=handler.config())`,
+    or the ID of the root run otherwise. The metrics are exported as
+    Prometheus text and the spans as JSON lines.
+    """
+    run_inline = True  # no thread per event
+
+    def __init__(self, max_spans: int = 10000):
+        """
+        Initialize a new MetricsCallbackHandler.
+
+        Parameters
+        ----------
+        max_spans: int, optional
+            The number of recent spans kept for the export. Defaults to
+            10000.
+        """
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=max_spans)
+        # run ID -> the open span, or the trace ID of an untraced run
+        self._runs: Dict[UUID, dict] = {}
+        self._seconds: Dict[Tuple[str, str], Histogram] = {}
+        self._first_token_seconds: Dict[str, Histogram] = {}
+        self._tokens: Dict[Tuple[str, str], Histogram] = {}
+        self._errors: Dict[Tuple[str, str], int] = {}
+        self.parsing_errors = 0
+
+    @staticmethod
+    def new_trace_id() -> str:
+        """
+        Create a new trace ID.
+        """
+        return uuid.uuid4().hex
+
+    def config(self, trace_id: Optional[str] = None, **metadata) -> dict:
+        """
+        Create the run config of a request, with this handler and its trace
+        ID.
+
+        Parameters
+        ----------
+        trace_id: Optional[str], optional
+            The trace ID, a new one if not given.
+        **metadata
+            The other metadata of the request, e.g. the session ID, or the
+            'parent_span_id' of the root runs.
+
+        Returns
+        -------
+        dict
+            The config, e.g. of `agent_executor.invoke`.
+        """
+        return {'callbacks': [self],
+                'metadata': {**metadata,
+                             'trace_id': trace_id or self.new_trace_id()}}
+
+    # the callbacks of the runs
+    def on_chain_start(self, serialized: Dict[str, Any],
+                       inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None,
+                       metadata: Optional[Dict[str, Any]] = None,
+                       **kwargs: Any):
+        # only the root chain is a span, the run of the agent
+        self._start(run_id, parent_run_id, metadata, 'agent',
+                    self._name(serialized, kwargs),
+                    span=parent_run_id is None)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID,
+                       **kwargs: Any):
+        self._end(run_id, error=error)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str],
+                     *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                     metadata: Optional[Dict[str, Any]] = None,
+                     **kwargs: Any):
+        self._start(run_id, parent_run_id, metadata, 'llm',
+                    self._name(serialized, kwargs))
+
+    def on_chat_model_start(self, serialized: Dict[str, Any],
+                            messages: List[list], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None,
+                            metadata: Optional[Dict[str, Any]] = None,
+                            **kwargs: Any):
+        self._start(run_id, parent_run_id, metadata, 'llm',
+                    self._name(serialized, kwargs))
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            span = self._runs.get(run_id)
+            if span is None or 'kind' not in span:
+                return
+            attributes = span['attributes']
+            if 'first_token_seconds' not in attributes:
+                attributes['first_token_seconds'] = \
+                    time.perf_counter() - span['perf_start']
+                self._histogram(self._first_token_seconds, span['name'],
+                                SECONDS_BUCKETS).observe(
+                    attributes['first_token_seconds'])
+            attributes['streamed_tokens'] = \
+                attributes.get('streamed_tokens', 0) + 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID,
+                   **kwargs: Any):
+        self._end(run_id, **self._token_usage(response))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID,
+                     **kwargs: Any):
+        self._end(run_id, error=error)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *,
+                      run_id: UUID, parent_run_id: Optional[UUID] = None,
+                      metadata: Optional[Dict[str, Any]] = None,
+                      **kwargs: Any):
+        name = self._name(serialized, kwargs)
+        if name == PARSING_ERROR_TOOL:
+            with self._lock:
+                self.parsing_errors += 1
+        self._start(run_id, parent_run_id, metadata, 'tool', name)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, output_chars=len(str(output)))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID,
+                      **kwargs: Any):
+        self._end(run_id, error=error)
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *,
+                           run_id: UUID, parent_run_id: Optional[UUID] = None,
+                           metadata: Optional[Dict[str, Any]] = None,
+                           **kwargs: Any):
+        self._start(run_id, parent_run_id, metadata, 'retriever',
+                    self._name(serialized, kwargs))
+
+    def on_retriever_end(self, documents: Sequence[Any], *, run_id: UUID,
+                         **kwargs: Any):
+        self._end(run_id, n_document=len(documents))
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID,
+                           **kwargs: Any):
+        self._end(run_id, error=error)
+
+    # the reports
+    def spans(self, trace_id: Optional[str] = None) -> List[dict]:
+        """
+        List the recent spans, oldest first.
+
+        Parameters
+        ----------
+        trace_id: Optional[str], optional
+            If given, the spans of this trace only.
+
+        Returns
+        -------
+        List[dict]
+            The trace ID, span ID, parent span ID, kind ('request', 'agent',
+            'llm', 'tool' or 'retriever'), name, start time, seconds, status
+            and attributes, e.g. the tokens, of every span.
+        """
+        with self._lock:
+            return [dict(span) for span in self._spans
+                    if trace_id is None or span['trace_id'] == trace_id]
+
+    def breakdown(self, trace_id: str) -> dict:
+        """
+        Break the latency of a request down by kind of span.
+
+        Parameters
+        ----------
+        trace_id: str
+            The trace ID of the request.
+
+        Returns
+        -------
+        dict
+            The seconds of the request, and the total seconds and number of
+            its agent runs, LLM calls, tool calls and retrievals, by name.
+        """
+        breakdown = {'seconds': 0.0}
+        spans = self.spans(trace_id)
+        requests = [span for span in spans if span['kind'] == 'request']
+        for span in requests or [span for span in spans
+                                 if span['kind'] == 'agent']:
+            breakdown['seconds'] += span['seconds']
+        for span in spans:
+            if span['kind'] == 'request':
+                continue
+            kind = breakdown.setdefault(span['kind'], {})
+            entry = kind.setdefault(span['name'], {'seconds': 0.0,
+                                                   'count': 0})
+            entry['seconds'] += span['seconds']
+            entry['count'] += 1
+        return breakdown
+
+    def to_prometheus(self) -> str:
+        """
+        Export the metrics in the Prometheus text format.
+
+        Returns
+        -------
+        str
+            The latency histograms of the spans and of the first tokens, the
+            token histograms, and the counters of errors and parsing errors.
+        """
+        lines = []
+        with self._lock:
+            self._export_histograms(
+                lines, "span_seconds", "The latency of the spans.",
+                {(('kind', kind), ('name', name)): histogram
+                 for (kind, name), histogram in self._seconds.items()})
+            self._export_histograms(
+                lines, "llm_first_token_seconds",
+                "The latency of the first streamed token of the LLM calls.",
+                {(('name', name),): histogram
+                 for name, histogram in self._first_token_seconds.items()})
+            self._export_histograms(
+                lines, "llm_tokens", "The tokens of the LLM calls.",
+                {(('name', name), ('type', token_type)): histogram
+                 for (name, token_type), histogram in self._tokens.items()})
+            name = f"{METRIC_PREFIX}_span_errors_total"
+            lines += [f"# HELP {name} The failed spans.",
+                      f"# TYPE {name} counter"]
+            lines += [f"{name}{self._labels((('kind', kind), ('name', n)))} "
+                      f"{count}" for (kind, n), count in self._errors.items()]
+            name = f"{METRIC_PREFIX}_parsing_errors_total"
+            lines += [f"# HELP {name} The LLM outputs the agent could not "
+                      f"parse.",
+                      f"# TYPE {name} counter",
+                      f"{name} {self.parsing_errors}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """
+        Write the metrics in the Prometheus text format, e.g. for the
+        textfile collector of the node exporter.
+
+        Parameters
+        ----------
+        path: str
+            The path of the file.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(self.to_prometheus())
+
+    def write_jsonl(self, path: str) -> int:
+        """
+        Append the recent spans to a JSON lines file, one span per line, and
+        forget them, so the next export only writes the new ones.
+
+        Parameters
+        ----------
+        path: str
+            The path of the file.
+
+        Returns
+        -------
+        int
+            The number of spans written.
+        """
+        with self._lock:
+            spans = list(self._spans)
+            self._spans.clear()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span, default=str) + "\n")
+        return len(spans)
+
+    def record(self, trace_id: str, kind: str, name: str, seconds: float,
+               span_id: Optional[str] = None,
+               parent_span_id: Optional[str] = None,
+               error: Optional[BaseException] = None, **attributes):
+        """
+        Record a span timed outside of the callbacks, e.g. a whole request
+        around the runs of the agent.
+
+        Parameters
+        ----------
+        trace_id: str
+            The trace ID of the request.
+        kind: str
+            The kind of the span, e.g. 'request'.
+        name: str
+            The name of the span.
+        seconds: float
+            The seconds of the span, ending now.
+        span_id: Optional[str], optional
+            The span ID, e.g. the 'parent_span_id' given to the runs, a new
+            one if not given.
+        parent_span_id: Optional[str], optional
+            The span ID of the parent span, if any.
+        error: Optional[BaseException], optional
+            The error of the span, if it failed.
+        **attributes
+            The attributes of the span.
+        """
+        span = {'trace_id': trace_id, 'span_id': span_id or self.new_trace_id(),
+                'parent_span_id': parent_span_id, 'kind': kind, 'name': name,
+                'start': time.time() - seconds, 'attributes': {}}
+        with self._lock:
+            self._record(span, seconds, error, attributes)
+
+    def reset(self):
+        """
+        Forget the spans and the metrics.
+        """
+        with self._lock:
+            self._spans.clear()
+            self._seconds.clear()
+            self._first_token_seconds.clear()
+            self._tokens.clear()
+            self._errors.clear()
+            self.parsing_errors = 0
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID],
+               metadata: Optional[Dict[str, Any]], kind: str, name: str,
+               span: bool = True):
+        """
+        Open the span of a run, in the trace of its parent.
+        """
+        metadata = metadata or {}
+        with self._lock:
+            parent = self._runs.get(parent_run_id)
+            if parent is not None:
+                trace_id = parent['trace_id']
+            else:
+                trace_id = metadata.get('trace_id') or run_id.hex
+            if not span:  # an inner chain, only passing the trace on
+                self._runs[run_id] = {'trace_id': trace_id,
+                                      'parent_run_id': parent_run_id}
+                return
+            # the parent span is the closest ancestor with a span, else the
+            # span given to the root run
+            parent_span_id = None if parent_run_id is not None \
+                else metadata.get('parent_span_id')
+            while parent is not None:
+                if 'kind' in parent:
+                    parent_span_id = parent['span_id']
+                    break
+                parent = self._runs.get(parent['parent_run_id'])
+            self._runs[run_id] = {
+                'trace_id': trace_id, 'span_id': run_id.hex,
+                'parent_span_id': parent_span_id, 'kind': kind,
+                'name': name, 'start': time.time(),
+                'perf_start': time.perf_counter(),
+                'attributes': {'session_id': metadata['session_id']}
+                if kind == 'agent' and 'session_id' in metadata else {},
+                'parent_run_id': parent_run_id}
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None,
+             **attributes):
+        """
+        Close the span of a run and record it.
+        """
+        with self._lock:
+            span = self._runs.pop(run_id, None)
+            if span is None or 'kind' not in span:
+                return
+            seconds = time.perf_counter() - span.pop('perf_start')
+            span.pop('parent_run_id')
+            if span['kind'] == 'llm' and 'completion_tokens' not in attributes\
+                    and 'streamed_tokens' in span['attributes']:
+                # the model reports no usage, count the streamed tokens
+                attributes['completion_tokens'] = \
+                    span['attributes']['streamed_tokens']
+            self._record(span, seconds, error, attributes)
+
+    def _record(self, span: dict, seconds: float,
+                error: Optional[BaseException], attributes: dict):
+        """
+        Record a closed span in the histograms and the recent spans, with the
+        lock held.
+        """
+        span['seconds'] = seconds
+        span['status'] = 'ok' if error is None else 'error'
+        span['attributes'].update(attributes)
+        if error is not None:
+            span['attributes']['error'] = f"{type(error).__name__}: {error}"
+            key = (span['kind'], span['name'])
+            self._errors[key] = self._errors.get(key, 0) + 1
+        self._histogram(self._seconds, (span['kind'], span['name']),
+                        SECONDS_BUCKETS).observe(seconds)
+        for token_type in ('prompt', 'completion'):
+            if f"{token_type}_tokens" in attributes:
+                self._histogram(self._tokens, (span['name'], token_type),
+                                TOKEN_BUCKETS).observe(
+                    attributes[f"{token_type}_tokens"])
+        self._spans.append(span)
+
+    @staticmethod
+    def _histogram(histograms: dict, key, buckets: Sequence[float]
+                   ) -> Histogram:
+        if key not in histograms:
+            histograms[key] = Histogram(buckets)
+        return histograms[key]
+
+    @staticmethod
+    def _name(serialized: Optional[Dict[str, Any]], kwargs: dict) -> str:
+        """
+        Get the name of a run: its run name, else the name of its class.
+        """
+        if kwargs.get('name'):
+            return kwargs['name']
+        serialized = serialized or {}
+        if serialized.get('name'):
+            return serialized['name']
+        return (serialized.get('id') or ["unknown"])[-1]
+
+    @staticmethod
+    def _token_usage(response: LLMResult) -> dict:
+        """
+        Get the tokens of an LLM call, from the usage reported by the model.
+        """
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        if usage:
+            return {'prompt_tokens': usage.get('prompt_tokens', 0),
+                    'completion_tokens': usage.get('completion_tokens', 0)}
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(getattr(generation, 'message', None),
+                                   'usage_metadata', None)
+                if metadata:
+                    return {'prompt_tokens': metadata['input_tokens'],
+                            'completion_tokens': metadata['output_tokens']}
+        return {}
+
+    @staticmethod
+    def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+        escaped = [(key, str(value).replace("\\", "\\\\")
+                    .replace('"', '\\"').replace("\n", "\\n"))
+                   for key, value in labels]
+        return "{" + ",".join(f'{key}="{value}"'
+                              for key, value in escaped) + "}"
+
+    def _export_histograms(self, lines: List[str], name: str, help_text: str,
+                           histograms: Dict[tuple, Histogram]):
+        """
+        Export histograms in the Prometheus text format.
+        """
+        name = f"{METRIC_PREFIX}_{name}"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, histogram in histograms.items():
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f"{name}_bucket"
+                             f"{self._labels(labels + (('le', f'{bound:g}'),))}"
+                             f" {count}")
+            lines.append(f"{name}_bucket"
+                         f"{self._labels(labels + (('le', '+Inf'),))} "
+                         f"{histogram.count}")
+            lines.append(f"{name}_sum{self._labels(labels)} "
+                         f"{histogram.sum:g}")
+            lines.append(f"{name}_count{self._labels(labels)} "
+                         f"{histogram.count}")
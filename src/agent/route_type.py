@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class RoutePath(str, Enum):
+    RAG = "rag"
+    AGENT = "agent"
@@ -0,0 +1,311 @@
+import re, time, asyncio, threading
+import numpy as np
+from collections import deque
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.prompts import PromptTemplate
+from langchain_core.retrievers import BaseRetriever
+from .metrics import MetricsCallbackHandler
+from .route_type import RoutePath
+from .runner import AgentRunner
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+# the questions about distances need the tools of the agent
+PROXIMITY_PATTERN = re.compile(
+    r"\b(near|nearby|nearest|closest|close to|within|walking distance|"
+    r"distance|km|miles?)\b", re.IGNORECASE)
+
+
+class QuestionRouter:
+    """
+    A router in front of the agent. The question is retrieved first: if the
+    retrieved documents match it closely enough, it is answered with a
+    single call of the LLM on a RAG prompt, else by the ReAct agent, which
+    takes several calls. The path, the confidence and the latency of every
+    question are recorded to tune the threshold, and with the metrics of the
+    runner, a request span around the spans of the retrieval and the LLM
+    calls.
+    """
+    def __init__(self,
+                 runner: AgentRunner,
+                 llm: BaseLanguageModel,
+                 prompt: PromptTemplate,
+                 retriever: BaseRetriever,
+                 embedding_model: Optional[Embeddings] = None,
+                 threshold: float = 0.6,
+                 confidence_fn: Optional[
+                     Callable[[str, List[Document]], float]] = None,
+                 agent_question: str = "{question}",
+                 max_records: int = 1000):
+        """
+        Initialize a new QuestionRouter.
+
+        Parameters
+        ----------
+        runner: AgentRunner
+            The runner of the agent, the slow path.
+        llm: BaseLanguageModel
+            The LLM answering on the fast path.
+        prompt: PromptTemplate
+            The RAG prompt of the fast path, with the 'input' and 'context'
+            variables, and 'chat_history' to see the message history of the
+            session, e.g. from `RAGPrompt(conversation_history=True).get`.
+        retriever: BaseRetriever
+            The retriever of the fast path, e.g. the one of the retriever
+            tool.
+        embedding_model: Optional[Embeddings], optional
+            The embedding model measuring the confidence, see `confidence`.
+            Required without a confidence function.
+        threshold: float, optional
+            The minimum confidence of the fast path. Defaults to 0.6.
+        confidence_fn: Optional[Callable[[str, List[Document]], float]],
+        optional
+            Measures the confidence of the retrieved documents. Defaults to
+            the highest cosine similarity between the question and the
+            documents.
+        agent_question: str, optional
+            The template of the question given to the agent, with a
+            {question} placeholder. Defaults to the question itself.
+        max_records: int, optional
+            The number of recent questions recorded. Defaults to 1000.
+        """
+        if embedding_model is None and confidence_fn is None:
+            raise ValueError("The router needs an embedding model or a "
+                             "confidence function.")
+        self.runner = runner
+        self.llm = llm
+        self.prompt = prompt
+        self.retriever = retriever
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.confidence_fn = confidence_fn
+        self.agent_question = agent_question
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=max_records)
+
+    async def astream(self, question: str,
+                      session_id: Optional[str] = None,
+                      trace_id: Optional[str] = None
+                      ) -> AsyncIterator[Dict]:
+        """
+        Answer a question on the fast or the slow path, streaming its
+        progress.
+
+        Parameters
+        ----------
+        question: str
+            The question.
+        session_id: Optional[str], optional
+            The session ID, a new one if not given.
+        trace_id: Optional[str], optional
+            The trace ID of the request, a new one if not given.
+
+        Yields
+        ------
+        Dict
+            The events of `AgentRunner.astream`, after a first 'route' event
+            with the path as content and the confidence.
+        """
+        session_id = session_id or self.runner.new_session_id()
+        trace_id = trace_id or MetricsCallbackHandler.new_trace_id()
+        # the span of the request, the parent of the root runs
+        span_id = MetricsCallbackHandler.new_trace_id()
+        config = self.runner.config(session_id, trace_id,
+                                    parent_span_id=span_id)
+        start = time.perf_counter()
+
+        def event(event_type: str, content: str, **fields) -> Dict:
+            return {'session_id': session_id, 'trace_id': trace_id,
+                    'type': event_type, 'content': content,
+                    'seconds': time.perf_counter() - start, **fields}
+
+        documents, confidence = await asyncio.get_running_loop(
+        ).run_in_executor(None, self._retrieve, question, config)
+        retrieval_seconds = time.perf_counter() - start
+        path = self.route(question, documents, confidence)
+        yield event('route', path.value, confidence=confidence)
+
+        if path == RoutePath.RAG:
+            inputs = {'input': question,
+                      'context': self.format_documents(documents)}
+            if 'chat_history' in self.prompt.input_variables:
+                # a follow-up question is answered in the conversation
+                inputs['chat_history'] = self.runner.history(session_id)
+            answer = ""
+            async with self.runner.slot():
+                async for chunk in self.llm.astream(
+                        self.prompt.format(**inputs), config=config):
+                    text = getattr(chunk, 'content', chunk)
+                    if not answer:
+                        text = text.lstrip()
+                    if text:
+                        answer += text
+                        yield event('token', text)
+            answer = answer.strip()
+            # in the history of the agent, so that it sees the turn
+            self.runner.add_turn(session_id, question, answer)
+            yield event('final', answer)
+        else:
+            async for agent_event in self.runner.astream(
+                    self.agent_question.format(question=question),
+                    session_id, trace_id, parent_span_id=span_id):
+                agent_event['seconds'] = time.perf_counter() - start
+                yield agent_event
+
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self._records.append({'path': path.value,
+                                  'confidence': confidence,
+                                  'retrieval_seconds': retrieval_seconds,
+                                  'seconds': seconds,
+                                  'trace_id': trace_id})
+        if self.runner.metrics is not None:
+            self.runner.metrics.record(trace_id, 'request', 'question_router',
+                                       seconds, span_id=span_id,
+                                       session_id=session_id, path=path.value,
+                                       confidence=confidence,
+                                       retrieval_seconds=retrieval_seconds)
+        print(f"[INFO] Answered on the {path.value} path (confidence "
+              f"{confidence:.2f}) in {seconds:.2f} s")
+
+    async def ainvoke(self, question: str,
+                      session_id: Optional[str] = None,
+                      trace_id: Optional[str] = None) -> str:
+        """
+        Answer a question on the fast or the slow path.
+
+        Parameters
+        ----------
+        question: str
+            The question.
+        session_id: Optional[str], optional
+            The session ID, a new one if not given.
+        trace_id: Optional[str], optional
+            The trace ID of the request, a new one if not given.
+
+        Returns
+        -------
+        str
+            The final answer.
+        """
+        answer = ""
+        async for event in self.astream(question, session_id, trace_id):
+            if event['type'] == 'final':
+                answer = event['content']
+        return answer
+
+    def route(self, question: str, documents: List[Document],
+              confidence: float) -> RoutePath:
+        """
+        Choose the path of a question: the fast path needs documents at
+        least as confident as the threshold, and no distance to compute.
+
+        Parameters
+        ----------
+        question: str
+            The question.
+        documents: List[Document]
+            The retrieved documents.
+        confidence: float
+            The confidence of the documents.
+
+        Returns
+        -------
+        RoutePath
+            The path.
+        """
+        if documents and confidence >= self.threshold \
+                and not PROXIMITY_PATTERN.search(question):
+            return RoutePath.RAG
+        return RoutePath.AGENT
+
+    def confidence(self, question: str, documents: List[Document]) -> float:
+        """
+        Measure how well the retrieved documents match a question.
+
+        Parameters
+        ----------
+        question: str
+            The question.
+        documents: List[Document]
+            The retrieved documents.
+
+        Returns
+        -------
+        float
+            The confidence, by default the highest cosine similarity between
+            the question and the documents, 0 without documents.
+
+        Notes
+        -----
+        The retrievers fuse their rankings, so the documents carry no
+        similarity: by default, they are embedded on every question. The
+        embedding model should be the cached one, e.g. from
+        `Embeddings.get(..., cache=True)`, which reads the vectors of the
+        documents seen before from its cache, else every question pays for
+        embedding its documents again.
+        """
+        if not documents:
+            return 0.0
+        if self.confidence_fn is not None:
+            return float(self.confidence_fn(question, documents))
+        query_vector = np.asarray(self.embedding_model.embed_query(question))
+        vectors = np.asarray(self.embedding_model.embed_documents(
+            [document.page_content for document in documents]))
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector)
+        return float(np.max(vectors @ query_vector / np.maximum(norms, 1e-12)))
+
+    def records(self) -> List[dict]:
+        """
+        List the recent questions, oldest first.
+
+        Returns
+        -------
+        List[dict]
+            The path, the confidence, the retrieval seconds, the total
+            seconds and the trace ID of every question.
+        """
+        with self._lock:
+            return list(self._records)
+
+    def stats(self) -> dict:
+        """
+        Report the paths taken by the recent questions.
+
+        Returns
+        -------
+        dict
+            The threshold, and for every path the number and the share of the
+            questions, and their mean, median and 95th percentile seconds.
+        """
+        records = self.records()
+        stats = {'threshold': self.threshold, 'questions': len(records)}
+        for path in RoutePath:
+            seconds = np.array([record['seconds'] for record in records
+                                if record['path'] == path.value])
+            stats[path.value] = {
+                'count': len(seconds),
+                'share': len(seconds) / len(records) if records else 0.0,
+                'mean_seconds': float(seconds.mean()) if len(seconds)
+                else 0.0,
+                'p50_seconds': float(np.percentile(seconds, 50))
+                if len(seconds) else 0.0,
+                'p95_seconds': float(np.percentile(seconds, 95))
+                if len(seconds) else 0.0}
+        return stats
+
+    @staticmethod
+    def format_documents(documents: List[Document]) -> str:
+        """
+        Join the retrieved documents into the context of the RAG prompt, the
+        best ranked first.
+        """
+        return "\n\n".join(document.page_content for document in documents)
+
+    def _retrieve(self, question: str, config: Optional[dict] = None):
+        """
+        Retrieve the documents of a question and measure their confidence.
+        """
+        documents = self.retriever.invoke(question, config=config)
+        return documents, self.confidence(question, documents)
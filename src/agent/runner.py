@@ -0,0 +1,264 @@
+import time, uuid, asyncio, weakref
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.history import RunnableWithMessageHistory
+from .metrics import MetricsCallbackHandler
+from typing import AsyncIterator, Dict, List, Optional
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+
+class AgentRunner:
+    """
+    An asyncio runner of the agent, for many concurrent sessions. Every run
+    streams what the agent does as it happens: the thoughts of the LLM, the
+    actions and observations of the tools, then the tokens of the final
+    answer. Every run has a trace ID, the spans of its LLM calls, tool calls
+    and retrievals share it when metrics are recorded.
+    """
+    def __init__(self, agent: Runnable, max_concurrency: int = 16,
+                 metrics: Optional[MetricsCallbackHandler] = None):
+        """
+        Initialize a new AgentRunner.
+
+        Parameters
+        ----------
+        agent: Runnable
+            The agent executor from `Agents.get`, possibly with a message
+            history keyed by the session ID.
+        max_concurrency: int, optional
+            The maximum number of runs at once, the others wait. Defaults to
+            16.
+        metrics: Optional[MetricsCallbackHandler], optional
+            The handler recording the spans of the runs, if any.
+        """
+        self.agent = agent
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics
+        self._semaphores = weakref.WeakKeyDictionary()  # loop -> semaphore
+
+    @staticmethod
+    def new_session_id() -> str:
+        """
+        Create a new session ID.
+
+        Returns
+        -------
+        str
+            The session ID.
+        """
+        return uuid.uuid4().hex
+
+    def config(self, session_id: str, trace_id: str, **metadata) -> dict:
+        """
+        Create the run config of the agent for a session and a request.
+
+        Parameters
+        ----------
+        session_id: str
+            The session ID, the key of the message history.
+        trace_id: str
+            The trace ID of the request.
+        **metadata
+            The other metadata of the request.
+
+        Returns
+        -------
+        dict
+            The config, with the metrics handler as callback if any.
+        """
+        metadata = {**metadata, 'session_id': session_id}
+        if self.metrics is not None:
+            config = self.metrics.config(trace_id, **metadata)
+        else:
+            config = {'metadata': {**metadata, 'trace_id': trace_id}}
+        config['configurable'] = {'session_id': session_id}
+        return config
+
+    async def astream(self, question: str,
+                      session_id: Optional[str] = None,
+                      trace_id: Optional[str] = None,
+                      **metadata) -> AsyncIterator[Dict]:
+        """
+        Run the agent on a question, streaming its progress.
+
+        Parameters
+        ----------
+        question: str
+            The question.
+        session_id: Optional[str], optional
+            The session ID, a new one if not given.
+        trace_id: Optional[str], optional
+            The trace ID of the request, a new one if not given.
+        **metadata
+            The other metadata of the run, e.g. the 'parent_span_id' of a
+            request recorded around it.
+
+        Yields
+        ------
+        Dict
+            The events, with the session ID, the trace ID, the seconds since
+            the start and a type:
+            - 'thought': a token of the LLM before the final answer,
+            - 'action': a tool call, with the tool name and its input,
+            - 'observation': the output of a tool, with the tool name,
+            - 'token': a token of the final answer,
+            - 'final': the whole final answer, last.
+        """
+        session_id = session_id or self.new_session_id()
+        trace_id = trace_id or MetricsCallbackHandler.new_trace_id()
+        start = time.perf_counter()
+
+        def event(event_type: str, content: str, **fields) -> Dict:
+            return {'session_id': session_id, 'trace_id': trace_id,
+                    'type': event_type, 'content': content,
+                    'seconds': time.perf_counter() - start, **fields}
+
+        # LLM run ID -> the streamed text, the length emitted as thoughts and
+        # the final answer once its marker is found
+        buffers = {}
+        async with self.slot():
+            async for raw in self.agent.astream_events(
+                    {'input': question},
+                    config=self.config(session_id, trace_id, **metadata),
+                    version="v2"):
+                kind = raw['event']
+                if kind in ('on_chat_model_stream', 'on_llm_stream'):
+                    chunk = raw['data']['chunk']
+                    text = getattr(chunk, 'content', None)
+                    if text is None:
+                        text = getattr(chunk, 'text', str(chunk))
+                    buffer = buffers.setdefault(
+                        raw['run_id'],
+                        {'text': "", 'emitted': 0, 'answer': None})
+                    for event_type, content in self._split(buffer, text):
+                        yield event(event_type, content)
+                elif kind in ('on_chat_model_end', 'on_llm_end'):
+                    buffer = buffers.pop(raw['run_id'], None)
+                    if buffer and buffer['answer'] is None \
+                            and buffer['emitted'] < len(buffer['text']):
+                        yield event('thought',
+                                    buffer['text'][buffer['emitted']:])
+                elif kind == 'on_tool_start':
+                    yield event('action', str(raw['data'].get('input', "")),
+                                tool=raw['name'])
+                elif kind == 'on_tool_end':
+                    yield event('observation',
+                                str(raw['data'].get('output', "")),
+                                tool=raw['name'])
+                elif kind == 'on_chain_end' and not raw.get('parent_ids'):
+                    output = raw['data'].get('output')
+                    if isinstance(output, dict):
+                        output = output.get('output', "")
+                    yield event('final', str(output))
+
+    async def ainvoke(self, question: str,
+                      session_id: Optional[str] = None,
+                      trace_id: Optional[str] = None) -> str:
+        """
+        Run the agent on a question.
+
+        Parameters
+        ----------
+        question: str
+            The question.
+        session_id: Optional[str], optional
+            The session ID, a new one if not given.
+        trace_id: Optional[str], optional
+            The trace ID of the request, a new one if not given.
+
+        Returns
+        -------
+        str
+            The final answer.
+        """
+        answer = ""
+        async for event in self.astream(question, session_id, trace_id):
+            if event['type'] == 'final':
+                answer = event['content']
+        return answer
+
+    @staticmethod
+    def _split(buffer: dict, text: str):
+        """
+        Split the streamed text of an LLM run into thoughts and final answer
+        tokens. The text that may be the start of the final answer marker is
+        held back until the next token.
+        """
+        buffer['text'] += text
+        if buffer['answer'] is not None:
+            if not buffer['answer']:
+                # the spaces after the marker are not part of the answer
+                text = text.lstrip()
+            if text:
+                buffer['answer'] += text
+                yield 'token', text
+            return
+        position = buffer['text'].find(FINAL_ANSWER_MARKER, buffer['emitted'])
+        if position < 0:
+            end = len(buffer['text']) - len(FINAL_ANSWER_MARKER) + 1
+            if end > buffer['emitted']:
+                yield 'thought', buffer['text'][buffer['emitted']:end]
+                buffer['emitted'] = end
+            return
+        if position > buffer['emitted']:
+            yield 'thought', buffer['text'][buffer['emitted']:position]
+        buffer['emitted'] = len(buffer['text'])
+        buffer['answer'] = buffer['text'][
+            position + len(FINAL_ANSWER_MARKER):].lstrip()
+        if buffer['answer']:
+            yield 'token', buffer['answer']
+
+    def slot(self) -> asyncio.Semaphore:
+        """
+        Get the semaphore limiting the runs of the current event loop, to
+        hold around the other LLM calls of a request so that they share the
+        limit, e.g. `async with runner.slot():`.
+
+        Returns
+        -------
+        asyncio.Semaphore
+            The semaphore of the current event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    def history(self, session_id: str) -> List[BaseMessage]:
+        """
+        Get the message history of the agent for a session, e.g. for the
+        other LLM calls of the session to see it.
+
+        Parameters
+        ----------
+        session_id: str
+            The session ID, the key of the message history.
+
+        Returns
+        -------
+        List[BaseMessage]
+            The messages, none for the agents without history.
+        """
+        if isinstance(self.agent, RunnableWithMessageHistory):
+            return self.agent.get_session_history(session_id).messages
+        return []
+
+    def add_turn(self, session_id: str, question: str, answer: str):
+        """
+        Add a turn answered without the agent to the message history of the
+        agent, so that its next runs see it. The agents without history keep
+        no turn.
+
+        Parameters
+        ----------
+        session_id: str
+            The session ID, the key of the message history.
+        question: str
+            The question.
+        answer: str
+            The answer.
+        """
+        if isinstance(self.agent, RunnableWithMessageHistory):
+            self.agent.get_session_history(session_id).add_messages(
+                [HumanMessage(content=question), AIMessage(content=answer)])
@@ -1 +0,0 @@
-from .prepare_docs import CSVData
@@ -0,0 +1,10 @@
+from ..shared import lazy_exports
+
+# the data preparation is imported on first use, with pandas and pyarrow
+_LAZY_IMPORTS = {
+    'CSVData': '.prepare_docs',
+    'AddressParser': '.address_parsers',
+    'REGISTRY_ADDRESS_PARSER': '.address_parsers',
+    'register_address_parser': '.address_parsers'
+}
+__getattr__, __dir__, __all__ = lazy_exports(__name__, _LAZY_IMPORTS)
@@ -0,0 +1,107 @@
+import pandas as pd
+
+from typing import Tuple
+
+
+class AddressParser:
+    """
+    Parse the postal code and the city from the hotel addresses of a country.
+    The addresses end with either '<city> <postal code> <country>' or
+    '<postal code> <city> <country>'.
+    """
+    def __init__(self, country: str, n_postal_code_token: int,
+                 city_first: bool):
+        """
+        Initialize a new AddressParser.
+
+        Parameters
+        ----------
+        country: str
+            The country at the end of the addresses.
+        n_postal_code_token: int
+            The number of space-separated tokens of the postal code.
+        city_first: bool
+            If True, the city comes before the postal code.
+        """
+        self.country = country
+        self.n_postal_code_token = n_postal_code_token
+        self.city_first = city_first
+
+    def parse(self, addresses: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        """
+        Parse the postal codes and the cities.
+
+        Parameters
+        ----------
+        addresses: pd.Series
+            The hotel addresses.
+
+        Returns
+        -------
+        Tuple[pd.Series, pd.Series]
+            The postal codes and the cities.
+        """
+        len_country = len(self.country.split())
+        n_token = self.n_postal_code_token
+        tokens = addresses.str.split(" ")
+        if self.city_first:
+            postal_code = tokens.str[-(len_country + n_token):-len_country]
+            city = tokens.str[-(len_country + n_token + 1)]
+        else:
+            postal_code = tokens.str[-(len_country + n_token + 1):
+                                     -(len_country + 1)]
+            city = tokens.str[-(len_country + 1)]
+        return postal_code.str.join(" "), city
+
+
+REGISTRY_ADDRESS_PARSER = {
+    # e.g. '... Westminster Borough London SW1A 2JR United Kingdom'
+    "United Kingdom": AddressParser("United Kingdom", 2, city_first=True),
+    # e.g. '... 2nd arr 75002 Paris France'
+    "France": AddressParser("France", 1, city_first=False),
+    # e.g. '... Oost 1092 AA Amsterdam Netherlands'
+    "Netherlands": AddressParser("Netherlands", 2, city_first=False),
+    # e.g. '... Eixample 08011 Barcelona Spain'
+    "Spain": AddressParser("Spain", 1, city_first=False),
+    # e.g. '... Vigentino 20141 Milan Italy'
+    "Italy": AddressParser("Italy", 1, city_first=False),
+    # e.g. '... Landstra e 1030 Vienna Austria'
+    "Austria": AddressParser("Austria", 1, city_first=False),
+}
+
+
+def register_address_parser(parser: AddressParser):
+    """
+    Register the address parser of a new country.
+
+    Parameters
+    ----------
+    parser: AddressParser
+        The address parser.
+    """
+    REGISTRY_ADDRESS_PARSER[parser.country] = parser
+
+
+def get_address_parser(country: str) -> AddressParser:
+    """
+    Retrieve the address parser of a country.
+
+    Parameters
+    ----------
+    country: str
+        The desired country.
+
+    Returns
+    -------
+    AddressParser
+        The address parser.
+
+    Raises
+    ------
+    NotImplementedError
+        If no address parser has been registered for the country.
+    """
+    if country not in REGISTRY_ADDRESS_PARSER:
+        raise NotImplementedError(
+            f"Need to implement the address parser for {country}.")
+    return REGISTRY_ADDRESS_PARSER[country]
@@ -0,0 +1,181 @@
+import pandas as pd
+
+from typing import Dict, List
+
+# list of words to be ignored from the reviews
+EXCL_REVIEWS = [
+    "no negative",
+    "no positive",
+    "none",
+    "nothing",
+    "n a",
+    "na"]
+N_REVIEW = 3  # collect only last 3 reviews
+REVIEW_COLS = ['Positive_Review', 'Negative_Review']
+HOTEL_AGG = {
+    'Average_Score': 'first',
+    'Hotel_Address': 'first',
+    'Review_Date': 'first',
+    'Postal_Code': 'first',
+    'City': 'first',
+    'lat': 'first',
+    'lng': 'first',
+    'Clean_Tags': 'first',
+}
+
+
+class ReviewAggregator:
+    """
+    Fold the filtered reviews into per-hotel aggregates. The reviews can be
+    given all at once or chunk by chunk, in the order of the raw data; only
+    the first value of the hotel columns and the first `n_review` kept reviews
+    per hotel are held, so the memory is bounded by the number of hotels.
+    """
+    def __init__(self,
+                 n_review: int = N_REVIEW,
+                 excl_reviews: List[str] = EXCL_REVIEWS):
+        """
+        Initialize a new ReviewAggregator.
+
+        Parameters
+        ----------
+        n_review: int, optional
+            The number of reviews to be collected per hotel. Defaults to 3.
+        excl_reviews: List[str], optional
+            The (lower-cased) reviews to be ignored.
+
+        Raises
+        ------
+        ValueError
+            If `n_review` is smaller than 1.
+        """
+        if n_review < 1:
+            raise ValueError("n_review must be at least 1.")
+        self.n_review = n_review
+        self.excl_reviews = excl_reviews
+        self._hotel_df = None
+        self._review_dfs = {col: None for col in REVIEW_COLS}
+
+    def update(self, df: pd.DataFrame) -> "ReviewAggregator":
+        """
+        Fold the next reviews into the aggregates.
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            The filtered reviews, one row per review.
+
+        Returns
+        -------
+        ReviewAggregator
+            The aggregator itself.
+        """
+        hotel_df = df.groupby('Hotel_Name', sort=False).agg(HOTEL_AGG)
+        review_dfs = {}
+        for col in REVIEW_COLS:
+            keep = ~df[col].str.lower().isin(self.excl_reviews)
+            review_dfs[col] = pd.DataFrame({
+                'Hotel_Name': df.loc[keep, 'Hotel_Name'],
+                col: df.loc[keep, col].str.strip()})
+        return self._fold(hotel_df, review_dfs)
+
+    def merge(self, other: "ReviewAggregator") -> "ReviewAggregator":
+        """
+        Fold the aggregates of another aggregator, built from the reviews that
+        come after the ones already folded.
+
+        Parameters
+        ----------
+        other: ReviewAggregator
+            The aggregator of the next reviews.
+
+        Returns
+        -------
+        ReviewAggregator
+            The aggregator itself.
+        """
+        if other._hotel_df is None:
+            return self
+        return self._fold(other._hotel_df, other._review_dfs)
+
+    def _fold(self, hotel_df: pd.DataFrame,
+              review_dfs: Dict[str, pd.DataFrame]) -> "ReviewAggregator":
+        """
+        Fold the per-hotel aggregates of the next reviews into the running
+        aggregates.
+
+        Parameters
+        ----------
+        hotel_df: pd.DataFrame
+            The first values of the hotel columns, indexed by 'Hotel_Name'.
+        review_dfs: Dict[str, pd.DataFrame]
+            The kept reviews of every review column, in the original order.
+
+        Returns
+        -------
+        ReviewAggregator
+            The aggregator itself.
+        """
+        if self._hotel_df is not None:
+            hotel_df = pd.concat([self._hotel_df, hotel_df]).groupby(
+                level=0, sort=False).first()
+        self._hotel_df = hotel_df
+
+        for col in REVIEW_COLS:
+            reviews = review_dfs[col]
+            if self._review_dfs[col] is not None:
+                reviews = pd.concat([self._review_dfs[col], reviews],
+                                    ignore_index=True)
+            # groupby keeps the original row order inside every hotel
+            self._review_dfs[col] = reviews.groupby(
+                'Hotel_Name', sort=False).head(self.n_review)
+        return self
+
+    def result(self) -> pd.DataFrame:
+        """
+        Retrieve the aggregated hotels.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per hotel (sorted by 'Hotel_Name') with the hotel
+            information and the joined 'Positive_Review' and
+            'Negative_Review'.
+        """
+        if self._hotel_df is None:
+            return pd.DataFrame(
+                columns=['Hotel_Name', *HOTEL_AGG.keys(), *REVIEW_COLS])
+        agg_df = self._hotel_df.sort_index().reset_index()
+        review_dct = dict(Hotel_Name=list(agg_df['Hotel_Name']))
+        for col in REVIEW_COLS:
+            joined = self._review_dfs[col].groupby(
+                'Hotel_Name', sort=False)[col].agg(", ".join)
+            review_dct[col] = list(joined.reindex(review_dct['Hotel_Name'],
+                                                  fill_value=""))
+        review_df = pd.DataFrame(review_dct)
+        return pd.merge(left=agg_df, right=review_df,
+                        on='Hotel_Name', how='left')
+
+
+def aggregate_hotels(df: pd.DataFrame,
+                     n_review: int = N_REVIEW,
+                     excl_reviews: List[str] = EXCL_REVIEWS) -> pd.DataFrame:
+    """
+    Aggregate the filtered reviews into one row per hotel.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The filtered reviews, one row per review, in the order of the raw data.
+    n_review: int, optional
+        The number of reviews to be collected per hotel. Defaults to 3.
+    excl_reviews: List[str], optional
+        The (lower-cased) reviews to be ignored.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per hotel with the hotel information and the joined
+        'Positive_Review' and 'Negative_Review'.
+    """
+    return ReviewAggregator(n_review, excl_reviews).update(df).result()
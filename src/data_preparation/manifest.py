@@ -0,0 +1,263 @@
+import os, json, hashlib
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List, Optional
+
+MANIFEST_VERSION = 1
+_MASK = (1 << 64) - 1
+
+
+def hotel_id(hotel_name: str) -> str:
+    """
+    Create the stable ID of a hotel from its name.
+
+    Parameters
+    ----------
+    hotel_name: str
+        The name of the hotel.
+
+    Returns
+    -------
+    str
+        The hotel ID.
+    """
+    return hashlib.sha1(hotel_name.encode("utf-8")).hexdigest()[:16]
+
+
+def fingerprint_file(path: str, block_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 of the content of a file, block by block.
+
+    Parameters
+    ----------
+    path: str
+        The path of the file.
+    block_size: int, optional
+        The number of bytes read at once. Defaults to 1 MiB.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class HotelFingerprints:
+    """
+    Fingerprint the selected reviews of every hotel. The fingerprint depends
+    on the content and the order of the reviews but not on how the raw data
+    has been chunked: for the row hashes h_i of a hotel (i = 1, 2, ...), it
+    keeps the count, sum(h_i) and sum(i * h_i) modulo 2^64, which can be
+    merged chunk by chunk.
+    """
+    def __init__(self):
+        """
+        Initialize a new HotelFingerprints.
+        """
+        self._state = {}  # hotel name -> [count, sum(h_i), sum(i * h_i)]
+
+    def update(self, df: pd.DataFrame) -> "HotelFingerprints":
+        """
+        Fold the next selected reviews into the fingerprints.
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            The selected raw reviews, in the order of the raw data.
+
+        Returns
+        -------
+        HotelFingerprints
+            The fingerprints themselves.
+        """
+        if df.empty:
+            return self
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy(
+            dtype=np.uint64)
+        codes, names = pd.factorize(df['Hotel_Name'])
+        ranks = df.groupby(codes).cumcount().to_numpy(dtype=np.uint64) + 1
+        counts = np.bincount(codes, minlength=len(names))
+        sum_0 = np.zeros(len(names), dtype=np.uint64)
+        sum_1 = np.zeros(len(names), dtype=np.uint64)
+        np.add.at(sum_0, codes, hashes)
+        np.add.at(sum_1, codes, hashes * ranks)  # wraps modulo 2^64
+        other = HotelFingerprints()
+        other._state = {
+            name: [int(count), int(s_0), int(s_1)]
+            for name, count, s_0, s_1 in zip(names, counts, sum_0, sum_1)}
+        return self.merge(other)
+
+    def merge(self, other: "HotelFingerprints") -> "HotelFingerprints":
+        """
+        Fold the fingerprints of the reviews that come after.
+
+        Parameters
+        ----------
+        other: HotelFingerprints
+            The fingerprints of the next reviews.
+
+        Returns
+        -------
+        HotelFingerprints
+            The fingerprints themselves.
+        """
+        for name, (count, s_0, s_1) in other._state.items():
+            if name not in self._state:
+                self._state[name] = [count, s_0, s_1]
+                continue
+            state = self._state[name]
+            # the ranks of the next reviews are shifted by the current count
+            state[2] = (state[2] + s_1 + state[0] * s_0) & _MASK
+            state[1] = (state[1] + s_0) & _MASK
+            state[0] += count
+        return self
+
+    def result(self) -> Dict[str, str]:
+        """
+        Retrieve the fingerprints.
+
+        Returns
+        -------
+        Dict[str, str]
+            The fingerprint of every hotel name.
+        """
+        return {name: f"{count}-{s_0:016x}-{s_1:016x}"
+                for name, (count, s_0, s_1) in self._state.items()}
+
+
+def create_manifest(raw_data_path: str,
+                    fingerprints: Dict[str, str],
+                    n_review: int,
+                    raw_fingerprint: Optional[str] = None) -> dict:
+    """
+    Create the manifest of a processed dataset.
+
+    Parameters
+    ----------
+    raw_data_path: str
+        The path of the raw data.
+    fingerprints: Dict[str, str]
+        The fingerprint of every hotel name.
+    n_review: int
+        The number of reviews collected per hotel.
+    raw_fingerprint: Optional[str], optional
+        The fingerprint of the raw data, if already computed.
+
+    Returns
+    -------
+    dict
+        The manifest.
+    """
+    stat = os.stat(raw_data_path)
+    return {
+        'version': MANIFEST_VERSION,
+        'n_review': n_review,
+        'raw_data': {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': raw_fingerprint or fingerprint_file(raw_data_path),
+        },
+        'hotels': {name: {'hotel_id': hotel_id(name),
+                          'fingerprint': fingerprint}
+                   for name, fingerprint in sorted(fingerprints.items())},
+    }
+
+
+def load_manifest(manifest_path: str) -> Optional[dict]:
+    """
+    Load a manifest.
+
+    Parameters
+    ----------
+    manifest_path: str
+        The path of the manifest.
+
+    Returns
+    -------
+    Optional[dict]
+        The manifest, or None if it does not exist or has another version.
+    """
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest: dict, manifest_path: str):
+    """
+    Save a manifest.
+
+    Parameters
+    ----------
+    manifest: dict
+        The manifest.
+    manifest_path: str
+        The path of the manifest.
+    """
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+
+
+def is_raw_data_unchanged(manifest: dict, raw_data_path: str) -> bool:
+    """
+    Check whether the raw data is the one recorded in the manifest. The
+    content is only hashed if the size or the modification time changed, and
+    the manifest is then updated in place.
+
+    Parameters
+    ----------
+    manifest: dict
+        The manifest.
+    raw_data_path: str
+        The path of the raw data.
+
+    Returns
+    -------
+    bool
+        If True, the raw data has not changed.
+    """
+    stat = os.stat(raw_data_path)
+    raw_data = manifest['raw_data']
+    if (stat.st_size, stat.st_mtime_ns) == (raw_data['size'],
+                                            raw_data['mtime_ns']):
+        return True
+    if stat.st_size != raw_data['size'] \
+            or fingerprint_file(raw_data_path) != raw_data['sha256']:
+        return False
+    raw_data['mtime_ns'] = stat.st_mtime_ns
+    return True
+
+
+def find_dirty_hotels(manifest: Optional[dict],
+                      fingerprints: Dict[str, str]) -> List[str]:
+    """
+    Find the hotels whose reviews changed, appeared or disappeared.
+
+    Parameters
+    ----------
+    manifest: Optional[dict]
+        The previous manifest. If None, every hotel is dirty.
+    fingerprints: Dict[str, str]
+        The new fingerprint of every hotel name.
+
+    Returns
+    -------
+    List[str]
+        The sorted names of the dirty hotels.
+    """
+    old = {} if manifest is None else {
+        name: hotel['fingerprint']
+        for name, hotel in manifest['hotels'].items()}
+    dirty = {name for name, fingerprint in fingerprints.items()
+             if old.get(name) != fingerprint}
+    dirty.update(set(old) - set(fingerprints))
+    return sorted(dirty)
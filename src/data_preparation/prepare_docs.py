@@ -1,14 +1,30 @@
 import os, re
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 
 from abc import abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+from .aggregation import ReviewAggregator, N_REVIEW
+from .address_parsers import REGISTRY_ADDRESS_PARSER, get_address_parser
+from .manifest import (HotelFingerprints, hotel_id, fingerprint_file,
+                       create_manifest, load_manifest, save_manifest,
+                       is_raw_data_unchanged, find_dirty_hotels)
+from .storage import (save_processed_df, load_processed_df,
+                      read_processed_columns)
 
 np.random.seed(0)
 
 DATA_DIR = os.path.join(os.path.dirname(os.getcwd()), 'data')
 RAW_DATA_DIR = os.path.join(DATA_DIR, 'raw')
 PROCESSED_DATA_DIR = os.path.join(DATA_DIR, 'processed')
+RAW_COLS = [  # only the columns used to create the processed data
+    'Hotel_Address', 'Average_Score', 'Hotel_Name', 'Reviewer_Nationality',
+    'Negative_Review', 'Positive_Review', 'Review_Date', 'Reviewer_Score',
+    'Tags', 'lat', 'lng',
+]
 
 
 class Data:
@@ -33,14 +49,96 @@ class Data:
         self._check_raw_data()
 
     @abstractmethod
-    def create_processed_data(self, country: str):
+    def create_processed_data(self, country: str, n_review: int = N_REVIEW,
+                              chunksize: Optional[int] = None,
+                              csv_export: bool = True) -> List[str]:
         """
         Create the processed data and save to the processed data directory.
+        The processed data is reused while the raw data matches its manifest;
+        when the raw data changes, only the hotels whose reviews changed are
+        processed again.
 
         Parameters
         ----------
         country: str
             The country to be the focus of the dataset.
+        n_review: int, optional
+            The number of reviews to be collected per hotel. Defaults to 3.
+        chunksize: Optional[int], optional
+            If given, the raw data is streamed in chunks of this many rows so
+            that the memory stays bounded. Defaults to None (read the whole
+            raw data at once).
+        csv_export: bool, optional
+            If True, a human-readable CSV is saved next to the processed data.
+            Defaults to True.
+
+        Returns
+        -------
+        List[str]
+            The IDs of the hotels that changed, appeared or disappeared since
+            the last processing (all of them for a first processing).
+        """
+        pass
+
+    @abstractmethod
+    def create_all_processed_data(self,
+                                  countries: Optional[List[str]] = None,
+                                  n_review: int = N_REVIEW,
+                                  chunksize: Optional[int] = None,
+                                  csv_export: bool = True,
+                                  max_workers: Optional[int] = None
+                                  ) -> Dict[str, List[str]]:
+        """
+        Create the processed data of several countries in one pass over the
+        raw data. The reviews of every country (and every chunk) are parsed
+        and aggregated in a process pool.
+
+        Parameters
+        ----------
+        countries: Optional[List[str]], optional
+            The countries to be processed. Defaults to None (all the countries
+            with a registered address parser).
+        n_review: int, optional
+            The number of reviews to be collected per hotel. Defaults to 3.
+        chunksize: Optional[int], optional
+            If given, the raw data is streamed in chunks of this many rows.
+            Defaults to None (read the whole raw data at once).
+        csv_export: bool, optional
+            If True, a human-readable CSV is saved next to the processed data.
+            Defaults to True.
+        max_workers: Optional[int], optional
+            The number of worker processes. Defaults to None (the number of
+            CPUs).
+
+        Returns
+        -------
+        Dict[str, List[str]]
+            The IDs of the dirty hotels of every processed country.
+
+        Raises
+        ------
+        NotImplementedError
+            If no address parser has been registered for a country.
+        """
+        pass
+
+    @abstractmethod
+    def load_processed_data(self,
+                            columns: Optional[List[str]] = None
+                            ) -> pd.DataFrame:
+        """
+        Load the processed data. Nothing is read before it is needed, and only
+        the requested columns are read.
+
+        Parameters
+        ----------
+        columns: Optional[List[str]], optional
+            The columns to be loaded. Defaults to None (all columns).
+
+        Returns
+        -------
+        pd.DataFrame
+            The processed data.
         """
         pass
 
@@ -78,93 +176,299 @@ class CSVData(Data):
     def __init__(self, raw_file_name):
         super().__init__(raw_file_name)
 
-    def create_processed_data(self, country):
-        self.processed_data_name = f"{country}_processed_df.csv"
-        data_path = os.path.join(PROCESSED_DATA_DIR, self.processed_data_name)
-        if os.path.isfile(data_path):
+    def create_processed_data(self, country, n_review=N_REVIEW,
+                              chunksize=None, csv_export=True):
+        self.processed_data_name = f"{country}_processed_df.parquet"
+        self.data = None
+        if self._reuse_processed_data(country, n_review):
             self._check_processed_data()
+            return []
+        print("[INFO] Creating processed data.")
+        get_address_parser(country)  # fail before reading the raw data
+        self._make_data_dirs()
+        data_path = self._processed_data_path(country)
+        manifest = load_manifest(self._manifest_path(country))
+        if manifest is None or manifest['n_review'] != n_review \
+                or not os.path.isfile(data_path):
+            manifest = None
+        fingerprints = HotelFingerprints()
+        aggregator = ReviewAggregator(n_review=n_review)
+        if manifest is None:
+            # build everything in a single pass
+            for df in self._read_raw_data(chunksize):
+                df = self._select_reviews(df, country)
+                fingerprints.update(df)
+                aggregator.update(self._prepare_reviews(df, country))
+            dirty_hotels = find_dirty_hotels(None, fingerprints.result())
+            final_df = aggregator.result()
         else:
-            print("[INFO] Creating processed data.")
-            if not os.path.exists(RAW_DATA_DIR):
-                os.mkdir(RAW_DATA_DIR)
-            if not os.path.exists(PROCESSED_DATA_DIR):
-                os.mkdir(PROCESSED_DATA_DIR)
-            df = pd.read_csv(os.path.join(RAW_DATA_DIR,
-                                          self.raw_data_name))
-            # create new columns
-            len_country = len(country.split())
-            df['Clean_Tags'] = df['Tags'].apply(self._clean_tag)
-            if country == "United Kingdom":
-                df['Postal_Code'] = df['Hotel_Address'].apply(
-                    lambda x: " ".join(
-                        x.split(" ")[-(len_country + 2):-len_country]))
-                df['City'] = df['Hotel_Address'].apply(
-                    lambda x: x.split(" ")[-(len_country + 3)])
-            else:
-                raise NotImplementedError(
-                    "Need to implement for other countries.")
-
-            # filter based on the desired country
-            df = df[
-                (df['Hotel_Address'].str.contains(country))
-                & (df['Reviewer_Nationality'].str.contains(country))
-            ]
-            df.reset_index(drop=True, inplace=True)
-            df = df[df['Reviewer_Score'] >= 8]  # only take from reviewer > 8
-            take_cols = [
-                'Hotel_Name', 'Average_Score',
-                'Positive_Review', 'Negative_Review', 'Review_Date',
-                'Hotel_Address', 'Postal_Code', 'City', 'lat', 'lng',
-                'Reviewer_Score', 'Clean_Tags',
-            ]
-            df = df[take_cols]
-
-            # aggregate
-            agg_df = df.groupby('Hotel_Name').agg(
-                {
-                    'Average_Score': 'first',
-                    'Hotel_Address': 'first',
-                    'Review_Date': 'first',
-                    'Postal_Code': 'first',
-                    'City': 'first',
-                    'lat': 'first',
-                    'lng': 'first',
-                    'Clean_Tags': 'first',
-                }
-            ).reset_index()
-
-            # reorganize the reviews
-            review_dct = dict(Hotel_Name=[],
-                              Positive_Review=[],
-                              Negative_Review=[])
-            excl_reviews = [  # list of words to be ignored from the reviews
-                "no negative",
-                "no positive",
-                "none",
-                "nothing",
-                "n a",
-                "na"]
-            n_review = 3  # collect only last 3 reviews
-            for hotel_name in agg_df['Hotel_Name']:
-                review_dct['Hotel_Name'].append(hotel_name)
-                for col in ['Positive_Review', 'Negative_Review']:
-                    reviews = df[df['Hotel_Name'] == hotel_name][col].values
-                    review = []
-                    for text in reviews:
-                        if text.lower() in excl_reviews: continue
-                        review.append(text.strip())
-                        if len(review) == n_review: break
-                    review_dct[col].append(", ".join(review))
-            review_df = pd.DataFrame(review_dct)
-
-            # merge
-            final_df = pd.merge(
-                left=agg_df, right=review_df, on='Hotel_Name', how='left')
-            # save to the directory
-            final_df.to_csv(os.path.join(DATA_DIR,
-                                         'processed',
-                                         self.processed_data_name),
-                            index=False)
+            # fingerprint first, then only aggregate the dirty hotels
+            for df in self._read_raw_data(chunksize):
+                fingerprints.update(self._select_reviews(df, country))
+            dirty_hotels = find_dirty_hotels(manifest, fingerprints.result())
+            print(f"[INFO] {len(dirty_hotels)} hotels changed since the last "
+                  f"processing.")
+            if dirty_hotels:
+                for df in self._read_raw_data(chunksize):
+                    df = self._select_reviews(df, country)
+                    df = df[df['Hotel_Name'].isin(dirty_hotels)]
+                    aggregator.update(self._prepare_reviews(df, country))
+            old_df = load_processed_df(data_path)
+            final_df = pd.concat(
+                [old_df[~old_df['Hotel_Name'].isin(dirty_hotels)],
+                 aggregator.result()]
+            ).sort_values('Hotel_Name', ignore_index=True)
+        # save to the directory
+        save_processed_df(final_df, data_path, csv_export=csv_export)
+        save_manifest(create_manifest(self._raw_data_path(),
+                                      fingerprints.result(), n_review),
+                      self._manifest_path(country))
+        return [hotel_id(name) for name in dirty_hotels]
+
+    def create_all_processed_data(self, countries=None, n_review=N_REVIEW,
+                                  chunksize=None, csv_export=True,
+                                  max_workers=None):
+        if countries is None:
+            countries = list(REGISTRY_ADDRESS_PARSER)
+        countries = [country for country in countries
+                     if not self._reuse_processed_data(country, n_review)]
+        for country in countries:
+            get_address_parser(country)
+        if not countries:
+            print("[INFO] Processed data already exists for all countries.")
+            return {}
+        print(f"[INFO] Creating processed data for {', '.join(countries)}.")
+        self._make_data_dirs()
+
+        aggregators = {country: ReviewAggregator(n_review=n_review)
+                       for country in countries}
+        fingerprints = {country: HotelFingerprints() for country in countries}
+        max_pending = 2 * len(countries) * (max_workers or os.cpu_count())
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for df in self._read_raw_data(chunksize):
+                for country in countries:
+                    pending.append((country, executor.submit(
+                        CSVData._aggregate_reviews,
+                        self._select_reviews(df, country),
+                        country, n_review)))
+                # bound the number of chunks waiting in the pool
+                while len(pending) > max_pending:
+                    self._merge_pending(pending, aggregators, fingerprints)
+            while pending:
+                self._merge_pending(pending, aggregators, fingerprints)
+
+        raw_fingerprint = fingerprint_file(self._raw_data_path())
+        dirty_hotel_ids = {}
+        for country in countries:
+            data_path = self._processed_data_path(country)
+            final_df = save_processed_df(aggregators[country].result(),
+                                         data_path, csv_export=csv_export)
+            print(f"[INFO] Saved {len(final_df)} hotels to {data_path}.")
+            manifest_path = self._manifest_path(country)
+            country_fingerprints = fingerprints[country].result()
+            dirty_hotel_ids[country] = [
+                hotel_id(name) for name in find_dirty_hotels(
+                    load_manifest(manifest_path), country_fingerprints)]
+            save_manifest(create_manifest(self._raw_data_path(),
+                                          country_fingerprints, n_review,
+                                          raw_fingerprint),
+                          manifest_path)
+        return dirty_hotel_ids
+
+    def load_processed_data(self, columns=None):
+        if self.data is not None:
+            return self.data if columns is None else self.data[columns]
+        data_path = os.path.join(PROCESSED_DATA_DIR, self.processed_data_name)
+        df = load_processed_df(data_path, columns=columns)
+        if columns is None:
+            self.data = df
+        return df
+
+    def _reuse_processed_data(self, country: str, n_review: int) -> bool:
+        """
+        Check whether the processed data of a country is up to date with the
+        raw data, using the fingerprints recorded in its manifest.
+
+        Parameters
+        ----------
+        country: str
+            The desired country.
+        n_review: int
+            The number of reviews to be collected per hotel.
+
+        Returns
+        -------
+        bool
+            If True, the processed data can be reused.
+        """
+        manifest_path = self._manifest_path(country)
+        manifest = load_manifest(manifest_path)
+        if manifest is None or manifest['n_review'] != n_review \
+                or not os.path.isfile(self._processed_data_path(country)):
+            return False
+        mtime_ns = manifest['raw_data']['mtime_ns']
+        if not is_raw_data_unchanged(manifest, self._raw_data_path()):
+            return False
+        if manifest['raw_data']['mtime_ns'] != mtime_ns:
+            save_manifest(manifest, manifest_path)  # only touched
+        return True
+
+    def _raw_data_path(self) -> str:
+        """
+        Get the path of the raw data.
+        """
+        return os.path.join(RAW_DATA_DIR, self.raw_data_name)
+
+    @staticmethod
+    def _processed_data_path(country: str) -> str:
+        """
+        Get the path of the processed data of a country.
+        """
+        return os.path.join(PROCESSED_DATA_DIR,
+                            f"{country}_processed_df.parquet")
+
+    @staticmethod
+    def _manifest_path(country: str) -> str:
+        """
+        Get the path of the manifest of the processed data of a country.
+        """
+        return os.path.join(PROCESSED_DATA_DIR, f"{country}_manifest.json")
+
+    @staticmethod
+    def _merge_pending(pending: deque,
+                       aggregators: Dict[str, ReviewAggregator],
+                       fingerprints: Dict[str, HotelFingerprints]):
+        """
+        Merge the oldest task of the process pool into the results of its
+        country.
+
+        Parameters
+        ----------
+        pending: deque
+            The (country, future) of the submitted tasks, oldest first.
+        aggregators: Dict[str, ReviewAggregator]
+            The aggregator of every country.
+        fingerprints: Dict[str, HotelFingerprints]
+            The hotel fingerprints of every country.
+        """
+        country, future = pending.popleft()
+        aggregator, country_fingerprints = future.result()
+        aggregators[country].merge(aggregator)
+        fingerprints[country].merge(country_fingerprints)
+
+    @staticmethod
+    def _make_data_dirs():
+        """
+        Create the raw and the processed data directories.
+        """
+        if not os.path.exists(RAW_DATA_DIR):
+            os.mkdir(RAW_DATA_DIR)
+        if not os.path.exists(PROCESSED_DATA_DIR):
+            os.mkdir(PROCESSED_DATA_DIR)
+
+    def _read_raw_data(self,
+                       chunksize: Optional[int] = None
+                       ) -> Iterator[pd.DataFrame]:
+        """
+        Read the raw data, either at once or in chunks.
+
+        Parameters
+        ----------
+        chunksize: Optional[int], optional
+            If given, the raw data is streamed in chunks of this many rows so
+            that only the kept reviews stay in memory. Defaults to None.
+
+        Returns
+        -------
+        Iterator[pd.DataFrame]
+            The raw data (or its chunks), with the used columns only.
+        """
+        raw_data_path = self._raw_data_path()
+        if chunksize is None:
+            yield pd.read_csv(raw_data_path, usecols=RAW_COLS)
+        else:
+            print(f"[INFO] Reading raw data in chunks of {chunksize} rows.")
+            yield from pd.read_csv(raw_data_path, usecols=RAW_COLS,
+                                   chunksize=chunksize)
+
+    @staticmethod
+    def _select_reviews(df: pd.DataFrame, country: str) -> pd.DataFrame:
+        """
+        Keep the reviews of the desired country.
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            The raw reviews (or a chunk of them).
+        country: str
+            The country to be the focus of the dataset.
+
+        Returns
+        -------
+        pd.DataFrame
+            The reviews of the hotels in the country written by reviewers
+            of the country with a score of at least 8.
+        """
+        return df[
+            (df['Hotel_Address'].str.contains(country))
+            & (df['Reviewer_Nationality'].str.contains(country))
+            & (df['Reviewer_Score'] >= 8)  # only take from reviewer > 8
+        ]
+
+    @staticmethod
+    def _prepare_reviews(df: pd.DataFrame, country: str) -> pd.DataFrame:
+        """
+        Add the derived columns to the selected reviews.
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            The selected reviews.
+        country: str
+            The country to be the focus of the dataset.
+
+        Returns
+        -------
+        pd.DataFrame
+            The reviews with the columns used for the aggregation.
+        """
+        df = df.copy()
+        df['Clean_Tags'] = df['Tags'].apply(CSVData._clean_tag)
+        df['Postal_Code'], df['City'] = get_address_parser(country).parse(
+            df['Hotel_Address'])
+        take_cols = [
+            'Hotel_Name', 'Average_Score',
+            'Positive_Review', 'Negative_Review', 'Review_Date',
+            'Hotel_Address', 'Postal_Code', 'City', 'lat', 'lng',
+            'Reviewer_Score', 'Clean_Tags',
+        ]
+        return df[take_cols]
+
+    @staticmethod
+    def _aggregate_reviews(df: pd.DataFrame, country: str, n_review: int
+                           ) -> Tuple[ReviewAggregator, HotelFingerprints]:
+        """
+        Fingerprint, prepare and aggregate the selected reviews of a country.
+        Used as the task of the process pool.
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            The selected reviews.
+        country: str
+            The country to be the focus of the dataset.
+        n_review: int
+            The number of reviews to be collected per hotel.
+
+        Returns
+        -------
+        Tuple[ReviewAggregator, HotelFingerprints]
+            The aggregates and the hotel fingerprints of the reviews.
+        """
+        return (ReviewAggregator(n_review=n_review).update(
+                    CSVData._prepare_reviews(df, country)),
+                HotelFingerprints().update(df))
 
     def _check_raw_data(self):
         data_path = os.path.join(
@@ -182,11 +486,13 @@ class CSVData(Data):
     def _check_processed_data(self):
         data_path = os.path.join(
             PROCESSED_DATA_DIR, self.processed_data_name)
-        self.data = pd.read_csv(data_path)
-        if isinstance(self.data, pd.DataFrame):
-            print(f"[INFO] Processed data already exists at {data_path}.")
-        else:
-            raise TypeError("Processed data is not a CSV file.")
+        try:
+            # only the footer is read, the data is loaded lazily
+            columns = read_processed_columns(data_path)
+        except pa.ArrowInvalid:
+            raise TypeError("Processed data is not a Parquet file.")
+        print(f"[INFO] Processed data already exists at {data_path} "
+              f"with columns {columns}.")
 
     @staticmethod
     def _clean_tag(tag) -> str:
@@ -0,0 +1,79 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+
+from typing import List, Optional
+
+# compact dtypes of the processed data
+PROCESSED_DTYPES = {
+    'Average_Score': 'float32',
+    'Postal_Code': 'category',
+    'City': 'category',
+    'lat': 'float32',
+    'lng': 'float32',
+}
+
+
+def save_processed_df(df: pd.DataFrame,
+                      data_path: str,
+                      csv_export: bool = True) -> pd.DataFrame:
+    """
+    Save the processed data as a typed, columnar Parquet file.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The processed data.
+    data_path: str
+        The path of the Parquet file.
+    csv_export: bool, optional
+        If True, a human-readable CSV with the same name is also saved.
+        Defaults to True.
+
+    Returns
+    -------
+    pd.DataFrame
+        The processed data with the compact dtypes.
+    """
+    df = df.astype(PROCESSED_DTYPES)
+    df.to_parquet(data_path, index=False)
+    if csv_export:
+        df.to_csv(f"{os.path.splitext(data_path)[0]}.csv", index=False)
+    return df
+
+
+def load_processed_df(data_path: str,
+                      columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Load the processed data, reading only the requested columns.
+
+    Parameters
+    ----------
+    data_path: str
+        The path of the Parquet file.
+    columns: Optional[List[str]], optional
+        The columns to be read. Defaults to None (all columns).
+
+    Returns
+    -------
+    pd.DataFrame
+        The processed data.
+    """
+    return pd.read_parquet(data_path, columns=columns)
+
+
+def read_processed_columns(data_path: str) -> List[str]:
+    """
+    Read the column names of the processed data from the file footer only.
+
+    Parameters
+    ----------
+    data_path: str
+        The path of the Parquet file.
+
+    Returns
+    -------
+    List[str]
+        The column names.
+    """
+    return pq.read_schema(data_path).names
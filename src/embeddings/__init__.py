@@ -1,2 +1,13 @@
-from .embedding import Embeddings
+from ..shared import lazy_exports
 from .embedding_type import EmbeddingType
+
+# the embedding models are imported on first use, with their backends, so
+# that importing the package for the embedding types stays cheap
+_LAZY_IMPORTS = {
+    'Embeddings': '.embedding',
+    'CachedEmbeddings': '.cache',
+    'EmbeddingCache': '.cache',
+    'HashingEmbeddings': '.hashing'
+}
+__getattr__, __dir__, __all__ = lazy_exports(
+    __name__, _LAZY_IMPORTS, ['EmbeddingType'])
@@ -0,0 +1,229 @@
+import os, time, sqlite3, hashlib, threading
+import numpy as np
+from langchain_core.embeddings import Embeddings as BaseEmbeddings
+from typing import Dict, Iterable, List
+
+DATA_DIR = os.path.join(os.path.dirname(os.getcwd()), 'data')
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, "embedding_cache",
+                                    "embeddings.sqlite")
+MAX_CACHE_BYTES = 512 * 2 ** 20
+ACCESS_INTERVAL_SECONDS = 60
+
+
+class EmbeddingCache:
+    """
+    A local on-disk store of embedding vectors, keyed by content, with a
+    size-bounded least-recently-used eviction. The access time of a vector
+    is only updated once it is older than an interval, so that most hits
+    only read the store.
+    """
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH,
+                 max_bytes: int = MAX_CACHE_BYTES,
+                 access_interval_seconds: float = ACCESS_INTERVAL_SECONDS):
+        """
+        Initialize a new EmbeddingCache.
+
+        Parameters
+        ----------
+        path: str, optional
+            The path of the SQLite file. Defaults to
+            'data/embedding_cache/embeddings.sqlite'.
+        max_bytes: int, optional
+            The maximum size of the stored vectors. Defaults to 512 MiB.
+        access_interval_seconds: float, optional
+            The minimum seconds between two updates of the access time of a
+            vector. Defaults to a minute.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.access_interval_seconds = access_interval_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "n_byte INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_access "
+                           "ON embeddings (last_access)")
+        self._conn.commit()
+        self.n_byte = self._conn.execute(
+            "SELECT COALESCE(SUM(n_byte), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up vectors and mark the found ones as recently used, if their
+        access time is older than the access interval.
+
+        Parameters
+        ----------
+        keys: Iterable[str]
+            The keys.
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+            The float32 vectors of the found keys.
+        """
+        keys = list(dict.fromkeys(keys))
+        found, stale = {}, []
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), 500):  # SQLite variable limit
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector, last_access FROM embeddings "
+                    f"WHERE key IN ({','.join('?' * len(batch))})",
+                    batch).fetchall()
+                for key, vector, last_access in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+                    if now - last_access >= self.access_interval_seconds:
+                        stale.append((now, key))
+            if stale:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    stale)
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, vectors: Dict[str, List[float]]):
+        """
+        Store vectors, then evict the least recently used ones if the store
+        is too large.
+
+        Parameters
+        ----------
+        vectors: Dict[str, List[float]]
+            The vector of every key.
+        """
+        now = time.time()
+        rows = []
+        for key, vector in vectors.items():
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self._lock:
+            old_n_byte = 0  # of the replaced vectors
+            for start in range(0, len(rows), 500):
+                batch = [row[0] for row in rows[start:start + 500]]
+                old_n_byte += self._conn.execute(
+                    f"SELECT COALESCE(SUM(n_byte), 0) FROM embeddings "
+                    f"WHERE key IN ({','.join('?' * len(batch))})",
+                    batch).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self.n_byte += sum(row[2] for row in rows) - old_n_byte
+            self._evict()
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """
+        Report the usage of the cache.
+
+        Returns
+        -------
+        dict
+            The hits, misses and hit rate of this process, and the number of
+            entries and bytes stored.
+        """
+        with self._lock:
+            n_entry = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        n_lookup = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / n_lookup if n_lookup else 0.0,
+                'entries': n_entry,
+                'bytes': self.n_byte}
+
+    def clear(self):
+        """
+        Remove every stored vector.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self.n_byte = 0
+
+    def _evict(self):
+        """
+        Delete the least recently used vectors until the store fits.
+        """
+        while self.n_byte > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, n_byte FROM embeddings "
+                "ORDER BY last_access LIMIT 256").fetchall()
+            if not rows:
+                break
+            evicted, n_byte = [], 0
+            for key, row_n_byte in rows:
+                if self.n_byte - n_byte <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                n_byte += row_n_byte
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?",
+                                   evicted)
+            self.n_byte -= n_byte
+
+
+class CachedEmbeddings(BaseEmbeddings):
+    """
+    An embedding model that looks up the vectors of the texts in an
+    EmbeddingCache before computing the missing ones. Documents and queries
+    share the same cache.
+    """
+    def __init__(self, embedding_model: BaseEmbeddings, model_name: str,
+                 cache: EmbeddingCache):
+        """
+        Initialize a new CachedEmbeddings.
+
+        Parameters
+        ----------
+        embedding_model: BaseEmbeddings
+            The embedding model computing the missing vectors.
+        model_name: str
+            The name of the model, part of the cache key.
+        cache: EmbeddingCache
+            The cache.
+        """
+        self.embedding_model = embedding_model
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts)
+                   if key not in vectors}
+        if missing:
+            computed = dict(zip(missing, self.embedding_model.embed_documents(
+                list(missing.values()))))
+            self.cache.put_many(computed)
+            vectors.update(computed)
+        return [list(map(float, vectors[key])) for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vectors = self.cache.get_many([key])
+        if key not in vectors:
+            vectors[key] = self.embedding_model.embed_query(text)
+            self.cache.put_many(vectors)
+        return list(map(float, vectors[key]))
+
+    def stats(self) -> dict:
+        """
+        Report the usage of the cache.
+        """
+        return self.cache.stats()
+
+    def _key(self, text: str) -> str:
+        """
+        Create the cache key of a text: the model name and the hash of the
+        text.
+        """
+        return f"{self.model_name}:" \
+               f"{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
@@ -1,21 +1,49 @@
-from langchain_community.embeddings import (HuggingFaceEmbeddings,
-                                            OpenAIEmbeddings)
+from __future__ import annotations
+import sys, json, threading
+from .cache import CachedEmbeddings, EmbeddingCache, EMBEDDING_CACHE_PATH, \
+    MAX_CACHE_BYTES
 from .embedding_type import EmbeddingType
-from typing import Union
+from .hashing import HashingEmbeddings
+from ..shared import SharedInstances
+from langchain_core.embeddings import Embeddings as BaseEmbeddings
+from typing import Hashable, List, Optional, Sequence, Tuple, Union, \
+    TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # the backends are imported once their model is selected
+    from langchain_community.embeddings import (HuggingFaceEmbeddings,
+                                                OpenAIEmbeddings)
 
 REGISTRY_EMBEDDING = {
     EmbeddingType.SENTENCE_TRANSFORMER: "all-MiniLM-L6-v2",
-    EmbeddingType.OPENAI_EMBEDDING_SMALL: "text-embedding-3-small"
+    EmbeddingType.OPENAI_EMBEDDING_SMALL: "text-embedding-3-small",
+    EmbeddingType.HASHING: "hashing-384"
 }
+# the dummy batch embedded by the warm-up
+WARM_UP_TEXTS = ("Hotel_Name: warm up", "A quiet room near the station.")
 
 
 class Embeddings:
     """
-    A class to get the embedding model.
+    A class to get the embedding model. The models are shared: the same type
+    with the same options returns the same instance, built once by a single
+    thread even if several ask for it at once, so the weights of a local
+    model are loaded and held once per process.
     """
+    _instances = SharedInstances()
+    _lock = threading.Lock()  # guards the cached wrappers
+    _cached = {}  # (key, cache path, max bytes) -> CachedEmbeddings
+
     @classmethod
-    def get(cls, embedding_name: EmbeddingType) -> Union[HuggingFaceEmbeddings,
-                                                         OpenAIEmbeddings]:
+    def get(cls,
+            embedding_name: EmbeddingType,
+            cache: bool = False,
+            cache_path: str = EMBEDDING_CACHE_PATH,
+            max_cache_bytes: int = MAX_CACHE_BYTES,
+            shared: bool = True,
+            **kwargs
+            ) -> Union[HuggingFaceEmbeddings, OpenAIEmbeddings,
+                       HashingEmbeddings, CachedEmbeddings]:
         """
         Retrieve the desired embedding model.
 
@@ -23,27 +51,179 @@ class Embeddings:
         ----------
         embedding_name: EmbeddingType
             The name of desired embedding model.
+        cache: bool, optional
+            If True, wrap the model so that the vectors are cached on disk.
+            Defaults to False.
+        cache_path: str, optional
+            The path of the cache. Defaults to
+            'data/embedding_cache/embeddings.sqlite'.
+        max_cache_bytes: int, optional
+            The maximum size of the cached vectors. Defaults to 512 MiB.
+        shared: bool, optional
+            If True, return the instance shared by the callers with the same
+            type and options, else a new one. Defaults to True.
+        **kwargs
+            The options of the hashing model, e.g. latency or jitter.
 
         Returns
         -------
-        Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+        Union[HuggingFaceEmbeddings, OpenAIEmbeddings, HashingEmbeddings,
+              CachedEmbeddings]
             The desired embedding model.
 
         Raises
         ------
         NotImplementedError
             If the desired embedding model has not been implemented.
+        TypeError
+            If options are given to an embedding model that takes none.
+        """
+        if not shared:
+            embedding_model = cls._build(embedding_name, **kwargs)
+            if cache:
+                return cls._wrap(embedding_name, embedding_model, cache_path,
+                                 max_cache_bytes)
+            return embedding_model
+        key = cls._key(embedding_name, kwargs)
+        embedding_model = cls._instances.get(
+            key, lambda: cls._build(embedding_name, **kwargs),
+            embedding=embedding_name, options=json.loads(key[1]))
+        if not cache:
+            return embedding_model
+        with cls._lock:
+            cached_key = (key, cache_path, max_cache_bytes)
+            if cached_key not in cls._cached:
+                cls._cached[cached_key] = cls._wrap(
+                    embedding_name, embedding_model, cache_path,
+                    max_cache_bytes)
+            return cls._cached[cached_key]
+
+    @classmethod
+    def warm_up(cls,
+                embedding_name: EmbeddingType,
+                texts: Sequence[str] = WARM_UP_TEXTS,
+                **kwargs
+                ) -> Union[HuggingFaceEmbeddings, OpenAIEmbeddings,
+                           HashingEmbeddings, CachedEmbeddings]:
+        """
+        Load the shared embedding model and embed a dummy batch, so that the
+        first request does not pay for the lazy initialization of the model.
+        The batch skips the cache of the vectors.
+
+        Parameters
+        ----------
+        embedding_name: EmbeddingType
+            The name of desired embedding model.
+        texts: Sequence[str], optional
+            The dummy batch.
+        **kwargs
+            The arguments of `get`.
+
+        Returns
+        -------
+        Union[HuggingFaceEmbeddings, OpenAIEmbeddings, HashingEmbeddings,
+              CachedEmbeddings]
+            The desired embedding model.
+        """
+        kwargs.pop('shared', None)
+        embedding_model = cls.get(embedding_name, **kwargs)
+        base_model = getattr(embedding_model, 'embedding_model',
+                             embedding_model)
+        seconds = cls._instances.warm_up(
+            base_model, lambda: base_model.embed_documents(list(texts)))
+        print(f"[INFO] Warmed up {embedding_name} in {seconds:.2f} s")
+        return embedding_model
+
+    @classmethod
+    def release(cls, embedding_name: Optional[EmbeddingType] = None) -> int:
+        """
+        Release the shared embedding models, so that their memory is freed
+        once no caller holds them.
+
+        Parameters
+        ----------
+        embedding_name: Optional[EmbeddingType], optional
+            The type of the models, every model if not given.
+
+        Returns
+        -------
+        int
+            The number of released models.
+        """
+        with cls._lock:
+            keys = cls._instances.release(
+                lambda key: embedding_name is None or key[0] == embedding_name)
+            for cached_key in [cached_key for cached_key in cls._cached
+                               if cached_key[0] in keys]:
+                del cls._cached[cached_key]
+        print(f"[INFO] Released {len(keys)} embedding models")
+        torch = sys.modules.get('torch')
+        if keys and torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return len(keys)
+
+    @classmethod
+    def loaded(cls) -> List[dict]:
+        """
+        List the shared embedding models, least recently loaded first.
+
+        Returns
+        -------
+        List[dict]
+            The type, the options, the bytes of the parameters, None for a
+            remote model, the growth of the resident memory of the process
+            while it was loaded and warmed up, the load seconds and the
+            warm-up seconds, if warmed up, of every model.
+        """
+        return cls._instances.entries()
+
+    @staticmethod
+    def _key(embedding_name: EmbeddingType,
+             kwargs: dict) -> Tuple[Hashable, ...]:
+        """
+        Get the key of a shared model: its type and its options.
         """
+        return embedding_name, json.dumps(kwargs, sort_keys=True,
+                                          default=repr)
+
+    @staticmethod
+    def _build(embedding_name: EmbeddingType, **kwargs) -> BaseEmbeddings:
+        """
+        Build a new embedding model.
+        """
+        if kwargs and embedding_name in (EmbeddingType.SENTENCE_TRANSFORMER,
+                                         EmbeddingType.OPENAI_EMBEDDING_SMALL):
+            raise TypeError(f"{embedding_name} takes no options, got "
+                            f"{', '.join(sorted(kwargs))}")
         if embedding_name == EmbeddingType.SENTENCE_TRANSFORMER:
             print(f"[INFO] Using {EmbeddingType.SENTENCE_TRANSFORMER}")
+            from langchain_community.embeddings import HuggingFaceEmbeddings
             return HuggingFaceEmbeddings(
                 model_name=REGISTRY_EMBEDDING[embedding_name]
             )
         elif embedding_name == EmbeddingType.OPENAI_EMBEDDING_SMALL:
             print(f"[INFO] Using {EmbeddingType.OPENAI_EMBEDDING_SMALL}")
-            return OpenAIEmbeddings(
-                model=REGISTRY_EMBEDDING[embedding_name])
+            from langchain_community.embeddings import OpenAIEmbeddings
+            return OpenAIEmbeddings(model=REGISTRY_EMBEDDING[embedding_name])
+        elif embedding_name == EmbeddingType.HASHING:
+            # an offline, deterministic stand-in for load testing
+            print(f"[INFO] Using {EmbeddingType.HASHING}")
+            return HashingEmbeddings(**kwargs)
         else:
             raise NotImplementedError("Other embedding models have not been"
                                       "implemented.")
 
+    @staticmethod
+    def _wrap(embedding_name: EmbeddingType, embedding_model: BaseEmbeddings,
+              cache_path: str, max_cache_bytes: int) -> CachedEmbeddings:
+        """
+        Wrap an embedding model so that the vectors are cached on disk.
+        """
+        print(f"[INFO] Caching the embeddings in {cache_path}")
+        # the hashing vectors depend on their size
+        return CachedEmbeddings(
+            embedding_model,
+            embedding_model.model_name
+            if isinstance(embedding_model, HashingEmbeddings)
+            else REGISTRY_EMBEDDING[embedding_name],
+            EmbeddingCache(cache_path, max_cache_bytes))
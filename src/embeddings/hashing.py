@@ -0,0 +1,80 @@
+import re, time, zlib, random, hashlib
+import numpy as np
+from langchain_core.embeddings import Embeddings as BaseEmbeddings
+from typing import List
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbeddings(BaseEmbeddings):
+    """
+    An offline, deterministic embedding model for load testing: the words and
+    the pairs of consecutive words of a text are hashed into the dimensions
+    of the vector with a sign, and the vector is normalized. Texts sharing
+    words are similar, so the retrieval still finds the hotels named in a
+    question. The latency of a call can be simulated, with a jitter as a
+    fraction, the same way for the same texts.
+    """
+    def __init__(self,
+                 size: int = 384,
+                 latency: float = 0.0,
+                 latency_per_text: float = 0.0,
+                 jitter: float = 0.0,
+                 seed: int = 0):
+        """
+        Initialize a new HashingEmbeddings.
+
+        Parameters
+        ----------
+        size: int, optional
+            The dimension of the vectors. Defaults to 384, as all-MiniLM-L6-v2.
+        latency: float, optional
+            The seconds of a call. Defaults to 0.
+        latency_per_text: float, optional
+            The additional seconds of every text of a call. Defaults to 0.
+        jitter: float, optional
+            The variation of the latency, as a fraction. Defaults to 0.
+        seed: int, optional
+            The seed of the jitter. Defaults to 0.
+        """
+        self.size = size
+        self.model_name = f"hashing-{size}"
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+        self.jitter = jitter
+        self.seed = seed
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._wait(texts)
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self._wait([text])
+        return self._embed(text).tolist()
+
+    def _embed(self, text: str) -> np.ndarray:
+        """
+        Hash the words and the pairs of words of a text into a unit vector.
+        """
+        words = _WORD_PATTERN.findall(text.lower())
+        features = words + [f"{first} {second}"
+                            for first, second in zip(words, words[1:])]
+        vector = np.zeros(self.size, dtype=np.float32)
+        for feature in features:
+            digest = int.from_bytes(hashlib.blake2b(
+                feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.size] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _wait(self, texts: List[str]):
+        """
+        Simulate the latency of a call.
+        """
+        seconds = self.latency + self.latency_per_text * len(texts)
+        if seconds <= 0:
+            return
+        rng = random.Random(zlib.crc32("\n".join(texts).encode("utf-8"))
+                            + self.seed)
+        time.sleep(max(seconds * (1 + self.jitter * rng.uniform(-1, 1)),
+                       0.0))
@@ -1,2 +0,0 @@
-from .llms import Models
-from .model_type import ModelType
@@ -0,0 +1,14 @@
+from ..shared import lazy_exports
+from .model_type import ModelType
+
+# the models are imported on first use, with their backends, so that
+# importing the package for the model types stays cheap
+_LAZY_IMPORTS = {
+    'Models': '.llms',
+    'REGISTRY_MODEL': '.llms',
+    'LLMCache': '.cache',
+    'ScriptedChatModel': '.fake_llm',
+    'OFFLINE_REACT_SCRIPT': '.fake_llm'
+}
+__getattr__, __dir__, __all__ = lazy_exports(
+    __name__, _LAZY_IMPORTS, ['ModelType'])
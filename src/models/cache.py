@@ -0,0 +1,336 @@
+import os, math, time, sqlite3, hashlib, threading, warnings
+from uuid import UUID
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.load import dumps, loads
+from typing import Any, Dict, List, Optional
+
+DATA_DIR = os.path.join(os.path.dirname(os.getcwd()), 'data')
+LLM_CACHE_PATH = os.path.join(DATA_DIR, "llm_cache", "responses.sqlite")
+MAX_CACHE_BYTES = 256 * 2 ** 20
+CACHE_TTL_SECONDS = 7 * 24 * 3600
+ACCESS_INTERVAL_SECONDS = 60
+
+
+class LLMCache(BaseCache, BaseCallbackHandler):
+    """
+    A local on-disk store of the responses of an LLM, keyed by the model
+    parameters and the full prompt, with a time to live and a size-bounded
+    least-recently-used eviction. The models can share the same store, and the
+    hits, misses and the time saved are recorded per model.
+
+    So that most hits only read the store, the access time of a response is
+    only updated once it is older than an interval, and the usage is written
+    with the next write of the store, at the latest after that interval.
+
+    The store is also a callback handler of the model, timing its calls by
+    run ID, so that a response is stored with the duration of the call that
+    produced it.
+    """
+    def __init__(self,
+                 model_id: str,
+                 path: str = LLM_CACHE_PATH,
+                 ttl_seconds: Optional[float] = CACHE_TTL_SECONDS,
+                 max_bytes: int = MAX_CACHE_BYTES,
+                 access_interval_seconds: float = ACCESS_INTERVAL_SECONDS):
+        """
+        Initialize a new LLMCache.
+
+        Parameters
+        ----------
+        model_id: str
+            The ID of the model, e.g. "gpt-3.5-turbo".
+        path: str, optional
+            The path of the SQLite file. Defaults to
+            'data/llm_cache/responses.sqlite'.
+        ttl_seconds: Optional[float], optional
+            The time to live of the responses, None to never expire. Defaults
+            to a week.
+        max_bytes: int, optional
+            The maximum size of the stored responses. Defaults to 256 MiB.
+        access_interval_seconds: float, optional
+            The minimum seconds between two updates of the access time of a
+            response, and between two writes of the usage. Defaults to a
+            minute.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.model_id = model_id
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.access_interval_seconds = access_interval_seconds
+        self._lock = threading.Lock()
+        # the hits, misses and seconds saved not written yet
+        self._usage = [0, 0, 0.0]
+        self._usage_written_at = time.time()
+        # run ID -> the prompt, whether it is a chat model and the start and
+        # end of the LLM call, while it runs or until its response is stored
+        self._runs = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, "
+            "response TEXT NOT NULL, n_byte INTEGER NOT NULL, "
+            "seconds REAL NOT NULL, created_at REAL NOT NULL, "
+            "last_access REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_access "
+                           "ON responses (last_access)")
+        # the size of the store, kept up to date by triggers
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS size ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), "
+            "n_entry INTEGER NOT NULL, n_byte INTEGER NOT NULL)")
+        self._conn.execute(
+            "INSERT OR IGNORE INTO size "
+            "SELECT 0, COUNT(*), COALESCE(SUM(n_byte), 0) FROM responses")
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_insert "
+            "AFTER INSERT ON responses BEGIN UPDATE size SET "
+            "n_entry = n_entry + 1, n_byte = n_byte + NEW.n_byte; END")
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_update "
+            "AFTER UPDATE OF n_byte ON responses BEGIN UPDATE size SET "
+            "n_byte = n_byte - OLD.n_byte + NEW.n_byte; END")
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_delete "
+            "AFTER DELETE ON responses BEGIN UPDATE size SET "
+            "n_entry = n_entry - 1, n_byte = n_byte - OLD.n_byte; END")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "model TEXT PRIMARY KEY, hits INTEGER NOT NULL, "
+            "misses INTEGER NOT NULL, seconds_saved REAL NOT NULL)")
+        self._conn.commit()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """
+        Look a response up and mark it as recently used, if its access time
+        is older than the access interval. The expired responses are deleted.
+
+        Parameters
+        ----------
+        prompt: str
+            The serialized prompt.
+        llm_string: str
+            The serialized model parameters.
+
+        Returns
+        -------
+        Optional[RETURN_VAL_TYPE]
+            The generations, or None if the response is not cached.
+        """
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, seconds, created_at, last_access "
+                "FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None \
+                    and now - row[2] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?",
+                                   (key,))
+                row = None
+            if row is None:
+                self._record(0, 1, 0.0)
+                self._write_usage(now)
+                self._conn.commit()
+                return None
+            self._record(1, 0, row[1])
+            stale = now - row[3] >= self.access_interval_seconds
+            if stale:
+                self._conn.execute(
+                    "UPDATE responses SET last_access = ? WHERE key = ?",
+                    (now, key))
+            if stale or now - self._usage_written_at \
+                    >= self.access_interval_seconds:
+                self._write_usage(now)
+                self._conn.commit()
+        with warnings.catch_warnings():
+            # the loading of LangChain objects is a beta feature
+            warnings.simplefilter("ignore")
+            return loads(row[0])
+
+    def update(self, prompt: str, llm_string: str,
+               return_val: RETURN_VAL_TYPE):
+        """
+        Store a response with the duration of the call that produced it,
+        then evict the least recently used responses if the store is too
+        large.
+
+        Parameters
+        ----------
+        prompt: str
+            The serialized prompt.
+        llm_string: str
+            The serialized model parameters.
+        return_val: RETURN_VAL_TYPE
+            The generations.
+        """
+        key = self._key(prompt, llm_string)
+        response = dumps(list(return_val))
+        now = time.time()
+        with self._lock:
+            seconds = self._pop_run(prompt)
+            self._conn.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                "model = excluded.model, response = excluded.response, "
+                "n_byte = excluded.n_byte, seconds = excluded.seconds, "
+                "created_at = excluded.created_at, "
+                "last_access = excluded.last_access",
+                (key, self.model_id, response, len(response.encode("utf-8")),
+                 seconds, now, now))
+            self._write_usage(now)
+            self._evict()
+            self._conn.commit()
+
+    def clear(self, **kwargs):
+        """
+        Remove every stored response of the model.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE model = ?",
+                               (self.model_id,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Report the usage of the store, per model. The usage of the other
+        stores on the same file is included once written.
+
+        Returns
+        -------
+        Dict[str, dict]
+            The hits, misses, hit rate and seconds saved of every model since
+            the store was created, and the number of its entries and bytes
+            stored.
+        """
+        with self._lock:
+            self._write_usage(time.time())
+            self._conn.commit()
+            usage = self._conn.execute(
+                "SELECT model, hits, misses, seconds_saved FROM usage"
+            ).fetchall()
+            stored = dict((model, (n_entry, n_byte)) for model, n_entry, n_byte
+                          in self._conn.execute(
+                              "SELECT model, COUNT(*), SUM(n_byte) "
+                              "FROM responses GROUP BY model"))
+        report = {}
+        for model, hits, misses, seconds_saved in usage:
+            n_entry, n_byte = stored.get(model, (0, 0))
+            report[model] = {'hits': hits,
+                             'misses': misses,
+                             'hit_rate': hits / (hits + misses)
+                             if hits + misses else 0.0,
+                             'seconds_saved': seconds_saved,
+                             'entries': n_entry,
+                             'bytes': n_byte}
+        return report
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *,
+                     run_id: UUID, **kwargs: Any):
+        """
+        Start timing a call of a language model.
+        """
+        self._start_run(run_id, prompts[0], chat=False)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any],
+                            messages: List[list], *, run_id: UUID,
+                            **kwargs: Any):
+        """
+        Start timing a call of a chat model, with its messages serialized as
+        the prompt of the store.
+        """
+        self._start_run(run_id, dumps(messages[0]), chat=True)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        """
+        Stop timing a call. A chat model stores its response before the end
+        of its run, or not at all on a hit, so its run is done; a language
+        model stores it after, so its run is kept until then.
+        """
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None and run['chat']:
+                del self._runs[run_id]
+            elif run is not None:
+                run['end'] = time.perf_counter()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID,
+                     **kwargs: Any):
+        """
+        Forget a call that failed, whose response is never stored.
+        """
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+    def _start_run(self, run_id: UUID, prompt: str, chat: bool):
+        """
+        Record the start of a call.
+        """
+        with self._lock:
+            self._runs[run_id] = {'prompt': prompt, 'chat': chat,
+                                  'start': time.perf_counter(), 'end': None}
+
+    def _pop_run(self, prompt: str) -> float:
+        """
+        Remove the earliest call of a prompt whose response is not stored yet.
+
+        Returns
+        -------
+        float
+            The duration of the call, 0 if the store is not a callback handler
+            of the model.
+        """
+        runs = [(run['start'], run_id) for run_id, run in self._runs.items()
+                if run['prompt'] == prompt]
+        if not runs:
+            return 0.0
+        run = self._runs.pop(min(runs)[1])
+        return (run['end'] or time.perf_counter()) - run['start']
+
+    def _record(self, hits: int, misses: int, seconds_saved: float):
+        """
+        Add to the usage of the model not written yet.
+        """
+        self._usage[0] += hits
+        self._usage[1] += misses
+        self._usage[2] += seconds_saved
+
+    def _write_usage(self, now: float):
+        """
+        Add the usage not written yet to the one of the store, in the current
+        transaction.
+        """
+        if any(self._usage):
+            self._conn.execute(
+                "INSERT INTO usage VALUES (?, ?, ?, ?) ON CONFLICT (model) "
+                "DO UPDATE SET hits = hits + excluded.hits, "
+                "misses = misses + excluded.misses, "
+                "seconds_saved = seconds_saved + excluded.seconds_saved",
+                (self.model_id, *self._usage))
+            self._usage = [0, 0, 0.0]
+        self._usage_written_at = now
+
+    def _evict(self):
+        """
+        Delete the least recently used responses until the store fits, about
+        as many as the excess size holds on average at a time.
+        """
+        n_entry, n_byte = self._conn.execute(
+            "SELECT n_entry, n_byte FROM size").fetchone()
+        while n_byte > self.max_bytes and n_entry > 0:
+            n_evicted = math.ceil((n_byte - self.max_bytes) * n_entry / n_byte)
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key "
+                "FROM responses ORDER BY last_access LIMIT ?)", (n_evicted,))
+            n_entry, n_byte = self._conn.execute(
+                "SELECT n_entry, n_byte FROM size").fetchone()
+
+    def _key(self, prompt: str, llm_string: str) -> str:
+        """
+        Create the key of a response: the hash of the model ID, the model
+        parameters and the prompt.
+        """
+        return hashlib.sha256("\0".join(
+            [self.model_id, llm_string, prompt]).encode("utf-8")).hexdigest()
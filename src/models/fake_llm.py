@@ -0,0 +1,129 @@
+import re, time, zlib, random, asyncio
+from langchain_core.callbacks import (AsyncCallbackManagerForLLMRun,
+                                      CallbackManagerForLLMRun)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import (ChatGeneration, ChatGenerationChunk,
+                                    ChatResult)
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+_TOKEN_PATTERN = re.compile(r"\s*\S+")
+_PLACEHOLDERS = {'{question}': "Question:", '{observation}': "Observation:",
+                 '{context}': "Context:"}
+# searches the reviews for the question, then answers with the first line of
+# the result
+OFFLINE_REACT_SCRIPT = [
+    "Thought: I should search the hotel reviews\n"
+    "Action: retriever-tool\n"
+    "Action Input: {question}",
+    "Thought: I now know the final answer\n"
+    "Final Answer: {observation}",
+]
+OFFLINE_ANSWER = "From the reviews: {context}"
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    A local chat model answering a ReAct prompt from a script, token by
+    token, to run the agent offline. The n-th response answers the n-th step
+    of the ReAct loop, counted by the observations after the last question of
+    the prompt, so that concurrent sessions sharing the model each follow the
+    script.
+
+    The responses may quote the prompt: {question}, {observation} and
+    {context} are replaced by the first line after the last "Question:",
+    "Observation:" and "Context:". The delays vary by up to the jitter, as a
+    fraction, the same way for the same prompt.
+    """
+    responses: List[str]
+    # the response to the prompts that are not ReAct ones, e.g. the RAG
+    # prompt, the next response of the script if not given
+    default_response: Optional[str] = None
+    token_delay: float = 0.0  # seconds between two tokens
+    first_token_delay: float = 0.0  # seconds before the first token
+    jitter: float = 0.0
+    seed: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-chat"
+
+    def _generate(self,
+                  messages: List[BaseMessage],
+                  stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None,
+                  **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages, stop)
+        time.sleep(sum(self._delays(messages, len(tokens))))
+        return ChatResult(generations=[
+            ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self,
+                messages: List[BaseMessage],
+                stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        tokens = self._tokens(messages, stop)
+        for token, delay in zip(tokens, self._delays(messages, len(tokens))):
+            time.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self,
+                       messages: List[BaseMessage],
+                       stop: Optional[List[str]] = None,
+                       run_manager: Optional[
+                           AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        tokens = self._tokens(messages, stop)
+        for token, delay in zip(tokens, self._delays(messages, len(tokens))):
+            await asyncio.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def _tokens(self, messages: List[BaseMessage],
+                stop: Optional[List[str]]) -> List[str]:
+        """
+        Get the tokens of the response to the current step, cut at the first
+        stop sequence.
+        """
+        prompt = self._prompt(messages)
+        if self.default_response is not None \
+                and "Action Input:" not in prompt:
+            text = self.default_response
+        else:
+            step = prompt.rsplit("Question:", 1)[-1].count("Observation:")
+            text = self.responses[min(step, len(self.responses) - 1)]
+        for placeholder, marker in _PLACEHOLDERS.items():
+            if placeholder in text:
+                quoted = prompt.rsplit(marker, 1)[-1] if marker in prompt \
+                    else ""
+                text = text.replace(placeholder,
+                                    quoted.strip().split("\n", 1)[0])
+        for sequence in stop or []:
+            if sequence in text:
+                text = text[:text.index(sequence)]
+        return _TOKEN_PATTERN.findall(text)
+
+    def _delays(self, messages: List[BaseMessage], n_token: int
+                ) -> List[float]:
+        """
+        Get the seconds to wait before every token, with the same jitter for
+        the same prompt.
+        """
+        rng = random.Random(zlib.crc32(
+            self._prompt(messages).encode("utf-8")) + self.seed)
+        delays = [self.first_token_delay] + [self.token_delay] * (n_token - 1)
+        return [max(delay * (1 + self.jitter * rng.uniform(-1, 1)), 0.0)
+                for delay in delays[:n_token]]
+
+    @staticmethod
+    def _prompt(messages: List[BaseMessage]) -> str:
+        """
+        Join the messages into the prompt text.
+        """
+        return "\n".join(str(message.content) for message in messages)
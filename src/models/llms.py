@@ -1,21 +1,43 @@
-from langchain_openai import ChatOpenAI
-from langchain_community.llms import HuggingFaceEndpoint
+from __future__ import annotations
+import json
+from langchain_core.language_models import BaseLanguageModel
+from .cache import LLMCache, LLM_CACHE_PATH, MAX_CACHE_BYTES, \
+    CACHE_TTL_SECONDS
+from .fake_llm import ScriptedChatModel, OFFLINE_REACT_SCRIPT, OFFLINE_ANSWER
 from .model_type import ModelType
-from typing import Union
+from ..shared import SharedInstances
+from typing import List, Optional, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # the backends are imported once their model is selected
+    from langchain_openai import ChatOpenAI
+    from langchain_community.llms import HuggingFaceEndpoint
 
 REGISTRY_MODEL = {
     ModelType.CHATGPTSTANDARD: "gpt-3.5-turbo",
-    ModelType.PHITHREE4k: "microsoft/Phi-3-mini-4k-instruct"
+    ModelType.PHITHREE4k: "microsoft/Phi-3-mini-4k-instruct",
+    ModelType.SCRIPTED_REACT: "scripted-react"
 }
 
 
 class Models:
     """
-    A class to get the LLM.
+    A class to get the LLM. The LLMs are shared: the same type with the same
+    options returns the same client, built once by a single thread even if
+    several ask for it at once.
     """
+    _instances = SharedInstances()
+
     @classmethod
-    def get(cls, model_name: ModelType) -> Union[ChatOpenAI,
-                                                 HuggingFaceEndpoint]:
+    def get(cls,
+            model_name: ModelType,
+            cache: bool = False,
+            cache_path: str = LLM_CACHE_PATH,
+            cache_ttl_seconds: Optional[float] = CACHE_TTL_SECONDS,
+            max_cache_bytes: int = MAX_CACHE_BYTES,
+            shared: bool = True,
+            **kwargs
+            ) -> Union[ChatOpenAI, HuggingFaceEndpoint, ScriptedChatModel]:
         """
         Retrieve the desired LLm.
 
@@ -23,31 +45,164 @@ class Models:
         ----------
         model_name: ModelType
             The name of the LLM.
+        cache: bool, optional
+            If True, the responses are cached on disk, so that the same prompt
+            with the same parameters is only sent once. Defaults to False.
+        cache_path: str, optional
+            The path of the cache. Defaults to
+            'data/llm_cache/responses.sqlite'.
+        cache_ttl_seconds: Optional[float], optional
+            The time to live of the cached responses. Defaults to a week.
+        max_cache_bytes: int, optional
+            The maximum size of the cached responses. Defaults to 256 MiB.
+        shared: bool, optional
+            If True, return the client shared by the callers with the same
+            type and options, else a new one. Defaults to True.
+        **kwargs
+            The options of the scripted model, e.g. token_delay,
+            first_token_delay, jitter or responses.
 
         Returns
         -------
-        Union[ChatOpenAI, HuggingFaceEndpoint]
+        Union[ChatOpenAI, HuggingFaceEndpoint, ScriptedChatModel]
             The desired LLM.
 
         Raises
         ------
         NotImplementedError
             If the desired LLM has not been implemented.
+        TypeError
+            If options are given to an LLM that takes none.
+        """
+        if cache:
+            kwargs.update(cache_path=cache_path,
+                          cache_ttl_seconds=cache_ttl_seconds,
+                          max_cache_bytes=max_cache_bytes)
+        if not shared:
+            return cls._build(model_name, cache, **kwargs)
+        key = model_name, json.dumps({'cache': cache, **kwargs},
+                                     sort_keys=True, default=repr)
+        return cls._instances.get(
+            key, lambda: cls._build(model_name, cache, **kwargs),
+            llm=model_name, options=json.loads(key[1]))
+
+    @classmethod
+    def warm_up(cls,
+                model_name: ModelType,
+                prompt: Optional[str] = None,
+                **kwargs
+                ) -> Union[ChatOpenAI, HuggingFaceEndpoint,
+                           ScriptedChatModel]:
+        """
+        Load the shared LLM and, given a prompt, send it once, e.g. so that
+        a serverless endpoint is loaded before the first request. The LLMs
+        here are remote or scripted, so they have no weights to load.
+
+        Parameters
+        ----------
+        model_name: ModelType
+            The name of the LLM.
+        prompt: Optional[str], optional
+            The dummy prompt, none is sent if not given.
+        **kwargs
+            The arguments of `get`.
+
+        Returns
+        -------
+        Union[ChatOpenAI, HuggingFaceEndpoint, ScriptedChatModel]
+            The desired LLM.
+        """
+        kwargs.pop('shared', None)
+        llm = cls.get(model_name, **kwargs)
+        if prompt is None:
+            return llm
+        seconds = cls._instances.warm_up(llm, lambda: llm.invoke(prompt))
+        print(f"[INFO] Warmed up {model_name} in {seconds:.2f} s")
+        return llm
+
+    @classmethod
+    def release(cls, model_name: Optional[ModelType] = None) -> int:
+        """
+        Release the shared LLMs, so that their memory is freed once no
+        caller holds them.
+
+        Parameters
+        ----------
+        model_name: Optional[ModelType], optional
+            The type of the LLMs, every LLM if not given.
+
+        Returns
+        -------
+        int
+            The number of released LLMs.
+        """
+        keys = cls._instances.release(
+            lambda key: model_name is None or key[0] == model_name)
+        print(f"[INFO] Released {len(keys)} LLMs")
+        return len(keys)
+
+    @classmethod
+    def loaded(cls) -> List[dict]:
+        """
+        List the shared LLMs, least recently loaded first.
+
+        Returns
+        -------
+        List[dict]
+            The type, the options, the bytes of the parameters, None as the
+            LLMs are remote or scripted, the growth of the resident memory of
+            the process while it was loaded and warmed up, the load seconds
+            and the warm-up seconds, if warmed up, of every LLM.
+        """
+        return cls._instances.entries()
+
+    @staticmethod
+    def _build(model_name: ModelType, cache: bool = False,
+               cache_path: str = LLM_CACHE_PATH,
+               cache_ttl_seconds: Optional[float] = CACHE_TTL_SECONDS,
+               max_cache_bytes: int = MAX_CACHE_BYTES,
+               **kwargs) -> BaseLanguageModel:
+        """
+        Build a new LLM.
         """
+        if kwargs and model_name in (ModelType.CHATGPTSTANDARD,
+                                     ModelType.PHITHREE4k):
+            raise TypeError(f"{model_name} takes no options, got "
+                            f"{', '.join(sorted(kwargs))}")
+        llm_cache = callbacks = None
+        if cache and model_name in REGISTRY_MODEL:
+            print(f"[INFO] Caching the responses in {cache_path}")
+            llm_cache = LLMCache(REGISTRY_MODEL[model_name], cache_path,
+                                 cache_ttl_seconds, max_cache_bytes)
+            # the store times the calls of the model
+            callbacks = [llm_cache]
         if model_name == ModelType.CHATGPTSTANDARD:
             print(f"[INFO] Using {ModelType.CHATGPTSTANDARD}")
+            from langchain_openai import ChatOpenAI
             return ChatOpenAI(
                 model_name=REGISTRY_MODEL[model_name],
-                temperature=0
+                temperature=0,
+                cache=llm_cache,
+                callbacks=callbacks
             )
         elif model_name == ModelType.PHITHREE4k:
             print(f"[INFO] Using {ModelType.PHITHREE4k}")
+            from langchain_community.llms import HuggingFaceEndpoint
             endpoint = f"https://api-inference.huggingface.co/models/" \
                        f"{REGISTRY_MODEL[model_name]}"
             return HuggingFaceEndpoint(
                 endpoint_url=endpoint,
                 task="text-generation",
-                temmperature=0.1
+                temmperature=0.1,
+                cache=llm_cache,
+                callbacks=callbacks
             )
+        elif model_name == ModelType.SCRIPTED_REACT:
+            # an offline, deterministic stand-in for load testing
+            print(f"[INFO] Using {ModelType.SCRIPTED_REACT}")
+            kwargs.setdefault('responses', OFFLINE_REACT_SCRIPT)
+            kwargs.setdefault('default_response', OFFLINE_ANSWER)
+            return ScriptedChatModel(cache=llm_cache, callbacks=callbacks,
+                                     **kwargs)
         else:
             raise NotImplementedError("Other LLM have not been implemented.")
@@ -4,4 +4,4 @@ from enum import Enum
 class ModelType(str, Enum):
     CHATGPTSTANDARD = "chat-gpt-3.5"
     PHITHREE4k = "Phi3-4k"
-
+    SCRIPTED_REACT = "scripted-react"
@@ -1 +1,3 @@
 from .prompts import ReactPrompt, RAGPrompt
+from .budget import (BudgetedPromptTemplate, PromptBudget, TokenCounter,
+                     REGISTRY_CONTEXT_WINDOW)
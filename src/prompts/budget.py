@@ -0,0 +1,332 @@
+import re
+from langchain_core.messages import (BaseMessage, SystemMessage,
+                                     get_buffer_string)
+from langchain_core.prompts import PromptTemplate
+from typing import Callable, Dict, List, Optional, Union
+
+# the context window of the models, in tokens
+REGISTRY_CONTEXT_WINDOW = {
+    "gpt-3.5-turbo": 16385,
+    "microsoft/Phi-3-mini-4k-instruct": 4096,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+# the share of the budget of every variable part of the prompts
+DEFAULT_SHARES = {
+    'chat_history': 0.25,
+    'context': 0.45,
+    'agent_scratchpad': 0.30,
+}
+TRUNCATION_MARKER = " [...]"
+_APPROXIMATE_PATTERN = re.compile(r"\s*\w{1,4}|\s*[^\w\s]|\s+")
+_OBSERVATION_PATTERN = re.compile(r"(\nObservation: )(.*?)(?=\nThought: |$)",
+                                  re.DOTALL)
+_STEP_SEPARATOR = "\nThought: "
+_COUNTERS = {}  # model ID -> TokenCounter
+
+
+class _ApproximateEncoding:
+    """
+    An offline stand-in for a tokenizer: pieces of up to four word
+    characters, about the size of the BPE tokens of English text.
+    """
+    @staticmethod
+    def encode(text: str) -> List[str]:
+        return _APPROXIMATE_PATTERN.findall(text)
+
+    @staticmethod
+    def decode(tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+class TokenCounter:
+    """
+    Counts and truncates text in the tokens of a model: with tiktoken for the
+    OpenAI models, with the tokenizer of the model for the HuggingFace ones,
+    and with an approximation if the tokenizer cannot be loaded, e.g.
+    offline.
+    """
+    def __init__(self, model_id: str):
+        """
+        Initialize a new TokenCounter.
+
+        Parameters
+        ----------
+        model_id: str
+            The ID of the model, e.g. "gpt-3.5-turbo".
+        """
+        self.model_id = model_id
+        self.encoding = self._load_encoding(model_id)
+        self.exact = not isinstance(self.encoding, _ApproximateEncoding)
+
+    @classmethod
+    def get(cls, model_id: str) -> "TokenCounter":
+        """
+        Retrieve the shared counter of a model.
+
+        Parameters
+        ----------
+        model_id: str
+            The ID of the model.
+
+        Returns
+        -------
+        TokenCounter
+            The counter.
+        """
+        if model_id not in _COUNTERS:
+            _COUNTERS[model_id] = cls(model_id)
+        return _COUNTERS[model_id]
+
+    def count(self, text: str) -> int:
+        """
+        Count the tokens of a text.
+        """
+        return len(self.encoding.encode(text)) if text else 0
+
+    def truncate(self, text: str, n_token: int, keep_end: bool = False) -> str:
+        """
+        Truncate a text to a number of tokens, the marker included.
+
+        Parameters
+        ----------
+        text: str
+            The text.
+        n_token: int
+            The maximum number of tokens.
+        keep_end: bool, optional
+            If True, the end of the text is kept instead of the start.
+            Defaults to False.
+
+        Returns
+        -------
+        str
+            The text, truncated with a marker if it is too long.
+        """
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= n_token:
+            return text
+        n_kept = n_token - self.count(TRUNCATION_MARKER)
+        if n_kept <= 0:
+            return ""
+        if keep_end:
+            return TRUNCATION_MARKER.lstrip() \
+                + self.encoding.decode(tokens[-n_kept:])
+        return self.encoding.decode(tokens[:n_kept]) + TRUNCATION_MARKER
+
+    @staticmethod
+    def _load_encoding(model_id: str):
+        """
+        Load the tokenizer of a model, or the approximation.
+        """
+        try:
+            if "/" in model_id:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(model_id)
+
+                class _Encoding:
+                    encode = staticmethod(lambda text: tokenizer.encode(
+                        text, add_special_tokens=False))
+                    decode = staticmethod(tokenizer.decode)
+                return _Encoding()
+            import tiktoken
+            return tiktoken.encoding_for_model(model_id)
+        except Exception:  # not installed, unknown model or offline
+            print(f"[INFO] Approximating the tokens of {model_id}")
+            return _ApproximateEncoding()
+
+
+class PromptBudget:
+    """
+    The token budget of the prompts of a model: the context window less the
+    tokens reserved for the output, shared between the variable parts of the
+    prompt once its fixed part is counted.
+    """
+    def __init__(self,
+                 model_id: str,
+                 context_window: Optional[int] = None,
+                 max_output_tokens: int = 512,
+                 shares: Optional[Dict[str, float]] = None):
+        """
+        Initialize a new PromptBudget.
+
+        Parameters
+        ----------
+        model_id: str
+            The ID of the model, e.g. "gpt-3.5-turbo".
+        context_window: Optional[int], optional
+            The context window of the model, in tokens. Defaults to the one
+            of REGISTRY_CONTEXT_WINDOW.
+        max_output_tokens: int, optional
+            The tokens reserved for the output. Defaults to 512.
+        shares: Optional[Dict[str, float]], optional
+            The share of the budget of every variable part: 'chat_history',
+            'context' and 'agent_scratchpad'. Defaults to DEFAULT_SHARES.
+        """
+        self.model_id = model_id
+        self.context_window = context_window or REGISTRY_CONTEXT_WINDOW.get(
+            model_id, DEFAULT_CONTEXT_WINDOW)
+        self.max_output_tokens = max_output_tokens
+        self.shares = dict(shares or DEFAULT_SHARES)
+        self.counter = TokenCounter.get(model_id)
+
+    def allocate(self, available: int,
+                 demands: Dict[str, int]) -> Dict[str, int]:
+        """
+        Share the available tokens between parts by their shares; the tokens
+        a part does not need go to the others.
+
+        Parameters
+        ----------
+        available: int
+            The available tokens.
+        demands: Dict[str, int]
+            The tokens of every part before truncation.
+
+        Returns
+        -------
+        Dict[str, int]
+            The budget of every part.
+        """
+        budgets = {part: 0 for part in demands}
+        remaining = max(available, 0)
+        open_parts = [part for part, demand in demands.items() if demand > 0]
+        while open_parts and remaining > 0:
+            total_share = sum(self.shares.get(part, 0.0) or 1e-9
+                              for part in open_parts)
+            offers = {part: int(remaining * (self.shares.get(part, 0.0)
+                                             or 1e-9) / total_share)
+                      for part in open_parts}
+            satisfied = [part for part in open_parts
+                         if demands[part] - budgets[part] <= offers[part]]
+            if not satisfied:
+                for part in open_parts:
+                    budgets[part] += offers[part]
+                break
+            for part in satisfied:
+                remaining -= demands[part] - budgets[part]
+                budgets[part] = demands[part]
+                open_parts.remove(part)
+        return budgets
+
+
+class BudgetedPromptTemplate(PromptTemplate):
+    """
+    A prompt template fitting the prompt in the token budget of the model.
+    The fixed part of the prompt is counted first, then the chat history, the
+    retrieved context and the agent scratchpad share the remaining tokens and
+    are truncated deterministically:
+    - the chat history keeps its most recent messages,
+    - the context keeps its first, best ranked, documents,
+    - the scratchpad shortens its oldest observations first.
+    The token usage of every formatted prompt is reported.
+    """
+    budget: PromptBudget
+    # called with the token usage of every formatted prompt
+    on_usage: Optional[Callable[[dict], None]] = None
+    last_usage: Optional[dict] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def format(self, **kwargs) -> str:
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        counter = self.budget.counter
+        parts = {part: kwargs[part] for part in self.budget.shares
+                 if part in kwargs}
+        texts = {part: self._render(value) for part, value in parts.items()}
+        fixed = super().format(**{**kwargs, **{part: "" for part in parts}})
+        available = self.budget.context_window \
+            - self.budget.max_output_tokens - counter.count(fixed)
+        demands = {part: counter.count(text) for part, text in texts.items()}
+        budgets = self.budget.allocate(available, demands)
+
+        fitted = {}
+        for part, value in parts.items():
+            if demands[part] <= budgets[part]:
+                fitted[part] = texts[part]
+            elif part == 'chat_history':
+                fitted[part] = self._fit_history(value, budgets[part])
+            elif part == 'agent_scratchpad':
+                fitted[part] = self._fit_scratchpad(texts[part], budgets[part])
+            else:
+                fitted[part] = counter.truncate(texts[part], budgets[part])
+        prompt = super().format(**{**kwargs, **fitted})
+
+        usage = {'model': self.budget.model_id,
+                 'exact': counter.exact,
+                 'context_window': self.budget.context_window,
+                 'fixed': counter.count(fixed),
+                 'total': counter.count(prompt)}
+        for part in parts:
+            usage[part] = {'tokens': counter.count(fitted[part]),
+                           'budget': budgets[part],
+                           'truncated': fitted[part] != texts[part]}
+        self.last_usage = usage
+        if self.on_usage is not None:
+            self.on_usage(usage)
+        return prompt
+
+    def _fit_history(self, history: Union[str, List[BaseMessage]],
+                     n_token: int) -> str:
+        """
+        Keep the most recent messages of the chat history that fit, and the
+        summary of the older turns first if there is one.
+        """
+        counter = self.budget.counter
+        if isinstance(history, str):
+            return counter.truncate(history, n_token, keep_end=True)
+        summary = ""
+        if history and isinstance(history[0], SystemMessage):
+            summary = counter.truncate(get_buffer_string(history[:1]),
+                                       n_token)
+            n_token -= counter.count(summary) + 1
+            history = history[1:]
+        kept = []
+        for message in reversed(history):
+            text = get_buffer_string([message])
+            n_message = counter.count(text) + 1  # the line break
+            if n_message > n_token:
+                break
+            kept.insert(0, text)
+            n_token -= n_message
+        return "\n".join(([summary] if summary else []) + kept)
+
+    def _fit_scratchpad(self, scratchpad: str, n_token: int) -> str:
+        """
+        Shorten the observations of the scratchpad, the oldest first, keeping
+        the thoughts and actions of every step.
+        """
+        counter = self.budget.counter
+        observations = [match.span(2)
+                        for match in _OBSERVATION_PATTERN.finditer(scratchpad)]
+        excess = counter.count(scratchpad) - n_token
+        shortened = {}
+        for start, end in observations:
+            if excess <= 0:
+                break
+            n_observation = counter.count(scratchpad[start:end])
+            keep = max(n_observation - excess, 0)
+            shortened[start] = counter.truncate(scratchpad[start:end], keep)
+            excess -= n_observation - counter.count(shortened[start])
+        pieces, position = [], 0
+        for start, end in observations:
+            if start in shortened:
+                pieces += [scratchpad[position:start], shortened[start]]
+                position = end
+        scratchpad = "".join(pieces) + scratchpad[position:]
+        # the last resort: the latest steps only
+        steps = scratchpad.split(_STEP_SEPARATOR)
+        while len(steps) > 1 and counter.count(
+                _STEP_SEPARATOR.join(steps)) > n_token:
+            steps.pop(0)
+        return counter.truncate(_STEP_SEPARATOR.join(steps), n_token,
+                                keep_end=True)
+
+    @staticmethod
+    def _render(value) -> str:
+        """
+        Render a variable part as text.
+        """
+        if isinstance(value, list):
+            return get_buffer_string(value)
+        return str(value)
@@ -1,5 +1,7 @@
 from langchain_core.prompts import PromptTemplate
 from abc import abstractmethod
+from .budget import BudgetedPromptTemplate, PromptBudget
+from typing import Callable, Optional
 
 
 class BasePrompt:
@@ -30,10 +32,22 @@ class BasePrompt:
         return self.final_template
 
     @abstractmethod
-    def get(self) -> PromptTemplate:
+    def get(self,
+            budget: Optional[PromptBudget] = None,
+            on_usage: Optional[Callable[[dict], None]] = None
+            ) -> PromptTemplate:
         """
         Retrieve the prompt template.
 
+        Parameters
+        ----------
+        budget: Optional[PromptBudget], optional
+            The token budget of the model. If given, the chat history, the
+            context and the agent scratchpad are truncated to fit in it.
+            Defaults to None.
+        on_usage: Optional[Callable[[dict], None]], optional
+            Called with the token usage of every prompt, with a budget only.
+
         Returns
         -------
         PromptTemplate
@@ -41,6 +55,21 @@ class BasePrompt:
         """
         pass
 
+    def _template(self, input_variables: list,
+                  budget: Optional[PromptBudget],
+                  on_usage: Optional[Callable[[dict], None]]
+                  ) -> PromptTemplate:
+        """
+        Create the prompt template, budgeted if a budget is given.
+        """
+        if budget is None:
+            return PromptTemplate(input_variables=input_variables,
+                                  template=self.final_template)
+        return BudgetedPromptTemplate(input_variables=input_variables,
+                                      template=self.final_template,
+                                      budget=budget,
+                                      on_usage=on_usage)
+
 
 class ReactPrompt(BasePrompt):
     def __init__(self, conversation_history: bool):
@@ -89,7 +118,10 @@ class ReactPrompt(BasePrompt):
             self.final_template = self.head_template + self.body_template + \
                                   self.end_template
 
-    def get(self) -> PromptTemplate:
+    def get(self,
+            budget: Optional[PromptBudget] = None,
+            on_usage: Optional[Callable[[dict], None]] = None
+            ) -> PromptTemplate:
         input_variables = ['agent_scratchpad',
                            'input',
                            'chat_history',
@@ -97,18 +129,23 @@ class ReactPrompt(BasePrompt):
                            'tools']
         if self.conversation_history:
             input_variables.append('chat_history')
-        return PromptTemplate(
-            input_variables=input_variables,
-            template=self.final_template
-        )
+        return self._template(input_variables, budget, on_usage)
 
 
 class RAGPrompt(BasePrompt):
-    def __init__(self):
+    def __init__(self, conversation_history: bool = False):
         """
         Initialize the prompt for RAG only purpose.
+
+        Parameters
+        ----------
+        conversation_history: bool, optional
+            If True, the prompt template will add chat history as context, so
+            that the follow-up questions are answered in the conversation.
+            Defaults to False.
         """
         super().__init__()
+        self.conversation_history = conversation_history
         self.body_template = """
         Use the following pieces of retrieved context to answer the question.
         If you don't know the answer, just say you don't know.
@@ -118,11 +155,18 @@ class RAGPrompt(BasePrompt):
         Context: {context}
         Answer:
         """
-        self.final_template = self.head_template + self.body_template
+        if self.conversation_history:
+            self.final_template = self.head_template + \
+                                  self.chat_history_template + \
+                                  self.body_template
+        else:
+            self.final_template = self.head_template + self.body_template
 
-    def get(self) -> PromptTemplate:
+    def get(self,
+            budget: Optional[PromptBudget] = None,
+            on_usage: Optional[Callable[[dict], None]] = None
+            ) -> PromptTemplate:
         input_variables = ['input', 'context']
-        return PromptTemplate(
-            input_variables=input_variables,
-            template=self.final_template
-        )
+        if self.conversation_history:
+            input_variables.append('chat_history')
+        return self._template(input_variables, budget, on_usage)
@@ -0,0 +1,2 @@
+from .instances import SharedInstances, parameter_bytes, rss_bytes
+from .lazy import lazy_exports
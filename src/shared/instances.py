@@ -0,0 +1,177 @@
+import gc, os, time, threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+
+def rss_bytes() -> int:
+    """
+    Get the resident memory of the process.
+
+    Returns
+    -------
+    int
+        The resident memory in bytes, or 0 if it is unknown on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def parameter_bytes(model: Any) -> Optional[int]:
+    """
+    Get the memory of the weights of a local model.
+
+    Parameters
+    ----------
+    model: Any
+        The model, e.g. a sentence-transformer embedding model, whose client
+        is a torch module.
+
+    Returns
+    -------
+    Optional[int]
+        The bytes of the parameters of its torch module, None if it has
+        none, e.g. a remote model.
+    """
+    parameters = getattr(getattr(model, 'client', None), 'parameters', None)
+    if not callable(parameters):
+        return None
+    try:
+        return sum(parameter.numel() * parameter.element_size()
+                   for parameter in parameters())
+    except (AttributeError, TypeError):
+        return None
+
+
+class SharedInstances:
+    """
+    The instances shared by the callers asking for the same key, e.g. the
+    models of a type with the same options. An instance is built once, by a
+    single thread even if several ask for it at once, and held until it is
+    released. Its memory is reported as the bytes of its parameters, for a
+    local model, and as the growth of the resident memory of the process
+    while it was built and warmed up, which the other threads may inflate.
+    """
+    def __init__(self):
+        """
+        Initialize a new SharedInstances.
+        """
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        # key -> the instance, its description and its load stats, least
+        # recently built first
+        self._entries = OrderedDict()
+
+    def get(self, key: Tuple[Hashable, ...], build_fn: Callable[[], Any],
+            **description) -> Any:
+        """
+        Retrieve an instance, building it the first time.
+
+        Parameters
+        ----------
+        key: Tuple[Hashable, ...]
+            The key of the instance, e.g. its type and its options.
+        build_fn: Callable[[], Any]
+            Builds the instance.
+        **description
+            The fields of its entry besides the stats, e.g. its type and its
+            options.
+
+        Returns
+        -------
+        Any
+            The instance.
+        """
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]['instance']
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._entries:  # built by another thread
+                    return self._entries[key]['instance']
+            try:
+                start, start_rss = time.perf_counter(), rss_bytes()
+                instance = build_fn()
+                entry = {'instance': instance,
+                         **description,
+                         'parameter_bytes': parameter_bytes(instance),
+                         'rss_growth_bytes': max(rss_bytes() - start_rss, 0),
+                         'load_seconds': time.perf_counter() - start,
+                         'warm_up_seconds': None}
+                with self._lock:
+                    self._entries[key] = entry
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+        return instance
+
+    def warm_up(self, instance: Any, warm_up_fn: Callable[[], Any]) -> float:
+        """
+        Run a dummy call of a shared instance, recording its duration and the
+        memory it allocated lazily.
+
+        Parameters
+        ----------
+        instance: Any
+            The shared instance.
+        warm_up_fn: Callable[[], Any]
+            Runs the dummy call.
+
+        Returns
+        -------
+        float
+            The seconds of the call.
+        """
+        start, start_rss = time.perf_counter(), rss_bytes()
+        warm_up_fn()
+        seconds = time.perf_counter() - start
+        n_byte = max(rss_bytes() - start_rss, 0)
+        with self._lock:
+            for entry in self._entries.values():
+                if entry['instance'] is instance:
+                    entry['warm_up_seconds'] = seconds
+                    entry['rss_growth_bytes'] += n_byte
+        return seconds
+
+    def release(self, match: Callable[[Tuple[Hashable, ...]], bool]
+                ) -> List[Tuple[Hashable, ...]]:
+        """
+        Release the matching instances, so that their memory is freed once
+        no caller holds them.
+
+        Parameters
+        ----------
+        match: Callable[[Tuple[Hashable, ...]], bool]
+            Whether to release the instance of a key.
+
+        Returns
+        -------
+        List[Tuple[Hashable, ...]]
+            The keys of the released instances.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if match(key)]
+            for key in keys:
+                del self._entries[key]
+        gc.collect()
+        return keys
+
+    def entries(self) -> List[dict]:
+        """
+        List the shared instances, least recently built first.
+
+        Returns
+        -------
+        List[dict]
+            The description of every instance, with the bytes of its
+            parameters, None if it has none, the growth of the resident
+            memory while it was built and warmed up, its load seconds and its
+            warm-up seconds, if warmed up.
+        """
+        with self._lock:
+            return [{name: value for name, value in entry.items()
+                     if name != 'instance'}
+                    for entry in self._entries.values()]
@@ -0,0 +1,43 @@
+import sys, importlib
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+
+def lazy_exports(package: str, lazy_imports: Dict[str, str],
+                 eager: Sequence[str] = ()
+                 ) -> Tuple[Callable[[str], Any], Callable[[], List[str]],
+                            List[str]]:
+    """
+    Export the contents of a package lazily: each name is imported from its
+    module on first use, with its backends, so that importing the package
+    stays cheap.
+
+    Parameters
+    ----------
+    package: str
+        The name of the package, i.e. its `__name__`.
+    lazy_imports: Dict[str, str]
+        The module, relative to the package, of every lazy name.
+    eager: Sequence[str], optional
+        The names the package imports itself, e.g. its enums.
+
+    Returns
+    -------
+    Tuple[Callable[[str], Any], Callable[[], List[str]], List[str]]
+        The `__getattr__`, `__dir__` and `__all__` of the package.
+    """
+    exports = [*eager, *lazy_imports]
+
+    def __getattr__(name: str) -> Any:
+        if name not in lazy_imports:
+            raise AttributeError(f"module {package!r} has no attribute "
+                                 f"{name!r}")
+        value = getattr(importlib.import_module(lazy_imports[name], package),
+                        name)
+        # the next lookups skip __getattr__
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__() -> List[str]:
+        return sorted(exports)
+
+    return __getattr__, __dir__, exports
@@ -0,0 +1,18 @@
+"""
+Serve the chatbot, from the src directory:
+
+    streamlit run streamlit_app.py
+
+The packages import each other relatively, so the app is imported from the
+src package rather than run as a script.
+"""
+import os, sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from src.vector_database.app import main
+
+if __name__ == "__main__":
+    main()
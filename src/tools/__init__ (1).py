@@ -1,3 +0,0 @@
-from .tools import RetrieverTool, OnlineSearchTool
-from .tool_type import ToolType
-
@@ -0,0 +1,13 @@
+from ..shared import lazy_exports
+from .tool_type import ToolType
+
+# the tools are imported on first use, with their backends, so that
+# importing the package for the tool types stays cheap
+_LAZY_IMPORTS = {
+    'RetrieverTool': '.tools',
+    'OnlineSearchTool': '.tools',
+    'OfflineSearchTool': '.tools',
+    'NearbyHotelsTool': '.tools'
+}
+__getattr__, __dir__, __all__ = lazy_exports(
+    __name__, _LAZY_IMPORTS, ['ToolType'])
@@ -4,3 +4,4 @@ from enum import Enum
 class ToolType(str, Enum):
     RETRIEVER = "retriever-tool"
     ONLINE_SEARCH = "online-search-tool"
+    NEARBY_HOTELS = "nearby-hotels-tool"
@@ -1,8 +1,14 @@
-from langchain.tools.retriever import create_retriever_tool
-from langchain_community.utilities import SerpAPIWrapper
-from langchain.agents import Tool
-from langchain_core.vectorstores import VectorStoreRetriever
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.tools import Tool, create_retriever_tool
 from abc import abstractmethod
+from typing import Dict, Optional
+import re, time, zlib, random
+
+_RADIUS_PATTERN = re.compile(
+    r"(?:within|in|under|less than)?\s*(\d+(?:\.\d+)?)\s*"
+    r"(km|kilometers?|kilometres?|miles?|mi|m|meters?|metres?)\b",
+    re.IGNORECASE)
+_KM_PER_UNIT = {'k': 1.0, 'mi': 1.609344, 'm': 0.001}
 
 
 class Tools:
@@ -28,14 +34,15 @@ class RetrieverTool(Tool):
     The class to create retriever tool.
     """
     @classmethod
-    def get(cls, retriever: VectorStoreRetriever) -> Tool:
+    def get(cls, retriever: BaseRetriever) -> Tool:
         """
         Retrieve the retriever tool
 
         Parameters
         ----------
-        retriever: VectorStoreRetriever
-            The retriever of the vector store.
+        retriever: BaseRetriever
+            The retriever of the vector store, or the hybrid retriever of a
+            vector database.
         """
         print(f"[INFO] Using Retriever Tool")
         return create_retriever_tool(
@@ -52,9 +59,116 @@ class OnlineSearchTool(Tool):
     @classmethod
     def get(cls) -> Tool:
         print(f"[INFO] Using Online Search Tool")
+        # SerpAPI is only imported when the online search is used
+        from langchain_community.utilities import SerpAPIWrapper
         search = SerpAPIWrapper()
         return Tool(
             name="online-search-tool",
             description="Online search to answer questions",
             func=search.run
         )
+
+
+class OfflineSearchTool(Tool):
+    """
+    The class to create an offline, deterministic stand-in for the online
+    search tool, under the same name, for load testing without SerpAPI.
+    """
+    @classmethod
+    def get(cls,
+            results: Optional[Dict[str, str]] = None,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            seed: int = 0) -> Tool:
+        """
+        Retrieve the offline search tool.
+
+        Parameters
+        ----------
+        results: Optional[Dict[str, str]], optional
+            The result of the queries holding every key, case insensitive.
+            The other queries find no result.
+        latency: float, optional
+            The seconds of a search. Defaults to 0.
+        jitter: float, optional
+            The variation of the latency, as a fraction, the same for the
+            same query. Defaults to 0.
+        seed: int, optional
+            The seed of the jitter. Defaults to 0.
+        """
+        print(f"[INFO] Using Offline Search Tool")
+        results = {key.lower(): result
+                   for key, result in (results or {}).items()}
+
+        def search(query: str) -> str:
+            if latency > 0:
+                rng = random.Random(zlib.crc32(query.encode("utf-8")) + seed)
+                time.sleep(max(latency * (1 + jitter * rng.uniform(-1, 1)),
+                               0.0))
+            for key, result in results.items():
+                if key in query.lower():
+                    return result
+            # the answer of SerpAPI without result
+            return "No good search result found"
+
+        return Tool(
+            name="online-search-tool",
+            description="Online search to answer questions",
+            func=search
+        )
+
+
+class NearbyHotelsTool(Tool):
+    """
+    The class to create the tool to find the hotels near a place, answered
+    from the coordinates of the hotels instead of the documents.
+    """
+    @classmethod
+    def get(cls, spatial_index, k: int = 5) -> Tool:
+        """
+        Retrieve the nearby hotels tool.
+
+        Parameters
+        ----------
+        spatial_index: SpatialIndex
+            The spatial index of a vector database, resolving the places and
+            answering the radius and k-nearest queries.
+        k: int, optional
+            The maximum number of hotels given. Defaults to 5.
+        """
+        print(f"[INFO] Using Nearby Hotels Tool")
+
+        def find_nearby_hotels(query: str) -> str:
+            radius_km = None
+            match = _RADIUS_PATTERN.search(query)
+            if match:
+                unit = match.group(2).lower()
+                radius_km = float(match.group(1)) * _KM_PER_UNIT[
+                    'mi' if unit.startswith('mi') else unit[0]]
+                query = query[:match.start()] + query[match.end():]
+            place = spatial_index.locate(query)
+            if place is None:
+                return f"Cannot find the place: {query.strip()}"
+            name, lat, lng = place
+            if radius_km is None:
+                hotels = spatial_index.nearest(lat, lng, k)
+            else:
+                hotels = spatial_index.within(lat, lng, radius_km)[:k]
+            if not hotels and radius_km is None:
+                return f"No hotel near {name}"
+            if not hotels:
+                return f"No hotel within {radius_km:g} km of {name}"
+            return "\n".join(
+                [f"Hotels nearest to {name}:"]
+                + [f"{hotel['Hotel_Name']} ({hotel.get('City', '')}, "
+                   f"score {hotel.get('Average_Score', 'unknown')}): "
+                   f"{distance:.2f} km" for hotel, distance in hotels])
+
+        return Tool(
+            name="nearby-hotels-tool",
+            description="Find the hotels nearest to a place, such as a "
+                        "landmark, a postal code, a city or a hotel name. "
+                        "The input is the place, optionally with a radius, "
+                        "e.g. 'Big Ben within 1 km'",
+            func=find_nearby_hotels
+        )
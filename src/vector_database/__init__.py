@@ -1 +1,23 @@
-from .vector_database import ChromaDB, FaissDB
+from ..shared import lazy_exports
+from .index_type import FaissIndexType, QuantizationType
+
+# the databases and the indexes are imported on first use, with their
+# backends, so that importing the package for the index types stays cheap
+_LAZY_IMPORTS = {
+    'ChromaDB': '.vector_database',
+    'FaissDB': '.vector_database',
+    'NumpyDB': '.vector_database',
+    'IndexBuilder': '.index_builder',
+    'NumpyVectorStore': '.numpy_store',
+    'BM25Index': '.bm25',
+    'MetadataIndex': '.metadata_index',
+    'CachedRetriever': '.retrievers',
+    'FilteredRetriever': '.retrievers',
+    'HybridRetriever': '.retrievers',
+    'QueryCache': '.query_cache',
+    'SpatialIndex': '.spatial_index',
+    'ResourcePool': '.resource_pool',
+    'RESOURCE_POOL': '.resource_pool'
+}
+__getattr__, __dir__, __all__ = lazy_exports(
+    __name__, _LAZY_IMPORTS, ['FaissIndexType', 'QuantizationType'])
@@ -1,97 +1,233 @@
-from data_preparation import CSVData
-from models import Models, ModelType
-from embeddings import Embeddings, EmbeddingType
-from vector_databases import ChromaDB
-from tools import RetrieverTool, OnlineSearchTool, ToolType
-from prompts import ReactPrompt
-from agents import Agents
+from ..data_preparation import CSVData, REGISTRY_ADDRESS_PARSER
+from ..models import Models, ModelType, REGISTRY_MODEL as MODEL_IDS
+from ..embeddings import Embeddings, EmbeddingType
+from .vector_database import ChromaDB, FaissDB, NumpyDB
+from .query_cache import QueryCache
+from .resource_pool import RESOURCE_POOL
+from ..tools import (RetrieverTool, OnlineSearchTool, OfflineSearchTool,
+                     NearbyHotelsTool, ToolType)
+from ..prompts import ReactPrompt, RAGPrompt, PromptBudget
+from ..agent import (Agents, AgentRunner, HistoryPolicy,
+                     MetricsCallbackHandler, QuestionRouter, SessionStore,
+                     SESSION_STORE_PATH, METRICS_DIR)
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain.memory import ChatMessageHistory
 
-import os
+import os, asyncio
 from dotenv import load_dotenv
-import streamlit as st
 
 ENV_DIR = os.path.join(os.path.dirname(os.getcwd()), ".env")
 load_dotenv(ENV_DIR)
 
 
-def run(model_name, embedding_name, country="United Kingdom",
-        online_search=False):
-    CSVData("Hotel_Reviews").create_processed_data(country)
-    llm = Models.get(model_name=model_name)
-    embedding_model = Embeddings.get(embedding_name=embedding_name)
-
-    vector_db = ChromaDB.get(
-        embedding_model=embedding_model,
-        country=country)
-    retriever = vector_db.as_retriever(search_kwargs={'k': 3})
-    tools = [RetrieverTool.get(retriever)]
-    if online_search:
-        tools.append(OnlineSearchTool.get())
-
-    # use default setting: react prompt
-    prompt = ReactPrompt(conversation_history=True).get()
+def build_agent(model_name, embedding_name, country="United Kingdom",
+                online_search=False, vector_database=ChromaDB, cache=True):
+    """
+    Get the agent from the shared pool. The agent and every component it is
+    built from are built once per process, so the reruns of the script and
+    the other sessions reuse them. The offline model searches offline.
+    """
+    return RESOURCE_POOL.get(
+        ("agent", model_name, embedding_name, country, online_search,
+         vector_database.__name__, cache),
+        lambda: _build_agent(model_name, embedding_name, country,
+                             online_search, vector_database, cache))
+
+
+def _build_agent(model_name, embedding_name, country, online_search,
+                 vector_database, cache):
+    dirty_hotel_ids = RESOURCE_POOL.get(
+        ("processed-data", country),
+        lambda: CSVData("Hotel_Reviews").create_processed_data(country))
+    llm = RESOURCE_POOL.get(
+        ("llm", model_name, cache),
+        lambda: Models.get(model_name=model_name, cache=cache))
+    # the weights are loaded and run once before the first question
+    embedding_model = RESOURCE_POOL.get(
+        ("embedding", embedding_name, cache),
+        lambda: Embeddings.warm_up(embedding_name=embedding_name,
+                                   cache=cache))
+    print(f"[INFO] Loaded models: {Models.loaded() + Embeddings.loaded()}")
+
+    def build_retriever():
+        # only re-embed the hotels whose reviews changed
+        vector_database.update(embedding_model=embedding_model,
+                               country=country,
+                               hotel_ids=dirty_hotel_ids)
+        # the cities, postal codes and scores named in the question filter
+        # the hotels, then vector search fused with BM25 matches names
+        # exactly; repeated and near-duplicate questions skip the search
+        return vector_database.get_filtered_retriever(
+            embedding_model=embedding_model,
+            country=country,
+            k=3,
+            query_cache=QueryCache(similarity_threshold=0.95))
+
+    retriever = RESOURCE_POOL.get(
+        ("retriever", embedding_name, cache, country,
+         vector_database.__name__),
+        build_retriever)
+
+    def build_tools():
+        # proximity questions are answered from the hotel coordinates
+        tools = [RetrieverTool.get(retriever),
+                 NearbyHotelsTool.get(
+                     vector_database.get_spatial_index(country))]
+        if online_search and model_name == ModelType.SCRIPTED_REACT:
+            tools.append(OfflineSearchTool.get())
+        elif online_search:
+            tools.append(OnlineSearchTool.get())
+        return tools
+
+    tools = RESOURCE_POOL.get(
+        ("tools", model_name, embedding_name, cache, country, online_search,
+         vector_database.__name__), build_tools)
+
+    # use default setting: react prompt, fitted in the context window of
+    # the model
+    budget = PromptBudget(MODEL_IDS[model_name])
+    prompt = ReactPrompt(conversation_history=True).get(
+        budget=budget,
+        on_usage=lambda usage: print(f"[INFO] Prompt tokens: {usage}"))
     agent = Agents.get(llm=llm,
                        tools=tools,
                        prompt=prompt,
                        react=True,
                        verbose=True)
-    # use default setting: chat memory
-    store = {}
-
-    def get_session_history(session_id: str):
-        if session_id not in store:
-            store[session_id] = ChatMessageHistory()
-        return store[session_id]
+    # the last turns of every session and a rolling summary of the older
+    # ones, saved across restarts, shared by the agents of the model
+    store = RESOURCE_POOL.get(
+        ("session-store", model_name, cache, SESSION_STORE_PATH),
+        lambda: SessionStore(policy=HistoryPolicy.SUMMARY,
+                             k=3,
+                             llm=llm,
+                             path=SESSION_STORE_PATH))
 
     # TODO: fix "treating as root run..'
     agent_executor = RunnableWithMessageHistory(
         agent,
-        get_session_history,
+        store.get_session_history,
         input_messages_key='input',
         history_messages_key='chat_history'
     )
+    # runs the sessions concurrently, streaming the answers; the questions
+    # the retrieved reviews answer well skip the agent for one LLM call.
+    # The spans of every request are recorded by the shared handler
+    metrics = RESOURCE_POOL.get(("metrics",), MetricsCallbackHandler)
+    return QuestionRouter(
+        AgentRunner(agent_executor, metrics=metrics),
+        llm=llm,
+        prompt=RAGPrompt(conversation_history=True).get(budget=budget),
+        retriever=retriever,
+        embedding_model=embedding_model,
+        agent_question="Use the 'retriever_tool' first to answer: "
+                       "{question}. If cannot get the answer, use other tool")
+
+
+def run(model_name, embedding_name, country="United Kingdom",
+        online_search=False, vector_database=ChromaDB):
+    # the UI is only imported to serve the app, not to build the agent
+    import streamlit as st
+    if st.sidebar.button("Reload data"):
+        # rebuild the components of the country from the new reviews
+        RESOURCE_POOL.invalidate(country)
+    runner = build_agent(model_name, embedding_name, country, online_search,
+                         vector_database)
 
     st.text("------------- Chatting -------------")
     question = st.text_input("Your question: ")
-    full_question = f"Use the 'retriever_tool' first to answer: {question}. " \
-                    f"If cannot get the answer, use other tool"
     submit = st.button("Ask!")
 
     # only response when all components are ready
-    if agent_executor and full_question:
+    if runner and question:
         print(f"[INFO] Agent is ready!")
         if submit:
-            print(f"[INFO] Question: {full_question}")
-            response = agent_executor.invoke(
-                {"input": full_question},
-                config={"configurable": {"session_id": "test-session"}},
-                    )
-            st.text(response['output'])
-
-
-if __name__ == "__main__":
+            print(f"[INFO] Question: {question}")
+            # every browser session has its own history
+            if "session_id" not in st.session_state:
+                st.session_state.session_id = AgentRunner.new_session_id()
+            trace_id = MetricsCallbackHandler.new_trace_id()
+            asyncio.run(stream_answer(runner, question,
+                                      st.session_state.session_id, trace_id))
+            print(f"[INFO] Routes: {runner.stats()}")
+            metrics = runner.runner.metrics
+            print(f"[INFO] Latency of {trace_id}: "
+                  f"{metrics.breakdown(trace_id)}")
+            metrics.write_prometheus(os.path.join(METRICS_DIR,
+                                                  "staychat.prom"))
+            metrics.write_jsonl(os.path.join(METRICS_DIR, "spans.jsonl"))
+
+
+async def stream_answer(runner, question, session_id, trace_id=None):
+    """
+    Show the thoughts and the tool calls of the agent, then its answer, as
+    they are streamed. The questions answered on the fast path have no
+    thoughts.
+    """
+    import streamlit as st
+    steps = st.expander("Thinking...")
+    thought = steps.empty()
+    answer = st.empty()
+    thought_text, answer_text = "", ""
+    async for event in runner.astream(question, session_id, trace_id):
+        if event['type'] == 'route':
+            steps.text(f"Route: {event['content']} (confidence "
+                       f"{event['confidence']:.2f})")
+        elif event['type'] == 'thought':
+            thought_text += event['content']
+            thought.text(thought_text)
+        elif event['type'] in ('action', 'observation'):
+            steps.text(f"{event['type'].title()} ({event['tool']}): "
+                       f"{event['content']}")
+            thought_text = ""
+            thought = steps.empty()
+        elif event['type'] == 'token':
+            answer_text += event['content']
+            answer.text(answer_text)
+        elif event['type'] == 'final':
+            answer.text(event['content'])
+
+
+def main():
+    """
+    Serve the chatbot. The app is imported from the src package, see
+    src/streamlit_app.py.
+    """
+    import streamlit as st
     st.title("StayChat: A Hotel Recommendation Chatbot")
 
     # User input parameters
-    model_options = ["ChatGPT 3.5", "Phi3 4K"]
+    model_options = ["ChatGPT 3.5", "Phi3 4K", "Scripted (offline)"]
     REGISTRY_MODEL = {
         model_options[0]: ModelType.CHATGPTSTANDARD,
-        model_options[1]: ModelType.PHITHREE4k
+        model_options[1]: ModelType.PHITHREE4k,
+        model_options[2]: ModelType.SCRIPTED_REACT
     }
     selected_model = st.selectbox("Select model: ", model_options)
     selected_model = REGISTRY_MODEL[selected_model]
 
-    embedding_options = ["Sentence Transformer", "OpenAI Embedding Small"]
+    embedding_options = ["Sentence Transformer", "OpenAI Embedding Small",
+                         "Hashing (offline)"]
     REGISTRY_EMBEDDING = {
         embedding_options[0]: EmbeddingType.SENTENCE_TRANSFORMER,
-        embedding_options[1]: EmbeddingType.OPENAI_EMBEDDING_SMALL
+        embedding_options[1]: EmbeddingType.OPENAI_EMBEDDING_SMALL,
+        embedding_options[2]: EmbeddingType.HASHING
     }
     selected_embedding = st.selectbox("Select embedding: ", embedding_options)
     selected_embedding = REGISTRY_EMBEDDING[selected_embedding]
 
-    selected_country = st.selectbox("Select country: ", ["United Kingdom"])
+    selected_country = st.selectbox("Select country: ",
+                                    list(REGISTRY_ADDRESS_PARSER))
+
+    vector_database_options = ["Chroma", "FAISS", "NumPy"]
+    REGISTRY_VECTOR_DATABASE = {
+        vector_database_options[0]: ChromaDB,
+        vector_database_options[1]: FaissDB,
+        vector_database_options[2]: NumpyDB
+    }
+    selected_vector_database = st.selectbox("Select vector database: ",
+                                            vector_database_options)
+    selected_vector_database = REGISTRY_VECTOR_DATABASE[
+        selected_vector_database]
 
     REGISTRY_SEARCH = {"No": False, "Yes": True}
     use_online_search = st.selectbox("Use online search? ", ["No", "Yes"])
@@ -99,5 +235,7 @@ if __name__ == "__main__":
 
     run(model_name=selected_model,
         embedding_name=selected_embedding,
-        online_search=use_online_search)
+        country=selected_country,
+        online_search=use_online_search,
+        vector_database=selected_vector_database)
 
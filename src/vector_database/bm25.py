@@ -0,0 +1,216 @@
+import os, re, json, shutil
+import numpy as np
+from collections import Counter
+from langchain_core.documents import Document
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase word tokens, so that hotel names, postal codes
+    and districts are matched exactly.
+
+    Parameters
+    ----------
+    text: str
+        The text.
+
+    Returns
+    -------
+    List[str]
+        The tokens.
+    """
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    A lexical inverted index scored with BM25. The posting list of every term
+    holds the documents containing it with their precomputed BM25 weight, so a
+    query only reads the postings of its terms instead of scanning the corpus.
+    """
+    INDEX_FILE_NAME = "bm25.npz"
+    VOCABULARY_FILE_NAME = "vocabulary.json"
+    DOCSTORE_FILE_NAME = "docstore.json"
+
+    def __init__(self,
+                 vocabulary: Dict[str, int],
+                 offsets: np.ndarray,
+                 postings: np.ndarray,
+                 weights: np.ndarray,
+                 documents: List[Document]):
+        """
+        Initialize a new BM25Index.
+
+        Parameters
+        ----------
+        vocabulary: Dict[str, int]
+            The index of every term.
+        offsets: np.ndarray
+            The start of the posting list of every term, and the end of the
+            last one, of shape (n_term + 1,).
+        postings: np.ndarray
+            The documents of all the posting lists.
+        weights: np.ndarray
+            The BM25 weight of the term in every posting.
+        documents: List[Document]
+            The documents.
+        """
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.postings = postings
+        self.weights = weights
+        self.documents = documents
+        self._position_of_id = None
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], k1: float = 1.2,
+                       b: float = 0.75) -> "BM25Index":
+        """
+        Build the index of documents.
+
+        Parameters
+        ----------
+        documents: List[Document]
+            The documents.
+        k1: float, optional
+            The term frequency saturation. Defaults to 1.2.
+        b: float, optional
+            The document length normalization. Defaults to 0.75.
+
+        Returns
+        -------
+        BM25Index
+            The index.
+        """
+        term_counts = [Counter(tokenize(document.page_content))
+                       for document in documents]
+        lengths = np.array([sum(counts.values()) for counts in term_counts],
+                           dtype=np.float32)
+        avg_length = max(lengths.mean(), 1.0) if len(lengths) else 1.0
+        posting_lists = {}
+        for i, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                posting_lists.setdefault(term, []).append((i, count))
+
+        vocabulary = {term: i for i, term in enumerate(sorted(posting_lists))}
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        postings, weights = [], []
+        for term, i in vocabulary.items():
+            doc_ids, counts = map(np.array, zip(*posting_lists[term]))
+            idf = np.log(1 + (len(documents) - len(doc_ids) + 0.5)
+                         / (len(doc_ids) + 0.5))
+            norms = k1 * (1 - b + b * lengths[doc_ids] / avg_length)
+            postings.append(doc_ids)
+            weights.append(idf * counts * (k1 + 1) / (counts + norms))
+            offsets[i + 1] = offsets[i] + len(doc_ids)
+        return cls(vocabulary=vocabulary,
+                   offsets=offsets,
+                   postings=np.concatenate(postings or [[]]).astype(np.int32),
+                   weights=np.concatenate(weights or [[]]).astype(np.float32),
+                   documents=list(documents))
+
+    def search(self, query: str, k: int = 4,
+               hotel_ids: Optional[Iterable[str]] = None
+               ) -> List[Tuple[Document, float]]:
+        """
+        Find the top-k documents of a query.
+
+        Parameters
+        ----------
+        query: str
+            The query.
+        k: int, optional
+            The number of documents. Defaults to 4.
+        hotel_ids: Optional[Iterable[str]], optional
+            If given, only the documents of these hotels are returned.
+
+        Returns
+        -------
+        List[Tuple[Document, float]]
+            The documents containing a query term and their BM25 score, best
+            first.
+        """
+        term_ids = {self.vocabulary[term] for term in tokenize(query)
+                    if term in self.vocabulary}
+        if not term_ids or k < 1:
+            return []
+        slices = [slice(self.offsets[i], self.offsets[i + 1])
+                  for i in term_ids]
+        doc_ids, inverse = np.unique(
+            np.concatenate([self.postings[s] for s in slices]),
+            return_inverse=True)
+        scores = np.bincount(
+            inverse, np.concatenate([self.weights[s] for s in slices]))
+        if hotel_ids is not None:
+            keep = np.isin(doc_ids, self._positions(hotel_ids))
+            doc_ids, scores = doc_ids[keep], scores[keep]
+            if not len(scores):
+                return []
+        n_top = min(k, len(scores))
+        top = np.argpartition(-scores, n_top - 1)[:n_top]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.documents[doc_ids[i]], float(scores[i])) for i in top]
+
+    def _positions(self, hotel_ids: Iterable[str]) -> np.ndarray:
+        """
+        Find the positions of the documents of the given hotels.
+        """
+        if self._position_of_id is None:
+            self._position_of_id = {
+                document.metadata.get('hotel_id'): i
+                for i, document in enumerate(self.documents)}
+        return np.array([self._position_of_id[doc_id] for doc_id in hotel_ids
+                         if doc_id in self._position_of_id], dtype=np.int64)
+
+    def save(self, path: str):
+        """
+        Save the index. It is written to a temporary directory first, so that
+        an interrupted save never leaves a partial index.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the index.
+        """
+        tmp_path = f"{path}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        np.savez(os.path.join(tmp_path, self.INDEX_FILE_NAME),
+                 offsets=self.offsets, postings=self.postings,
+                 weights=self.weights)
+        with open(os.path.join(tmp_path, self.VOCABULARY_FILE_NAME), "w") as f:
+            json.dump(self.vocabulary, f)
+        with open(os.path.join(tmp_path, self.DOCSTORE_FILE_NAME), "w") as f:
+            json.dump([{'page_content': document.page_content,
+                        'metadata': document.metadata}
+                       for document in self.documents], f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """
+        Load a saved index.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the index.
+
+        Returns
+        -------
+        BM25Index
+            The index.
+        """
+        with np.load(os.path.join(path, cls.INDEX_FILE_NAME)) as arrays:
+            offsets, postings, weights = (arrays['offsets'],
+                                          arrays['postings'],
+                                          arrays['weights'])
+        with open(os.path.join(path, cls.VOCABULARY_FILE_NAME)) as f:
+            vocabulary = json.load(f)
+        with open(os.path.join(path, cls.DOCSTORE_FILE_NAME)) as f:
+            documents = [Document(**document) for document in json.load(f)]
+        return cls(vocabulary=vocabulary, offsets=offsets, postings=postings,
+                   weights=weights, documents=documents)
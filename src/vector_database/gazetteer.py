@@ -0,0 +1,100 @@
+import re, unicodedata
+from typing import Dict, Tuple
+
+# the landmarks, stations and districts of the cities of the dataset, by
+# normalized name, to resolve the places of the questions offline
+GAZETTEER: Dict[str, Tuple[float, float]] = {
+    # London
+    "big ben": (51.5007, -0.1246),
+    "houses of parliament": (51.4995, -0.1248),
+    "westminster abbey": (51.4994, -0.1273),
+    "london eye": (51.5033, -0.1196),
+    "tower of london": (51.5081, -0.0759),
+    "tower bridge": (51.5055, -0.0754),
+    "buckingham palace": (51.5014, -0.1419),
+    "trafalgar square": (51.5080, -0.1281),
+    "piccadilly circus": (51.5101, -0.1340),
+    "covent garden": (51.5117, -0.1240),
+    "oxford street": (51.5152, -0.1418),
+    "british museum": (51.5194, -0.1270),
+    "st pauls cathedral": (51.5138, -0.0984),
+    "natural history museum": (51.4967, -0.1764),
+    "hyde park": (51.5073, -0.1657),
+    "kensington palace": (51.5058, -0.1877),
+    "camden market": (51.5413, -0.1462),
+    "shoreditch": (51.5264, -0.0780),
+    "canary wharf": (51.5054, -0.0235),
+    "o2 arena": (51.5030, 0.0032),
+    "kings cross": (51.5308, -0.1238),
+    "paddington": (51.5154, -0.1755),
+    "waterloo": (51.5031, -0.1132),
+    "victoria station": (51.4952, -0.1441),
+    "liverpool street": (51.5178, -0.0823),
+    "heathrow airport": (51.4700, -0.4543),
+    # Paris
+    "eiffel tower": (48.8584, 2.2945),
+    "louvre": (48.8606, 2.3376),
+    "notre dame": (48.8530, 2.3499),
+    "arc de triomphe": (48.8738, 2.2950),
+    "champs elysees": (48.8698, 2.3078),
+    "sacre coeur": (48.8867, 2.3431),
+    "montmartre": (48.8867, 2.3431),
+    "opera garnier": (48.8720, 2.3316),
+    "le marais": (48.8590, 2.3620),
+    "gare du nord": (48.8809, 2.3553),
+    "charles de gaulle airport": (49.0097, 2.5479),
+    # Amsterdam
+    "dam square": (52.3731, 4.8926),
+    "rijksmuseum": (52.3600, 4.8852),
+    "van gogh museum": (52.3584, 4.8811),
+    "anne frank house": (52.3752, 4.8840),
+    "vondelpark": (52.3580, 4.8686),
+    "leidseplein": (52.3641, 4.8828),
+    "amsterdam centraal": (52.3791, 4.9003),
+    "schiphol airport": (52.3105, 4.7683),
+    # Barcelona
+    "sagrada familia": (41.4036, 2.1744),
+    "la rambla": (41.3809, 2.1734),
+    "park guell": (41.4145, 2.1527),
+    "camp nou": (41.3809, 2.1228),
+    "placa de catalunya": (41.3870, 2.1701),
+    "gothic quarter": (41.3833, 2.1777),
+    "barceloneta": (41.3784, 2.1925),
+    # Milan
+    "duomo di milano": (45.4642, 9.1900),
+    "galleria vittorio emanuele ii": (45.4656, 9.1900),
+    "sforza castle": (45.4705, 9.1793),
+    "la scala": (45.4674, 9.1895),
+    "milano centrale": (45.4861, 9.2045),
+    "san siro": (45.4781, 9.1240),
+    # Vienna
+    "st stephens cathedral": (48.2085, 16.3731),
+    "hofburg": (48.2066, 16.3655),
+    "vienna state opera": (48.2031, 16.3691),
+    "schonbrunn palace": (48.1845, 16.3122),
+    "belvedere palace": (48.1915, 16.3809),
+    "prater": (48.2167, 16.3956),
+    "wien hauptbahnhof": (48.1852, 16.3759),
+}
+
+
+def normalize_place(text: str) -> str:
+    """
+    Normalize a place name, so that "St. Paul's Cathédral" and
+    "st pauls cathedral" match: without accents, apostrophes and
+    punctuation, in lowercase.
+
+    Parameters
+    ----------
+    text: str
+        The place name.
+
+    Returns
+    -------
+    str
+        The normalized name.
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"['’]", "", text.lower())
+    return " ".join(re.findall(r"\w+", text))
@@ -0,0 +1,200 @@
+import os, copy, time
+import numpy as np
+from contextlib import contextmanager
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from typing import Callable, Iterator, List, Optional, Set
+
+
+class MultiProcessEmbeddings(Embeddings):
+    """
+    Embed the documents with a local sentence-transformer model across a pool
+    of worker processes, which is started once for the whole index build.
+    """
+    def __init__(self, embedding_model: Embeddings, n_worker: int):
+        """
+        Initialize a new MultiProcessEmbeddings and start its pool.
+
+        Parameters
+        ----------
+        embedding_model: Embeddings
+            The sentence-transformer embedding model, with the
+            SentenceTransformer as client.
+        n_worker: int
+            The number of worker processes.
+        """
+        self.embedding_model = embedding_model
+        self.client = embedding_model.client
+        self.pool = self.client.start_multi_process_pool(
+            target_devices=["cpu"] * n_worker)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        encode_kwargs = getattr(self.embedding_model, 'encode_kwargs', {})
+        kwargs = {key: encode_kwargs[key]
+                  for key in ('batch_size', 'normalize_embeddings')
+                  if key in encode_kwargs}
+        vectors = self.client.encode_multi_process(
+            [text.replace("\n", " ") for text in texts], self.pool, **kwargs)
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embedding_model.embed_query(text)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        self.client.stop_multi_process_pool(self.pool)
+
+
+class IndexBuilder:
+    """
+    Build a vector index by streaming the documents in batches: every batch is
+    embedded, across a worker pool with a local sentence-transformer model,
+    then handed to the store before the next one, so that the memory stays
+    flat. The documents whose ID is already in the store are skipped, which
+    resumes an interrupted build.
+    """
+    def __init__(self,
+                 batch_size: int = 256,
+                 n_worker: Optional[int] = None,
+                 progress: Optional[Callable[[int, int], None]] = None):
+        """
+        Initialize a new IndexBuilder.
+
+        Parameters
+        ----------
+        batch_size: int, optional
+            The number of documents embedded and written at once. Defaults
+            to 256.
+        n_worker: Optional[int], optional
+            The number of embedding processes. Defaults to the number of CPUs.
+        progress: Optional[Callable[[int, int], None]], optional
+            Called with the number of documents done and the total after
+            every batch. Defaults to printing the progress.
+        """
+        if batch_size < 1:
+            raise ValueError("The batch size must be at least 1.")
+        self.batch_size = batch_size
+        self.n_worker = n_worker or os.cpu_count() or 1
+        self.progress = progress
+
+    def build(self,
+              embedding_model: Embeddings,
+              documents: List[Document],
+              add_batch: Callable[[List[Document], List[List[float]]], None],
+              existing_ids: Optional[Set[str]] = None) -> dict:
+        """
+        Embed the documents batch by batch and hand every batch to the store.
+
+        Parameters
+        ----------
+        embedding_model: Embeddings
+            The embedding model.
+        documents: List[Document]
+            The documents, with their ID as 'hotel_id' in the metadata.
+        add_batch: Callable[[List[Document], List[List[float]]], None]
+            Writes a batch of documents and their vectors to the store.
+        existing_ids: Optional[Set[str]], optional
+            The IDs already in the store, which are not embedded again.
+
+        Returns
+        -------
+        dict
+            The build stats: the number of documents embedded and skipped,
+            the number of batches and the duration in seconds.
+        """
+        existing_ids = existing_ids or set()
+        todo = [document for document in documents
+                if document.metadata['hotel_id'] not in existing_ids]
+        n_skipped = len(documents) - len(todo)
+        if n_skipped:
+            print(f"[INFO] Resuming the build: {n_skipped} documents are "
+                  f"already indexed.")
+        start = time.perf_counter()
+        n_batch = 0
+        with self._embeddings(embedding_model, len(todo)) as embeddings:
+            for batch in self._batches(todo):
+                vectors = embeddings.embed_documents(
+                    [document.page_content for document in batch])
+                add_batch(batch, vectors)
+                n_batch += 1
+                self._report(n_skipped + min(n_batch * self.batch_size,
+                                             len(todo)), len(documents))
+        return {'n_document': len(todo),
+                'n_skipped': n_skipped,
+                'n_batch': n_batch,
+                'seconds': time.perf_counter() - start}
+
+    def build_vectors(self,
+                      embedding_model: Embeddings,
+                      documents: List[Document]) -> np.ndarray:
+        """
+        Embed the documents batch by batch into a single float32 matrix, for
+        the stores that are written at once.
+
+        Parameters
+        ----------
+        embedding_model: Embeddings
+            The embedding model.
+        documents: List[Document]
+            The documents, with their ID as 'hotel_id' in the metadata.
+
+        Returns
+        -------
+        np.ndarray
+            The vectors, of shape (n_document, dimension).
+        """
+        blocks = []
+        self.build(embedding_model, documents,
+                   lambda batch, vectors: blocks.append(
+                       np.asarray(vectors, dtype=np.float32)))
+        if not blocks:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(blocks)
+
+    def _batches(self, documents: List[Document]) -> Iterator[List[Document]]:
+        """
+        Split the documents into batches.
+        """
+        for start in range(0, len(documents), self.batch_size):
+            yield documents[start:start + self.batch_size]
+
+    @contextmanager
+    def _embeddings(self, embedding_model: Embeddings, n_document: int):
+        """
+        Provide the embedding model of the build, embedding across a worker
+        pool when the model is a local sentence-transformer and there is more
+        than one batch. A caching wrapper keeps its cache in front of the
+        pool.
+        """
+        # a caching wrapper exposes the wrapped model and its cache
+        cached = hasattr(embedding_model, 'cache') \
+            and hasattr(embedding_model, 'embedding_model')
+        model = embedding_model.embedding_model if cached else embedding_model
+        if self.n_worker < 2 or n_document <= self.batch_size or \
+                not hasattr(getattr(model, 'client', None),
+                            'start_multi_process_pool'):
+            yield embedding_model
+            return
+
+        print(f"[INFO] Embedding across {self.n_worker} processes.")
+        pool_model = MultiProcessEmbeddings(model, self.n_worker)
+        try:
+            if cached:
+                embedding_model = copy.copy(embedding_model)
+                embedding_model.embedding_model = pool_model
+                yield embedding_model
+            else:
+                yield pool_model
+        finally:
+            pool_model.close()
+
+    def _report(self, n_done: int, n_total: int):
+        """
+        Report the progress of the build.
+        """
+        if self.progress is not None:
+            self.progress(n_done, n_total)
+        else:
+            print(f"[INFO] Indexed {n_done}/{n_total} documents.")
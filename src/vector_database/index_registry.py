@@ -0,0 +1,231 @@
+import os, json, time, hashlib
+from typing import Any, Callable, List, Optional
+
+_FINGERPRINTS = {}  # (path, size, mtime_ns) -> fingerprint
+
+
+def embedding_model_name(embedding_model) -> str:
+    """
+    Get the name of the model behind an embedding model.
+
+    Parameters
+    ----------
+    embedding_model: Embeddings
+        The embedding model, possibly wrapped by a cache.
+
+    Returns
+    -------
+    str
+        The model name, or the class name if the model has no name.
+    """
+    for attribute in ('model_name', 'model'):
+        name = getattr(embedding_model, attribute, None)
+        if isinstance(name, str):
+            return name
+    return type(embedding_model).__name__
+
+
+def data_fingerprint(data_path: str) -> str:
+    """
+    Compute the SHA-256 of a data file, only hashing the content again if the
+    size or the modification time changed.
+
+    Parameters
+    ----------
+    data_path: str
+        The path of the data file.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest.
+    """
+    stat = os.stat(data_path)
+    key = (os.path.abspath(data_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _FINGERPRINTS:
+        sha256 = hashlib.sha256()
+        with open(data_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(block)
+        _FINGERPRINTS[key] = sha256.hexdigest()
+    return _FINGERPRINTS[key]
+
+
+class IndexRegistry:
+    """
+    The registry of the indexes of a vector database, one per embedding
+    model, country and data fingerprint. A manifest records every complete
+    index with its dimension and build stats, and the loaded indexes are kept
+    warm side by side.
+    """
+    MANIFEST_FILE_NAME = "registry.json"
+
+    def __init__(self, path: str):
+        """
+        Initialize a new IndexRegistry.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the vector database.
+        """
+        self.path = path
+        self.manifest_path = os.path.join(path, self.MANIFEST_FILE_NAME)
+        self.indexes = {}
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.indexes = json.load(f)['indexes']
+        self._loaded = {}
+
+    @staticmethod
+    def index_name(model_name: str, country: str, fingerprint: str,
+                   variant: str = "") -> str:
+        """
+        Create the name of an index, which is a valid collection and
+        directory name.
+
+        Parameters
+        ----------
+        model_name: str
+            The name of the embedding model.
+        country: str
+            The country.
+        fingerprint: str
+            The fingerprint of the processed data.
+        variant: str, optional
+            The variant of the index, e.g. the type of FAISS index.
+
+        Returns
+        -------
+        str
+            The index name.
+        """
+        key = "|".join([model_name, country, fingerprint, variant])
+        return f"index_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+    def find(self, model_name: str, country: str, fingerprint: str,
+             variant: str = "") -> Optional[dict]:
+        """
+        Find the complete index of an embedding model, country and data
+        fingerprint.
+
+        Returns
+        -------
+        Optional[dict]
+            The manifest entry of the index, or None if it does not exist.
+        """
+        return self.indexes.get(
+            self.index_name(model_name, country, fingerprint, variant))
+
+    def find_latest(self, model_name: str, country: str,
+                    variant: str = "") -> Optional[dict]:
+        """
+        Find the most recent index of an embedding model and country,
+        whatever the data it has been built from.
+
+        Returns
+        -------
+        Optional[dict]
+            The manifest entry of the index, or None if there is none.
+        """
+        entries = [entry for entry in self.indexes.values()
+                   if (entry['embedding_model'], entry['country'],
+                       entry['variant']) == (model_name, country, variant)]
+        return max(entries, key=lambda entry: entry['updated_at'],
+                   default=None)
+
+    def register(self, model_name: str, country: str, fingerprint: str,
+                 dimension: int, stats: dict, variant: str = "") -> dict:
+        """
+        Record a complete index in the manifest.
+
+        Parameters
+        ----------
+        model_name: str
+            The name of the embedding model.
+        country: str
+            The country.
+        fingerprint: str
+            The fingerprint of the processed data.
+        dimension: int
+            The dimension of the vectors.
+        stats: dict
+            The build stats.
+        variant: str, optional
+            The variant of the index.
+
+        Returns
+        -------
+        dict
+            The manifest entry of the index.
+        """
+        name = self.index_name(model_name, country, fingerprint, variant)
+        self.indexes[name] = {'name': name,
+                              'embedding_model': model_name,
+                              'country': country,
+                              'data_fingerprint': fingerprint,
+                              'variant': variant,
+                              'dimension': dimension,
+                              'stats': stats,
+                              'updated_at': time.time()}
+        self._save()
+        return self.indexes[name]
+
+    def remove(self, name: str):
+        """
+        Remove an index from the manifest and from the warm indexes.
+
+        Parameters
+        ----------
+        name: str
+            The index name.
+        """
+        self.indexes.pop(name, None)
+        self._loaded = {key: store for key, store in self._loaded.items()
+                        if key[0] != name}
+        self._save()
+
+    def entries(self) -> List[dict]:
+        """
+        List the manifest entries of the indexes.
+        """
+        return list(self.indexes.values())
+
+    def load(self, name: str, load_fn: Callable[[], Any],
+             *options: Any) -> Any:
+        """
+        Retrieve a loaded index, loading it the first time.
+
+        Parameters
+        ----------
+        name: str
+            The index name.
+        load_fn: Callable[[], Any]
+            Loads the index.
+        *options: Any
+            The loading options that give another store, e.g. the
+            quantization.
+
+        Returns
+        -------
+        Any
+            The loaded index.
+        """
+        key = (name, *options)
+        if key not in self._loaded:
+            self._loaded[key] = load_fn()
+        return self._loaded[key]
+
+    def unload(self):
+        """
+        Release the loaded indexes.
+        """
+        self._loaded = {}
+
+    def _save(self):
+        """
+        Save the manifest.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.manifest_path, "w") as f:
+            json.dump({'indexes': self.indexes}, f, indent=1)
@@ -0,0 +1,13 @@
+from enum import Enum
+
+
+class FaissIndexType(str, Enum):
+    FLAT = "flat"
+    IVF = "ivf"
+    HNSW = "hnsw"
+
+
+class QuantizationType(str, Enum):
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    INT8 = "int8"
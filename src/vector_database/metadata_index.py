@@ -0,0 +1,327 @@
+import os, re, json, shutil
+import numpy as np
+from langchain_core.documents import Document
+from typing import Dict, List, Optional
+
+_OPERATORS = {
+    '$gt': lambda index, value: index._range(value, None, False, True),
+    '$gte': lambda index, value: index._range(value, None, True, True),
+    '$lt': lambda index, value: index._range(None, value, True, False),
+    '$lte': lambda index, value: index._range(None, value, True, True),
+}
+_BOUND = (r"(above|over|more than|better than|at least|below|under|"
+          r"less than|at most|>=|<=|>|<)\s*(\d+(?:\.\d+)?)")
+_SCORE_WORD = r"(?:scor(?:e|ed|es|ing)|rated|ratings?)"
+# a bound is a score bound only next to a score word, e.g. "rated above 9",
+# "a score of at least 8.5" or "over 8 rating", so that "under 5 minutes"
+# or "more than 2 bars" are not
+_SCORE_PATTERNS = (
+    re.compile(rf"\b{_SCORE_WORD}(?:\s+of)?\s+{_BOUND}(?!\.?\w)"),
+    re.compile(rf"(?<!\w){_BOUND}(?:\s*/\s*10)?\s+{_SCORE_WORD}\b"),
+)
+_MAX_SCORE = 10
+_SCORE_OPERATORS = {
+    'above': '$gt', 'over': '$gt', 'more than': '$gt', 'better than': '$gt',
+    '>': '$gt', 'at least': '$gte', '>=': '$gte', 'below': '$lt',
+    'under': '$lt', 'less than': '$lt', '<': '$lt', 'at most': '$lte',
+    '<=': '$lte',
+}
+_MAX_NGRAM = 3  # the longest city or postal code, in tokens
+
+
+class _CategoricalField:
+    """
+    The inverted index of a categorical field: the sorted positions of the
+    documents of every (lower-cased) value.
+    """
+    def __init__(self, values: List[str], offsets: np.ndarray,
+                 positions: np.ndarray):
+        self.values = {value: i for i, value in enumerate(values)}
+        self.offsets = offsets
+        self.positions = positions
+
+    def get(self, value) -> np.ndarray:
+        i = self.values.get(str(value).lower())
+        if i is None:
+            return np.empty(0, dtype=np.int32)
+        return self.positions[self.offsets[i]:self.offsets[i + 1]]
+
+    def _range(self, *args):
+        raise ValueError("Range filters only apply to numeric fields.")
+
+
+class _NumericField:
+    """
+    The sorted index of a numeric field, answering ranges by binary search.
+    """
+    def __init__(self, sorted_values: np.ndarray, order: np.ndarray):
+        self.sorted_values = sorted_values
+        self.order = order
+
+    def get(self, value) -> np.ndarray:
+        return self._range(value, value, True, True)
+
+    def _range(self, low, high, include_low: bool,
+               include_high: bool) -> np.ndarray:
+        start = 0 if low is None else np.searchsorted(
+            self.sorted_values, low, side='left' if include_low else 'right')
+        end = len(self.sorted_values) if high is None else np.searchsorted(
+            self.sorted_values, high, side='right' if include_high else 'left')
+        return np.sort(self.order[start:end])
+
+
+class MetadataIndex:
+    """
+    Precomputed per-field indexes of the typed metadata of the hotel
+    documents: an inverted index for the categorical fields and a sorted
+    index for the numeric ones. A filter is answered from the indexes only,
+    giving the candidate hotels to be ranked by similarity.
+
+    The filters use the Chroma syntax, e.g.
+    {"City": "London", "Average_Score": {"$gte": 9}}, with the operators
+    $eq, $in, $gt, $gte, $lt, $lte, and $and / $or to combine filters. A list
+    field such as 'tags' matches if it contains the value.
+    """
+    CATEGORICAL_FIELDS = ('City', 'Postal_Code', 'tags')
+    NUMERIC_FIELDS = ('Average_Score', 'lat', 'lng')
+    INDEX_FILE_NAME = "metadata.npz"
+    FIELDS_FILE_NAME = "metadata.json"
+
+    def __init__(self, hotel_ids: List[str], fields: Dict[str, object]):
+        """
+        Initialize a new MetadataIndex.
+
+        Parameters
+        ----------
+        hotel_ids: List[str]
+            The hotel ID of every document position.
+        fields: Dict[str, object]
+            The index of every field.
+        """
+        self.hotel_ids = np.array(hotel_ids, dtype=object)
+        self.fields = fields
+
+    @classmethod
+    def from_documents(cls, documents: List[Document]) -> "MetadataIndex":
+        """
+        Build the indexes of the metadata of documents.
+
+        Parameters
+        ----------
+        documents: List[Document]
+            The documents, with the hotel ID and the typed fields in their
+            metadata.
+
+        Returns
+        -------
+        MetadataIndex
+            The index.
+        """
+        fields = {}
+        for field in cls.CATEGORICAL_FIELDS:
+            posting_lists = {}
+            for i, document in enumerate(documents):
+                values = document.metadata.get(field)
+                if values is None:
+                    continue
+                if not isinstance(values, list):
+                    values = [values]
+                for value in {str(value).lower() for value in values}:
+                    posting_lists.setdefault(value, []).append(i)
+            if not posting_lists:
+                continue
+            values = sorted(posting_lists)
+            offsets = np.cumsum([0] + [len(posting_lists[value])
+                                       for value in values])
+            fields[field] = _CategoricalField(
+                values, offsets, np.array(
+                    [i for value in values for i in posting_lists[value]],
+                    dtype=np.int32))
+        for field in cls.NUMERIC_FIELDS:
+            positions = [i for i, document in enumerate(documents)
+                         if document.metadata.get(field) is not None]
+            if not positions:
+                continue
+            values = np.array([documents[i].metadata[field]
+                               for i in positions], dtype=np.float64)
+            order = np.argsort(values, kind='stable')
+            fields[field] = _NumericField(
+                values[order], np.array(positions, dtype=np.int32)[order])
+        return cls([document.metadata['hotel_id'] for document in documents],
+                   fields)
+
+    def filter(self, where: dict) -> List[str]:
+        """
+        Find the hotels matching a filter.
+
+        Parameters
+        ----------
+        where: dict
+            The filter.
+
+        Returns
+        -------
+        List[str]
+            The IDs of the matching hotels.
+
+        Raises
+        ------
+        ValueError
+            If the filter uses an unknown field or operator.
+        """
+        return list(self.hotel_ids[self._positions(where)])
+
+    def parse_filter(self, query: str) -> dict:
+        """
+        Extract the filterable constraints of a question: the known cities
+        and postal codes it names and the score bounds, e.g. "hotels in
+        London rated above 9". A number is a score bound only next to a
+        score word and within the 0-10 scale.
+
+        Parameters
+        ----------
+        query: str
+            The question.
+
+        Returns
+        -------
+        dict
+            The filter, empty if the question has no constraint.
+        """
+        lowered = query.lower()
+        tokens = re.findall(r"\w+", lowered)
+        # look the n-grams of the question up instead of scanning the values
+        ngrams = {" ".join(tokens[i:i + n])
+                  for n in range(1, _MAX_NGRAM + 1)
+                  for i in range(len(tokens) - n + 1)}
+        conditions = []
+        for field in ('City', 'Postal_Code'):
+            index = self.fields.get(field)
+            if index is None:
+                continue
+            values = sorted(ngram for ngram in ngrams if ngram in index.values)
+            if values:
+                conditions.append({field: {'$in': values}})
+        if 'Average_Score' in self.fields:
+            for pattern in _SCORE_PATTERNS:
+                for word, value in pattern.findall(lowered):
+                    if float(value) <= _MAX_SCORE:
+                        conditions.append({'Average_Score': {
+                            _SCORE_OPERATORS[word]: float(value)}})
+        if len(conditions) > 1:
+            return {'$and': conditions}
+        return conditions[0] if conditions else {}
+
+    def save(self, path: str):
+        """
+        Save the index, through a temporary directory so that an interrupted
+        save never leaves a partial index.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the index.
+        """
+        tmp_path = f"{path}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        arrays, fields = {}, {}
+        for field, index in self.fields.items():
+            if isinstance(index, _CategoricalField):
+                fields[field] = {'type': 'categorical',
+                                 'values': list(index.values)}
+                arrays[f"{field}_offsets"] = index.offsets
+                arrays[f"{field}_positions"] = index.positions
+            else:
+                fields[field] = {'type': 'numeric'}
+                arrays[f"{field}_values"] = index.sorted_values
+                arrays[f"{field}_order"] = index.order
+        np.savez(os.path.join(tmp_path, self.INDEX_FILE_NAME), **arrays)
+        with open(os.path.join(tmp_path, self.FIELDS_FILE_NAME), "w") as f:
+            json.dump({'hotel_ids': list(self.hotel_ids), 'fields': fields}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataIndex":
+        """
+        Load a saved index.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the index.
+
+        Returns
+        -------
+        MetadataIndex
+            The index.
+        """
+        with open(os.path.join(path, cls.FIELDS_FILE_NAME)) as f:
+            manifest = json.load(f)
+        fields = {}
+        with np.load(os.path.join(path, cls.INDEX_FILE_NAME)) as arrays:
+            for field, spec in manifest['fields'].items():
+                if spec['type'] == 'categorical':
+                    fields[field] = _CategoricalField(
+                        spec['values'], arrays[f"{field}_offsets"],
+                        arrays[f"{field}_positions"])
+                else:
+                    fields[field] = _NumericField(arrays[f"{field}_values"],
+                                                  arrays[f"{field}_order"])
+        return cls(manifest['hotel_ids'], fields)
+
+    def _positions(self, where: dict) -> np.ndarray:
+        """
+        Find the sorted positions of the documents matching a filter.
+        """
+        result: Optional[np.ndarray] = None
+        for key, condition in where.items():
+            if key == '$and':
+                positions = self._intersect(
+                    [self._positions(sub_where) for sub_where in condition])
+            elif key == '$or':
+                positions = np.unique(np.concatenate(
+                    [self._positions(sub_where) for sub_where in condition]
+                    or [np.empty(0, dtype=np.int32)]))
+            else:
+                positions = self._match(key, condition)
+            result = positions if result is None \
+                else self._intersect([result, positions])
+        if result is None:
+            return np.arange(len(self.hotel_ids))
+        return result
+
+    def _match(self, field: str, condition) -> np.ndarray:
+        """
+        Find the sorted positions of the documents whose field matches a
+        condition.
+        """
+        if field not in self.fields:
+            raise ValueError(f"The metadata field {field} is not indexed.")
+        index = self.fields[field]
+        if not isinstance(condition, dict):
+            return index.get(condition)
+        matches = []
+        for operator, value in condition.items():
+            if operator == '$eq':
+                matches.append(index.get(value))
+            elif operator == '$in':
+                matches.append(np.unique(np.concatenate(
+                    [index.get(item) for item in value]
+                    or [np.empty(0, dtype=np.int32)])))
+            elif operator in _OPERATORS:
+                matches.append(_OPERATORS[operator](index, value))
+            else:
+                raise ValueError(f"The operator {operator} is not supported.")
+        return self._intersect(matches)
+
+    @staticmethod
+    def _intersect(positions: List[np.ndarray]) -> np.ndarray:
+        """
+        Intersect sorted positions, the smallest first.
+        """
+        positions = sorted(positions, key=len)
+        result = positions[0] if positions else np.empty(0, dtype=np.int32)
+        for other in positions[1:]:
+            result = np.intersect1d(result, other, assume_unique=True)
+        return result
@@ -0,0 +1,403 @@
+import os, json, uuid
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+from .index_type import QuantizationType
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    An in-memory vector store that keeps the normalized embedding matrix in a
+    contiguous NumPy array and searches it by batched matrix products (cosine
+    similarity). The resident matrix can be quantized to float16 or int8; the
+    candidates are then rescored with the float32 vectors, which stay in a
+    memory-mapped .npy file once saved.
+    """
+    VECTORS_FILE_NAME = "vectors.npy"
+    DOCSTORE_FILE_NAME = "docstore.json"
+    BLOCK_SIZE = 4096  # rows cast to float32 at once when quantized
+
+    def __init__(self,
+                 embedding_function: Embeddings,
+                 vectors: np.ndarray,
+                 documents: List[Document],
+                 ids: List[str],
+                 quantization: QuantizationType = QuantizationType.FLOAT32,
+                 rescore_factor: int = 4):
+        """
+        Initialize a new NumpyVectorStore.
+
+        Parameters
+        ----------
+        embedding_function: Embeddings
+            The embedding model.
+        vectors: np.ndarray
+            The float32 embeddings of the documents, of shape
+            (n_document, dimension). Can be memory-mapped.
+        documents: List[Document]
+            The documents.
+        ids: List[str]
+            The IDs of the documents.
+        quantization: QuantizationType, optional
+            The type of the resident matrix. Defaults to
+            QuantizationType.FLOAT32.
+        rescore_factor: int, optional
+            With a quantized matrix, `k * rescore_factor` candidates are
+            rescored with the float32 vectors. Defaults to 4.
+        """
+        self.embedding_function = embedding_function
+        self.quantization = QuantizationType(quantization)
+        self.rescore_factor = rescore_factor
+        self.documents = list(documents)
+        self.ids = list(ids)
+        self._set_vectors(vectors)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def add_texts(self,
+                  texts: Iterable[str],
+                  metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None,
+                  **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = self._normalize(
+            self.embedding_function.embed_documents(texts))
+        self.documents.extend(Document(page_content=text, metadata=metadata)
+                              for text, metadata in zip(texts, metadatas))
+        self.ids.extend(ids)
+        self._set_vectors(np.concatenate([self.vectors, vectors]))
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None,
+               **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            return False
+        ids = set(ids)
+        keep = [i for i, doc_id in enumerate(self.ids) if doc_id not in ids]
+        self.documents = [self.documents[i] for i in keep]
+        self.ids = [self.ids[i] for i in keep]
+        self._set_vectors(self.vectors[keep])
+        return True
+
+    @classmethod
+    def from_texts(cls,
+                   texts: List[str],
+                   embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None,
+                   quantization: QuantizationType = QuantizationType.FLOAT32,
+                   rescore_factor: int = 4,
+                   **kwargs: Any) -> "NumpyVectorStore":
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        return cls(
+            embedding_function=embedding,
+            vectors=cls._normalize(embedding.embed_documents(list(texts))),
+            documents=[Document(page_content=text, metadata=metadata)
+                       for text, metadata in zip(texts, metadatas)],
+            ids=ids,
+            quantization=quantization,
+            rescore_factor=rescore_factor)
+
+    def similarity_search(self, query: str, k: int = 4,
+                          ids: Optional[List[str]] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [document for document, _ in
+                self.similarity_search_with_score(query, k, ids=ids)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     ids: Optional[List[str]] = None,
+                                     **kwargs: Any
+                                     ) -> List[Tuple[Document, float]]:
+        return self.batch_similarity_search_with_score([query], k, ids=ids)[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    ids: Optional[List[str]] = None,
+                                    **kwargs: Any) -> List[Document]:
+        return [document for document, _ in
+                self._search(np.array([embedding]), k, ids)[0]]
+
+    def batch_similarity_search_with_score(
+            self, queries: List[str],
+            k: int = 4,
+            ids: Optional[List[str]] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Search the documents of several queries at once.
+
+        Parameters
+        ----------
+        queries: List[str]
+            The queries.
+        k: int, optional
+            The number of documents per query. Defaults to 4.
+        ids: Optional[List[str]], optional
+            If given, only the documents with these IDs are searched, scored
+            exactly with the float32 vectors.
+
+        Returns
+        -------
+        List[List[Tuple[Document, float]]]
+            The documents and their cosine similarity, best first, for every
+            query.
+        """
+        return self._search(
+            np.array([self.embedding_function.embed_query(query)
+                      for query in queries]), k, ids)
+
+    def _search(self, query_vectors: np.ndarray, k: int,
+                ids: Optional[List[str]] = None
+                ) -> List[List[Tuple[Document, float]]]:
+        """
+        Search the documents of a batch of query vectors, among the documents
+        with the given IDs only if there are some.
+        """
+        if ids is None:
+            indices, scores = self.search_vectors(query_vectors, k)
+        else:
+            indices, scores = self.search_rows(query_vectors, k,
+                                               self._rows_of_ids(ids))
+        return [[(self.documents[i], float(score))
+                 for i, score in zip(row_indices, row_scores)]
+                for row_indices, row_scores in zip(indices, scores)]
+
+    def search_vectors(self, query_vectors: np.ndarray,
+                       k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the top-k documents of a batch of query vectors.
+
+        Parameters
+        ----------
+        query_vectors: np.ndarray
+            The query vectors, of shape (n_query, dimension).
+        k: int
+            The number of documents per query.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The indices of the documents and their cosine similarity, both of
+            shape (n_query, k), best first.
+        """
+        query_vectors = self._normalize(query_vectors)
+        k = min(k, len(self.ids))
+        if k == 0:
+            empty = np.empty((len(query_vectors), 0))
+            return empty.astype(np.int64), empty
+        if self.quantization == QuantizationType.FLOAT32:
+            return self._top_k(self.vectors @ query_vectors.T, k)
+
+        # coarse search on the quantized matrix, then rescoring
+        n_candidate = min(k * self.rescore_factor, len(self.ids))
+        candidates, _ = self._top_k(self._quantized_scores(query_vectors),
+                                    n_candidate)
+        scores = np.einsum("qcd,qd->qc", self.vectors[candidates],
+                           query_vectors)
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return (np.take_along_axis(candidates, order, axis=1),
+                np.take_along_axis(scores, order, axis=1))
+
+    def search_rows(self, query_vectors: np.ndarray, k: int,
+                    rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the top-k documents of a batch of query vectors among some rows
+        only, scored exactly with the float32 vectors.
+
+        Parameters
+        ----------
+        query_vectors: np.ndarray
+            The query vectors, of shape (n_query, dimension).
+        k: int
+            The number of documents per query.
+        rows: np.ndarray
+            The rows of the candidate documents.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The indices of the documents and their cosine similarity, both of
+            shape (n_query, min(k, n_row)), best first.
+        """
+        query_vectors = self._normalize(query_vectors)
+        rows = np.asarray(rows, dtype=np.int64)
+        k = min(k, len(rows))
+        if k == 0:
+            empty = np.empty((len(query_vectors), 0))
+            return empty.astype(np.int64), empty
+        indices, scores = self._top_k(
+            np.asarray(self.vectors[rows], dtype=np.float32)
+            @ query_vectors.T, k)
+        return rows[indices], scores
+
+    def save(self, path: str):
+        """
+        Save the float32 matrix as a single .npy file and the documents.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the vector store.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, self.VECTORS_FILE_NAME),
+                np.ascontiguousarray(self.vectors, dtype=np.float32))
+        with open(os.path.join(path, self.DOCSTORE_FILE_NAME), "w") as f:
+            json.dump([{'id': doc_id,
+                        'page_content': document.page_content,
+                        'metadata': document.metadata}
+                       for doc_id, document in zip(self.ids, self.documents)],
+                      f)
+
+    @classmethod
+    def load(cls,
+             path: str,
+             embedding_function: Embeddings,
+             quantization: QuantizationType = QuantizationType.FLOAT32,
+             rescore_factor: int = 4) -> "NumpyVectorStore":
+        """
+        Load a saved vector store. The float32 matrix is memory-mapped and
+        only the resident (possibly quantized) matrix is held in RAM.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the vector store.
+        embedding_function: Embeddings
+            The embedding model.
+        quantization: QuantizationType, optional
+            The type of the resident matrix. Defaults to
+            QuantizationType.FLOAT32.
+        rescore_factor: int, optional
+            The candidates rescored per result with a quantized matrix.
+            Defaults to 4.
+
+        Returns
+        -------
+        NumpyVectorStore
+            The vector store.
+        """
+        vectors = np.load(os.path.join(path, cls.VECTORS_FILE_NAME),
+                          mmap_mode='r')
+        with open(os.path.join(path, cls.DOCSTORE_FILE_NAME)) as f:
+            records = json.load(f)
+        return cls(embedding_function=embedding_function,
+                   vectors=vectors,
+                   documents=[Document(page_content=record['page_content'],
+                                       metadata=record['metadata'])
+                              for record in records],
+                   ids=[record['id'] for record in records],
+                   quantization=quantization,
+                   rescore_factor=rescore_factor)
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # the scores are already cosine similarities
+        return lambda score: score
+
+    def _set_vectors(self, vectors: np.ndarray):
+        """
+        Set the float32 matrix and build the resident matrix from it.
+
+        Parameters
+        ----------
+        vectors: np.ndarray
+            The normalized float32 vectors. Can be memory-mapped.
+        """
+        self.vectors = vectors
+        self.scales = None
+        self._row_of_id = None
+        if self.quantization == QuantizationType.FLOAT32:
+            self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            self.matrix = self.vectors
+        elif self.quantization == QuantizationType.FLOAT16:
+            self.matrix = np.ascontiguousarray(vectors, dtype=np.float16)
+        elif self.quantization == QuantizationType.INT8:
+            # symmetric quantization with one scale per row
+            scales = np.abs(vectors).max(axis=1, initial=0) / 127
+            scales[scales == 0] = 1
+            self.scales = scales.astype(np.float32)
+            self.matrix = np.ascontiguousarray(
+                np.round(vectors / scales[:, None]), dtype=np.int8)
+        else:
+            raise NotImplementedError(
+                f"Quantization {self.quantization} has not been implemented.")
+
+    def _rows_of_ids(self, ids: List[str]) -> np.ndarray:
+        """
+        Find the rows of the documents with the given IDs, ignoring the
+        unknown IDs.
+        """
+        if self._row_of_id is None:
+            self._row_of_id = {doc_id: row
+                               for row, doc_id in enumerate(self.ids)}
+        return np.array(sorted({self._row_of_id[doc_id] for doc_id in ids
+                                if doc_id in self._row_of_id}),
+                         dtype=np.int64)
+
+    def _quantized_scores(self, query_vectors: np.ndarray) -> np.ndarray:
+        """
+        Score every document on the quantized matrix, block by block so that
+        only one block is cast to float32 at a time.
+
+        Parameters
+        ----------
+        query_vectors: np.ndarray
+            The normalized query vectors, of shape (n_query, dimension).
+
+        Returns
+        -------
+        np.ndarray
+            The approximate scores, of shape (n_document, n_query).
+        """
+        scores = np.empty((len(self.matrix), len(query_vectors)),
+                          dtype=np.float32)
+        for start in range(0, len(self.matrix), self.BLOCK_SIZE):
+            block = self.matrix[start:start + self.BLOCK_SIZE]
+            scores[start:start + len(block)] = \
+                block.astype(np.float32) @ query_vectors.T
+        if self.scales is not None:
+            scores *= self.scales[:, None]
+        return scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Select the top-k rows of every column with argpartition.
+
+        Parameters
+        ----------
+        scores: np.ndarray
+            The scores, of shape (n_document, n_query).
+        k: int
+            The number of documents per query.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The indices and the scores, of shape (n_query, k), best first.
+        """
+        scores = scores.T
+        if k < scores.shape[1]:
+            indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            indices = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+        top_scores = np.take_along_axis(scores, indices, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return (np.take_along_axis(indices, order, axis=1),
+                np.take_along_axis(top_scores, order, axis=1))
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        """
+        L2-normalize float32 vectors.
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
@@ -0,0 +1,242 @@
+import re, time, threading
+import numpy as np
+from collections import OrderedDict
+from langchain_core.documents import Document
+from typing import Hashable, List, Optional
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query, so that the case, the punctuation and the spacing do
+    not matter.
+
+    Parameters
+    ----------
+    query: str
+        The query.
+
+    Returns
+    -------
+    str
+        The lowercase words of the query, separated by single spaces.
+    """
+    return " ".join(_TOKEN_PATTERN.findall(query.lower()))
+
+
+class QueryCache:
+    """
+    An in-memory cache of the documents retrieved for queries. A query hits
+    the cache if its normalized text was seen, or if its embedding is close
+    enough to the one of a cached query of the same partition, e.g. the same
+    metadata filter. The entries expire after a time to live and the least
+    recently used ones are evicted first.
+    """
+    def __init__(self,
+                 similarity_threshold: float = 0.95,
+                 ttl_seconds: Optional[float] = 3600,
+                 max_entries: int = 1024):
+        """
+        Initialize a new QueryCache.
+
+        Parameters
+        ----------
+        similarity_threshold: float, optional
+            The minimum cosine similarity of the embeddings of near-duplicate
+            queries. Defaults to 0.95.
+        ttl_seconds: Optional[float], optional
+            The time to live of the entries, None to never expire. Defaults to
+            one hour.
+        max_entries: int, optional
+            The maximum number of entries. Defaults to 1024.
+        """
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version = None
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        # normalized query -> (partition, slot, documents, creation time),
+        # least recently used first
+        self._entries = OrderedDict()
+        self._vectors = None  # the unit query embedding of every slot
+        self._slot_keys: List[Optional[str]] = [None] * max_entries
+
+    def get_exact(self, query: str, partition: Hashable = None
+                  ) -> Optional[List[Document]]:
+        """
+        Look a query up by its normalized text. The lookup is not counted as
+        a miss, as the embedding lookup may follow.
+
+        Parameters
+        ----------
+        query: str
+            The query.
+        partition: Hashable, optional
+            The partition of the query.
+
+        Returns
+        -------
+        Optional[List[Document]]
+            The cached documents, or None.
+        """
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != partition or self._expired(entry):
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry[2]
+
+    def get_similar(self, query_vector: List[float],
+                    partition: Hashable = None) -> Optional[List[Document]]:
+        """
+        Look a query up by its embedding, among the cached queries of the
+        same partition.
+
+        Parameters
+        ----------
+        query_vector: List[float]
+            The embedding of the query.
+        partition: Hashable, optional
+            The partition of the query.
+
+        Returns
+        -------
+        Optional[List[Document]]
+            The documents of the most similar cached query, or None if no
+            cached query is similar enough.
+        """
+        with self._lock:
+            if self._entries:
+                # a single product with every slot: the free slots and the
+                # other partitions' slots are scored too, and skipped below
+                scores = self._vectors @ self._unit(query_vector)
+                for rank in np.argsort(-scores, kind='stable'):
+                    if scores[rank] < self.similarity_threshold:
+                        break
+                    key = self._slot_keys[rank]
+                    entry = self._entries.get(key) if key else None
+                    if entry is None or entry[0] != partition:
+                        continue
+                    if self._expired(entry):
+                        continue
+                    self._entries.move_to_end(key)
+                    self.similar_hits += 1
+                    return entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, query: str, query_vector: List[float],
+            documents: List[Document], partition: Hashable = None):
+        """
+        Cache the documents of a query, evicting the least recently used
+        entry if the cache is full.
+
+        Parameters
+        ----------
+        query: str
+            The query.
+        query_vector: List[float]
+            The embedding of the query.
+        documents: List[Document]
+            The retrieved documents.
+        partition: Hashable, optional
+            The partition of the query.
+        """
+        key = normalize_query(query)
+        vector = self._unit(query_vector)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                self._reset(len(vector))
+            if key in self._entries:
+                slot = self._entries.pop(key)[1]
+            elif len(self._entries) < self.max_entries:
+                slot = self._slot_keys.index(None)
+            else:
+                _, (_, slot, _, _) = self._entries.popitem(last=False)
+                self.evictions += 1
+            self._vectors[slot] = vector
+            self._slot_keys[slot] = key
+            self._entries[key] = (partition, slot, documents, time.time())
+
+    def invalidate(self, version: Hashable = None):
+        """
+        Remove every entry if the version of the index changed.
+
+        Parameters
+        ----------
+        version: Hashable, optional
+            The version of the index the queries are answered from. If None,
+            the entries are removed whatever the version.
+        """
+        with self._lock:
+            if version is not None and version == self.version:
+                return
+            self.version = version
+            if self._entries:
+                self.invalidations += 1
+                self._reset(self._vectors.shape[1])
+
+    def stats(self) -> dict:
+        """
+        Report the usage of the cache.
+
+        Returns
+        -------
+        dict
+            The exact and similar hits, the misses, the hit rate, and the
+            number of entries, evictions and invalidations.
+        """
+        hits = self.exact_hits + self.similar_hits
+        n_lookup = hits + self.misses
+        return {'exact_hits': self.exact_hits,
+                'similar_hits': self.similar_hits,
+                'misses': self.misses,
+                'hit_rate': hits / n_lookup if n_lookup else 0.0,
+                'entries': len(self._entries),
+                'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+    def _expired(self, entry: tuple) -> bool:
+        """
+        Check if an entry outlived the time to live, removing it if so.
+        """
+        if self.ttl_seconds is None \
+                or time.time() - entry[3] <= self.ttl_seconds:
+            return False
+        key = self._slot_keys[entry[1]]
+        self._entries.pop(key, None)
+        self._free(entry[1])
+        return True
+
+    def _free(self, slot: int):
+        """
+        Release the slot of an entry.
+        """
+        self._vectors[slot] = 0
+        self._slot_keys[slot] = None
+
+    def _reset(self, dimension: int):
+        """
+        Remove every entry, with slots of the given dimension.
+        """
+        self._entries.clear()
+        self._vectors = np.zeros((self.max_entries, dimension),
+                                 dtype=np.float32)
+        self._slot_keys = [None] * self.max_entries
+
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        """
+        Normalize a vector to unit length.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
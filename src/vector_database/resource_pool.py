@@ -0,0 +1,170 @@
+import time, threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+from ..shared import rss_bytes
+
+MAX_POOL_ENTRIES = 32
+MAX_POOL_BYTES = 4 * 2 ** 30
+
+
+class ResourcePool:
+    """
+    A process-wide pool of the components of the chatbot, e.g. the LLM, the
+    embedding model or the agent, built once per key and shared by every
+    session. A component is built by a single thread even if several sessions
+    ask for it at once. The least recently used components are released when
+    the pool holds too many of them or too much memory, estimated by the
+    growth of the resident memory while building them.
+    """
+    def __init__(self,
+                 max_entries: int = MAX_POOL_ENTRIES,
+                 max_bytes: Optional[int] = MAX_POOL_BYTES):
+        """
+        Initialize a new ResourcePool.
+
+        Parameters
+        ----------
+        max_entries: int, optional
+            The maximum number of components. Defaults to 32.
+        max_bytes: Optional[int], optional
+            The maximum memory of the components, None for no limit.
+            Defaults to 4 GiB.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        # key -> (component, bytes, build seconds), least recently used first
+        self._entries = OrderedDict()
+        self._local = threading.local()
+
+    def get(self, key: Tuple[Hashable, ...], build_fn: Callable[[], Any]) -> Any:
+        """
+        Retrieve a component, building it the first time.
+
+        Parameters
+        ----------
+        key: Tuple[Hashable, ...]
+            The key of the component, e.g. ("llm", ModelType.CHATGPTSTANDARD).
+        build_fn: Callable[[], Any]
+            Builds the component. It may get other components from the pool.
+
+        Returns
+        -------
+        Any
+            The component.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._entries:  # built by another session
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+            # the components built inside build_fn are not counted twice
+            nested = getattr(self._local, 'n_byte', 0)
+            self._local.n_byte = 0
+            start, start_rss = time.perf_counter(), rss_bytes()
+            try:
+                component = build_fn()
+            finally:
+                n_nested_byte = self._local.n_byte
+                self._local.n_byte = nested
+            n_byte = max(rss_bytes() - start_rss - n_nested_byte, 0)
+            self._local.n_byte = nested + n_nested_byte + n_byte
+            with self._lock:
+                self._entries[key] = (component, n_byte,
+                                      time.perf_counter() - start)
+                self.misses += 1
+                self._evict(keep=key)
+                self._key_locks.pop(key, None)
+        return component
+
+    def invalidate(self, *parts: Hashable) -> int:
+        """
+        Release the components whose key holds all the given parts, e.g.
+        every component of a country, or all of them if no part is given.
+
+        Parameters
+        ----------
+        *parts: Hashable
+            The parts of the keys.
+
+        Returns
+        -------
+        int
+            The number of released components.
+        """
+        with self._lock:
+            keys = [key for key in self._entries
+                    if all(part in key for part in parts)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def entries(self) -> List[dict]:
+        """
+        List the components of the pool, least recently used first.
+
+        Returns
+        -------
+        List[dict]
+            The key, the estimated bytes and the build seconds of every
+            component.
+        """
+        with self._lock:
+            return [{'key': key, 'bytes': n_byte, 'build_seconds': seconds}
+                    for key, (_, n_byte, seconds) in self._entries.items()]
+
+    def stats(self) -> dict:
+        """
+        Report the usage of the pool.
+
+        Returns
+        -------
+        dict
+            The hits, misses, hit rate and evictions, and the number of
+            components and their estimated bytes.
+        """
+        with self._lock:
+            n_byte = sum(n_byte for _, n_byte, _ in self._entries.values())
+            n_entry = len(self._entries)
+        n_lookup = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / n_lookup if n_lookup else 0.0,
+                'evictions': self.evictions,
+                'entries': n_entry,
+                'bytes': n_byte}
+
+    def _evict(self, keep: Hashable):
+        """
+        Release the least recently used components, except the given one,
+        until the pool fits.
+        """
+        def too_large():
+            if len(self._entries) > self.max_entries:
+                return True
+            return self.max_bytes is not None and sum(
+                n_byte for _, n_byte, _ in self._entries.values()
+            ) > self.max_bytes
+
+        while len(self._entries) > 1 and too_large():
+            key = next(iter(self._entries))
+            if key == keep:
+                self._entries.move_to_end(key)
+                key = next(iter(self._entries))
+            del self._entries[key]
+            self.evictions += 1
+
+
+# the pool shared by the sessions of the process
+RESOURCE_POOL = ResourcePool()
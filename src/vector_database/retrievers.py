@@ -0,0 +1,259 @@
+import re, json, time
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from .bm25 import BM25Index
+from .metadata_index import MetadataIndex
+from .query_cache import QueryCache
+from typing import Callable, Dict, Hashable, List, Optional
+
+_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int,
+                           rrf_k: int = 60) -> List[Document]:
+    """
+    Fuse rankings of documents: every document scores
+    sum(1 / (rrf_k + rank)) over the rankings it appears in.
+
+    Parameters
+    ----------
+    rankings: List[List[Document]]
+        The rankings, best first.
+    k: int
+        The number of documents kept.
+    rrf_k: int, optional
+        The constant damping the top ranks. Defaults to 60.
+
+    Returns
+    -------
+    List[Document]
+        The fused top-k documents, best first.
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = document.metadata.get('hotel_id', document.page_content)
+            scores[key] = scores.get(key, 0.0) + 1 / (rrf_k + rank)
+            documents.setdefault(key, document)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    A retriever fusing the vector search and the BM25 search with reciprocal
+    rank fusion, so exact hotel names and postal codes found by BM25 are kept
+    next to the semantic matches.
+    """
+    vector_store: VectorStore
+    bm25_index: BM25Index
+    k: int = 4
+    fetch_k: int = 20  # documents taken from every ranking before the fusion
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+            self, query: str, *,
+            run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.search(query)
+
+    def search(self, query: str,
+               query_vector: Optional[List[float]] = None) -> List[Document]:
+        """
+        Retrieve the documents of a question.
+
+        Parameters
+        ----------
+        query: str
+            The question.
+        query_vector: Optional[List[float]], optional
+            The embedding of the question, computed here if not given.
+
+        Returns
+        -------
+        List[Document]
+            The fused top-k documents, best first.
+        """
+        if query_vector is None:
+            query_vector = self.vector_store.embeddings.embed_query(query)
+        return reciprocal_rank_fusion(
+            [self.vector_store.similarity_search_by_vector(query_vector,
+                                                           k=self.fetch_k),
+             [document for document, _ in
+              self.bm25_index.search(query, k=self.fetch_k)]],
+            self.k, self.rrf_k)
+
+
+class FilteredRetriever(BaseRetriever):
+    """
+    A retriever narrowing the candidate hotels with the metadata indexes
+    before ranking them by similarity. The filter is the given one combined
+    with the constraints found in the question, e.g. "hotels in London rated
+    above 9", which are dropped if no hotel matches them. With a BM25 index,
+    the ranking is fused with the BM25 one.
+    """
+    vector_store: VectorStore
+    metadata_index: MetadataIndex
+    # searches the vector store with the query embedding among the given
+    # hotel IDs only
+    candidate_search: Callable[[VectorStore, List[float], int, List[str]],
+                               List[Document]]
+    bm25_index: Optional[BM25Index] = None
+    filter: dict = {}
+    parse_query: bool = True
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+            self, query: str, *,
+            run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.search(query)
+
+    def search(self, query: str,
+               query_vector: Optional[List[float]] = None,
+               query_filter: Optional[dict] = None) -> List[Document]:
+        """
+        Retrieve the documents of a question.
+
+        Parameters
+        ----------
+        query: str
+            The question.
+        query_vector: Optional[List[float]], optional
+            The embedding of the question, computed here if not given.
+        query_filter: Optional[dict], optional
+            The filter of the question, as given by `query_filter`, computed
+            here if not given.
+
+        Returns
+        -------
+        List[Document]
+            The top-k documents, best first.
+        """
+        if query_filter is None:
+            query_filter = self.query_filter(query)
+        n_fetch = self.k if self.bm25_index is None else self.fetch_k
+        hotel_ids = self._candidates(query_filter)
+        if hotel_ids == [] and self.parse_query:
+            # the constraints read in the question match no hotel, e.g. a
+            # number that is not a score: search without them
+            hotel_ids = self._candidates(self.filter)
+        if hotel_ids == []:
+            return []
+
+        if query_vector is None:
+            query_vector = self.vector_store.embeddings.embed_query(query)
+        if hotel_ids is not None:
+            rankings = [self.candidate_search(self.vector_store, query_vector,
+                                              n_fetch, hotel_ids)]
+        else:
+            rankings = [self.vector_store.similarity_search_by_vector(
+                query_vector, k=n_fetch)]
+        if self.bm25_index is None:
+            return rankings[0][:self.k]
+        rankings.append([document for document, _ in self.bm25_index.search(
+            query, k=n_fetch, hotel_ids=hotel_ids)])
+        return reciprocal_rank_fusion(rankings, self.k, self.rrf_k)
+
+    def query_filter(self, query: str) -> dict:
+        """
+        Get the filter of a question: the given filter combined with the
+        constraints found in the question.
+
+        Parameters
+        ----------
+        query: str
+            The question.
+
+        Returns
+        -------
+        dict
+            The filter, empty if there is none.
+        """
+        parsed = self.metadata_index.parse_filter(query) \
+            if self.parse_query else {}
+        if self.filter and parsed:
+            return {'$and': [self.filter, parsed]}
+        return parsed or self.filter
+
+    def _candidates(self, where: dict) -> Optional[List[str]]:
+        """
+        Get the IDs of the hotels matching a filter, None if there is none.
+        """
+        return self.metadata_index.filter(where) if where else None
+
+
+class CachedRetriever(BaseRetriever):
+    """
+    A retriever answering the repeated and near-duplicate queries from a
+    query cache, and the others with the wrapped retriever. The cache is
+    emptied whenever the version of the index changes.
+
+    Only the queries with the same numbers and the same metadata filter are
+    near-duplicates, so "hotels rated above 8" never gets the hotels above 9.
+    On a miss, the hybrid and filtered retrievers are given the query
+    embedding and the filter computed for the lookup, so neither is computed
+    twice.
+    """
+    retriever: BaseRetriever
+    embedding_model: Embeddings
+    cache: QueryCache
+    # the version of the index the retriever searches, e.g. its data
+    # fingerprint
+    index_version: Optional[Callable[[], Hashable]] = None
+    # the minimum seconds between two checks of the version
+    version_check_seconds: float = 1.0
+    _version_checked: Optional[float] = PrivateAttr(default=None)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+            self, query: str, *,
+            run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        self._check_version()
+        query_filter = self.retriever.query_filter(query) \
+            if isinstance(self.retriever, FilteredRetriever) else None
+        partition = (tuple(_NUMBER_PATTERN.findall(query)),
+                     json.dumps(query_filter, sort_keys=True)
+                     if query_filter is not None else None)
+        documents = self.cache.get_exact(query, partition)
+        if documents is None:
+            query_vector = self.embedding_model.embed_query(query)
+            documents = self.cache.get_similar(query_vector, partition)
+            if documents is None:
+                if isinstance(self.retriever, FilteredRetriever):
+                    documents = self.retriever.search(query, query_vector,
+                                                      query_filter)
+                elif isinstance(self.retriever, HybridRetriever):
+                    documents = self.retriever.search(query, query_vector)
+                else:
+                    documents = self.retriever.invoke(
+                        query, config={'callbacks': run_manager.get_child()})
+                self.cache.put(query, query_vector, documents, partition)
+        return list(documents)
+
+    def _check_version(self):
+        """
+        Empty the cache if the version of the index changed, checking it at
+        most every `version_check_seconds`.
+        """
+        if self.index_version is None:
+            return
+        now = time.monotonic()
+        if self._version_checked is not None \
+                and now - self._version_checked < self.version_check_seconds:
+            return
+        self._version_checked = now
+        self.cache.invalidate(self.index_version())
@@ -0,0 +1,338 @@
+import os, re, json, shutil
+import numpy as np
+from langchain_core.documents import Document
+from .gazetteer import GAZETTEER, normalize_place
+from typing import Dict, List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * np.pi / 180
+_KEY_OFFSET = 1 << 24  # keeps the cell coordinates positive in the keys
+_MAX_PLACE_NGRAM = 6  # the longest place name, in tokens
+_COORDINATES_PATTERN = re.compile(
+    r"(-?\d{1,2}\.\d+)\s*,\s*(-?\d{1,3}\.\d+)")
+# the fields of the hotels kept to answer the queries
+HOTEL_FIELDS = ('hotel_id', 'Hotel_Name', 'City', 'Postal_Code',
+                'Average_Score')
+
+
+def haversine_km(lat: float, lng: float, lats: np.ndarray,
+                 lngs: np.ndarray) -> np.ndarray:
+    """
+    Compute the great-circle distances from a point to other points.
+
+    Parameters
+    ----------
+    lat: float
+        The latitude of the point, in degrees.
+    lng: float
+        The longitude of the point, in degrees.
+    lats: np.ndarray
+        The latitudes of the other points, in degrees.
+    lngs: np.ndarray
+        The longitudes of the other points, in degrees.
+
+    Returns
+    -------
+    np.ndarray
+        The distances, in kilometres.
+    """
+    lat, lng = np.radians(lat), np.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2) ** 2 \
+        + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpatialIndex:
+    """
+    A grid index of the hotel coordinates. The hotels are sorted by the key of
+    their cell, so a radius or a k-nearest query only computes the distances
+    of the hotels in the cells around the point instead of all of them.
+
+    The index also knows the places it can resolve offline: the hotel names,
+    the cities and the postal codes of the data, and the landmarks of the
+    gazetteer.
+    """
+    CELL_DEGREES = 0.01  # about 1 km of latitude
+    INDEX_FILE_NAME = "spatial.npz"
+    HOTELS_FILE_NAME = "hotels.json"
+
+    def __init__(self,
+                 hotels: List[dict],
+                 coordinates: np.ndarray,
+                 places: Dict[str, Tuple[float, float]],
+                 cell_degrees: float = CELL_DEGREES):
+        """
+        Initialize a new SpatialIndex.
+
+        Parameters
+        ----------
+        hotels: List[dict]
+            The fields of every hotel.
+        coordinates: np.ndarray
+            The latitude and longitude of every hotel, in degrees, of shape
+            (n_hotel, 2).
+        places: Dict[str, Tuple[float, float]]
+            The coordinates of the places of the data, by normalized name.
+        cell_degrees: float, optional
+            The size of the cells, in degrees.
+        """
+        self.hotels = hotels
+        self.coordinates = np.asarray(coordinates, dtype=np.float64)
+        self.places = places
+        self.cell_degrees = cell_degrees
+        keys = self._keys(*self._cells(self.coordinates[:, 0],
+                                       self.coordinates[:, 1]))
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    @classmethod
+    def from_documents(cls, documents: List[Document],
+                       cell_degrees: float = CELL_DEGREES) -> "SpatialIndex":
+        """
+        Build the index of the hotels of documents.
+
+        Parameters
+        ----------
+        documents: List[Document]
+            The documents, with the hotel ID and the typed fields in their
+            metadata. The hotels without coordinates are left out.
+        cell_degrees: float, optional
+            The size of the cells, in degrees. Defaults to 0.01.
+
+        Returns
+        -------
+        SpatialIndex
+            The index.
+        """
+        documents = [document for document in documents
+                     if document.metadata.get('lat') is not None
+                     and document.metadata.get('lng') is not None]
+        hotels = [{field: document.metadata[field] for field in HOTEL_FIELDS
+                   if field in document.metadata} for document in documents]
+        coordinates = np.array([(document.metadata['lat'],
+                                 document.metadata['lng'])
+                                for document in documents],
+                               dtype=np.float64).reshape(-1, 2)
+
+        # the cities and the postal districts are located at the centroid of
+        # their hotels, e.g. "W1" for "W1K 1AB", the hotels at their own place
+        groups = {}
+        for hotel, point in zip(hotels, coordinates):
+            postal_code = hotel.get('Postal_Code', "")
+            for name in (hotel.get('City'), postal_code,
+                         postal_code.split(" ")[0]):
+                if name:
+                    groups.setdefault(normalize_place(name), []).append(point)
+        places = {name: tuple(np.mean(points, axis=0).round(6).tolist())
+                  for name, points in groups.items() if name}
+        for hotel, point in zip(hotels, coordinates):
+            places[normalize_place(hotel['Hotel_Name'])] = tuple(point.tolist())
+        return cls(hotels, coordinates, places, cell_degrees)
+
+    def nearest(self, lat: float, lng: float,
+                k: int = 5) -> List[Tuple[dict, float]]:
+        """
+        Find the k hotels nearest to a point. The rings of cells around the
+        point are visited until no unvisited cell can hold a nearer hotel.
+
+        Parameters
+        ----------
+        lat: float
+            The latitude of the point, in degrees.
+        lng: float
+            The longitude of the point, in degrees.
+        k: int, optional
+            The number of hotels. Defaults to 5.
+
+        Returns
+        -------
+        List[Tuple[dict, float]]
+            The hotels and their distance in kilometres, nearest first.
+        """
+        if k < 1 or not self.hotels:
+            return []
+        row, col = self._cells(lat, lng)
+        candidates = []
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > len(self.hotels):
+                # more cells than hotels: computing every distance is cheaper
+                return self._ranked(lat, lng, np.arange(len(self.hotels)), k)
+            if ring == 0:
+                rows, cols = np.array([row]), np.array([col])
+            else:
+                side = np.arange(-ring, ring + 1)
+                inner = side[1:-1]
+                rows = row + np.concatenate(
+                    [np.full(len(side), -ring), np.full(len(side), ring),
+                     inner, inner])
+                cols = col + np.concatenate(
+                    [side, side, np.full(len(inner), -ring),
+                     np.full(len(inner), ring)])
+            candidates.append(self._positions(rows, cols))
+            positions = np.concatenate(candidates)
+            if len(positions) >= k:
+                result = self._ranked(lat, lng, positions, k)
+                # the hotels of the unvisited cells are more than `ring` cells
+                # away in latitude or longitude
+                max_lat = min(abs(lat) + (ring + 1) * self.cell_degrees, 89.0)
+                bound = ring * self.cell_degrees * KM_PER_DEGREE \
+                    * np.cos(np.radians(max_lat)) * 0.99
+                if result[-1][1] <= bound:
+                    return result
+            ring += 1
+
+    def within(self, lat: float, lng: float,
+               radius_km: float) -> List[Tuple[dict, float]]:
+        """
+        Find the hotels within a radius of a point.
+
+        Parameters
+        ----------
+        lat: float
+            The latitude of the point, in degrees.
+        lng: float
+            The longitude of the point, in degrees.
+        radius_km: float
+            The radius, in kilometres.
+
+        Returns
+        -------
+        List[Tuple[dict, float]]
+            The hotels and their distance in kilometres, nearest first.
+        """
+        if radius_km < 0 or not self.hotels:
+            return []
+        d_lat = radius_km / KM_PER_DEGREE
+        max_lat = min(abs(lat) + d_lat, 89.0)
+        d_lng = min(d_lat / np.cos(np.radians(max_lat)), 180.0)
+        low_row, low_col = self._cells(lat - d_lat, lng - d_lng)
+        high_row, high_col = self._cells(lat + d_lat, lng + d_lng)
+        n_cell = (high_row - low_row + 1) * (high_col - low_col + 1)
+        if n_cell > len(self.hotels):
+            positions = np.arange(len(self.hotels))
+        else:
+            rows, cols = np.meshgrid(np.arange(low_row, high_row + 1),
+                                     np.arange(low_col, high_col + 1))
+            positions = self._positions(rows.ravel(), cols.ravel())
+        distances = haversine_km(lat, lng, self.coordinates[positions, 0],
+                                 self.coordinates[positions, 1])
+        keep = distances <= radius_km
+        positions, distances = positions[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return [(self.hotels[positions[i]], float(distances[i]))
+                for i in order]
+
+    def locate(self, text: str) -> Optional[Tuple[str, float, float]]:
+        """
+        Resolve the place named in a text: coordinates such as
+        "51.50, -0.12", or the longest hotel name, city, postal code or
+        landmark of the gazetteer it contains.
+
+        Parameters
+        ----------
+        text: str
+            The text naming the place.
+
+        Returns
+        -------
+        Optional[Tuple[str, float, float]]
+            The name, the latitude and the longitude of the place, or None if
+            no place is found.
+        """
+        match = _COORDINATES_PATTERN.search(text)
+        if match:
+            return match.group(0), float(match.group(1)), float(match.group(2))
+        tokens = normalize_place(text).split()
+        # the longest n-gram first, the data before the gazetteer
+        for n in range(min(len(tokens), _MAX_PLACE_NGRAM), 0, -1):
+            for i in range(len(tokens) - n + 1):
+                name = " ".join(tokens[i:i + n])
+                for places in (self.places, GAZETTEER):
+                    if name in places:
+                        return (name, *places[name])
+        return None
+
+    def save(self, path: str):
+        """
+        Save the index, through a temporary directory so that an interrupted
+        save never leaves a partial index.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the index.
+        """
+        tmp_path = f"{path}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        np.savez(os.path.join(tmp_path, self.INDEX_FILE_NAME),
+                 coordinates=self.coordinates)
+        with open(os.path.join(tmp_path, self.HOTELS_FILE_NAME), "w") as f:
+            json.dump({'hotels': self.hotels, 'places': self.places,
+                       'cell_degrees': self.cell_degrees}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SpatialIndex":
+        """
+        Load a saved index.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the index.
+
+        Returns
+        -------
+        SpatialIndex
+            The index.
+        """
+        with np.load(os.path.join(path, cls.INDEX_FILE_NAME)) as arrays:
+            coordinates = arrays['coordinates']
+        with open(os.path.join(path, cls.HOTELS_FILE_NAME)) as f:
+            manifest = json.load(f)
+        places = {name: tuple(point)
+                  for name, point in manifest['places'].items()}
+        return cls(manifest['hotels'], coordinates, places,
+                   manifest['cell_degrees'])
+
+    def _cells(self, lats, lngs) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the row and the column of the cells of points.
+        """
+        return (np.floor(np.asarray(lats) / self.cell_degrees).astype(np.int64),
+                np.floor(np.asarray(lngs) / self.cell_degrees).astype(np.int64))
+
+    @staticmethod
+    def _keys(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """
+        Get the keys of cells.
+        """
+        return (rows + _KEY_OFFSET) * (2 * _KEY_OFFSET) + cols + _KEY_OFFSET
+
+    def _positions(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """
+        Find the hotels of cells by binary search of their keys.
+        """
+        keys = self._keys(rows, cols)
+        starts = np.searchsorted(self.sorted_keys, keys, side='left')
+        ends = np.searchsorted(self.sorted_keys, keys, side='right')
+        return np.concatenate([self.order[start:end]
+                               for start, end in zip(starts, ends)
+                               if end > start] or [np.empty(0, np.int64)])
+
+    def _ranked(self, lat: float, lng: float, positions: np.ndarray,
+                k: int) -> List[Tuple[dict, float]]:
+        """
+        Rank hotels by distance to a point, keeping the k nearest.
+        """
+        distances = haversine_km(lat, lng, self.coordinates[positions, 0],
+                                 self.coordinates[positions, 1])
+        n_top = min(k, len(distances))
+        if n_top == 0:
+            return []
+        top = np.argpartition(distances, n_top - 1)[:n_top]
+        top = top[np.argsort(distances[top], kind='stable')]
+        return [(self.hotels[positions[i]], float(distances[i])) for i in top]
@@ -1,19 +1,150 @@
-import os
-from langchain_community.embeddings import (HuggingFaceEmbeddings,
-                                            OpenAIEmbeddings)
-from langchain_community.vectorstores import Chroma
-from langchain.document_loaders.csv_loader import CSVLoader
+from __future__ import annotations
+import os, json, time, shutil, hashlib, warnings, weakref
+from functools import partial
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+from .bm25 import BM25Index
+from .index_builder import IndexBuilder
+from .index_registry import (IndexRegistry, data_fingerprint,
+                             embedding_model_name)
+from .index_type import FaissIndexType, QuantizationType
+from .metadata_index import MetadataIndex
+from .numpy_store import NumpyVectorStore
+from .query_cache import QueryCache
+from .retrievers import CachedRetriever, FilteredRetriever, HybridRetriever
+from .spatial_index import SpatialIndex
+from ..data_preparation.manifest import hotel_id
 from abc import abstractmethod
-from typing import Union
+from typing import Dict, List, Optional, Set, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # the backends are imported once a database of their kind is used
+    import chromadb
+    from langchain_community.embeddings import (HuggingFaceEmbeddings,
+                                                OpenAIEmbeddings)
+    from langchain_community.vectorstores import Chroma, FAISS
 
 DATA_DIR = os.path.join(os.path.dirname(os.getcwd()), 'data')
+_REGISTRIES = {}  # database directory -> IndexRegistry
+_CHROMA_CLIENTS = {}  # database directory -> chromadb client
+_FAISS_POSITIONS = weakref.WeakKeyDictionary()  # FAISS -> {hotel ID: row}
+# the typed metadata of the documents, in addition to their content
+METADATA_FIELDS = {
+    'Hotel_Name': str,
+    'City': str,
+    'Postal_Code': str,
+    'Average_Score': float,
+    'lat': float,
+    'lng': float,
+}
+
+
+def processed_data_path(country: str) -> str:
+    """
+    Get the path of the processed data of a country.
+
+    Parameters
+    ----------
+    country: str
+        The desired country.
+
+    Returns
+    -------
+    str
+        The path of the processed data.
+    """
+    return os.path.join(DATA_DIR, f"processed/{country}_processed_df.parquet")
+
+
+def load_documents(country: str,
+                   hotel_ids: Optional[List[str]] = None) -> List[Document]:
+    """
+    Load the processed data of a country as documents, one per hotel, with
+    the same "column: value" content as a CSV loader would give, and the
+    hotel fields as typed metadata.
+
+    Parameters
+    ----------
+    country: str
+        The desired country.
+    hotel_ids: Optional[List[str]], optional
+        If given, only the documents of these hotels are loaded.
+
+    Returns
+    -------
+    List[Document]
+        The documents, with the hotel ID, the typed fields and the list of
+        tags in their metadata.
+    """
+    data_path = processed_data_path(country)
+    df = pd.read_parquet(data_path)
+    for col in df.select_dtypes('float32'):
+        # the shortest decimal of every float32, e.g. 8.4, not 8.3999996
+        df[col] = [None if np.isnan(value) else str(value)
+                   for value in df[col].to_numpy()]
+    typed_rows = df.to_dict(orient='records')
+    df = df.astype(object).where(df.notna(), "")
+    documents = []
+    for i, (row, typed_row) in enumerate(zip(df.to_dict(orient='records'),
+                                             typed_rows)):
+        row_hotel_id = hotel_id(row['Hotel_Name'])
+        if hotel_ids is not None and row_hotel_id not in hotel_ids:
+            continue
+        documents.append(Document(
+            page_content="\n".join(f"{col}: {str(value).strip()}"
+                                   for col, value in row.items()),
+            metadata={"source": data_path, "row": i,
+                      "hotel_id": row_hotel_id,
+                      **typed_metadata(typed_row)}))
+    return documents
+
+
+def typed_metadata(row: dict) -> dict:
+    """
+    Get the typed metadata of a hotel from its processed data.
+
+    Parameters
+    ----------
+    row: dict
+        The processed data of the hotel.
+
+    Returns
+    -------
+    dict
+        The fields of METADATA_FIELDS that are not missing, and the list of
+        tags.
+    """
+    metadata = {}
+    for field, field_type in METADATA_FIELDS.items():
+        value = row.get(field)
+        if value is None or pd.isna(value):
+            continue
+        metadata[field] = field_type(str(value).strip())
+    tags = row.get('Clean_Tags')
+    if isinstance(tags, str):
+        metadata['tags'] = [tag.strip() for tag in tags.split(",")
+                            if tag.strip()]
+    return metadata
+
+
+def _import_faiss():
+    """
+    Import faiss, once a FAISS index is used.
+    """
+    from langchain_community.vectorstores.faiss import dependable_faiss_import
+    return dependable_faiss_import()
 
 
 class VectorDatabase:
     """
     The base class for vector database that stores the documents for retriever
-    tool.
+    tool. Every embedding model, country and version of the processed data
+    has its own index, recorded in the registry of the database.
     """
+    BUILD_BATCH_SIZE = 256  # documents embedded and written at once
+    BUILD_N_WORKER = None  # embedding processes, defaults to the CPU count
+
     @classmethod
     @abstractmethod
     def get(cls,
@@ -24,6 +155,17 @@ class VectorDatabase:
         """
         pass
 
+    @classmethod
+    @abstractmethod
+    def update(cls,
+               embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings],
+               country: str,
+               hotel_ids: List[str]):
+        """
+        Re-embed the documents of the given hotels only.
+        """
+        pass
+
     @classmethod
     @abstractmethod
     def _create_db(cls,
@@ -38,6 +180,298 @@ class VectorDatabase:
                                              OpenAIEmbeddings]):
         pass
 
+    @classmethod
+    @abstractmethod
+    def _root_path(cls) -> str:
+        """
+        Get the directory of the database, which holds every index.
+        """
+        pass
+
+    @classmethod
+    def get_bm25(cls, country: str) -> BM25Index:
+        """
+        Retrieve the BM25 index of the processed data of a country, which is
+        built once and saved next to the vector indexes.
+
+        Parameters
+        ----------
+        country: str
+            The desired country.
+
+        Returns
+        -------
+        BM25Index
+            The BM25 index.
+        """
+        return cls._get_data_index(country, BM25Index, "bm25")
+
+    @classmethod
+    def get_metadata_index(cls, country: str) -> MetadataIndex:
+        """
+        Retrieve the metadata indexes of the processed data of a country,
+        which are built once and saved next to the vector indexes.
+
+        Parameters
+        ----------
+        country: str
+            The desired country.
+
+        Returns
+        -------
+        MetadataIndex
+            The metadata indexes.
+        """
+        return cls._get_data_index(country, MetadataIndex, "metadata")
+
+    @classmethod
+    def get_spatial_index(cls, country: str) -> SpatialIndex:
+        """
+        Retrieve the grid index of the hotel coordinates of the processed data
+        of a country, which is built once and saved next to the vector
+        indexes.
+
+        Parameters
+        ----------
+        country: str
+            The desired country.
+
+        Returns
+        -------
+        SpatialIndex
+            The spatial index.
+        """
+        return cls._get_data_index(country, SpatialIndex, "spatial")
+
+    @classmethod
+    def get_hybrid_retriever(cls,
+                             embedding_model: Union[HuggingFaceEmbeddings,
+                                                    OpenAIEmbeddings],
+                             country: str,
+                             k: int = 4,
+                             query_cache: Optional[QueryCache] = None,
+                             **kwargs) -> Union[HybridRetriever,
+                                                CachedRetriever]:
+        """
+        Retrieve a retriever fusing the vector search and the BM25 search.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        country: str
+            The desired country.
+        k: int, optional
+            The number of documents retrieved. Defaults to 4.
+        query_cache: Optional[QueryCache], optional
+            If given, the repeated and near-duplicate queries are answered
+            from this cache.
+        **kwargs
+            The other arguments of `get`, e.g. the type of FAISS index.
+
+        Returns
+        -------
+        Union[HybridRetriever, CachedRetriever]
+            The hybrid retriever, behind the query cache if there is one.
+        """
+        return cls._cached(HybridRetriever(
+            vector_store=cls.get(embedding_model, country, **kwargs),
+            bm25_index=cls.get_bm25(country),
+            k=k), embedding_model, country, query_cache)
+
+    @classmethod
+    def get_filtered_retriever(cls,
+                               embedding_model: Union[HuggingFaceEmbeddings,
+                                                      OpenAIEmbeddings],
+                               country: str,
+                               k: int = 4,
+                               filter: Optional[dict] = None,
+                               parse_query: bool = True,
+                               hybrid: bool = True,
+                               query_cache: Optional[QueryCache] = None,
+                               **kwargs) -> Union[FilteredRetriever,
+                                                  CachedRetriever]:
+        """
+        Retrieve a retriever narrowing the candidate hotels by metadata
+        before ranking them by similarity.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        country: str
+            The desired country.
+        k: int, optional
+            The number of documents retrieved. Defaults to 4.
+        filter: Optional[dict], optional
+            The filter always applied, e.g. {"Average_Score": {"$gte": 8}}.
+        parse_query: bool, optional
+            If True, the cities, postal codes and score bounds named in the
+            questions are applied as filters too. Defaults to True.
+        hybrid: bool, optional
+            If True, the ranking is fused with the BM25 one. Defaults to True.
+        query_cache: Optional[QueryCache], optional
+            If given, the repeated and near-duplicate queries are answered
+            from this cache.
+        **kwargs
+            The other arguments of `get`, e.g. the type of FAISS index.
+
+        Returns
+        -------
+        Union[FilteredRetriever, CachedRetriever]
+            The filtered retriever, behind the query cache if there is one.
+        """
+        return cls._cached(FilteredRetriever(
+            vector_store=cls.get(embedding_model, country, **kwargs),
+            metadata_index=cls.get_metadata_index(country),
+            candidate_search=cls._candidate_search,
+            bm25_index=cls.get_bm25(country) if hybrid else None,
+            filter=filter or {},
+            parse_query=parse_query,
+            k=k), embedding_model, country, query_cache)
+
+    @classmethod
+    def indexes(cls) -> List[dict]:
+        """
+        List the indexes of the database.
+
+        Returns
+        -------
+        List[dict]
+            The manifest entry of every index, with the embedding model, the
+            country, the data fingerprint, the dimension and the build stats.
+        """
+        return cls._registry().entries()
+
+    @classmethod
+    def unload(cls):
+        """
+        Release the indexes kept loaded by the database.
+        """
+        cls._registry().unload()
+
+    @classmethod
+    @abstractmethod
+    def _candidate_search(cls, vector_db, query_vector: List[float], k: int,
+                          hotel_ids: List[str]) -> List[Document]:
+        """
+        Search the vector database among the given hotels only, with the
+        embedding of the query.
+        """
+        pass
+
+    @classmethod
+    def _cached(cls, retriever,
+                embedding_model: Union[HuggingFaceEmbeddings,
+                                       OpenAIEmbeddings],
+                country: str,
+                query_cache: Optional[QueryCache]):
+        """
+        Put a retriever behind a query cache, which is emptied whenever the
+        index of the current processed data changes, the data fingerprint
+        being checked at most every second.
+        """
+        if query_cache is None:
+            return retriever
+        return CachedRetriever(
+            retriever=retriever,
+            embedding_model=embedding_model,
+            cache=query_cache,
+            index_version=partial(cls._index_key, embedding_model, country))
+
+    @classmethod
+    def _get_data_index(cls, country: str, index_cls, prefix: str):
+        """
+        Retrieve an index built from the documents of the processed data of a
+        country, keyed by the data fingerprint, building and saving it the
+        first time.
+
+        Parameters
+        ----------
+        country: str
+            The desired country.
+        index_cls: Union[Type[BM25Index], Type[MetadataIndex],
+                         Type[SpatialIndex]]
+            The class of the index.
+        prefix: str
+            The prefix of the index name.
+
+        Returns
+        -------
+        Union[BM25Index, MetadataIndex, SpatialIndex]
+            The index.
+        """
+        fingerprint = data_fingerprint(processed_data_path(country))
+        name = f"{prefix}_" + hashlib.sha1(
+            f"{country}|{fingerprint}".encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(cls._root_path(), name)
+
+        def load():
+            if not cls._check_path_exist(path):
+                print(f"[INFO] Building the {prefix} index of {country}.")
+                index_cls.from_documents(load_documents(country)).save(path)
+            return index_cls.load(path)
+
+        return cls._registry().load(name, load)
+
+    @classmethod
+    def _registry(cls) -> IndexRegistry:
+        """
+        Get the registry of the indexes of the database.
+        """
+        path = cls._root_path()
+        if path not in _REGISTRIES:
+            _REGISTRIES[path] = IndexRegistry(path)
+        return _REGISTRIES[path]
+
+    @classmethod
+    def _index_key(cls,
+                   embedding_model: Union[HuggingFaceEmbeddings,
+                                          OpenAIEmbeddings],
+                   country: str) -> Tuple[str, str, str]:
+        """
+        Get the key of the index of the current processed data.
+
+        Returns
+        -------
+        Tuple[str, str, str]
+            The embedding model name, the country and the data fingerprint.
+        """
+        return (embedding_model_name(embedding_model), country,
+                data_fingerprint(processed_data_path(country)))
+
+    @classmethod
+    def _index_builder(cls) -> IndexBuilder:
+        """
+        Create the builder streaming the documents into the database.
+        """
+        return IndexBuilder(batch_size=cls.BUILD_BATCH_SIZE,
+                            n_worker=cls.BUILD_N_WORKER)
+
+    @staticmethod
+    def _dirty_hotel_ids(stored_contents: Dict[str, str],
+                         documents: List[Document]) -> Set[str]:
+        """
+        Find the hotels whose document changed, appeared or disappeared.
+
+        Parameters
+        ----------
+        stored_contents: Dict[str, str]
+            The content of every stored document, by hotel ID.
+        documents: List[Document]
+            The documents of the processed data.
+
+        Returns
+        -------
+        Set[str]
+            The IDs of the dirty hotels.
+        """
+        contents = {document.metadata['hotel_id']: document.page_content
+                    for document in documents}
+        dirty = {doc_id for doc_id, content in contents.items()
+                 if stored_contents.get(doc_id) != content}
+        return dirty | (set(stored_contents) - set(contents))
+
     @staticmethod
     def _check_path_exist(path) -> bool:
         """
@@ -61,7 +495,9 @@ class VectorDatabase:
 
 class ChromaDB(VectorDatabase):
     """
-    An implementation for Chroma vector database.
+    An implementation for Chroma vector database, with one collection per
+    index. The documents are written batch by batch, and a build that has
+    been interrupted resumes where it stopped.
     """
     CHROMA_DB_PATH = os.path.join(DATA_DIR, "chroma_db")
 
@@ -84,17 +520,24 @@ class ChromaDB(VectorDatabase):
         Chroma
             The Chroma database.
         """
-        if not cls._check_path_exist(cls.CHROMA_DB_PATH):
+        registry = cls._registry()
+        entry = registry.find(*cls._index_key(embedding_model, country))
+        if entry is None:
             print(f"ChromaDB doesn't exist. Creating ChromaDB.")
-            cls._create_db(embedding_model, country)
-        print(f"Loading ChromaDB from {cls.CHROMA_DB_PATH}")
-        return cls._load_db(embedding_model)
+            entry = cls._create_db(embedding_model, country)
+
+        def load() -> Chroma:
+            print(f"Loading ChromaDB {entry['name']} from "
+                  f"{cls.CHROMA_DB_PATH}")
+            return cls._load_db(embedding_model, entry['name'])
+
+        return registry.load(entry['name'], load)
 
     @classmethod
     def _create_db(cls,
                    embedding_model: Union[HuggingFaceEmbeddings,
                                           OpenAIEmbeddings],
-                   country: str):
+                   country: str) -> dict:
         """
         Create and save the vector database.
 
@@ -104,21 +547,89 @@ class ChromaDB(VectorDatabase):
             The embedding model.
         country: str
             The desired country.
+
+        Returns
+        -------
+        dict
+            The manifest entry of the index.
         """
-        os.mkdir(cls.CHROMA_DB_PATH)
-        loader = CSVLoader(
-            file_path=os.path.join(DATA_DIR,
-                                   f"processed/{country}_processed_df.csv"))
-        documents = loader.load()
-        Chroma.from_documents(
-            documents, embedding_model,
-            persist_directory=cls.CHROMA_DB_PATH
-        )
+        registry = cls._registry()
+        key = cls._index_key(embedding_model, country)
+        os.makedirs(cls.CHROMA_DB_PATH, exist_ok=True)
+        documents = load_documents(country)
+        name = registry.index_name(*key)
+        vector_db = cls._load_db(embedding_model, name)
+        collection = cls._collection(name)
+        stats = cls._index_builder().build(
+            embedding_model, documents, cls._add_batch(collection),
+            existing_ids=set(vector_db.get(include=[])['ids']))
+        return registry.register(*key, dimension=cls._dimension(collection),
+                                 stats=stats)
+
+    @classmethod
+    def update(cls,
+               embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings],
+               country: str,
+               hotel_ids: List[str]):
+        """
+        Re-embed the documents of the given hotels only, and of the other
+        hotels whose document changed since the latest index of the embedding
+        model. The vectors of the other hotels are copied into the collection
+        of the current processed data, which replaces the latest index once
+        complete, so an interrupted update leaves the latest index intact and
+        resumes where it stopped. The documents of the hotels that are not in
+        the processed data anymore are left out.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        country: str
+            The desired country.
+        hotel_ids: List[str]
+            The IDs of the dirty hotels, as returned by the data preparation.
+        """
+        registry = cls._registry()
+        key = cls._index_key(embedding_model, country)
+        latest = registry.find_latest(*key[:2])
+        if registry.find(*key) is not None or latest is None:
+            return
+        stored = cls._load_db(embedding_model, latest['name']).get(
+            include=['documents', 'metadatas', 'embeddings'])
+        documents = load_documents(country)
+        dirty = cls._dirty_hotel_ids(
+            dict(zip(stored['ids'], stored['documents'])),
+            documents) | set(hotel_ids)
+        print(f"[INFO] Re-embedding {len(dirty)} hotels in ChromaDB.")
+        # the collection may exist from an interrupted get or update, its
+        # documents are already those of the current processed data
+        name = registry.index_name(*key)
+        existing_ids = set(cls._load_db(embedding_model, name).get(
+            include=[])['ids'])
+        collection = cls._collection(name)
+        kept = [row for row, doc_id in enumerate(stored['ids'])
+                if doc_id not in dirty and doc_id not in existing_ids]
+        for start in range(0, len(kept), cls.BUILD_BATCH_SIZE):
+            rows = kept[start:start + cls.BUILD_BATCH_SIZE]
+            collection.upsert(
+                ids=[stored['ids'][row] for row in rows],
+                embeddings=[stored['embeddings'][row] for row in rows],
+                metadatas=[stored['metadatas'][row] for row in rows],
+                documents=[stored['documents'][row] for row in rows])
+        stats = cls._index_builder().build(
+            embedding_model,
+            [document for document in documents
+             if document.metadata['hotel_id'] in dirty],
+            cls._add_batch(collection), existing_ids=existing_ids)
+        registry.register(*key, dimension=latest['dimension'], stats=stats)
+        registry.remove(latest['name'])
+        cls._client().delete_collection(latest['name'])
 
     @classmethod
     def _load_db(cls,
                  embedding_model: Union[HuggingFaceEmbeddings,
-                                        OpenAIEmbeddings]) -> Chroma:
+                                        OpenAIEmbeddings],
+                 name: str = "langchain") -> Chroma:
         """
         To load the vector database.
 
@@ -126,34 +637,659 @@ class ChromaDB(VectorDatabase):
         ----------
         embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
             The embedding model.
+        name: str, optional
+            The name of the index. Defaults to "langchain".
 
         Returns
         -------
         Chroma
             The Chroma vector database.
         """
-        return Chroma(persist_directory=cls.CHROMA_DB_PATH,
+        from langchain_community.vectorstores import Chroma
+        return Chroma(collection_name=name,
+                      client=cls._client(),
                       embedding_function=embedding_model)
 
+    @classmethod
+    def _client(cls) -> chromadb.ClientAPI:
+        """
+        Get the client of the database directory, shared by the collections.
+        """
+        import chromadb
+        path = cls.CHROMA_DB_PATH
+        if path not in _CHROMA_CLIENTS:
+            _CHROMA_CLIENTS[path] = chromadb.PersistentClient(path=path)
+        return _CHROMA_CLIENTS[path]
+
+    @classmethod
+    def _collection(cls, name: str) -> chromadb.Collection:
+        """
+        Get a collection, to write the vectors embedded by the index builder
+        as they are, which the Chroma vector store would embed again.
+        """
+        return cls._client().get_or_create_collection(
+            name=name, embedding_function=None)
+
+    @classmethod
+    def _root_path(cls) -> str:
+        return cls.CHROMA_DB_PATH
+
+    @classmethod
+    def _candidate_search(cls, vector_db: Chroma, query_vector: List[float],
+                          k: int, hotel_ids: List[str]) -> List[Document]:
+        """
+        Search the collection among the given hotels only, which Chroma
+        applies before the nearest neighbour search.
+        """
+        return vector_db.similarity_search_by_vector(
+            query_vector, k=min(k, len(hotel_ids)),
+            filter={'hotel_id': {'$in': list(hotel_ids)}})
+
+    @staticmethod
+    def _add_batch(collection: chromadb.Collection):
+        """
+        Create the function writing a batch of embedded documents to the
+        collection, under their hotel IDs.
+        """
+        def add_batch(batch: List[Document], vectors: List[List[float]]):
+            collection.upsert(
+                ids=[document.metadata['hotel_id'] for document in batch],
+                embeddings=vectors,
+                # Chroma only stores scalar metadata
+                metadatas=[{key: ", ".join(value) if isinstance(value, list)
+                            else value
+                            for key, value in document.metadata.items()}
+                           for document in batch],
+                documents=[document.page_content for document in batch])
+
+        return add_batch
+
+    @staticmethod
+    def _dimension(collection: chromadb.Collection) -> int:
+        """
+        Get the dimension of the vectors of a collection.
+        """
+        vectors = collection.get(
+            limit=1, include=['embeddings'])['embeddings']
+        return len(vectors[0]) if vectors is not None and len(vectors) else 0
+
 
 class FaissDB(VectorDatabase):
     """
-    An implementation for FAISS database.
+    An implementation for FAISS database. The vectors are L2-normalized and
+    searched by inner product (cosine similarity). The index is memory-mapped
+    when loaded, so it is not copied into RAM at startup.
     """
     FAISS_DB_PATH = os.path.join(DATA_DIR, "faiss_db")
+    INDEX_FILE_NAME = "index.faiss"
+    DOCSTORE_FILE_NAME = "docstore.json"
+    HNSW_M = 32  # number of neighbours per node of the HNSW graph
+    HNSW_EF_SEARCH = 64
+    IVF_N_PROBE = 8
+    # the drop of the similarity to the IVF centroids that retrains them
+    IVF_DRIFT_TOLERANCE = 0.05
 
     @classmethod
-    def get(cls, embedding_model, country):
-        pass
+    def get(cls,
+            embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings],
+            country: str,
+            index_type: FaissIndexType = FaissIndexType.FLAT) -> FAISS:
+        """
+        Retrieve the vector database.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        country: str
+            The desired country.
+        index_type: FaissIndexType, optional
+            The type of FAISS index. Defaults to FaissIndexType.FLAT (exact
+            search).
+
+        Returns
+        -------
+        FAISS
+            The FAISS database.
+        """
+        index_type = FaissIndexType(index_type)
+        registry = cls._registry()
+        entry = registry.find(*cls._index_key(embedding_model, country),
+                              variant=index_type.value)
+        if entry is None:
+            print(f"FaissDB doesn't exist. Creating FaissDB.")
+            entry = cls._create_db(embedding_model, country, index_type)
+
+        def load() -> FAISS:
+            print(f"Loading FaissDB from {cls._db_path(entry['name'])}")
+            return cls._load_db(embedding_model, entry['name'], index_type)
+
+        return registry.load(entry['name'], load)
+
+    @classmethod
+    def update(cls,
+               embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings],
+               country: str,
+               hotel_ids: List[str],
+               index_type: FaissIndexType = FaissIndexType.FLAT):
+        """
+        Re-embed the documents of the given hotels only, and of the other
+        hotels whose document changed since the latest index of the embedding
+        model, which then becomes the index of the current processed data.
+        The latest index is read into memory, as the memory-mapped one is
+        read-only, and its vectors of the dirty hotels are replaced.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        country: str
+            The desired country.
+        hotel_ids: List[str]
+            The IDs of the dirty hotels, as returned by the data preparation.
+        index_type: FaissIndexType, optional
+            The type of FAISS index. Defaults to FaissIndexType.FLAT.
+        """
+        faiss = _import_faiss()
+        index_type = FaissIndexType(index_type)
+        registry = cls._registry()
+        key = cls._index_key(embedding_model, country)
+        latest = registry.find_latest(*key[:2], variant=index_type.value)
+        if registry.find(*key, variant=index_type.value) is not None \
+                or latest is None:
+            return
+        latest_path = cls._db_path(latest['name'])
+        index = faiss.read_index(os.path.join(latest_path,
+                                              cls.INDEX_FILE_NAME))
+        with open(os.path.join(latest_path, cls.DOCSTORE_FILE_NAME)) as f:
+            stored = [Document(**document) for document in json.load(f)]
+        documents = load_documents(country)
+        dirty = cls._dirty_hotel_ids(
+            {document.metadata['hotel_id']: document.page_content
+             for document in stored},
+            documents) | set(hotel_ids)
+        print(f"[INFO] Re-embedding {len(dirty)} hotels in FaissDB.")
+        rows = np.array([i for i, document in enumerate(stored)
+                         if document.metadata['hotel_id'] in dirty],
+                        dtype=np.int64)
+        dirty_documents = [document for document in documents
+                           if document.metadata['hotel_id'] in dirty]
+        builder = cls._index_builder()
+        start = time.perf_counter()
+        vectors = builder.build_vectors(
+            embedding_model, dirty_documents).reshape(-1, index.d)
+        faiss.normalize_L2(vectors)
+        index, retrained = cls._update_index(index, rows, vectors,
+                                             index_type)
+        db_path = cls._db_path(registry.index_name(
+            *key, variant=index_type.value))
+        os.makedirs(db_path, exist_ok=True)
+        faiss.write_index(index, os.path.join(db_path, cls.INDEX_FILE_NAME))
+        with open(os.path.join(db_path, cls.DOCSTORE_FILE_NAME), "w") as f:
+            # the rows kept their order, followed by the added ones
+            json.dump([{'page_content': document.page_content,
+                        'metadata': document.metadata}
+                       for document in stored
+                       if document.metadata['hotel_id'] not in dirty]
+                      + [{'page_content': document.page_content,
+                          'metadata': document.metadata}
+                         for document in dirty_documents], f)
+        registry.remove(latest['name'])
+        shutil.rmtree(latest_path, ignore_errors=True)
+        registry.register(
+            *key, dimension=index.d, variant=index_type.value,
+            stats={'n_document': len(dirty_documents),
+                   'n_batch': -(-len(dirty_documents) // builder.batch_size),
+                   'retrained': retrained,
+                   'seconds': time.perf_counter() - start})
+
+    @classmethod
+    def _update_index(cls, index, rows: np.ndarray, vectors: np.ndarray,
+                      index_type: FaissIndexType):
+        """
+        Replace the vectors at the given rows of an index with new ones,
+        appended at the end.
+
+        A flat index removes the rows with an ID selector. An IVF index keeps
+        the IDs of its vectors on removal, so its kept vectors are added back
+        in order under the trained centroids, which are retrained only if the
+        new vectors drifted from them; an HNSW graph cannot remove vectors,
+        so it is rebuilt from the kept vectors. None is re-embedded.
+
+        Parameters
+        ----------
+        index: faiss.Index
+            The index, read into memory.
+        rows: np.ndarray
+            The rows to remove.
+        vectors: np.ndarray
+            The normalized vectors to add, of shape (n_document, dimension).
+        index_type: FaissIndexType
+            The type of FAISS index.
+
+        Returns
+        -------
+        Tuple[faiss.Index, bool]
+            The updated index, and whether it has been retrained.
+        """
+        faiss = _import_faiss()
+        if index_type == FaissIndexType.FLAT:
+            index.remove_ids(faiss.IDSelectorBatch(rows))
+            index.add(vectors)
+            return index, False
+        if isinstance(index, faiss.IndexIVF):
+            index.make_direct_map()
+        kept = index.reconstruct_batch(
+            np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), rows))
+        all_vectors = np.concatenate([kept, vectors])
+        if index_type == FaissIndexType.IVF \
+                and not cls._ivf_drifted(index, kept, vectors):
+            index.make_direct_map(False)
+            index.reset()
+            index.add(all_vectors)
+            return index, False
+        return (cls._build_index(all_vectors, index_type),
+                index_type == FaissIndexType.IVF)
+
+    @classmethod
+    def _ivf_drifted(cls, index, kept: np.ndarray,
+                     vectors: np.ndarray) -> bool:
+        """
+        Whether the centroids of an IVF index do not fit the updated vectors
+        anymore: the new vectors are further from their nearest centroid than
+        the kept ones by more than the tolerance, or the number of lists is
+        too far from the one of a new build.
+        """
+        n_list = cls._n_list(len(kept) + len(vectors))
+        if not n_list / 2 <= index.nlist <= 2 * n_list:
+            return True
+        if not len(vectors) or not len(kept):
+            return False
+        similarity = {}
+        for name, block in (('kept', kept), ('new', vectors)):
+            scores, _ = index.quantizer.search(block, 1)
+            similarity[name] = float(scores.mean())
+        return similarity['new'] < similarity['kept'] \
+            - cls.IVF_DRIFT_TOLERANCE
 
     @classmethod
     def _create_db(cls,
-                   embedding_model,
-                   country):
-        pass
+                   embedding_model: Union[HuggingFaceEmbeddings,
+                                          OpenAIEmbeddings],
+                   country: str,
+                   index_type: FaissIndexType = FaissIndexType.FLAT) -> dict:
+        """
+        Create and save the vector database.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        country: str
+            The desired country.
+        index_type: FaissIndexType, optional
+            The type of FAISS index. Defaults to FaissIndexType.FLAT.
+
+        Returns
+        -------
+        dict
+            The manifest entry of the index.
+        """
+        faiss = _import_faiss()
+        registry = cls._registry()
+        key = cls._index_key(embedding_model, country)
+        db_path = cls._db_path(registry.index_name(
+            *key, variant=index_type.value))
+        os.makedirs(db_path, exist_ok=True)
+        documents = load_documents(country)
+        builder = cls._index_builder()
+        start = time.perf_counter()
+        vectors = builder.build_vectors(embedding_model, documents)
+        faiss.normalize_L2(vectors)
+        index = cls._build_index(vectors, index_type)
+        faiss.write_index(index, os.path.join(db_path, cls.INDEX_FILE_NAME))
+        with open(os.path.join(db_path, cls.DOCSTORE_FILE_NAME), "w") as f:
+            json.dump([{'page_content': document.page_content,
+                        'metadata': document.metadata}
+                       for document in documents], f)
+        return registry.register(
+            *key, dimension=index.d, variant=index_type.value,
+            stats={'n_document': len(documents),
+                   'n_batch': -(-len(documents) // builder.batch_size),
+                   'seconds': time.perf_counter() - start})
 
     @classmethod
     def _load_db(cls,
                  embedding_model: Union[HuggingFaceEmbeddings,
-                                        OpenAIEmbeddings]):
-        pass
+                                        OpenAIEmbeddings],
+                 name: str,
+                 index_type: FaissIndexType = FaissIndexType.FLAT) -> FAISS:
+        """
+        To load the vector database, memory-mapping the index.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        name: str
+            The name of the index.
+        index_type: FaissIndexType, optional
+            The type of FAISS index. Defaults to FaissIndexType.FLAT.
+
+        Returns
+        -------
+        FAISS
+            The FAISS vector database.
+        """
+        faiss = _import_faiss()
+        db_path = cls._db_path(name)
+        io_flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+        index = faiss.read_index(os.path.join(db_path, cls.INDEX_FILE_NAME),
+                                 io_flags | faiss.IO_FLAG_READ_ONLY)
+        if index_type == FaissIndexType.IVF:
+            index.nprobe = cls.IVF_N_PROBE
+        elif index_type == FaissIndexType.HNSW:
+            index.hnsw.efSearch = cls.HNSW_EF_SEARCH
+        with open(os.path.join(db_path, cls.DOCSTORE_FILE_NAME)) as f:
+            documents = [Document(**document) for document in json.load(f)]
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores import FAISS
+        from langchain_community.vectorstores.utils import DistanceStrategy
+        with warnings.catch_warnings():
+            # the queries still need to be normalized for the inner product
+            warnings.filterwarnings("ignore", "Normalizing L2")
+            return FAISS(
+                embedding_function=embedding_model,
+                index=index,
+                docstore=InMemoryDocstore(
+                    {str(i): document
+                     for i, document in enumerate(documents)}),
+                index_to_docstore_id={i: str(i)
+                                      for i in range(len(documents))},
+                relevance_score_fn=cls._relevance_score,
+                normalize_L2=True,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
+
+    @classmethod
+    def _build_index(cls, vectors: np.ndarray, index_type: FaissIndexType):
+        """
+        Build a FAISS inner-product index.
+
+        Parameters
+        ----------
+        vectors: np.ndarray
+            The normalized vectors, of shape (n_document, dimension).
+        index_type: FaissIndexType
+            The type of FAISS index.
+
+        Returns
+        -------
+        faiss.Index
+            The index containing the vectors.
+
+        Raises
+        ------
+        NotImplementedError
+            If the desired index type has not been implemented.
+        """
+        faiss = _import_faiss()
+        n_vector, dimension = vectors.shape
+        if index_type == FaissIndexType.FLAT:
+            index = faiss.IndexFlatIP(dimension)
+        elif index_type == FaissIndexType.IVF:
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dimension),
+                                       dimension, cls._n_list(n_vector),
+                                       faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+        elif index_type == FaissIndexType.HNSW:
+            index = faiss.IndexHNSWFlat(dimension, cls.HNSW_M,
+                                        faiss.METRIC_INNER_PRODUCT)
+        else:
+            raise NotImplementedError(
+                f"FAISS index {index_type} has not been implemented.")
+        index.add(vectors)
+        return index
+
+    @staticmethod
+    def _n_list(n_vector: int) -> int:
+        """
+        The number of IVF lists: about 4 * sqrt(n), with enough vectors to
+        train each one.
+        """
+        return max(1, min(int(4 * np.sqrt(n_vector)), n_vector // 39))
+
+    @staticmethod
+    def _relevance_score(score: float) -> float:
+        """
+        The inner product of normalized vectors is the cosine similarity.
+        """
+        return score
+
+    @classmethod
+    def _root_path(cls) -> str:
+        return cls.FAISS_DB_PATH
+
+    @classmethod
+    def _candidate_search(cls, vector_db: FAISS, query_vector: List[float],
+                          k: int, hotel_ids: List[str]) -> List[Document]:
+        """
+        Search the index among the given hotels only. Flat and IVF indexes
+        skip the other vectors with an ID selector, probing every IVF list;
+        the candidates of an HNSW index are scored exactly, since the graph
+        search may miss them.
+        """
+        faiss = _import_faiss()
+        if vector_db not in _FAISS_POSITIONS:
+            _FAISS_POSITIONS[vector_db] = {
+                vector_db.docstore.search(doc_id).metadata['hotel_id']: i
+                for i, doc_id in vector_db.index_to_docstore_id.items()}
+        positions = _FAISS_POSITIONS[vector_db]
+        rows = np.array(sorted({positions[doc_id] for doc_id in hotel_ids
+                                if doc_id in positions}), dtype=np.int64)
+        k = min(k, len(rows))
+        if k == 0:
+            return []
+        query_vector = np.array([query_vector], dtype=np.float32)
+        faiss.normalize_L2(query_vector)
+        index = vector_db.index
+        if isinstance(index, faiss.IndexHNSW):
+            scores = index.reconstruct_batch(rows) @ query_vector[0]
+            indices = rows[np.argsort(-scores, kind='stable')[:k]]
+        else:
+            selector = faiss.IDSelectorBatch(rows)
+            if isinstance(index, faiss.IndexIVF):
+                params = faiss.SearchParametersIVF(sel=selector,
+                                                   nprobe=index.nlist)
+            else:
+                params = faiss.SearchParameters(sel=selector)
+            _, indices = index.search(query_vector, k, params=params)
+            indices = indices[0][indices[0] >= 0]
+        return [vector_db.docstore.search(vector_db.index_to_docstore_id[i])
+                for i in indices]
+
+    @classmethod
+    def _db_path(cls, name: str) -> str:
+        """
+        Get the directory of a FAISS index.
+        """
+        return os.path.join(cls.FAISS_DB_PATH, name)
+
+
+class NumpyDB(VectorDatabase):
+    """
+    An implementation for an in-memory NumPy vector database, without any
+    persistence layer. The matrix is saved as a single .npy file and
+    memory-mapped when loaded.
+    """
+    NUMPY_DB_PATH = os.path.join(DATA_DIR, "numpy_db")
+
+    @classmethod
+    def get(cls,
+            embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings],
+            country: str,
+            quantization: QuantizationType = QuantizationType.FLOAT32
+            ) -> NumpyVectorStore:
+        """
+        Retrieve the vector database.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        country: str
+            The desired country.
+        quantization: QuantizationType, optional
+            The type of the matrix held in memory. Defaults to
+            QuantizationType.FLOAT32.
+
+        Returns
+        -------
+        NumpyVectorStore
+            The NumPy vector database.
+        """
+        quantization = QuantizationType(quantization)
+        registry = cls._registry()
+        entry = registry.find(*cls._index_key(embedding_model, country))
+        if entry is None:
+            print(f"NumpyDB doesn't exist. Creating NumpyDB.")
+            entry = cls._create_db(embedding_model, country)
+
+        def load() -> NumpyVectorStore:
+            print(f"Loading NumpyDB from {cls._db_path(entry['name'])}")
+            return cls._load_db(embedding_model, entry['name'], quantization)
+
+        return registry.load(entry['name'], load, quantization.value)
+
+    @classmethod
+    def update(cls,
+               embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings],
+               country: str,
+               hotel_ids: List[str]):
+        """
+        Re-embed the documents of the given hotels only, and of the other
+        hotels whose document changed since the latest index of the embedding
+        model, which then becomes the index of the current processed data.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        country: str
+            The desired country.
+        hotel_ids: List[str]
+            The IDs of the dirty hotels, as returned by the data preparation.
+        """
+        registry = cls._registry()
+        key = cls._index_key(embedding_model, country)
+        latest = registry.find_latest(*key[:2])
+        if registry.find(*key) is not None or latest is None:
+            return
+        vector_db = cls._load_db(embedding_model, latest['name'])
+        documents = load_documents(country)
+        dirty = cls._dirty_hotel_ids(
+            {doc_id: document.page_content for doc_id, document
+             in zip(vector_db.ids, vector_db.documents)},
+            documents) | set(hotel_ids)
+        print(f"[INFO] Re-embedding {len(dirty)} hotels in NumpyDB.")
+        vector_db.delete(ids=list(dirty))
+        dirty_documents = [document for document in documents
+                           if document.metadata['hotel_id'] in dirty]
+        start = time.perf_counter()
+        vector_db.add_documents(
+            dirty_documents,
+            ids=[document.metadata['hotel_id']
+                 for document in dirty_documents])
+        vector_db.save(cls._db_path(registry.index_name(*key)))
+        registry.remove(latest['name'])
+        shutil.rmtree(cls._db_path(latest['name']), ignore_errors=True)
+        registry.register(*key, dimension=latest['dimension'],
+                          stats={'n_document': len(dirty_documents),
+                                 'seconds': time.perf_counter() - start})
+
+    @classmethod
+    def _create_db(cls,
+                   embedding_model: Union[HuggingFaceEmbeddings,
+                                          OpenAIEmbeddings],
+                   country: str) -> dict:
+        """
+        Create and save the vector database.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        country: str
+            The desired country.
+
+        Returns
+        -------
+        dict
+            The manifest entry of the index.
+        """
+        registry = cls._registry()
+        key = cls._index_key(embedding_model, country)
+        documents = load_documents(country)
+        builder = cls._index_builder()
+        start = time.perf_counter()
+        vectors = builder.build_vectors(embedding_model, documents)
+        NumpyVectorStore(
+            embedding_function=embedding_model,
+            vectors=NumpyVectorStore._normalize(vectors),
+            documents=documents,
+            ids=[document.metadata['hotel_id'] for document in documents]
+        ).save(cls._db_path(registry.index_name(*key)))
+        return registry.register(
+            *key, dimension=vectors.shape[1],
+            stats={'n_document': len(documents),
+                   'n_batch': -(-len(documents) // builder.batch_size),
+                   'seconds': time.perf_counter() - start})
+
+    @classmethod
+    def _load_db(cls,
+                 embedding_model: Union[HuggingFaceEmbeddings,
+                                        OpenAIEmbeddings],
+                 name: str,
+                 quantization: QuantizationType = QuantizationType.FLOAT32
+                 ) -> NumpyVectorStore:
+        """
+        To load the vector database.
+
+        Parameters
+        ----------
+        embedding_model: Union[HuggingFaceEmbeddings, OpenAIEmbeddings]
+            The embedding model.
+        name: str
+            The name of the index.
+        quantization: QuantizationType, optional
+            The type of the matrix held in memory. Defaults to
+            QuantizationType.FLOAT32.
+
+        Returns
+        -------
+        NumpyVectorStore
+            The NumPy vector database.
+        """
+        return NumpyVectorStore.load(cls._db_path(name), embedding_model,
+                                     quantization=quantization)
+
+    @classmethod
+    def _root_path(cls) -> str:
+        return cls.NUMPY_DB_PATH
+
+    @classmethod
+    def _candidate_search(cls, vector_db: NumpyVectorStore,
+                          query_vector: List[float], k: int,
+                          hotel_ids: List[str]) -> List[Document]:
+        """
+        Score the vectors of the given hotels only.
+        """
+        return vector_db.similarity_search_by_vector(query_vector, k=k,
+                                                     ids=hotel_ids)
+
+    @classmethod
+    def _db_path(cls, name: str) -> str:
+        """
+        Get the directory of a NumPy index.
+        """
+        return os.path.join(cls.NUMPY_DB_PATH, name)
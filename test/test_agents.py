@@ -1,15 +1,71 @@
-import unittest, os
-from src.models import Models, ModelType
-from src.tools import RetrieverTool, ToolType
-from src.vector_databases import ChromaDB
-from src.embeddings import Embeddings, EmbeddingType
-from src.prompts import ReactPrompt
-from src.agents import Agents
+import unittest, os, time, asyncio, tempfile
+from unittest import mock
+from langchain.agents import Tool
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.history import RunnableWithMessageHistory
+from src.models import Models, ModelType, ScriptedChatModel
+from src.tools import RetrieverTool, OfflineSearchTool, ToolType
+from src.vector_database import ChromaDB
+from src.embeddings import Embeddings, EmbeddingType, HashingEmbeddings
+from src.prompts import ReactPrompt, RAGPrompt
+from src.agent import (Agents, AgentRunner, HistoryPolicy,
+                       MetricsCallbackHandler, QuestionRouter, RoutePath,
+                       SessionStore)
+from src.agent import history
 from dotenv import load_dotenv
 
 ENV_DIR = os.path.join(os.path.dirname(os.getcwd()), ".env")
 load_dotenv(ENV_DIR)
 
+REACT_SCRIPT = [
+    "Thought: I should look for quiet hotels\n"
+    "Action: retriever-tool\n"
+    "Action Input: quiet hotel\n"
+    "Observation: made up",
+    "Thought: I now know the final answer\n"
+    "Final Answer: The Quiet Inn is a calm hotel near the park",
+]
+
+
+def scripted_agent(token_delay: float = 0.0, history: bool = True):
+    """
+    Create an agent answering from the script, with a message history per
+    session.
+    """
+    llm = ScriptedChatModel(responses=REACT_SCRIPT, token_delay=token_delay)
+    tools = [Tool(name="retriever-tool",
+                  description="Search related documents to answer questions",
+                  func=lambda query: "Hotel_Name: The Quiet Inn")]
+    agent = Agents.get(llm, tools,
+                       ReactPrompt(conversation_history=history).get(),
+                       react=True)
+    if not history:
+        return agent, None
+    store = {}
+
+    def get_session_history(session_id: str):
+        return store.setdefault(session_id, InMemoryChatMessageHistory())
+
+    return RunnableWithMessageHistory(
+        agent, get_session_history, input_messages_key='input',
+        history_messages_key='chat_history'), store
+
+
+class RecordingChatModel(ScriptedChatModel):
+    """
+    A scripted chat model recording its prompts.
+    """
+    prompts: list = []
+
+    def _tokens(self, messages, stop):
+        self.prompts.append(messages[0].content)
+        return super()._tokens(messages, stop)
+
 
 class TestAgents(unittest.TestCase):
     def test_get(self):
@@ -25,5 +81,386 @@ class TestAgents(unittest.TestCase):
         self.assertIsNotNone(agent, ValueError)
 
 
+class TestAgentRunner(unittest.TestCase):
+    def test_astream(self):
+        agent, store = scripted_agent()
+        runner = AgentRunner(agent)
+
+        async def collect():
+            return [event async for event in runner.astream(
+                "Any quiet hotel?", session_id="session-1")]
+
+        events = asyncio.run(collect())
+        types = [event['type'] for event in events]
+        self.assertEqual(types[-1], 'final')
+        self.assertEqual(events[-1]['content'],
+                         "The Quiet Inn is a calm hotel near the park")
+        # the thoughts, the tool call, then the answer token by token
+        self.assertLess(types.index('thought'), types.index('action'))
+        self.assertLess(types.index('observation'), types.index('token'))
+        self.assertEqual(events[types.index('observation')]['content'],
+                         "Hotel_Name: The Quiet Inn")
+        self.assertEqual("".join(event['content'] for event in events
+                                 if event['type'] == 'token'),
+                         events[-1]['content'])
+        self.assertNotIn("Final Answer", "".join(
+            event['content'] for event in events if event['type'] == 'thought'))
+        self.assertEqual(list(store), ["session-1"])
+        self.assertEqual(len(store["session-1"].messages), 2)
+
+    def test_concurrent_sessions(self):
+        agent, store = scripted_agent(token_delay=0.01)
+        runner = AgentRunner(agent)
+        n_session = 8
+
+        async def run(session_id):
+            first_token, answer = None, None
+            async for event in runner.astream("Any quiet hotel?", session_id):
+                if event['type'] == 'token' and first_token is None:
+                    first_token = event['seconds']
+                if event['type'] == 'final':
+                    answer = event['seconds']
+            return first_token, answer
+
+        async def run_all():
+            return await asyncio.gather(*[run(f"session-{i}")
+                                          for i in range(n_session)])
+
+        start = time.perf_counter()
+        results = asyncio.run(run_all())
+        seconds = time.perf_counter() - start
+        self.assertEqual(len(store), n_session)
+        # the sessions run at once, not one after another
+        self.assertLess(seconds, sum(answer for _, answer in results) / 2)
+        # the first answer token comes before the end of the run
+        for first_token, answer in results:
+            self.assertLess(first_token, answer)
+
+    def test_ainvoke(self):
+        agent, _ = scripted_agent(history=False)
+        self.assertEqual(asyncio.run(AgentRunner(agent).ainvoke("Any hotel?")),
+                         "The Quiet Inn is a calm hotel near the park")
+
+
+class StaticRetriever(BaseRetriever):
+    """
+    A retriever always returning the same documents.
+    """
+    documents: list = []
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.documents
+
+
+def scripted_router(confidence: float, **kwargs):
+    """
+    Create a router in front of the scripted agent, with a fixed confidence.
+    """
+    agent, store = scripted_agent()
+    llm = RecordingChatModel(responses=["The Quiet Inn is calm."])
+    retriever = StaticRetriever(documents=[Document(
+        page_content="Hotel_Name: The Quiet Inn\nReviews: very calm")])
+    router = QuestionRouter(AgentRunner(agent), llm,
+                            RAGPrompt(conversation_history=True).get(),
+                            retriever, confidence_fn=lambda *_: confidence,
+                            **kwargs)
+    return router, llm, store
+
+
+class HashingRetriever(BaseRetriever):
+    """
+    A retriever ranking documents by their hashing embedding.
+    """
+    documents: list
+    embedding_model: HashingEmbeddings
+    k: int = 1
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        query_vector = self.embedding_model.embed_query(query)
+        scores = [sum(a * b for a, b in zip(query_vector, vector))
+                  for vector in self.embedding_model.embed_documents(
+                      [document.page_content for document in self.documents])]
+        ranks = sorted(range(len(scores)), key=lambda i: -scores[i])
+        return [self.documents[i] for i in ranks[:self.k]]
+
+
+class TestOfflinePipeline(unittest.TestCase):
+    def test_concurrent_sessions(self):
+        llm = Models.get(ModelType.SCRIPTED_REACT, token_delay=0.002,
+                         first_token_delay=0.02, jitter=0.5)
+        embedding_model = Embeddings.get(EmbeddingType.HASHING,
+                                         latency=0.005, jitter=0.5)
+        documents = [Document(page_content=f"Hotel_Name: {name}\n"
+                                           f"Reviews: {review}")
+                     for name, review in [("The Quiet Inn", "quiet calm"),
+                                          ("Party Hostel", "loud bar music"),
+                                          ("Grand Spa", "spa pool massage")]]
+        tools = [RetrieverTool.get(HashingRetriever(
+                     documents=documents, embedding_model=embedding_model)),
+                 OfflineSearchTool.get(latency=0.01)]
+        agent = Agents.get(llm, tools,
+                           ReactPrompt(conversation_history=False).get(),
+                           react=True)
+        runner = AgentRunner(agent, max_concurrency=32)
+        questions = {"Any quiet calm hotel?": "The Quiet Inn",
+                     "A hotel with a spa pool?": "Grand Spa",
+                     "Somewhere with loud music?": "Party Hostel"}
+
+        async def run_all():
+            return await asyncio.gather(*[
+                runner.ainvoke(question) for question in list(questions) * 20])
+
+        answers = asyncio.run(run_all())
+        # every session follows the script on its own question
+        self.assertEqual(answers, [f"Hotel_Name: {name}"
+                                   for name in questions.values()] * 20)
+
+
+class TestQuestionRouter(unittest.TestCase):
+    def test_fast_path(self):
+        router, llm, store = scripted_router(0.9)
+
+        async def collect():
+            return [event async for event in router.astream(
+                "Any quiet hotel?", session_id="session-1")]
+
+        events = asyncio.run(collect())
+        self.assertEqual(events[0]['type'], 'route')
+        self.assertEqual(events[0]['content'], RoutePath.RAG)
+        self.assertEqual(events[0]['confidence'], 0.9)
+        self.assertEqual(events[-1], {**events[-1], 'type': 'final',
+                                      'content': "The Quiet Inn is calm."})
+        self.assertNotIn('action', [event['type'] for event in events])
+        # a single LLM call on the RAG prompt, with the retrieved context
+        self.assertEqual(len(llm.prompts), 1)
+        self.assertIn("Context: Hotel_Name: The Quiet Inn", llm.prompts[0])
+        # the turn is in the history of the agent
+        self.assertEqual(store["session-1"].messages, [
+            HumanMessage(content="Any quiet hotel?"),
+            AIMessage(content="The Quiet Inn is calm.")])
+        # and the agent keeps adding to it
+        router.threshold = 1.0
+        asyncio.run(router.ainvoke("Any hotel near the park?", "session-1"))
+        self.assertEqual(len(store["session-1"].messages), 4)
+
+    def test_follow_up(self):
+        router, llm, _ = scripted_router(0.9)
+        asyncio.run(router.ainvoke("Any quiet hotel?", "session-1"))
+        # the follow-up question is answered in the conversation
+        asyncio.run(router.ainvoke("Does it have parking?", "session-1"))
+        history = llm.prompts[1].split("Previous conversation history:")[1]
+        self.assertIn("Any quiet hotel?", history)
+        self.assertIn("The Quiet Inn is calm.", history)
+        asyncio.run(router.ainvoke("Does it have parking?", "session-2"))
+        self.assertNotIn("Any quiet hotel?", llm.prompts[2])
+
+    def test_agent_path(self):
+        router, llm, store = scripted_router(
+            0.3, agent_question="Use the tools to answer: {question}")
+        self.assertEqual(asyncio.run(router.ainvoke("Any quiet hotel?",
+                                                    "session-1")),
+                         "The Quiet Inn is a calm hotel near the park")
+        self.assertEqual(llm.prompts, [])
+        self.assertEqual(store["session-1"].messages[0].content,
+                         "Use the tools to answer: Any quiet hotel?")
+        # the distances need the tools, however confident the retrieval
+        router, llm, _ = scripted_router(0.9)
+        asyncio.run(router.ainvoke("Any quiet hotel near Hyde Park?"))
+        self.assertEqual(llm.prompts, [])
+        self.assertEqual(router.records()[0]['path'], RoutePath.AGENT)
+
+    def test_stats(self):
+        router, _, _ = scripted_router(0.7, threshold=0.7)
+        for _ in range(3):
+            asyncio.run(router.ainvoke("Any quiet hotel?"))
+        router.threshold = 0.8
+        asyncio.run(router.ainvoke("Any quiet hotel?"))
+        stats = router.stats()
+        self.assertEqual(stats['questions'], 4)
+        self.assertEqual(stats['rag']['count'], 3)
+        self.assertEqual(stats['agent']['share'], 0.25)
+        for path in RoutePath:
+            self.assertGreater(stats[path]['p95_seconds'], 0)
+        self.assertEqual([record['confidence'] for record in
+                          router.records()], [0.7] * 4)
+
+    def test_confidence(self):
+        agent, _ = scripted_agent(history=False)
+        router = QuestionRouter(
+            AgentRunner(agent), RecordingChatModel(responses=["answer"]),
+            RAGPrompt().get(), StaticRetriever(),
+            embedding_model=DeterministicFakeEmbedding(size=32))
+        documents = [Document(page_content="a quiet hotel"),
+                     Document(page_content="a loud hotel")]
+        # the best matching document sets the confidence
+        self.assertAlmostEqual(router.confidence("a quiet hotel", documents),
+                               1.0, places=5)
+        self.assertEqual(router.confidence("a quiet hotel", []), 0.0)
+        self.assertEqual(asyncio.run(router.ainvoke("Any hotel?")),
+                         "The Quiet Inn is a calm hotel near the park")
+        with self.assertRaises(ValueError):
+            QuestionRouter(AgentRunner(agent), None, RAGPrompt().get(),
+                           StaticRetriever())
+
+
+class TestMetricsCallbackHandler(unittest.TestCase):
+    def test_invoke(self):
+        metrics = MetricsCallbackHandler()
+        agent, _ = scripted_agent(history=False)
+        agent.invoke({'input': "Any quiet hotel?"},
+                     config=metrics.config(trace_id="trace-1"))
+        agent.invoke({'input': "Any calm hotel?"}, config=metrics.config())
+        spans = metrics.spans("trace-1")
+        self.assertEqual([span['kind'] for span in spans].count('llm'), 2)
+        tool = next(span for span in spans if span['kind'] == 'tool')
+        self.assertEqual(tool['name'], "retriever-tool")
+        # the tool call is a child of the agent run
+        root = next(span for span in spans if span['kind'] == 'agent')
+        self.assertEqual(tool['parent_span_id'], root['span_id'])
+        self.assertIsNone(root['parent_span_id'])
+        breakdown = metrics.breakdown("trace-1")
+        self.assertEqual(breakdown['seconds'], root['seconds'])
+        self.assertEqual(breakdown['tool']["retriever-tool"]['count'], 1)
+        self.assertEqual(len(metrics.spans()), 2 * len(spans))
+
+        text = metrics.to_prometheus()
+        self.assertIn('# TYPE staychat_span_seconds histogram', text)
+        self.assertIn('staychat_span_seconds_count{kind="tool",'
+                      'name="retriever-tool"} 2', text)
+        self.assertIn('staychat_span_seconds_bucket{kind="tool",'
+                      'name="retriever-tool",le="+Inf"} 2', text)
+        self.assertIn('staychat_parsing_errors_total 0', text)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "spans.jsonl")
+            self.assertEqual(metrics.write_jsonl(path), 2 * len(spans))
+            # the written spans are not written again
+            self.assertEqual(metrics.write_jsonl(path), 0)
+            with open(path) as f:
+                self.assertEqual(len(f.readlines()), 2 * len(spans))
+
+    def test_router(self):
+        metrics = MetricsCallbackHandler()
+        for confidence, path in [(0.9, RoutePath.RAG),
+                                 (0.3, RoutePath.AGENT)]:
+            router, _, _ = scripted_router(confidence)
+            router.runner.metrics = metrics
+
+            async def collect():
+                return [event async for event in router.astream(
+                    "Any quiet hotel?", trace_id=path.value)]
+
+            events = asyncio.run(collect())
+            self.assertEqual({event['trace_id'] for event in events},
+                             {path.value})
+            spans = metrics.spans(path.value)
+            request = next(span for span in spans
+                           if span['kind'] == 'request')
+            self.assertEqual(request['attributes']['path'], path.value)
+            # the retrieval and the LLM calls are in the request span
+            retrieval = next(span for span in spans
+                             if span['kind'] == 'retriever')
+            self.assertEqual(retrieval['parent_span_id'],
+                             request['span_id'])
+            llm_calls = [span for span in spans if span['kind'] == 'llm']
+            self.assertEqual(len(llm_calls),
+                             1 if path == RoutePath.RAG else 2)
+            self.assertGreater(llm_calls[0]['attributes']
+                               ['completion_tokens'], 0)
+            self.assertEqual(metrics.breakdown(path.value)['seconds'],
+                             request['seconds'])
+
+
+def turn(i: int) -> list:
+    return [HumanMessage(content=f"question {i}"),
+            AIMessage(content=f"answer {i}")]
+
+
+class TestSessionStore(unittest.TestCase):
+    def test_window(self):
+        store = SessionStore(k=2)
+        session = store.get_session_history("a")
+        for i in range(5):
+            session.add_messages(turn(i))
+        # the last two turns only
+        self.assertEqual(session.messages, turn(3) + turn(4))
+        self.assertIs(store.get_session_history("a"), session)
+        self.assertEqual(store.get_session_history("b").messages, [])
+
+    def test_summary(self):
+        llm = FakeListChatModel(responses=["summary 1", "summary 2"])
+        store = SessionStore(policy=HistoryPolicy.SUMMARY, k=1, llm=llm)
+        session = store.get_session_history("a")
+        session.add_messages(turn(0))
+        self.assertEqual(session.messages, turn(0))
+        session.add_messages(turn(1))
+        session.add_messages(turn(2))
+        # the older turns are folded into the summary, one turn is kept
+        self.assertEqual(session.messages, [SystemMessage(
+            content="Summary of the earlier conversation: summary 2")]
+            + turn(2))
+        with self.assertRaises(ValueError):
+            SessionStore(policy=HistoryPolicy.SUMMARY)
+
+    def test_eviction(self):
+        store = SessionStore(max_sessions=2, ttl_seconds=60)
+        clock = [0]
+        with mock.patch.object(history.time, 'time',
+                               side_effect=lambda: clock[0]):
+            for session_id in ["a", "b", "a", "c"]:
+                store.get_session_history(session_id).add_messages(turn(0))
+            # the least recently used session is evicted
+            self.assertEqual(store.sessions(), ["a", "c"])
+            clock[0] = 30
+            store.get_session_history("c")
+            clock[0] = 70
+            store.get_session_history("d")
+            # the idle session expired
+            self.assertEqual(store.sessions(), ["c", "d"])
+        self.assertEqual(store.stats(), {'sessions': 2, 'messages': 2,
+                                         'evictions': 2})
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "sessions.sqlite")
+            llm = FakeListChatModel(responses=["summary"])
+            store = SessionStore(policy=HistoryPolicy.SUMMARY, k=1, llm=llm,
+                                 max_sessions=1, path=path)
+            for i in range(2):
+                store.get_session_history("a").add_messages(turn(i))
+            messages = store.get_session_history("a").messages
+            # an evicted session is reloaded, as after a restart
+            store.get_session_history("b")
+            self.assertEqual(store.get_session_history("a").messages,
+                             messages)
+            store = SessionStore(policy=HistoryPolicy.SUMMARY, k=1, llm=llm,
+                                 path=path)
+            self.assertEqual(store.get_session_history("a").messages,
+                             messages)
+            store.delete("a")
+            self.assertEqual(SessionStore(path=path).get_session_history(
+                "a").messages, [])
+
+    def test_agent_prompt_size(self):
+        llm = RecordingChatModel(responses=REACT_SCRIPT[1:])
+        agent = Agents.get(llm, [Tool(name="retriever-tool",
+                                      description="Search documents",
+                                      func=lambda query: "")],
+                           ReactPrompt(conversation_history=True).get(),
+                           react=True)
+        store = SessionStore(k=2)
+        agent = RunnableWithMessageHistory(
+            agent, store.get_session_history, input_messages_key='input',
+            history_messages_key='chat_history')
+        for _ in range(6):
+            agent.invoke({'input': "Any hotel?"},
+                         config={'configurable': {'session_id': "a"}})
+        # the prompt stops growing once the window is full
+        self.assertEqual(len(set(map(len, llm.prompts[-3:]))), 1)
+        self.assertEqual(len(store.get_session_history("a").messages), 4)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,68 @@
+import unittest, os, sys, asyncio, tempfile
+from unittest import mock
+from test_data_preparation import make_raw_reviews
+import src.vector_database.app as app
+
+
+class TestApp(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        raw_dir = os.path.join(self.tmp_dir.name, 'raw')
+        os.mkdir(raw_dir)
+        make_raw_reviews().to_csv(
+            os.path.join(raw_dir, "Hotel_Reviews.csv"), index=False)
+        prepare_docs = sys.modules['src.data_preparation.prepare_docs']
+        vector_database = sys.modules['src.vector_database.vector_database']
+        self.patches = [
+            mock.patch.object(prepare_docs, 'RAW_DATA_DIR', raw_dir),
+            mock.patch.object(prepare_docs, 'PROCESSED_DATA_DIR',
+                              os.path.join(self.tmp_dir.name, 'processed')),
+            mock.patch.object(vector_database, 'DATA_DIR', self.tmp_dir.name),
+            mock.patch.object(app.NumpyDB, 'NUMPY_DB_PATH',
+                              os.path.join(self.tmp_dir.name, "numpy_db")),
+            mock.patch.object(app, 'SESSION_STORE_PATH',
+                              os.path.join(self.tmp_dir.name,
+                                           "sessions.sqlite")),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        app.RESOURCE_POOL.invalidate()
+        self.tmp_dir.cleanup()
+
+    def test_build_agent(self):
+        kwargs = dict(model_name=app.ModelType.SCRIPTED_REACT,
+                      embedding_name=app.EmbeddingType.HASHING,
+                      online_search=True, vector_database=app.NumpyDB,
+                      cache=False)
+        # the offline model searches offline
+        with mock.patch.object(app.OfflineSearchTool, 'get',
+                               wraps=app.OfflineSearchTool.get) as search:
+            router = app.build_agent(**kwargs)
+        search.assert_called_once()
+        self.assertEqual(type(router.llm).__name__, "ScriptedChatModel")
+        self.assertEqual(type(router.embedding_model).__name__,
+                         "HashingEmbeddings")
+        answer = asyncio.run(router.ainvoke("Which hotel has a lovely room?",
+                                            session_id="smoke"))
+        self.assertIn("Hotel", answer)
+
+        # the agent and its components are shared
+        self.assertIs(app.build_agent(**kwargs), router)
+        keys = {entry['key'][0] for entry in app.RESOURCE_POOL.entries()}
+        self.assertTrue({"processed-data", "llm", "embedding", "retriever",
+                         "tools", "session-store", "metrics",
+                         "agent"} <= keys)
+        other = app.build_agent(**{**kwargs, 'online_search': False})
+        self.assertIsNot(other, router)
+        self.assertIs(other.llm, router.llm)
+        self.assertIs(other.retriever, router.retriever)
+        self.assertIs(other.runner.agent.get_session_history.__self__,
+                      router.runner.agent.get_session_history.__self__)
+
+
+if __name__ == "__main__":
+    unittest.main()
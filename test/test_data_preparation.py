@@ -1,6 +1,109 @@
-import unittest, os
+import unittest, os, tempfile
+import pandas as pd
+import numpy as np
+from unittest import mock
 
 from src.data_preparation import CSVData
+from src.data_preparation import prepare_docs
+from src.data_preparation.address_parsers import get_address_parser
+from src.data_preparation.manifest import HotelFingerprints, hotel_id
+from src.data_preparation.aggregation import (aggregate_hotels, HOTEL_AGG,
+                                              EXCL_REVIEWS)
+
+
+def make_reviews(n_hotel: int = 20, n_row: int = 500,
+                 seed: int = 0) -> pd.DataFrame:
+    """
+    Create a synthetic filtered review dataset with excluded reviews,
+    padded texts and hotels that only have excluded reviews.
+    """
+    rng = np.random.default_rng(seed)
+    texts = EXCL_REVIEWS + ["No Negative", " Nothing ", "NA",
+                            " Great staff ", "Lovely room", "Small bed ",
+                            "Noisy street", "Close to the tube"]
+    hotel_ids = rng.integers(0, n_hotel, n_row)
+    df = pd.DataFrame({
+        'Hotel_Name': [f"Hotel {i:02d}" for i in hotel_ids],
+        'Average_Score': (hotel_ids % 10 / 2 + 5).astype(float),
+        'Positive_Review': rng.choice(texts, n_row),
+        'Negative_Review': rng.choice(texts, n_row),
+        'Review_Date': [f"8/{i % 28 + 1}/2017" for i in range(n_row)],
+        'Hotel_Address': [f"{i} Road London SW{i} 1AA United Kingdom"
+                          for i in hotel_ids],
+        'Postal_Code': [f"SW{i} 1AA" for i in hotel_ids],
+        'City': "London",
+        'lat': 51.5 + hotel_ids / 100,
+        'lng': -0.1 - hotel_ids / 100,
+        'Reviewer_Score': rng.integers(8, 11, n_row).astype(float),
+        'Clean_Tags': "Leisure trip, Couple",
+    })
+    # a hotel whose reviews are all ignored
+    excluded = df.iloc[:3].copy()
+    excluded['Hotel_Name'] = "Hotel Excluded"
+    excluded[['Positive_Review', 'Negative_Review']] = "No Negative"
+    return pd.concat([df, excluded], ignore_index=True)
+
+
+def make_raw_reviews(n_row: int = 2000, seed: int = 0) -> pd.DataFrame:
+    """
+    Create a synthetic raw dataset with the columns of 'Hotel_Reviews.csv'.
+    """
+    rng = np.random.default_rng(seed)
+    addresses = [
+        "1 Baker Street Marylebone London W1U 8ED United Kingdom",
+        "2 Kensington Road London W8 5SP United Kingdom",
+        "3 Deansgate Manchester M3 4LQ United Kingdom",
+        "Rue de Rivoli 8th arr 75008 Paris France",
+        "Damrak 1 Centrum 1012 LG Amsterdam Netherlands",
+    ]
+    hotel_ids = rng.integers(0, len(addresses), n_row)
+    texts = ["No Negative", " Nothing ", " Great staff ", "Lovely room",
+             "Noisy street", "Close to the tube"]
+    return pd.DataFrame({
+        'Hotel_Address': [addresses[i] for i in hotel_ids],
+        'Additional_Number_of_Scoring': 100,
+        'Review_Date': [f"8/{i % 28 + 1}/2017" for i in range(n_row)],
+        'Average_Score': 8.0 + hotel_ids / 10,
+        'Hotel_Name': [f"Hotel {i}" for i in hotel_ids],
+        'Reviewer_Nationality': rng.choice(
+            [" United Kingdom ", " France ", " Netherlands ", " Ireland "],
+            n_row),
+        'Negative_Review': rng.choice(texts, n_row),
+        'Review_Total_Negative_Word_Counts': 2,
+        'Total_Number_of_Reviews': n_row,
+        'Positive_Review': rng.choice(texts, n_row),
+        'Review_Total_Positive_Word_Counts': 2,
+        'Total_Number_of_Reviews_Reviewer_Has_Given': 1,
+        'Reviewer_Score': rng.choice([5.0, 7.9, 8.0, 9.2, 10.0], n_row),
+        'Tags': "[' Leisure trip ', ' Couple ', ' Double Room ']",
+        'days_since_review': "0 days",
+        'lat': 51.5 + hotel_ids / 100,
+        'lng': -0.1 - hotel_ids / 100,
+    })
+
+
+def reference_aggregate_hotels(df: pd.DataFrame,
+                               n_review: int = 3) -> pd.DataFrame:
+    """
+    The original per-hotel loop used to aggregate the reviews.
+    """
+    agg_df = df.groupby('Hotel_Name').agg(HOTEL_AGG).reset_index()
+    review_dct = dict(Hotel_Name=[],
+                      Positive_Review=[],
+                      Negative_Review=[])
+    for hotel_name in agg_df['Hotel_Name']:
+        review_dct['Hotel_Name'].append(hotel_name)
+        for col in ['Positive_Review', 'Negative_Review']:
+            reviews = df[df['Hotel_Name'] == hotel_name][col].values
+            review = []
+            for text in reviews:
+                if text.lower() in EXCL_REVIEWS: continue
+                review.append(text.strip())
+                if len(review) == n_review: break
+            review_dct[col].append(", ".join(review))
+    review_df = pd.DataFrame(review_dct)
+    return pd.merge(
+        left=agg_df, right=review_df, on='Hotel_Name', how='left')
 
 
 class TestCSVData(unittest.TestCase):
@@ -17,5 +120,180 @@ class TestCSVData(unittest.TestCase):
         )))
 
 
+class TestAggregation(unittest.TestCase):
+    def test_aggregate_hotels_matches_reference(self):
+        df = make_reviews()
+        for n_review in [1, 3, 5]:
+            pd.testing.assert_frame_equal(
+                aggregate_hotels(df, n_review=n_review),
+                reference_aggregate_hotels(df, n_review=n_review))
+
+    def test_aggregate_hotels_excluded_reviews(self):
+        agg_df = aggregate_hotels(make_reviews()).set_index('Hotel_Name')
+        self.assertEqual(agg_df.loc["Hotel Excluded", 'Positive_Review'], "")
+        self.assertEqual(agg_df.loc["Hotel Excluded", 'Negative_Review'], "")
+
+    def test_aggregate_hotels_invalid_n_review(self):
+        with self.assertRaises(ValueError):
+            aggregate_hotels(make_reviews(), n_review=0)
+
+
+class ProcessedDataTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        raw_dir = os.path.join(self.tmp_dir.name, 'raw')
+        os.mkdir(raw_dir)
+        make_raw_reviews().to_csv(
+            os.path.join(raw_dir, "Hotel_Reviews.csv"), index=False)
+        self.patches = [
+            mock.patch.object(prepare_docs, 'RAW_DATA_DIR', raw_dir),
+            mock.patch.object(prepare_docs, 'PROCESSED_DATA_DIR',
+                              os.path.join(self.tmp_dir.name, 'processed')),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.tmp_dir.cleanup()
+
+
+class TestCSVDataChunked(ProcessedDataTestCase):
+    def _create(self, **kwargs) -> pd.DataFrame:
+        country = "United Kingdom"
+        data = CSVData("Hotel_Reviews")
+        data.create_processed_data(country, **kwargs)
+        df = data.load_processed_data()
+        for ext in ["parquet", "csv"]:
+            os.remove(os.path.join(prepare_docs.PROCESSED_DATA_DIR,
+                                   f"{country}_processed_df.{ext}"))
+        return df
+
+    def test_chunked_matches_in_memory(self):
+        in_memory_df = self._create()
+        self.assertEqual(len(in_memory_df), 3)
+        for chunksize in [37, 500, 10000]:
+            pd.testing.assert_frame_equal(
+                self._create(chunksize=chunksize), in_memory_df)
+
+    def test_processed_data_format(self):
+        country = "United Kingdom"
+        data = CSVData("Hotel_Reviews")
+        data.create_processed_data(country)
+        self.assertTrue(os.path.isfile(os.path.join(
+            prepare_docs.PROCESSED_DATA_DIR, f"{country}_processed_df.csv")))
+
+        data = CSVData("Hotel_Reviews")
+        data.create_processed_data(country)
+        self.assertIsNone(data.data)  # nothing is loaded before it is needed
+        df = data.load_processed_data(columns=['Hotel_Name', 'City', 'lat'])
+        self.assertEqual(list(df.columns), ['Hotel_Name', 'City', 'lat'])
+        self.assertIsInstance(df['City'].dtype, pd.CategoricalDtype)
+        self.assertEqual(df['lat'].dtype, np.float32)
+        self.assertIsNone(data.data)
+
+
+class TestAddressParser(unittest.TestCase):
+    def test_parse(self):
+        addresses = pd.Series([
+            "1 Baker Street Marylebone London W1U 8ED United Kingdom",
+            "28 Rue de la Michodi re 2nd arr 75002 Paris France",
+            "s Gravesandestraat 55 Oost 1092 AA Amsterdam Netherlands",
+            "Via Giuseppe Ripamonti 33 Vigentino 20141 Milan Italy",
+        ])
+        expected = [("W1U 8ED", "London"), ("75002", "Paris"),
+                    ("1092 AA", "Amsterdam"), ("20141", "Milan")]
+        for country, address, (postal_code, city) in zip(
+                ["United Kingdom", "France", "Netherlands", "Italy"],
+                addresses, expected):
+            parsed = get_address_parser(country).parse(pd.Series([address]))
+            self.assertEqual(parsed[0][0], postal_code)
+            self.assertEqual(parsed[1][0], city)
+
+    def test_unknown_country(self):
+        with self.assertRaises(NotImplementedError):
+            get_address_parser("Atlantis")
+
+
+class TestCSVDataAllCountries(ProcessedDataTestCase):
+    def test_create_all_processed_data(self):
+        countries = ["United Kingdom", "France", "Netherlands"]
+        CSVData("Hotel_Reviews").create_all_processed_data(
+            countries, chunksize=300, max_workers=2)
+        all_dfs = {}
+        for country in countries:
+            data_path = os.path.join(prepare_docs.PROCESSED_DATA_DIR,
+                                     f"{country}_processed_df.parquet")
+            all_dfs[country] = pd.read_parquet(data_path)
+            os.remove(data_path)
+        self.assertEqual(len(all_dfs["France"]), 1)
+        self.assertEqual(all_dfs["Netherlands"]['City'][0], "Amsterdam")
+        for country in countries:
+            os.remove(os.path.join(prepare_docs.PROCESSED_DATA_DIR,
+                                   f"{country}_processed_df.csv"))
+            data = CSVData("Hotel_Reviews")
+            data.create_processed_data(country)
+            pd.testing.assert_frame_equal(all_dfs[country],
+                                          data.load_processed_data())
+
+
+class TestIncrementalProcessing(ProcessedDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.country = "United Kingdom"
+        self.raw_data_path = os.path.join(prepare_docs.RAW_DATA_DIR,
+                                          "Hotel_Reviews.csv")
+
+    def test_fingerprints_ignore_chunks(self):
+        df = make_raw_reviews()
+        expected = HotelFingerprints().update(df).result()
+        for chunksize in [7, 33, 500]:
+            fingerprints = HotelFingerprints()
+            for start in range(0, len(df), chunksize):
+                fingerprints.update(df.iloc[start:start + chunksize])
+            self.assertEqual(fingerprints.result(), expected)
+        # the order of the reviews matters
+        self.assertNotEqual(
+            HotelFingerprints().update(df.iloc[::-1]).result(), expected)
+
+    def test_unchanged_raw_data(self):
+        data = CSVData("Hotel_Reviews")
+        dirty_hotel_ids = data.create_processed_data(self.country)
+        self.assertEqual(len(dirty_hotel_ids), 3)
+        os.utime(self.raw_data_path)  # touched only
+        self.assertEqual(data.create_processed_data(self.country), [])
+
+    def test_changed_raw_data(self):
+        data = CSVData("Hotel_Reviews")
+        data.create_processed_data(self.country, chunksize=300)
+        raw_df = pd.read_csv(self.raw_data_path)
+        uk_reviews = (raw_df['Hotel_Name'] == "Hotel 0") \
+            & (raw_df['Reviewer_Nationality'] == " United Kingdom ") \
+            & (raw_df['Reviewer_Score'] >= 8)
+        raw_df.loc[uk_reviews.idxmax(), 'Positive_Review'] = "Brand new bar"
+        new_hotel = raw_df[uk_reviews].iloc[:2].assign(
+            Hotel_Name="Hotel New")
+        raw_df = pd.concat([raw_df, new_hotel], ignore_index=True)
+        raw_df.to_csv(self.raw_data_path, index=False)
+
+        dirty_hotel_ids = data.create_processed_data(self.country,
+                                                     chunksize=300)
+        self.assertEqual(sorted(dirty_hotel_ids),
+                         sorted([hotel_id("Hotel 0"), hotel_id("Hotel New")]))
+        incremental_df = data.load_processed_data()
+        self.assertIn("Brand new bar", incremental_df['Positive_Review'][0])
+
+        # the same as processing everything again
+        for name in ["processed_df.parquet", "processed_df.csv",
+                     "manifest.json"]:
+            os.remove(os.path.join(prepare_docs.PROCESSED_DATA_DIR,
+                                   f"{self.country}_{name}"))
+        data = CSVData("Hotel_Reviews")
+        data.create_processed_data(self.country)
+        pd.testing.assert_frame_equal(incremental_df,
+                                      data.load_processed_data())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,11 +1,33 @@
-import unittest, os
-from src.embeddings import Embeddings, EmbeddingType
+import unittest, os, time, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import numpy as np
+from langchain_core.embeddings import Embeddings as BaseEmbeddings
+from src.embeddings import (Embeddings, EmbeddingType, CachedEmbeddings,
+                            EmbeddingCache, HashingEmbeddings)
+from src.embeddings import cache as cache_module
 from dotenv import load_dotenv
 
 ENV_DIR = os.path.join(os.path.dirname(os.getcwd()), ".env")
 load_dotenv(ENV_DIR)
 
 
+class CountingEmbeddings(BaseEmbeddings):
+    """
+    A deterministic embedding counting the embedded texts.
+    """
+    def __init__(self):
+        self.n_embedded = 0
+
+    def embed_documents(self, texts):
+        self.n_embedded += len(texts)
+        return [[float(len(text)), float(sum(map(ord, text)) % 97), 1.0]
+                for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
 class TestEmbeddings(unittest.TestCase):
     def test_get(self):
         embedding_model = Embeddings.get(EmbeddingType.SENTENCE_TRANSFORMER)
@@ -13,5 +35,155 @@ class TestEmbeddings(unittest.TestCase):
         print(embedding_model)
 
 
+class TestHashingEmbeddings(unittest.TestCase):
+    def test_embed(self):
+        embedding_model = Embeddings.get(EmbeddingType.HASHING, size=64)
+        self.assertIsInstance(embedding_model, HashingEmbeddings)
+        texts = ["Quiet hotel near Hyde Park", "A quiet hotel by Hyde Park",
+                 "Noisy bar in Paris"]
+        vectors = np.array(embedding_model.embed_documents(texts))
+        self.assertEqual(vectors.shape, (3, 64))
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0,
+                                   rtol=1e-5)
+        # deterministic, also across processes, and words shared matter
+        np.testing.assert_array_equal(
+            vectors[0], HashingEmbeddings(size=64).embed_query(texts[0]))
+        self.assertGreater(vectors[0] @ vectors[1], vectors[0] @ vectors[2])
+        self.assertEqual(embedding_model.embed_query(""), [0.0] * 64)
+
+    def test_latency(self):
+        embedding_model = HashingEmbeddings(latency=0.02,
+                                            latency_per_text=0.01,
+                                            jitter=0.5)
+        start = time.perf_counter()
+        embedding_model.embed_documents(["a", "b"])
+        self.assertGreaterEqual(time.perf_counter() - start, 0.02)
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cached = Embeddings.get(
+                EmbeddingType.HASHING, cache=True, size=32,
+                cache_path=os.path.join(tmp_dir, "embeddings.sqlite"))
+            self.assertIsInstance(cached, CachedEmbeddings)
+            self.assertEqual(cached.model_name, "hashing-32")
+
+
+class TestSharedEmbeddings(unittest.TestCase):
+    def setUp(self):
+        Embeddings.release()
+
+    def tearDown(self):
+        Embeddings.release()
+
+    def test_get(self):
+        # the threads asking at once share a single instance
+        with ThreadPoolExecutor(8) as executor:
+            models = list(executor.map(
+                lambda _: Embeddings.get(EmbeddingType.HASHING, size=48,
+                                         latency=0.01), range(8)))
+        self.assertTrue(all(model is models[0] for model in models))
+        self.assertIsNot(Embeddings.get(EmbeddingType.HASHING, size=96),
+                         models[0])
+        self.assertIsNot(Embeddings.get(EmbeddingType.HASHING, size=48,
+                                        latency=0.01, shared=False),
+                         models[0])
+        self.assertEqual([entry['options'] for entry in Embeddings.loaded()],
+                         [{'latency': 0.01, 'size': 48}, {'size': 96}])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # the cached model wraps the shared one
+            cached = Embeddings.get(
+                EmbeddingType.HASHING, cache=True, size=48, latency=0.01,
+                cache_path=os.path.join(tmp_dir, "embeddings.sqlite"))
+            self.assertIs(cached.embedding_model, models[0])
+
+    def test_lifecycle(self):
+        model = Embeddings.warm_up(EmbeddingType.HASHING, size=32)
+        entry, = Embeddings.loaded()
+        self.assertEqual(entry['embedding'], EmbeddingType.HASHING)
+        self.assertIsNone(entry['parameter_bytes'])
+        self.assertGreaterEqual(entry['rss_growth_bytes'], 0)
+        self.assertGreaterEqual(entry['warm_up_seconds'], 0)
+        self.assertEqual(
+            Embeddings.release(EmbeddingType.OPENAI_EMBEDDING_SMALL), 0)
+        self.assertEqual(Embeddings.release(EmbeddingType.HASHING), 1)
+        self.assertEqual(Embeddings.loaded(), [])
+        self.assertIsNot(Embeddings.get(EmbeddingType.HASHING, size=32),
+                         model)
+
+    def test_options(self):
+        # only the hashing model takes options
+        for shared in (True, False):
+            with self.assertRaises(TypeError):
+                Embeddings.get(EmbeddingType.OPENAI_EMBEDDING_SMALL,
+                               shared=shared, size=32)
+        self.assertEqual(Embeddings.loaded(), [])
+
+
+class TestCachedEmbeddings(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, "embeddings.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cache(self):
+        model = CountingEmbeddings()
+        cached = CachedEmbeddings(model, "counting",
+                                  EmbeddingCache(self.cache_path))
+        texts = ["great staff", "noisy room", "great staff"]
+        vectors = cached.embed_documents(texts)
+        self.assertEqual(vectors, model.embed_documents(texts))
+        self.assertEqual(model.n_embedded, 2 + 3)
+        # queries share the cache with the documents
+        self.assertEqual(cached.embed_query("noisy room"), vectors[1])
+        self.assertEqual(model.n_embedded, 5)
+        self.assertEqual(cached.stats()['hits'], 1)
+        # the cache persists across processes, per model name
+        cached = CachedEmbeddings(model, "counting",
+                                  EmbeddingCache(self.cache_path))
+        self.assertEqual(cached.embed_documents(texts), vectors)
+        self.assertEqual(model.n_embedded, 5)
+        CachedEmbeddings(model, "other", EmbeddingCache(
+            self.cache_path)).embed_query("noisy room")
+        self.assertEqual(model.n_embedded, 6)
+
+    def test_eviction(self):
+        model = CountingEmbeddings()
+        # room for 4 vectors of 3 float32, every access recorded
+        cache = EmbeddingCache(self.cache_path, max_bytes=4 * 12,
+                               access_interval_seconds=0)
+        cached = CachedEmbeddings(model, "counting", cache)
+        for i in range(10):
+            cached.embed_query(f"review {i}")
+            cached.embed_query("review 0")  # keep it recently used
+        self.assertEqual(cache.stats()['entries'], 4)
+        self.assertLessEqual(cache.stats()['bytes'], 4 * 12)
+        n_embedded = model.n_embedded
+        cached.embed_documents(["review 0", "review 9"])
+        self.assertEqual(model.n_embedded, n_embedded)
+        cached.embed_query("review 1")
+        self.assertEqual(model.n_embedded, n_embedded + 1)
+
+    def test_access_interval(self):
+        cache = EmbeddingCache(self.cache_path, access_interval_seconds=60)
+        clock = [0]
+        with mock.patch.object(cache_module.time, 'time',
+                               side_effect=lambda: clock[0]):
+            cache.put_many({"a": [1.0, 0.0], "b": [0.0, 1.0]})
+            n_change = cache._conn.total_changes
+            # the recent hits only read the store
+            clock[0] = 59
+            self.assertEqual(set(cache.get_many(["a", "b", "c"])), {"a", "b"})
+            self.assertEqual(cache._conn.total_changes, n_change)
+            clock[0] = 60
+            cache.get_many(["a"])
+            self.assertEqual(cache._conn.total_changes, n_change + 1)
+            self.assertEqual(cache._conn.execute(
+                "SELECT key FROM embeddings ORDER BY last_access").fetchall(),
+                [("b",), ("a",)])
+        self.assertEqual(cache.stats()['hits'], 3)
+
+
 if __name__ == "__main__":
     unittest.main()
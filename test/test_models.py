@@ -1,11 +1,56 @@
-import unittest, os
-from src.models import Models, ModelType
+import unittest, os, sys, json, time, tempfile, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from langchain_core.language_models import FakeListChatModel, FakeListLLM
+from langchain_core.messages import HumanMessage
+from src.models import Models, ModelType, LLMCache, ScriptedChatModel
+from src.models import cache as cache_module
 from dotenv import load_dotenv
 
 ENV_DIR = os.path.join(os.path.dirname(os.getcwd()), ".env")
 load_dotenv(ENV_DIR)
 
 
+def loaded_modules(code: str) -> set:
+    """
+    Run code in a fresh interpreter and list the top-level modules it loaded.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", code + "\nimport sys, json\n"
+         "print(json.dumps(sorted({name.split('.')[0] "
+         "for name in sys.modules})))"],
+        check=True, capture_output=True, text=True,
+        env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)}).stdout
+    return set(json.loads(output.strip().splitlines()[-1]))
+
+
+class SlowChatModel(FakeListChatModel):
+    """
+    A chat model answering from a list after a delay, like a remote model.
+    """
+    def _call(self, *args, **kwargs) -> str:
+        time.sleep(0.02)
+        return super()._call(*args, **kwargs)
+
+
+class SlowLLM(FakeListLLM):
+    def _call(self, *args, **kwargs) -> str:
+        time.sleep(0.05)
+        return super()._call(*args, **kwargs)
+
+
+class FailingChatModel(FakeListChatModel):
+    def _call(self, *args, **kwargs) -> str:
+        raise ConnectionError("the model is unreachable")
+
+
+def cached_model(model_class, cache: LLMCache, **kwargs):
+    """
+    Create a model using the store as its cache and as its callback handler.
+    """
+    return model_class(cache=cache, callbacks=[cache], **kwargs)
+
+
 class TestModels(unittest.TestCase):
     def test_get(self):
         llm = Models.get(ModelType.CHATGPTSTANDARD)
@@ -13,5 +58,186 @@ class TestModels(unittest.TestCase):
         print(llm)
 
 
+class TestLazyImports(unittest.TestCase):
+    def test_model_type(self):
+        # the types load no dependency
+        modules = loaded_modules("from src.models import ModelType")
+        self.assertFalse(modules & {"langchain_core", "langchain_openai",
+                                    "langchain_community"})
+
+    def test_get(self):
+        # the backends are only loaded once their model is selected
+        modules = loaded_modules(
+            "from src.models import Models, ModelType\n"
+            "Models.get(ModelType.SCRIPTED_REACT)")
+        self.assertIn("langchain_core", modules)
+        self.assertFalse(modules & {"langchain_openai",
+                                    "langchain_community"})
+
+
+class TestSharedModels(unittest.TestCase):
+    def tearDown(self):
+        Models.release()
+
+    def test_lifecycle(self):
+        Models.release()
+        llm = Models.warm_up(ModelType.SCRIPTED_REACT, prompt="Question: hi",
+                             token_delay=0.001)
+        self.assertIs(Models.get(ModelType.SCRIPTED_REACT, token_delay=0.001),
+                      llm)
+        self.assertIsNot(Models.get(ModelType.SCRIPTED_REACT), llm)
+        entry = Models.loaded()[0]
+        self.assertEqual(entry['options'], {'cache': False,
+                                            'token_delay': 0.001})
+        self.assertGreaterEqual(entry['warm_up_seconds'], 0.0)
+        self.assertIsNone(entry['parameter_bytes'])
+        self.assertGreaterEqual(entry['rss_growth_bytes'], 0)
+        self.assertEqual(Models.release(ModelType.SCRIPTED_REACT), 2)
+        self.assertIsNot(Models.get(ModelType.SCRIPTED_REACT,
+                                    token_delay=0.001), llm)
+
+    def test_options(self):
+        # only the scripted model takes options
+        with self.assertRaises(TypeError):
+            Models.get(ModelType.CHATGPTSTANDARD, token_delay=0.001)
+        self.assertEqual(Models.loaded(), [])
+
+
+class TestScriptedReact(unittest.TestCase):
+    def test_get(self):
+        llm = Models.get(ModelType.SCRIPTED_REACT, token_delay=0.01,
+                         jitter=0.5, seed=1)
+        self.assertIsInstance(llm, ScriptedChatModel)
+        # the script quotes the question, then the observation
+        prompt = "Thought: ...\nAction Input: ...\n\nQuestion: Quiet hotel?"
+        self.assertEqual(llm.invoke(prompt, stop=["\nObservation"]).content,
+                         "Thought: I should search the hotel reviews\n"
+                         "Action: retriever-tool\nAction Input: Quiet hotel?")
+        self.assertEqual(llm.invoke(
+            prompt + "\nObservation: Hotel_Name: The Quiet Inn\nReviews: "
+                     "calm\nThought: ").content,
+            "Thought: I now know the final answer\n"
+            "Final Answer: Hotel_Name: The Quiet Inn")
+        # the other prompts are answered from the context
+        self.assertEqual(llm.invoke("Question: Quiet hotel?\nContext: The "
+                                    "Quiet Inn\nAnswer:").content,
+                         "From the reviews: The Quiet Inn")
+
+    def test_delays(self):
+        llm = ScriptedChatModel(responses=["a b c d e f g h"],
+                                first_token_delay=0.1, token_delay=0.01,
+                                jitter=0.5)
+        messages = [HumanMessage(content="Question: any hotel?")]
+        delays = llm._delays(messages, 8)
+        # the same jitter for the same prompt, within its bounds
+        self.assertEqual(delays, llm._delays(messages, 8))
+        self.assertNotEqual(delays, llm._delays(
+            [HumanMessage(content="Question: another hotel?")], 8))
+        self.assertTrue(0.05 <= delays[0] <= 0.15)
+        self.assertTrue(all(0.005 <= delay <= 0.015 for delay in delays[1:]))
+        self.assertEqual(len(set(delays[1:])), 7)
+        start = time.perf_counter()
+        llm.invoke(messages)
+        self.assertGreaterEqual(time.perf_counter() - start, sum(delays))
+
+
+class TestLLMCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, "responses.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cache(self):
+        responses = ["first", "second", "third"]
+        # the stores share the file, so every access is written at once
+        interval = {'access_interval_seconds': 0}
+        llm = cached_model(SlowChatModel,
+                           LLMCache("slow", self.cache_path, **interval),
+                           responses=responses)
+        self.assertEqual(llm.invoke("Which hotel?").content, "first")
+        self.assertEqual(llm.invoke("Which hotel?").content, "first")
+        self.assertEqual(llm.invoke("Which room?").content, "second")
+        # the cache persists across processes, per model ID
+        llm = cached_model(SlowChatModel,
+                           LLMCache("slow", self.cache_path, **interval),
+                           responses=responses)
+        self.assertEqual(llm.invoke("Which room?").content, "second")
+        other = cached_model(SlowChatModel,
+                             LLMCache("other", self.cache_path, **interval),
+                             responses=["other"] + responses)
+        self.assertEqual(other.invoke("Which hotel?").content, "other")
+        # other parameters give another response
+        llm = cached_model(SlowChatModel,
+                           LLMCache("slow", self.cache_path, **interval),
+                           responses=["fourth"], sleep=1.0)
+        self.assertEqual(llm.invoke("Which hotel?").content, "fourth")
+
+        stats = llm.cache.stats()
+        self.assertEqual({model: (usage['hits'], usage['misses'],
+                                  usage['entries'])
+                          for model, usage in stats.items()},
+                         {'slow': (2, 3, 3), 'other': (0, 1, 1)})
+        self.assertGreaterEqual(stats['slow']['seconds_saved'], 0.04)
+        self.assertEqual(llm.cache._runs, {})
+
+    def test_timing_by_run(self):
+        cache = LLMCache("fake", self.cache_path)
+        # the language models store their response after the end of the run
+        llm = cached_model(SlowLLM, cache, responses=["a"])
+        self.assertEqual(llm.invoke("Which hotel?"), "a")
+        self.assertEqual(llm.invoke("Which hotel?"), "a")
+        self.assertGreaterEqual(cache.stats()['fake']['seconds_saved'], 0.05)
+        # a failed call is forgotten
+        failing = cached_model(FailingChatModel, cache, responses=["b"])
+        with self.assertRaises(ConnectionError):
+            failing.invoke("Which hotel?")
+        # the concurrent calls of the same prompt are timed apart
+        chat = cached_model(SlowChatModel, cache, responses=["c"] * 4)
+        with ThreadPoolExecutor(4) as executor:
+            answers = list(executor.map(chat.invoke, ["Which room?"] * 4))
+        self.assertEqual([answer.content for answer in answers], ["c"] * 4)
+        self.assertEqual(cache._runs, {})
+
+    def test_ttl_and_eviction(self):
+        cache = LLMCache("slow", self.cache_path, ttl_seconds=0.05,
+                         max_bytes=1500)
+        llm = cached_model(SlowChatModel, cache,
+                           responses=[str(i) * 100 for i in range(10)])
+        for i in range(6):
+            llm.invoke(f"question {i}")
+        stats = cache.stats()['slow']
+        self.assertLess(stats['bytes'], 1500)
+        self.assertLess(stats['entries'], 6)
+        # the most recent response is kept until it expires
+        self.assertEqual(llm.invoke("question 5").content, "5" * 100)
+        time.sleep(0.06)
+        self.assertEqual(llm.invoke("question 5").content, "6" * 100)
+
+    def test_access_interval(self):
+        cache = LLMCache("slow", self.cache_path, access_interval_seconds=60)
+        llm = cached_model(SlowChatModel, cache, responses=["a", "b"])
+        clock = [0]
+        with mock.patch.object(cache_module.time, 'time',
+                               side_effect=lambda: clock[0]):
+            llm.invoke("Which hotel?")
+            n_change = cache._conn.total_changes
+            # the recent hits only read the store
+            clock[0] = 30
+            for _ in range(3):
+                self.assertEqual(llm.invoke("Which hotel?").content, "a")
+            self.assertEqual(cache._conn.total_changes, n_change)
+            # an old access time is updated, with the usage
+            clock[0] = 60
+            llm.invoke("Which hotel?")
+            self.assertEqual(cache._conn.total_changes, n_change + 2)
+            self.assertEqual(cache._conn.execute(
+                "SELECT hits FROM usage").fetchone()[0], 4)
+            clock[0] = 70
+            llm.invoke("Which hotel?")
+            self.assertEqual(cache.stats()['slow']['hits'], 5)
+
+
 if __name__ == "__main__":
     unittest.main()
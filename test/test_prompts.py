@@ -1,5 +1,7 @@
 import unittest
-from src.prompts import ReactPrompt, RAGPrompt
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from src.prompts import (ReactPrompt, RAGPrompt, PromptBudget,
+                         BudgetedPromptTemplate, TokenCounter)
 
 
 class TestReactPrompt(unittest.TestCase):
@@ -23,8 +25,100 @@ class TestRAGPrompt(unittest.TestCase):
         prompt = RAGPrompt().get()
         self.assertIsNotNone(prompt, ValueError)
         self.assertNotIn("Use the following format:", prompt.template)
+        self.assertNotIn("chat_history", prompt.input_variables)
         print(f"Prompt for RAG: {prompt.template}")
 
+    def test_rag_prompt_with_memory(self):
+        prompt = RAGPrompt(conversation_history=True).get()
+        self.assertIn("Previous conversation history:", prompt.template)
+        self.assertEqual(sorted(prompt.input_variables),
+                         ['chat_history', 'context', 'input'])
+
+
+class TestPromptBudget(unittest.TestCase):
+    def setUp(self):
+        self.budget = PromptBudget("gpt-3.5-turbo", context_window=800,
+                                   max_output_tokens=100)
+        self.counter = self.budget.counter
+
+    def test_token_counter(self):
+        counter = TokenCounter.get("gpt-3.5-turbo")
+        self.assertIs(counter, self.counter)
+        text = "The hotel is close to Hyde Park. " * 20
+        self.assertGreater(counter.count(text), 0)
+        self.assertEqual(counter.truncate(text, 1000), text)
+        head = counter.truncate(text, 20)
+        self.assertLessEqual(counter.count(head), 20)
+        self.assertTrue(head.startswith("The hotel"))
+        tail = counter.truncate(text, 20, keep_end=True)
+        self.assertLessEqual(counter.count(tail), 20)
+        self.assertTrue(tail.endswith("Hyde Park. "))
+
+    def test_allocate(self):
+        # the share a part does not need goes to the others
+        budgets = self.budget.allocate(
+            1000, {'chat_history': 100, 'context': 5000})
+        self.assertEqual(budgets, {'chat_history': 100, 'context': 900})
+        budgets = self.budget.allocate(
+            700, {'chat_history': 5000, 'context': 5000})
+        self.assertLessEqual(sum(budgets.values()), 700)
+        self.assertGreater(budgets['context'], budgets['chat_history'])
+        self.assertEqual(self.budget.allocate(0, {'context': 10}),
+                         {'context': 0})
+
+    def test_react_prompt(self):
+        usages = []
+        prompt = ReactPrompt(conversation_history=True).get(
+            budget=self.budget, on_usage=usages.append)
+        self.assertIsInstance(prompt, BudgetedPromptTemplate)
+        # the partial variables of the agent keep the budget
+        prompt = prompt.partial(tools="retriever_tool: search the reviews",
+                                tool_names="retriever_tool")
+        history = [SystemMessage(content="Summary of the earlier "
+                                         "conversation: hotels in London")]
+        for i in range(20):
+            history += [HumanMessage(content=f"Question {i} " * 10),
+                        AIMessage(content=f"Answer {i} " * 10)]
+        scratchpad = "".join(
+            f"I need reviews {i}\nAction: retriever_tool\nAction Input: "
+            f"hotel {i}\nObservation: {'Great breakfast. ' * 60}"
+            f"\nThought: " for i in range(4))
+        text = prompt.format(input="Which hotel has a good breakfast?",
+                             chat_history=history,
+                             agent_scratchpad=scratchpad)
+        usage = usages[-1]
+        self.assertEqual(usage, prompt.last_usage)
+        self.assertLessEqual(usage['total'], 800 - 100)
+        self.assertEqual(usage['total'], self.counter.count(text))
+        self.assertTrue(usage['chat_history']['truncated'])
+        self.assertTrue(usage['agent_scratchpad']['truncated'])
+        # the summary and the latest turns are kept
+        self.assertIn("Summary of the earlier conversation", text)
+        self.assertIn("Answer 19", text)
+        self.assertNotIn("Question 0 ", text)
+        # the latest step is kept, the oldest observations are shortened
+        self.assertIn("Action Input: hotel 3", text)
+        self.assertIn("Question: Which hotel has a good breakfast?", text)
+        # the truncation is deterministic
+        self.assertEqual(text, prompt.format(
+            input="Which hotel has a good breakfast?",
+            chat_history=history, agent_scratchpad=scratchpad))
+
+    def test_rag_prompt(self):
+        prompt = RAGPrompt().get(budget=self.budget)
+        context = "\n\n".join(f"Hotel {i}: " + "Clean rooms. " * 40
+                               for i in range(10))
+        text = prompt.format(input="Which hotel is clean?", context=context)
+        usage = prompt.last_usage
+        self.assertLessEqual(usage['total'], 800 - 100)
+        self.assertTrue(usage['context']['truncated'])
+        # the best ranked documents come first and are kept
+        self.assertIn("Hotel 0:", text)
+        self.assertNotIn("Hotel 9:", text)
+        # a short prompt is not truncated
+        prompt.format(input="Which hotel is clean?", context="Hotel 0")
+        self.assertFalse(prompt.last_usage['context']['truncated'])
+
 
 if __name__ == "__main__":
     unittest.main()
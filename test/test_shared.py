@@ -0,0 +1,92 @@
+import unittest, sys, threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import numpy as np
+from src.shared import (SharedInstances, lazy_exports, parameter_bytes,
+                        rss_bytes)
+
+
+class TestSharedInstances(unittest.TestCase):
+    def test_get(self):
+        instances = SharedInstances()
+        n_build = []
+        barrier = threading.Barrier(8)
+
+        def build():
+            n_build.append(1)
+            return object()
+
+        def get(_):
+            barrier.wait()
+            return instances.get(("model", "{}"), build, name="model")
+
+        with ThreadPoolExecutor(8) as executor:
+            shared = list(executor.map(get, range(8)))
+        self.assertEqual(len(n_build), 1)
+        self.assertTrue(all(instance is shared[0] for instance in shared))
+        entry, = instances.entries()
+        self.assertEqual(entry['name'], "model")
+        self.assertIsNone(entry['parameter_bytes'])
+        self.assertGreaterEqual(entry['rss_growth_bytes'], 0)
+        self.assertIsNone(entry['warm_up_seconds'])
+        self.assertGreaterEqual(instances.warm_up(shared[0], lambda: None), 0)
+        self.assertIsNotNone(instances.entries()[0]['warm_up_seconds'])
+
+    def test_failed_build(self):
+        instances = SharedInstances()
+
+        def fail():
+            raise TypeError("no options")
+
+        with self.assertRaises(TypeError):
+            instances.get(("model", "{}"), fail)
+        self.assertEqual(instances.entries(), [])
+        # the next caller builds it again
+        instance = instances.get(("model", "{}"), object)
+        self.assertIs(instances.get(("model", "{}"), fail), instance)
+
+    def test_release(self):
+        instances = SharedInstances()
+        for name in ("a", "b", "a"):
+            instances.get((name, str(len(instances.entries()))), object)
+        self.assertEqual(instances.release(lambda key: key[0] == "a"),
+                         [("a", "0"), ("a", "2")])
+        self.assertEqual(len(instances.entries()), 1)
+
+
+class TestMemory(unittest.TestCase):
+    def test_parameter_bytes(self):
+        weights = [np.zeros((4, 8), dtype=np.float32),
+                   np.zeros(8, dtype=np.float16)]
+        parameters = [SimpleNamespace(numel=lambda w=w: w.size,
+                                      element_size=lambda w=w: w.itemsize)
+                      for w in weights]
+        model = SimpleNamespace(
+            client=SimpleNamespace(parameters=lambda: iter(parameters)))
+        self.assertEqual(parameter_bytes(model), 4 * 8 * 4 + 8 * 2)
+        self.assertIsNone(parameter_bytes(SimpleNamespace(client=None)))
+        self.assertGreaterEqual(rss_bytes(), 0)
+
+
+class TestLazyExports(unittest.TestCase):
+    def test_lazy_exports(self):
+        get, names, exports = lazy_exports(
+            "src.shared", {'SharedInstances': '.instances'}, ['lazy_exports'])
+        self.assertEqual(exports, ['lazy_exports', 'SharedInstances'])
+        self.assertEqual(names(), ['SharedInstances', 'lazy_exports'])
+        self.assertIs(get('SharedInstances'), SharedInstances)
+        with self.assertRaises(AttributeError):
+            get('parameter_bytes')
+
+    def test_packages(self):
+        import src.models as models
+        self.assertEqual(dir(models), sorted(models.__all__))
+        # the first lookup imports the module and caches the name
+        self.assertIs(models.Models, sys.modules['src.models.llms'].Models)
+        self.assertIn('Models', vars(models))
+        with self.assertRaises(AttributeError):
+            models.Missing
+
+
+if __name__ == "__main__":
+    unittest.main()
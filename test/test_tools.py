@@ -1,6 +1,8 @@
-import unittest, os
-from src.tools import RetrieverTool, OnlineSearchTool
-from src.vector_databases import ChromaDB
+import unittest, os, time
+from langchain_core.documents import Document
+from src.tools import (RetrieverTool, OnlineSearchTool, OfflineSearchTool,
+                       NearbyHotelsTool)
+from src.vector_database import ChromaDB, SpatialIndex
 from src.embeddings import Embeddings, EmbeddingType
 
 from dotenv import load_dotenv
@@ -20,5 +22,59 @@ class TestTools(unittest.TestCase):
         self.assertIsNotNone(online_search_tool, ValueError)
 
 
+class TestOfflineSearchTool(unittest.TestCase):
+    def test_search(self):
+        tool = OfflineSearchTool.get(
+            results={"Big Ben": "Big Ben is in Westminster, London."},
+            latency=0.02, jitter=0.5)
+        # stands in for the online search under its name
+        self.assertEqual(tool.name, "online-search-tool")
+        start = time.perf_counter()
+        self.assertEqual(tool.run("Where is big ben?"),
+                         "Big Ben is in Westminster, London.")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.01)
+        self.assertEqual(tool.run("Where is the Louvre?"),
+                         "No good search result found")
+
+
+class TestNearbyHotelsTool(unittest.TestCase):
+    def setUp(self):
+        hotels = [("Hotel Westminster", 51.5010, -0.1250, 8.7),
+                  ("Hotel Strand", 51.5100, -0.1200, 9.1),
+                  ("Hotel Tower", 51.5090, -0.0770, 8.2),
+                  ("Hotel Heathrow", 51.4710, -0.4500, 7.5)]
+        documents = [Document(page_content=name, metadata={
+            'hotel_id': str(i), 'Hotel_Name': name, 'City': "London",
+            'Average_Score': score, 'lat': lat, 'lng': lng})
+            for i, (name, lat, lng, score) in enumerate(hotels)]
+        self.tool = NearbyHotelsTool.get(SpatialIndex.from_documents(documents),
+                                         k=2)
+
+    def test_nearest(self):
+        answer = self.tool.run("Big Ben")
+        lines = answer.split("\n")
+        self.assertEqual(lines[0], "Hotels nearest to big ben:")
+        self.assertTrue(lines[1].startswith(
+            "Hotel Westminster (London, score 8.7): 0.0"))
+        self.assertTrue(lines[2].startswith("Hotel Strand"))
+        self.assertEqual(len(lines), 3)
+
+    def test_radius(self):
+        answer = self.tool.run("hotels within 800 m of the Tower of London")
+        self.assertEqual(len(answer.split("\n")), 2)
+        self.assertIn("Hotel Tower", answer)
+        self.assertIn("Hotel Heathrow",
+                      self.tool.run("Heathrow Airport within 1 mile"))
+        self.assertEqual(self.tool.run("Louvre within 2 km"),
+                         "No hotel within 2 km of louvre")
+        self.assertIn("Cannot find the place", self.tool.run("the moon"))
+
+    def test_empty_index(self):
+        tool = NearbyHotelsTool.get(SpatialIndex.from_documents([]))
+        self.assertEqual(tool.run("Big Ben"), "No hotel near big ben")
+        self.assertEqual(tool.run("Big Ben within 1 km"),
+                         "No hotel within 1 km of big ben")
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,8 +1,141 @@
-import unittest
-from src.vector_databases import ChromaDB
+import unittest, os, sys, time, tempfile, hashlib, threading, subprocess
+import numpy as np
+import pandas as pd
+from unittest import mock
+from langchain_core.embeddings import Embeddings as BaseEmbeddings
+from langchain_core.documents import Document
+from src.vector_database import (BM25Index, CachedRetriever, ChromaDB, FaissDB,
+                                 FaissIndexType, FilteredRetriever,
+                                 HybridRetriever, IndexBuilder, MetadataIndex,
+                                 NumpyDB, QuantizationType, QueryCache,
+                                 ResourcePool, SpatialIndex)
+from src.vector_database import (query_cache, resource_pool, retrievers,
+                                 vector_database)
+from src.vector_database.spatial_index import haversine_km
 from src.embeddings import Embeddings, EmbeddingType
 
 
+class WordHashEmbeddings(BaseEmbeddings):
+    """
+    A deterministic bag-of-words embedding to test without a model.
+    """
+    def __init__(self, dimension: int = 64):
+        self.dimension = dimension
+
+    def _embed(self, text: str):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in text.lower().split():
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimension] += 1
+        return (vector / max(np.linalg.norm(vector), 1e-12)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def make_processed_data(data_dir: str, country: str = "United Kingdom",
+                        n_hotel: int = 200,
+                        metadata: bool = False) -> pd.DataFrame:
+    """
+    Write a synthetic processed dataset in the data directory, with the postal
+    codes, the tags and the coordinates if `metadata` is True.
+    """
+    rng = np.random.default_rng(0)
+    words = ["staff", "friendly", "room", "spotless", "breakfast", "noisy",
+             "location", "tube", "bed", "small", "great", "view", "pool"]
+    cities = ["London", "Manchester", "Edinburgh", "Bristol"]
+    tags = ["Leisure trip, Couple", "Business trip, Solo traveler",
+            "Leisure trip, Family with young children"]
+    df = pd.DataFrame({
+        'Hotel_Name': [f"Hotel {i}" for i in range(n_hotel)],
+        'Average_Score': rng.uniform(6, 10, n_hotel).round(1).astype(
+            np.float32),
+        'City': [cities[i % len(cities)] for i in range(n_hotel)],
+        'Positive_Review': [" ".join(rng.choice(words, 8))
+                            for _ in range(n_hotel)],
+    })
+    if metadata:
+        df['Postal_Code'] = [f"W{i % 7} {i}AB" for i in range(n_hotel)]
+        df['Clean_Tags'] = [tags[i % len(tags)] for i in range(n_hotel)]
+        # around central London
+        df['lat'] = (51.5 + rng.uniform(-0.05, 0.05, n_hotel)).astype(
+            np.float32)
+        df['lng'] = (-0.12 + rng.uniform(-0.08, 0.08, n_hotel)).astype(
+            np.float32)
+    os.makedirs(os.path.join(data_dir, 'processed'), exist_ok=True)
+    df.to_parquet(os.path.join(data_dir, 'processed',
+                               f"{country}_processed_df.parquet"))
+    return df
+
+
+class NamedEmbeddings(WordHashEmbeddings):
+    def __init__(self, model_name: str, dimension: int):
+        super().__init__(dimension)
+        self.model_name = model_name
+
+
+class FailingEmbeddings(WordHashEmbeddings):
+    """
+    An embedding that fails after a number of batches, like an interrupted
+    build.
+    """
+    def __init__(self, n_batch: int):
+        super().__init__()
+        self.n_batch = n_batch
+        self.n_embedded = 0
+
+    def embed_documents(self, texts):
+        if self.n_batch == 0:
+            raise KeyboardInterrupt
+        self.n_batch -= 1
+        self.n_embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+class FakeSentenceTransformer:
+    """
+    A sentence-transformer client recording the use of its process pool.
+    """
+    def __init__(self):
+        self.embedding_model = WordHashEmbeddings()
+        self.pools = []
+
+    def start_multi_process_pool(self, target_devices):
+        self.pools.append({'n_worker': len(target_devices), 'open': True,
+                           'n_batch': 0})
+        return self.pools[-1]
+
+    def encode_multi_process(self, sentences, pool, **kwargs):
+        pool['n_batch'] += 1
+        return np.array(self.embedding_model.embed_documents(sentences))
+
+    @staticmethod
+    def stop_multi_process_pool(pool):
+        pool['open'] = False
+
+
+class LocalEmbeddings(WordHashEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.client = FakeSentenceTransformer()
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_backends(self):
+        # Chroma and FAISS are only loaded once a database of theirs is used
+        output = subprocess.run(
+            [sys.executable, "-c",
+             "import sys\n"
+             "from src.vector_database import ChromaDB, FaissDB, NumpyDB\n"
+             "print(sorted({'chromadb', 'faiss'} & set(sys.modules)))"],
+            check=True, capture_output=True, text=True,
+            env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)})
+        self.assertEqual(output.stdout.strip().splitlines()[-1], "[]")
+
+
 class TestChromaDB(unittest.TestCase):
     def test_get(self):
         embedding_model = Embeddings.get(EmbeddingType.SENTENCE_TRANSFORMER)
@@ -12,6 +145,685 @@ class TestChromaDB(unittest.TestCase):
         self.assertEqual(len(sim_docs), 3)
         print(sim_docs)
 
+    def test_resume_build(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(vector_database, 'DATA_DIR', tmp_dir), \
+                mock.patch.object(ChromaDB, 'CHROMA_DB_PATH',
+                                  os.path.join(tmp_dir, "chroma_db")), \
+                mock.patch.object(ChromaDB, 'BUILD_BATCH_SIZE', 30):
+            df = make_processed_data(tmp_dir, n_hotel=100)
+            with self.assertRaises(KeyboardInterrupt):
+                ChromaDB.get(FailingEmbeddings(n_batch=2), "United Kingdom")
+            embedding_model = FailingEmbeddings(n_batch=-1)
+            vector_db = ChromaDB.get(embedding_model, "United Kingdom")
+            # only the batches after the interruption are embedded
+            self.assertEqual(embedding_model.n_embedded, 100 - 2 * 30)
+            self.assertEqual(vector_db._collection.count(), 100)
+            sim_docs = vector_db.similarity_search(df['Positive_Review'][70],
+                                                   k=1)
+            self.assertIn(df['Positive_Review'][70], sim_docs[0].page_content)
+            ChromaDB.get(embedding_model, "United Kingdom")
+            self.assertEqual(embedding_model.n_embedded, 100 - 2 * 30)
+
+    def test_registry(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(vector_database, 'DATA_DIR', tmp_dir), \
+                mock.patch.object(ChromaDB, 'CHROMA_DB_PATH',
+                                  os.path.join(tmp_dir, "chroma_db")):
+            make_processed_data(tmp_dir, n_hotel=50)
+            small, large = NamedEmbeddings("small", 32), \
+                NamedEmbeddings("large", 64)
+            vector_db = ChromaDB.get(small, "United Kingdom")
+            # another embedding model has its own index, both stay warm
+            self.assertIsNot(ChromaDB.get(large, "United Kingdom"), vector_db)
+            self.assertIs(ChromaDB.get(small, "United Kingdom"), vector_db)
+            self.assertEqual(
+                sorted((entry['embedding_model'], entry['dimension'],
+                        entry['stats']['n_document'])
+                       for entry in ChromaDB.indexes()),
+                [("large", 64, 50), ("small", 32, 50)])
+
+            # the updated index becomes the one of the new processed data
+            df = make_processed_data(tmp_dir, n_hotel=51)
+            ChromaDB.update(small, "United Kingdom", hotel_ids=[])
+            self.assertEqual(len(ChromaDB.indexes()), 2)
+            ChromaDB.unload()
+            vector_db = ChromaDB.get(small, "United Kingdom")
+            self.assertEqual(vector_db._collection.count(), 51)
+            sim_docs = vector_db.similarity_search(df['Positive_Review'][50],
+                                                   k=1)
+            self.assertEqual(sim_docs[0].metadata['hotel_id'],
+                             vector_database.hotel_id("Hotel 50"))
+
+    def test_interrupted_update(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(vector_database, 'DATA_DIR', tmp_dir), \
+                mock.patch.object(ChromaDB, 'CHROMA_DB_PATH',
+                                  os.path.join(tmp_dir, "chroma_db")), \
+                mock.patch.object(ChromaDB, 'BUILD_BATCH_SIZE', 5):
+            path = vector_database.processed_data_path("United Kingdom")
+            df = make_processed_data(tmp_dir, n_hotel=210)
+            df[:200].to_parquet(path)
+            ChromaDB.get(FailingEmbeddings(n_batch=-1), "United Kingdom")
+            latest, = ChromaDB.indexes()
+            df.loc[3, 'Positive_Review'] = "a rooftop pool with a view"
+            df.to_parquet(path)
+            with self.assertRaises(KeyboardInterrupt):
+                ChromaDB.update(FailingEmbeddings(n_batch=1),
+                                "United Kingdom", hotel_ids=[])
+            # the latest index is still registered, and intact
+            self.assertEqual(ChromaDB.indexes(), [latest])
+            stored = ChromaDB._load_db(FailingEmbeddings(n_batch=-1),
+                                       latest['name']).get(
+                ids=[vector_database.hotel_id("Hotel 3")])
+            self.assertNotIn("rooftop", stored['documents'][0])
+
+            # the update resumes in the collection of the new data
+            embedding_model = FailingEmbeddings(n_batch=-1)
+            ChromaDB.update(embedding_model, "United Kingdom", hotel_ids=[])
+            self.assertEqual(embedding_model.n_embedded, 11 - 5)
+            entry, = ChromaDB.indexes()
+            self.assertNotEqual(entry['name'], latest['name'])
+            self.assertNotIn(latest['name'],
+                             [collection.name for collection
+                              in ChromaDB._client().list_collections()])
+            vector_db = ChromaDB.get(embedding_model, "United Kingdom")
+            self.assertEqual(len(vector_db.get(include=[])['ids']), 210)
+            for i in [3, 7, 209]:
+                sim_docs = vector_db.similarity_search(
+                    df['Positive_Review'][i], k=1)
+                self.assertEqual(sim_docs[0].metadata['Hotel_Name'],
+                                 f"Hotel {i}")
+
+
+class TestIndexBuilder(unittest.TestCase):
+    def setUp(self):
+        self.documents = [
+            vector_database.Document(page_content=f"review {i}",
+                                     metadata={'hotel_id': str(i)})
+            for i in range(25)]
+
+    def test_build(self):
+        progress = []
+        batches = []
+        stats = IndexBuilder(
+            batch_size=10, n_worker=1,
+            progress=lambda n_done, n_total: progress.append(n_done)).build(
+            WordHashEmbeddings(), self.documents,
+            lambda batch, vectors: batches.append((batch, vectors)),
+            existing_ids={'0', '1', '2'})
+        self.assertEqual([len(batch) for batch, _ in batches], [10, 10, 2])
+        self.assertEqual(progress, [13, 23, 25])
+        self.assertEqual((stats['n_document'], stats['n_skipped'],
+                          stats['n_batch']), (22, 3, 3))
+
+    def test_multi_process(self):
+        embedding_model = LocalEmbeddings()
+        vectors = IndexBuilder(batch_size=10, n_worker=4).build_vectors(
+            embedding_model, self.documents)
+        np.testing.assert_allclose(vectors, embedding_model.embed_documents(
+            [document.page_content for document in self.documents]))
+        pool, = embedding_model.client.pools
+        self.assertEqual((pool['n_worker'], pool['n_batch'], pool['open']),
+                         (4, 3, False))
+
+
+class TestFaissDB(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.df = make_processed_data(self.tmp_dir.name)
+        self.patches = [
+            mock.patch.object(vector_database, 'DATA_DIR', self.tmp_dir.name),
+            mock.patch.object(FaissDB, 'FAISS_DB_PATH',
+                              os.path.join(self.tmp_dir.name, "faiss_db")),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.tmp_dir.cleanup()
+
+    def test_get(self):
+        embedding_model = WordHashEmbeddings()
+        for index_type in FaissIndexType:
+            vector_db = FaissDB.get(embedding_model, "United Kingdom",
+                                    index_type=index_type)
+            self.assertEqual(vector_db.index.ntotal, len(self.df))
+            # a hotel's own reviews find the hotel itself
+            query = self.df['Positive_Review'][7]
+            sim_docs = vector_db.as_retriever(
+                search_kwargs={'k': 3}).invoke(query)
+            self.assertEqual(len(sim_docs), 3)
+            self.assertIn(query, sim_docs[0].page_content)
+            self.assertIn('hotel_id', sim_docs[0].metadata)
+
+    def test_update(self):
+        path = vector_database.processed_data_path("United Kingdom")
+        df = make_processed_data(self.tmp_dir.name, n_hotel=210)
+        previous_df = df[:200].copy()
+        df.loc[3, 'Positive_Review'] = "a rooftop pool with a view"
+        new_id = vector_database.hotel_id("Hotel 209")
+        for index_type in FaissIndexType:
+            with self.subTest(index_type=index_type):
+                embedding_model = WordHashEmbeddings()
+                previous_df.to_parquet(path)
+                FaissDB.get(embedding_model, "United Kingdom",
+                            index_type=index_type)
+                df.to_parquet(path)
+                with mock.patch.object(
+                        embedding_model, 'embed_documents',
+                        wraps=embedding_model.embed_documents) as embed:
+                    FaissDB.update(embedding_model, "United Kingdom",
+                                   hotel_ids=[new_id],
+                                   index_type=index_type)
+                # only the changed and the new hotels are embedded
+                self.assertEqual(
+                    sum(len(call.args[0]) for call in embed.call_args_list),
+                    11)
+                vector_db = FaissDB.get(embedding_model, "United Kingdom",
+                                        index_type=index_type)
+                self.assertEqual(vector_db.index.ntotal, 210)
+                for i in [3, 7, 209]:
+                    sim_docs = vector_db.similarity_search(
+                        df['Positive_Review'][i], k=1)
+                    self.assertEqual(sim_docs[0].metadata['Hotel_Name'],
+                                     f"Hotel {i}")
+                # the updated index replaced the previous one
+                self.assertEqual(
+                    [entry['variant'] for entry
+                     in FaissDB._registry().entries()].count(
+                        index_type.value), 1)
+
+
+class TestNumpyDB(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.df = make_processed_data(self.tmp_dir.name)
+        self.patches = [
+            mock.patch.object(vector_database, 'DATA_DIR', self.tmp_dir.name),
+            mock.patch.object(NumpyDB, 'NUMPY_DB_PATH',
+                              os.path.join(self.tmp_dir.name, "numpy_db")),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.tmp_dir.cleanup()
+
+    def test_get(self):
+        embedding_model = WordHashEmbeddings()
+        queries = list(self.df['Positive_Review'][:20])
+        exact = NumpyDB.get(embedding_model, "United Kingdom")
+        exact_results = exact.batch_similarity_search_with_score(queries, k=3)
+        for quantization in QuantizationType:
+            vector_db = NumpyDB.get(embedding_model, "United Kingdom",
+                                    quantization=quantization)
+            self.assertEqual(vector_db.matrix.dtype, quantization.value)
+            sim_docs = vector_db.as_retriever(
+                search_kwargs={'k': 3}).invoke(queries[7])
+            self.assertEqual(len(sim_docs), 3)
+            self.assertIn(queries[7], sim_docs[0].page_content)
+            # the rescored scores are the exact ones
+            results = vector_db.batch_similarity_search_with_score(queries,
+                                                                   k=3)
+            for result, exact_result in zip(results, exact_results):
+                np.testing.assert_allclose(
+                    [score for _, score in result],
+                    [score for _, score in exact_result], atol=1e-5)
+
+    def test_update(self):
+        embedding_model = WordHashEmbeddings()
+        NumpyDB.get(embedding_model, "United Kingdom")
+        df = make_processed_data(self.tmp_dir.name, n_hotel=201)
+        new_id = vector_database.hotel_id("Hotel 200")
+        NumpyDB.update(embedding_model, "United Kingdom",
+                       hotel_ids=[vector_database.hotel_id("Hotel 3"), new_id])
+        vector_db = NumpyDB.get(embedding_model, "United Kingdom")
+        self.assertEqual(len(vector_db.ids), 201)
+        self.assertEqual(vector_db.ids[-1], new_id)
+        sim_docs = vector_db.similarity_search(df['Positive_Review'][200], k=1)
+        self.assertEqual(sim_docs[0].metadata['hotel_id'], new_id)
+
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        texts = ["Hotel_Name: Park Plaza\nCity: London\nPostal_Code: SE1 7RT",
+                 "Hotel_Name: The Kensington\nCity: London\n"
+                 "Postal_Code: SW7 5HR",
+                 "Hotel_Name: Hotel Arena\nCity: Amsterdam\n"
+                 "Postal_Code: 1092 AA"]
+        self.documents = [
+            vector_database.Document(page_content=text,
+                                     metadata={'hotel_id': str(i)})
+            for i, text in enumerate(texts)]
+
+    def test_search(self):
+        index = BM25Index.from_documents(self.documents)
+        results = index.search("hotels in Kensington", k=3)
+        self.assertEqual(results[0][0].metadata['hotel_id'], "1")
+        results = index.search("london sw7", k=5)
+        self.assertEqual([document.metadata['hotel_id']
+                          for document, _ in results], ["1", "0"])
+        self.assertGreater(results[0][1], results[1][1])
+        self.assertEqual(index.search("Paris"), [])
+
+    def test_save_load(self):
+        index = BM25Index.from_documents(self.documents)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "bm25")
+            index.save(path)
+            loaded = BM25Index.load(path)
+        for query in ["Park Plaza", "1092 AA amsterdam", "City"]:
+            self.assertEqual(
+                [(document.metadata, score)
+                 for document, score in loaded.search(query, k=3)],
+                [(document.metadata, score)
+                 for document, score in index.search(query, k=3)])
+
+
+class TestHybridRetriever(unittest.TestCase):
+    def test_get_hybrid_retriever(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(vector_database, 'DATA_DIR', tmp_dir), \
+                mock.patch.object(NumpyDB, 'NUMPY_DB_PATH',
+                                  os.path.join(tmp_dir, "numpy_db")):
+            df = make_processed_data(tmp_dir)
+            retriever = NumpyDB.get_hybrid_retriever(WordHashEmbeddings(),
+                                                     "United Kingdom", k=3)
+            self.assertIsInstance(retriever, HybridRetriever)
+            self.assertIs(NumpyDB.get_bm25("United Kingdom"),
+                          retriever.bm25_index)
+            # the exact hotel name is found by BM25
+            sim_docs = retriever.invoke("Hotel 42")
+            self.assertEqual(len(sim_docs), 3)
+            self.assertEqual(sim_docs[0].metadata['hotel_id'],
+                             vector_database.hotel_id("Hotel 42"))
+            # the reviews are still found by the vector search
+            sim_docs = retriever.invoke(df['Positive_Review'][7])
+            self.assertIn(df['Positive_Review'][7], sim_docs[0].page_content)
+
+
+class TestMetadataIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.df = make_processed_data(self.tmp_dir.name, n_hotel=50,
+                                      metadata=True)
+        with mock.patch.object(vector_database, 'DATA_DIR',
+                               self.tmp_dir.name):
+            self.documents = vector_database.load_documents("United Kingdom")
+        self.index = MetadataIndex.from_documents(self.documents)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def expected(self, mask) -> list:
+        return sorted(vector_database.hotel_id(name)
+                      for name in self.df.loc[mask, 'Hotel_Name'])
+
+    def test_typed_metadata(self):
+        metadata = self.documents[4].metadata
+        self.assertEqual(metadata['City'], "London")
+        self.assertEqual(metadata['Postal_Code'], "W4 4AB")
+        # the shortest decimal of the float32 score
+        self.assertEqual(metadata['Average_Score'],
+                         float(str(self.df['Average_Score'][4])))
+        self.assertIn(f"Average_Score: {metadata['Average_Score']}\n",
+                      self.documents[4].page_content)
+        self.assertEqual(metadata['tags'], ["Business trip",
+                                            "Solo traveler"])
+
+    def test_filter(self):
+        df = self.df
+        cases = [
+            ({'City': "london"}, df['City'] == "London"),
+            ({'City': {'$in': ["London", "Bristol"]},
+              'Average_Score': {'$gte': 8.5}},
+             df['City'].isin(["London", "Bristol"])
+             & (df['Average_Score'] >= np.float32(8.5))),
+            ({'$or': [{'Average_Score': {'$lt': 7}},
+                      {'tags': "Family with young children"}]},
+             (df['Average_Score'] < np.float32(7))
+             | df['Clean_Tags'].str.contains("Family")),
+            ({'Average_Score': {'$gt': 7, '$lte': 9}},
+             (df['Average_Score'] > 7) & (df['Average_Score'] <= 9)),
+            ({'City': "Paris"}, df['City'] == "Paris"),
+        ]
+        for where, mask in cases:
+            self.assertEqual(sorted(self.index.filter(where)),
+                             self.expected(mask))
+        with self.assertRaises(ValueError):
+            self.index.filter({'Country': "United Kingdom"})
+        with self.assertRaises(ValueError):
+            self.index.filter({'City': {'$gt': "London"}})
+
+    def test_parse_filter(self):
+        self.assertEqual(
+            self.index.parse_filter("Quiet hotels in London rated above 9"),
+            {'$and': [{'City': {'$in': ["london"]}},
+                      {'Average_Score': {'$gt': 9.0}}]})
+        self.assertEqual(
+            self.index.parse_filter("a score of at least 8.5 and over 7 "
+                                    "rating"),
+            {'$and': [{'Average_Score': {'$gte': 8.5}},
+                      {'Average_Score': {'$gt': 7.0}}]})
+        self.assertEqual(self.index.parse_filter("near W3 10AB please"),
+                         {'Postal_Code': {'$in': ["w3 10ab"]}})
+        self.assertEqual(self.index.parse_filter("a nice pool"), {})
+        # only the numbers next to a score word, on its scale, are scores
+        for question in ["hotels under 5 minutes from Victoria station",
+                         "a room for less than 150 pounds",
+                         "more than 2 bars nearby",
+                         "rated by guests under 150 pounds a night",
+                         "hotels above 9"]:
+            self.assertEqual(self.index.parse_filter(question), {}, question)
+
+    def test_save_load(self):
+        path = os.path.join(self.tmp_dir.name, "metadata")
+        self.index.save(path)
+        loaded = MetadataIndex.load(path)
+        where = {'City': "Edinburgh", 'Average_Score': {'$gte': 8}}
+        self.assertEqual(loaded.filter(where), self.index.filter(where))
+
+
+class TestFilteredRetriever(unittest.TestCase):
+    def test_get_filtered_retriever(self):
+        question = "spotless room in London rated above 9"
+        for db_cls, path_attribute, get_kwargs in [
+                (NumpyDB, 'NUMPY_DB_PATH', {}),
+                (FaissDB, 'FAISS_DB_PATH', {'index_type': FaissIndexType.FLAT}),
+                (FaissDB, 'FAISS_DB_PATH', {'index_type': FaissIndexType.IVF}),
+                (FaissDB, 'FAISS_DB_PATH', {'index_type': FaissIndexType.HNSW}),
+                (ChromaDB, 'CHROMA_DB_PATH', {})]:
+            with tempfile.TemporaryDirectory() as tmp_dir, \
+                    mock.patch.object(vector_database, 'DATA_DIR', tmp_dir), \
+                    mock.patch.object(db_cls, path_attribute,
+                                      os.path.join(tmp_dir, "db")):
+                df = make_processed_data(tmp_dir, metadata=True)
+                expected = df[(df['City'] == "London")
+                              & (df['Average_Score'] > 9)]
+                embedding_model = WordHashEmbeddings()
+                retriever = db_cls.get_filtered_retriever(
+                    embedding_model, "United Kingdom", k=3, hybrid=False,
+                    **get_kwargs)
+                self.assertIsInstance(retriever, FilteredRetriever)
+                sim_docs = retriever.invoke(question)
+                # the exact top-3 of the matching hotels
+                scores = np.array(embedding_model.embed_documents(
+                    [document.page_content for document in
+                     vector_database.load_documents("United Kingdom")]
+                )) @ np.array(embedding_model.embed_query(question))
+                ranked = [vector_database.hotel_id(name) for name in
+                          expected['Hotel_Name'].to_numpy()[np.argsort(
+                              -scores[expected.index], kind='stable')]]
+                self.assertEqual(
+                    [document.metadata['hotel_id'] for document in sim_docs],
+                    ranked[:3], db_cls.__name__)
+
+                # the fixed filter is combined with the parsed one
+                retriever = db_cls.get_filtered_retriever(
+                    embedding_model, "United Kingdom", k=50,
+                    filter={'tags': "Couple"}, **get_kwargs)
+                sim_docs = retriever.invoke(question)
+                self.assertEqual(
+                    sorted(document.metadata['hotel_id']
+                           for document in sim_docs),
+                    sorted(vector_database.hotel_id(name) for name in
+                           expected.loc[expected['Clean_Tags'].str.contains(
+                               "Couple"), 'Hotel_Name']))
+
+    def test_unmatched_constraints(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(vector_database, 'DATA_DIR', tmp_dir), \
+                mock.patch.object(NumpyDB, 'NUMPY_DB_PATH',
+                                  os.path.join(tmp_dir, "db")):
+            make_processed_data(tmp_dir, metadata=True)
+            embedding_model = WordHashEmbeddings()
+            retriever = NumpyDB.get_filtered_retriever(
+                embedding_model, "United Kingdom", k=3, hybrid=False)
+            vector_db = NumpyDB.get(embedding_model, "United Kingdom")
+            # no hotel is rated below 2: the question is searched unfiltered
+            question = "spotless room with a view rated below 2"
+            self.assertEqual(retriever.invoke(question),
+                             vector_db.similarity_search(question, k=3))
+            # the given filter still applies
+            retriever = NumpyDB.get_filtered_retriever(
+                embedding_model, "United Kingdom", k=3, hybrid=False,
+                filter={'City': "Paris"})
+            self.assertEqual(retriever.invoke(question), [])
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.df = make_processed_data(self.tmp_dir.name, n_hotel=300,
+                                      metadata=True)
+        with mock.patch.object(vector_database, 'DATA_DIR',
+                               self.tmp_dir.name):
+            self.documents = vector_database.load_documents("United Kingdom")
+        self.index = SpatialIndex.from_documents(self.documents)
+        self.coordinates = np.array([
+            (document.metadata['lat'], document.metadata['lng'])
+            for document in self.documents])
+        self.distances = lambda lat, lng: haversine_km(
+            lat, lng, self.coordinates[:, 0], self.coordinates[:, 1])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_nearest(self):
+        # the same hotels as computing every distance, inside and outside
+        # the grid
+        for lat, lng in [(51.5007, -0.1246), (51.47, -0.2), (48.8584, 2.2945)]:
+            distances = self.distances(lat, lng)
+            for k in [1, 5, 40]:
+                result = self.index.nearest(lat, lng, k)
+                self.assertEqual(
+                    [hotel['Hotel_Name'] for hotel, _ in result],
+                    list(self.df['Hotel_Name'].to_numpy()[
+                        np.argsort(distances, kind='stable')[:k]]))
+                np.testing.assert_allclose(
+                    [distance for _, distance in result],
+                    np.sort(distances)[:k])
+        self.assertEqual(self.index.nearest(51.5, -0.12, 0), [])
+
+    def test_within(self):
+        lat, lng = 51.5081, -0.0759
+        for radius_km in [0.5, 2, 50]:
+            distances = self.distances(lat, lng)
+            result = self.index.within(lat, lng, radius_km)
+            self.assertEqual(
+                sorted(hotel['Hotel_Name'] for hotel, _ in result),
+                sorted(self.df.loc[distances <= radius_km, 'Hotel_Name']))
+            self.assertEqual([distance for _, distance in result],
+                             sorted(distance for _, distance in result))
+
+    def test_locate(self):
+        self.assertEqual(self.index.locate("hotels near Big Ben?"),
+                         ("big ben", 51.5007, -0.1246))
+        self.assertEqual(self.index.locate("close to St. Paul's Cathedral"),
+                         ("st pauls cathedral", 51.5138, -0.0984))
+        self.assertEqual(self.index.locate("51.5, -0.12"),
+                         ("51.5, -0.12", 51.5, -0.12))
+        name, lat, lng = self.index.locate("next to Hotel 17")
+        self.assertEqual((name, lat, lng),
+                         ("hotel 17", *self.coordinates[17]))
+        # the postal district is at the centroid of its hotels
+        name, lat, _ = self.index.locate("in W3")
+        self.assertEqual(name, "w3")
+        self.assertAlmostEqual(
+            lat, self.coordinates[
+                self.df['Postal_Code'].str.startswith("W3 "), 0].mean(),
+            places=6)
+        self.assertIsNone(self.index.locate("somewhere nice"))
+
+    def test_get_spatial_index(self):
+        with mock.patch.object(vector_database, 'DATA_DIR',
+                               self.tmp_dir.name), \
+                mock.patch.object(NumpyDB, 'NUMPY_DB_PATH',
+                                  os.path.join(self.tmp_dir.name, "db")):
+            index = NumpyDB.get_spatial_index("United Kingdom")
+            self.assertIs(NumpyDB.get_spatial_index("United Kingdom"), index)
+            NumpyDB.unload()
+            loaded = NumpyDB.get_spatial_index("United Kingdom")
+        self.assertIsNot(loaded, index)
+        self.assertEqual(loaded.nearest(51.5, -0.12, 10),
+                         self.index.nearest(51.5, -0.12, 10))
+        self.assertEqual(loaded.locate("W3"), self.index.locate("W3"))
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_lookup(self):
+        cache = QueryCache(similarity_threshold=0.9, ttl_seconds=60,
+                           max_entries=2)
+        documents = [Document(page_content="Hotel 1")]
+        clock = [0]
+        with mock.patch.object(query_cache.time, 'time',
+                               side_effect=lambda: clock[0]):
+            cache.put("Quiet hotel, London", [1, 0, 0], documents)
+            cache.put("pool", [0, 1, 0], [], partition=("8",))
+            self.assertIs(cache.get_exact("quiet  HOTEL london?"), documents)
+            self.assertIsNone(cache.get_exact("quiet hotel paris"))
+            self.assertIs(cache.get_similar([0.95, 0.1, 0]), documents)
+            self.assertIsNone(cache.get_similar([0.5, 0.5, 0]))
+            # another partition
+            self.assertIsNone(cache.get_similar([0, 1, 0], partition=("9",)))
+            self.assertEqual(cache.get_similar([0, 1, 0], partition=("8",)),
+                             [])
+            self.assertEqual(cache.stats(), {
+                'exact_hits': 1, 'similar_hits': 2, 'misses': 2,
+                'hit_rate': 0.6, 'entries': 2, 'evictions': 0,
+                'invalidations': 0})
+
+            # the least recently used entry is evicted
+            cache.put("spa", [0, 0, 1], [])
+            self.assertIsNone(cache.get_exact("quiet hotel london"))
+            self.assertEqual(cache.get_exact("pool", partition=("8",)), [])
+            self.assertEqual(cache.stats()['evictions'], 1)
+            # the entries expire
+            clock[0] = 61
+            self.assertIsNone(cache.get_exact("spa"))
+            self.assertIsNone(cache.get_similar([0, 0, 1]))
+            self.assertEqual(cache.stats()['entries'], 1)
+
+        cache.invalidate("v1")
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_cached_retriever(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(vector_database, 'DATA_DIR', tmp_dir), \
+                mock.patch.object(NumpyDB, 'NUMPY_DB_PATH',
+                                  os.path.join(tmp_dir, "numpy_db")):
+            make_processed_data(tmp_dir, metadata=True)
+            cache = QueryCache(similarity_threshold=0.6)
+            embedding_model = WordHashEmbeddings()
+            retriever = NumpyDB.get_filtered_retriever(
+                embedding_model, "United Kingdom", k=3, query_cache=cache)
+            self.assertIsInstance(retriever, CachedRetriever)
+            # a miss embeds the query and parses its filter only once
+            with mock.patch.object(
+                    embedding_model, 'embed_query',
+                    wraps=embedding_model.embed_query) as embed_query, \
+                    mock.patch.object(
+                        MetadataIndex, 'parse_filter', autospec=True,
+                        side_effect=MetadataIndex.parse_filter) as parse:
+                sim_docs = retriever.invoke("quiet hotel in central London")
+            self.assertEqual(embed_query.call_count, 1)
+            self.assertEqual(parse.call_count, 1)
+            self.assertEqual(sim_docs, retriever.retriever.invoke(
+                "quiet hotel in central London"))
+            self.assertEqual(
+                retriever.invoke("Quiet hotel in central London!"), sim_docs)
+            self.assertEqual(
+                retriever.invoke("quiet hotels central London"), sim_docs)
+            # the same words with another score bound are searched
+            retriever.invoke("quiet hotel in central London rated above 9")
+            retriever.invoke("quiet hotel in central London rated above 8")
+            self.assertEqual(
+                [cache.stats()[key] for key in ('exact_hits', 'similar_hits',
+                                                'misses')], [1, 1, 3])
+
+            # a new version of the data empties the cache, once the version
+            # is checked again
+            make_processed_data(tmp_dir, n_hotel=20, metadata=True)
+            retriever.invoke("quiet hotel in central London")
+            self.assertEqual(cache.stats()['invalidations'], 0)
+            with mock.patch.object(
+                    retrievers.time, 'monotonic',
+                    return_value=time.monotonic()
+                    + retriever.version_check_seconds):
+                retriever.invoke("quiet hotel in central London")
+            self.assertEqual(cache.stats()['invalidations'], 1)
+            self.assertEqual(cache.stats()['misses'], 4)
+
+
+class TestResourcePool(unittest.TestCase):
+    def test_get(self):
+        pool = ResourcePool()
+        n_built = []
+
+        def build():
+            time.sleep(0.05)
+            n_built.append(1)
+            return object()
+
+        # the sessions asking at once share a single build
+        components = []
+        threads = [threading.Thread(
+            target=lambda: components.append(pool.get(("llm", "gpt"), build)))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(n_built), 1)
+        self.assertTrue(all(component is components[0]
+                            for component in components))
+        self.assertEqual(pool.stats()['hits'], 3)
+
+        agent = pool.get(("agent", "gpt", "London"),
+                         lambda: (pool.get(("llm", "gpt"), build),
+                                  pool.get(("tools", "London"), object)))
+        self.assertIs(agent[0], components[0])
+        self.assertEqual(len(pool.entries()), 3)
+        # the components of a country are rebuilt after an invalidation
+        self.assertEqual(pool.invalidate("London"), 2)
+        self.assertEqual(pool.invalidate("London"), 0)
+        self.assertIsNot(pool.get(("tools", "London"), object), agent[1])
+        self.assertEqual(pool.invalidate(), 2)
+
+    def test_limits(self):
+        pool = ResourcePool(max_entries=2, max_bytes=1000)
+        memory = [0]
+
+        def allocate(n_byte):
+            memory[0] += n_byte
+            return n_byte
+
+        with mock.patch.object(resource_pool, 'rss_bytes',
+                               side_effect=lambda: memory[0]):
+            pool.get(("a",), lambda: allocate(100))
+            pool.get(("b",), lambda: allocate(200))
+            pool.get(("a",), lambda: allocate(100))
+            pool.get(("c",), lambda: allocate(300))
+            # the least recently used component is released
+            self.assertEqual([entry['key'] for entry in pool.entries()],
+                             [("a",), ("c",)])
+            # the nested components are not counted twice
+            pool.get(("d",), lambda: pool.get(("e",), lambda: allocate(400))
+                     + allocate(200))
+            self.assertEqual({entry['key']: entry['bytes']
+                              for entry in pool.entries()},
+                             {("e",): 400, ("d",): 200})
+            pool.get(("f",), lambda: allocate(900))
+            self.assertEqual([entry['key'] for entry in pool.entries()],
+                             [("f",)])
+        self.assertEqual(pool.stats()['evictions'], 5)
+
 
 if __name__ == "__main__":
     unittest.main()